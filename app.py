@@ -24,13 +24,16 @@ from utils.upload_materials_to_meta_and_update_registry import start_media_uploa
 import json, tempfile, textwrap
 from router import route_message
 from state.state import save_if_absent, get_state, update_state
-from utils.token_manager import init_token, get_token, set_token, save_token, start_token_check_loop
+from utils.token_manager import start_token_manager, get_token, set_token, save_token, start_token_check_loop
 from utils.telegram_alert import notify_if_token_invalid
 from utils.outgoing_message import send_text_message
+from utils import outbound_queue
 from utils.incoming_message import handle_message, handle_status
 from utils.supabase_token import start_supabase_ping_loop
 from utils.cleanup import cleanup_temp_files, start_memory_cleanup_loop, log_memory_usage
 from utils.env_flags import is_local_dev
+from state.archive import start_archiver_loop
+from utils.response_pool import start_response_pool_loop
 
 logger.info("💬 logger test — должен появиться в консоли Render")
 
@@ -66,8 +69,9 @@ from routes.debug_tail_route import debug_tail_bp
 from routes.home_route import home_bp
 from routes.debug_upload_log_route import debug_upload_log_bp
 from routes.ping_route import ping_bp
-from routes.webhook_route import webhook_bp
+from routes.webhook_route import webhook_bp, start_inbound_workers
 from routes.debug_mem_route import debug_mem_bp
+from routes.debug_metrics_route import debug_metrics_bp
 
 VERIFY_TOKEN = os.getenv("VERIFY_TOKEN")
 openai_api_key = os.getenv("OPENAI_APIKEY")
@@ -81,7 +85,7 @@ TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
 client = OpenAI(api_key=openai_api_key)
 logger.info(f"🔐 OpenAI API key начинается на: {openai_api_key[:5]}..., длина: {len(openai_api_key)}")
 
-init_token()  # учтёт LOCAL_DEV и/или Supabase
+start_token_manager()  # кэш-файл сразу, Supabase/ENV и проверка — в фоне (учтёт LOCAL_DEV)
 
 # ─────────────────────────────────────────────────────────────
 def _bootstrap_background():
@@ -121,6 +125,18 @@ def _bootstrap_background():
     else:
         logger.info("🟡 LOCAL_DEV=1: Supabase ping loop отключён")
 
+    # Выгрузка завершённых/давно молчащих диалогов в холодный архив
+    try:
+        start_archiver_loop()
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось запустить state archiver: {e}")
+
+    # Пулы готовых вариантов для статичных ответов (приветствие, напоминания, «передаю Арсению»)
+    try:
+        start_response_pool_loop()
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось запустить генератор пулов ответов: {e}")
+
     # Разовая очистка и фоновый контроль памяти
     try:
         cleanup_temp_files()
@@ -152,12 +168,25 @@ def create_app():
     app.register_blueprint(ping_bp)
     app.register_blueprint(webhook_bp)
     app.register_blueprint(debug_mem_bp)
+    app.register_blueprint(debug_metrics_bp)
 
     # Быстрый health — Render сразу увидит, что сервис жив
     @app.get("/health")
     def health():
         return "ok", 200
 
+    # Воркеры входящей очереди — сразу, чтобы уже первый вебхук отвечал без ожидания обработки
+    try:
+        start_inbound_workers()
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось запустить inbound_queue, вебхук работает синхронно: {e}")
+
+    # Исходящая очередь — обработчики хода не ждут HTTP к Graph API
+    try:
+        outbound_queue.start_workers()
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось запустить outbound_queue, отправляем синхронно: {e}")
+
     # Старт фона — уже после первого запроса (не блокирует импорт/инициализацию)
       # Старт фона при ПЕРВОМ входящем запросе (замена before_first_request в Flask 3.1)
     @app.before_request
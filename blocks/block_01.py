@@ -4,15 +4,13 @@ from utils.ask_openai import ask_openai
 from utils.wants_handover_ai import wants_handover_ai
 from state.state import get_state, update_state
 from logger import logger
+from utils.prompt_registry import load_prompt
 
 # Пути к промптам
 GLOBAL_PROMPT_PATH = "prompts/global_prompt.txt"
 STAGE_PROMPT_PATH = "prompts/block01_prompt.txt"
-
-def load_prompt(path):
-    with open(path, "r", encoding="utf-8") as f:
-        return f.read()
-
+FALLBACK_GREETING = ("Здравствуйте! Я помощник иллюзиониста Арсения. "
+                     "Расскажите, пожалуйста, о вашем празднике?")
 
 def proceed_to_block_2(user_id, send_func=None):
     from router import route_message
@@ -33,8 +31,12 @@ def handle_block1(message_text, user_id, send_reply_func):
     stage_prompt = load_prompt(STAGE_PROMPT_PATH)
     full_prompt = global_prompt + "\n\n" + stage_prompt + f'\n\nСообщение клиента: "{message_text}"'
 
-    # Генерация ответа
-    reply = ask_openai(full_prompt)
+    # Генерация ответа; OpenAI не ответил — приветствие-заглушка, сценарий идёт дальше
+    try:
+        reply = ask_openai(full_prompt)
+    except Exception as e:
+        logger.error(f"[block1] ❌ приветствие от модели не получено: {e}")
+        reply = FALLBACK_GREETING
 
     # Отправка ответа
     send_reply_func(reply)
@@ -2,6 +2,9 @@ import time
 from utils.ask_openai import ask_openai
 from utils.wants_handover_ai import wants_handover_ai
 from utils.reminder_engine import plan
+from utils import llm_cache, llm_limiter, response_pool
+from utils.prompt_registry import load_prompt, render_prompt
+from utils.fanout import FanOut
 from state.state import update_state
 from logger import logger
 from importlib import import_module
@@ -12,29 +15,25 @@ STAGE_PROMPT_PATH = "prompts/block02_prompt.txt"
 REMINDER_PROMPT_PATH = "prompts/block02_reminder_1_prompt.txt"
 REMINDER_2_PROMPT_PATH = "prompts/block02_reminder_2_prompt.txt"
 CLASSIF_PROMPT_PATH = "prompts/block02_classification_prompt.txt"
+# Кэш ответов LLM: только классификация (ответ зависит лишь от текста сообщения)
+CLASSIFICATION_TTL_SEC = 7 * 24 * 3600
 # Время до повторного касания (4 часа)
 DELAY_TO_BLOCK_2_1_HOURS = 4
 DELAY_TO_BLOCK_2_2_HOURS = 12
 FINAL_TIMEOUT_HOURS = 4
 
-def load_prompt(path):
-    with open(path, "r", encoding="utf-8") as f:
-        return f.read()
 
-def render_prompt(path: str, **kwargs) -> str:
-    """
-    Рендерим текст промпта с плейсхолдерами через str.format().
-    Внутренние фигурные скобки в промпте должны быть экранированы как {{ }}.
-    """
-    tmpl = load_prompt(path)
-    try:
-        return tmpl.format(**kwargs)
-    except Exception as e:
-        logger.warning(f"[block02] format error in {path}: {e}")
-        return tmpl  # лучше вернуть сырой, чем упасть
-    
-global_prompt = load_prompt(GLOBAL_PROMPT_PATH)
-stage_prompt = load_prompt(STAGE_PROMPT_PATH)
+def _stage_prompt() -> str:
+    # берём из реестра на каждом вызове, а не при импорте: hot-reload промпта работает и здесь
+    return load_prompt(GLOBAL_PROMPT_PATH) + "\n\n" + load_prompt(STAGE_PROMPT_PATH)
+
+
+# Статичные тексты (без данных клиента) — из пула заранее сгенерированных вариантов
+response_pool.register("block2_intro", _stage_prompt)
+response_pool.register("block2_reminder_1",
+                       lambda: load_prompt(GLOBAL_PROMPT_PATH) + "\n\n" + load_prompt(REMINDER_PROMPT_PATH))
+response_pool.register("block2_reminder_2",
+                       lambda: load_prompt(GLOBAL_PROMPT_PATH) + "\n\n" + load_prompt(REMINDER_2_PROMPT_PATH))
 
 def proceed_to_block(stage_name, user_id):
     from router import route_message
@@ -81,11 +80,14 @@ def handle_block2(message_text, user_id, send_reply_func):
         return
 
     # Отправляем стартовое сообщение (только один раз)
-    reply_to_client = ""
-    try:
-        reply_to_client = ask_openai(global_prompt + "\n\n" + stage_prompt)
-    except Exception as e:
-        logger.info(f"[error] ❌ Ошибка при ответе клиенту: {e}")
+    reply_to_client = response_pool.pick("block2_intro") or ""
+    if not reply_to_client:
+        try:
+            reply_to_client = ask_openai(_stage_prompt())
+        except llm_limiter.LLMUnavailable:
+            raise                   # ход откатится и будет повторён, а не «проглочен»
+        except Exception as e:
+            logger.info(f"[error] ❌ Ошибка при ответе клиенту: {e}")
     if reply_to_client:
         send_reply_func(reply_to_client)
 
@@ -102,20 +104,42 @@ def handle_block2(message_text, user_id, send_reply_func):
     return
 
 
+def _classify(message_text: str) -> str:
+    """Сырой ответ модели о типе шоу (нормализация — у вызывающего)."""
+    classification_prompt = render_prompt(CLASSIF_PROMPT_PATH, message_text=message_text)
+    try:
+        with llm_cache.policy(CLASSIFICATION_TTL_SEC, site="block2_classification"):
+            resp = ask_openai(classification_prompt)
+        return (resp or "").strip().lower()
+    except llm_limiter.LLMUnavailable:
+        # отказ модели — не «неизвестно»: иначе лимит засчитался бы клиенту
+        # как неинформативный ответ; ход откатится и будет повторён
+        raise
+    except Exception as e:
+        logger.info(f"[error] ❌ Ошибка при классификации: {e}")
+        return "неизвестно"
+
+
 def handle_block2_user_reply(message_text, user_id, send_reply_func):
     logger.info(f"[debug] 👤 handle_block2_user_reply: user={user_id}, text={message_text}")
     state = _state()
     st = state.get_state(user_id) or {}
-    # 🔁 Хендовер по явной просьбе клиента (теперь проверяем здесь, а не в handle_block2)
-    if wants_handover_ai(message_text):
-        update_state(user_id, {
-            "handover_reason": "asked_handover",
-            "scenario_stage_at_handover": "block2"
-        })
-        from router import route_message
-        return route_message(message_text, user_id, force_stage="block5")
-    # (0) Позитивные шорткаты: если уверенно узнали тип — сразу маршрутизируем.
+    # (0) Позитивные шорткаты: если уверенно узнали тип — классификация не нужна.
     rb = _rule_based_label(message_text)
+    # 🔁 Хендовер по явной просьбе клиента (теперь проверяем здесь, а не в handle_block2).
+    # Классификация от него не зависит — идёт параллельно; при хендовере отменяется.
+    with FanOut() as fan:
+        handover = fan.submit(wants_handover_ai, message_text)
+        classification = None if rb else fan.submit(_classify, message_text)
+        if handover.result():
+            fan.cancel()            # до хендовера, а не после него: структурирование больше не нужно
+            update_state(user_id, {
+                "handover_reason": "asked_handover",
+                "scenario_stage_at_handover": "block2"
+            })
+            from router import route_message
+            return route_message(message_text, user_id, force_stage="block5")
+        show_type = classification.result() if classification else None
     if rb:
         ts = time.time()
         state.update_state(user_id, {
@@ -137,16 +161,7 @@ def handle_block2_user_reply(message_text, user_id, send_reply_func):
         state.update_state(user_id, {"stage": next_block})
         return route_message(message_text, user_id, force_stage=next_block)
 
-    # Классификация
-    classification_prompt = render_prompt(CLASSIF_PROMPT_PATH, message_text=message_text)
-    try:
-        resp = ask_openai(classification_prompt)
-        show_type = (resp or "").strip().lower()
-    except Exception as e:
-        logger.info(f"[error] ❌ Ошибка при классификации: {e}")
-        show_type = "неизвестно"
-
-    # Нормализуем ПЕРЕД проверкой allowed
+    # Классификация: ответ модели получен выше. Нормализуем ПЕРЕД проверкой allowed
     for junk in (".", "!", "?", ":", ";", "—", "–"):
         show_type = show_type.replace(junk, "")
     show_type = show_type.strip()
@@ -175,12 +190,14 @@ def handle_block2_user_reply(message_text, user_id, send_reply_func):
             from router import route_message
             return route_message("", user_id, force_stage="block5")
 
-        clarification_prompt = global_prompt + "\n\n" + stage_prompt + "\n\n" + \
+        clarification_prompt = _stage_prompt() + "\n\n" + \
             "Предоставленной вами информации было недостаточно. " \
             "Пожалуйста, расскажите о вашем мероприятии подробнее: чей праздник, сколько гостей, взрослые или дети?"
 
         try:
             clarification_reply = ask_openai(clarification_prompt)
+        except llm_limiter.LLMUnavailable:
+            raise
         except Exception as e:
             logger.info(f"[error] ❌ Ошибка при напоминании 2: {e}")
             clarification_reply = ""
@@ -235,11 +252,12 @@ def send_first_reminder_if_silent(user_id, send_reply_func):
     if st.get("r1_scheduled_b2"):
         return
 
-    global_prompt = load_prompt(GLOBAL_PROMPT_PATH)
-    reminder_prompt = load_prompt(REMINDER_PROMPT_PATH)
-    full_prompt = global_prompt + "\n\n" + reminder_prompt
-
-    reply = ask_openai(full_prompt)
+    reply = response_pool.pick("block2_reminder_1")
+    if not reply:
+        global_prompt = load_prompt(GLOBAL_PROMPT_PATH)
+        reminder_prompt = load_prompt(REMINDER_PROMPT_PATH)
+        full_prompt = global_prompt + "\n\n" + reminder_prompt
+        reply = ask_openai(full_prompt)
     send_reply_func(reply)
 
     state.update_state(user_id, {"stage": "block2", "last_message_ts": time.time()})
@@ -259,11 +277,12 @@ def send_second_reminder_if_silent(user_id, send_reply_func):
     if st.get("r2_scheduled_b2"):
         return
 
-    global_prompt = load_prompt(GLOBAL_PROMPT_PATH)
-    reminder_prompt = load_prompt(REMINDER_2_PROMPT_PATH)
-    full_prompt = global_prompt + "\n\n" + reminder_prompt
-
-    reply = ask_openai(full_prompt)
+    reply = response_pool.pick("block2_reminder_2")
+    if not reply:
+        global_prompt = load_prompt(GLOBAL_PROMPT_PATH)
+        reminder_prompt = load_prompt(REMINDER_2_PROMPT_PATH)
+        full_prompt = global_prompt + "\n\n" + reminder_prompt
+        reply = ask_openai(full_prompt)
     send_reply_func(reply)
 
     state.update_state(user_id, {"stage": "block2", "last_message_ts": time.time()})
@@ -1,18 +1,19 @@
 # block_03a.py
 import time
-import re
 from utils.ask_openai import ask_openai
 from utils.wants_handover_ai import wants_handover_ai
 from utils.schedule import load_schedule_from_s3, check_date_availability
 from state.state import get_state, update_state
 from utils.reminder_engine import plan
 from logger import logger
+from utils.prompt_registry import load_prompt, render_prompt
+from utils.slot_extraction import extract_slots, clean_date as _clean_date, clean_time as _clean_time
 from utils.structured import build_structured_snapshot
+from utils.fanout import FanOut
 
 # Пути к промптам (оставляем 3a)
 GLOBAL_PROMPT_PATH    = "prompts/global_prompt.txt"
 STAGE_PROMPT_PATH     = "prompts/block03a_prompt.txt"
-STRUCTURE_PROMPT_PATH = "prompts/block03a_data_prompt.txt"
 REMINDER_1_PROMPT_PATH= "prompts/block03_reminder_1_prompt.txt"
 REMINDER_2_PROMPT_PATH= "prompts/block03_reminder_2_prompt.txt"
 AVAILABILITY_PROMPT_PATH = "prompts/block03_availability_prompt.txt"
@@ -42,21 +43,8 @@ KEY_NAMES = {
     "guests_age":       "возраст гостей",
 }
 
-def load_prompt(path):
-    with open(path, "r", encoding="utf-8") as f:
-        return f.read()
-    
-def render_prompt(path: str, **kwargs) -> str:
-    """
-    Рендерим текст промпта с плейсхолдерами {name} через str.format().
-    Если в шаблоне нужны фигурные скобки как символы — экранировать {{ }}.
-    """
-    tmpl = load_prompt(path)
-    try:
-        return tmpl.format(**kwargs)
-    except Exception as e:
-        logger.warning(f"[block03a] format error in {path}: {e}")
-        return tmpl
+# схема слотов для единого запроса извлечения
+SLOT_FIELDS = {**KEY_NAMES, "no_celebrant": "\"Да\", если ключевого участника нет, иначе \"нет\""}
 
 def missing_info_keys(state):
     required = [
@@ -114,133 +102,60 @@ def upsert_state(user_id, parsed_data: dict):
     return get_state(user_id)
 
 
-# ——— Fallback-парсер из старого 3a, если JSON не пришёл ———
-def parse_structured_pairs(text: str) -> dict:
-    flags = re.IGNORECASE | re.MULTILINE
-
-    patterns = {
-        "celebrant_name":       r"Имя\s+(?:ключевого\s+участника|именинника)\s*[-—:]\s*([^\n\r]+)",
-        "celebrant_gender":     r"Пол\s+(?:ключевого\s+участника|именинника)\s*[-—:]\s*([^\n\r]+)",
-        "celebrant_age":        r"Возраст\s+(?:ключевого\s+участника|именинника)\s*[-—:]\s*([^\n\r]+)",
-        "event_date":           r"Дата\s+мероприятия\s*[-—:]\s*([^\n\r]+)",
-        "event_time":           r"Время\s+мероприятия\s*[-—:]\s*([^\n\r]+)",
-        "event_location_type":  r"(?:Тип\s+места\s+проведения|Классификация\s+места)\s*[-—:]\s*([^\n\r]+)",
-        "event_location":       r"(?:Название\s+места\s+проведения|Название\s+места)\s*[-—:]\s*([^\n\r]+)",
-        "guests_count":         r"Количество\s+гостей\s*[-—:]\s*([^\n\r]+)",
-        "guests_gender":        r"(?:Пол\s+гостей|Пол\s+гостей\s+детского\s+возраста)\s*[-—:]\s*([^\n\r]+)",
-        "guests_age":           r"(?:Возраст\s+гостей|Возраст\s+гостей\s+детского\s+возраста)\s*[-—:]\s*([^\n\r]+)",
-    }
-
-    def clean(v: str) -> str:
-        return v.strip().strip(" .;,")
-
-    result = {}
-    for key, pat in patterns.items():
-        m = re.search(pat, text, flags)
-        if m:
-            result[key] = clean(m.group(1))
-    return result
-
-def _clean_time(raw_time: str) -> str:
-    m = re.search(r"\b([01]?\d|2[0-3]):[0-5]\d\b", raw_time or "")
-    return m.group(0) if m else ""
-
-def _clean_date(raw_date: str) -> str:
-    m = re.search(r"\b\d{4}-\d{2}-\d{2}\b", raw_date or "")
-    return m.group(0) if m else ""
-
 def handle_block3a(message_text, user_id, send_reply_func, client_request_date=None):
     from router import route_message
     if client_request_date is None:
         client_request_date = time.time()
 
-    if wants_handover_ai(message_text):
-        update_state(user_id, {
-            "handover_reason": "asked_handover",
-            "scenario_stage_at_handover": "block3"
-        })
-        return route_message(message_text, user_id, force_stage="block5")
-
     state = get_state(user_id) or {}
+    prev_info = state.get("event_description", "")
+    combined_text = f"{prev_info}\n{message_text}".strip()
+
+    # Проверка хендовера и структурирование (один JSON-запрос: поля + дата ISO + время ЧЧ:ММ;
+    # дату/время выясняем всегда, пока не отправлен availability_reply) независимы — идут параллельно.
+    # Если клиент просит Арсения, выход из with отменяет структурирование.
+    with FanOut() as fan:
+        handover = fan.submit(wants_handover_ai, message_text)
+        slots_job = fan.submit(extract_slots, message_text, combined_text, SLOT_FIELDS, ask=ask_openai,
+                               with_datetime=not state.get("availability_reply_sent"))
+        if handover.result():
+            fan.cancel()            # до хендовера, а не после него: структурирование больше не нужно
+            update_state(user_id, {
+                "handover_reason": "asked_handover",
+                "scenario_stage_at_handover": "block3"
+            })
+            return route_message(message_text, user_id, force_stage="block5")
+        slots = slots_job.result()
+
     # Любой входящий текст от клиента «гасит» дальнейшие автокасания до явного решения
     update_state(user_id, {"last_sender": "user"})
-    prev_info = state.get("event_description", "")
     updated_description = (prev_info + "\n" + (message_text or "")).strip()
     update_state(user_id, {"event_description": updated_description})
 
     # ——— Промпты (оставляем 3a) ———
     global_prompt = load_prompt(GLOBAL_PROMPT_PATH)
     stage_prompt  = load_prompt(STAGE_PROMPT_PATH)
-    struct_prompt = load_prompt(STRUCTURE_PROMPT_PATH)
-
-    # 1) Структурирование как в 3c: сначала пробуем JSON, иначе fallback
-    struct_input = struct_prompt + f'\n\nСообщение клиента: "{message_text}"'
-    structured_reply = ask_openai(struct_input).strip()
-    logger.info("Ответ от OpenAI ДО парсинга:\n%s", structured_reply)
-
-    parsed_data = {}
-    try:
-        import json
-        parsed = json.loads(structured_reply)
-        if isinstance(parsed, dict):
-            parsed_data = parsed
-        else:
-            parsed_data = {}
-    except Exception:
-        parsed_data = parse_structured_pairs(structured_reply)
+
+    # 1) Слоты из JSON-ответа
+    parsed_data = slots["fields"]
 
     state = upsert_state(user_id, parsed_data)
     logger.info("Структурированные данные после апсёрта %s", {k: state.get(k) for k in SAFE_KEYS})
-
-    # для лога — чистая карта входных значений
-    parsed_view = {
-        k: ("" if v is None else str(v).strip())
-        for k, v in (parsed_data or {}).items()
-        if v is not None and str(v).strip().lower() not in IGNORED_VALUES
-    }
-    logger.info("Структурированные данные после очистки %s", parsed_view)
+    logger.info("Структурированные данные после очистки %s", parsed_data)
 
     # snapshot как в 3c
     snap = build_structured_snapshot(state)
     update_state(user_id, {"structured_cache": snap})
     state = get_state(user_id)
 
-    # 2) Уточняем дату/время до ISO/24h (как в 3c)
+    # 2) Дата/время уже нормализованы до ISO/24h
     from datetime import datetime
     now = datetime.now()
     client_request_date_str = now.strftime("%d %B %Y")
-    current_year = now.year
-
-    match_date = None
-    match_time = None
 
-    combined_text = f"{prev_info}\n{message_text}".strip()
-
-    # Пытаемся извлечь дату/время всегда, пока не отправлен availability_reply
-    if not state.get("availability_reply_sent"):
-        date_prompt = f"""
-        Сегодня: {client_request_date_str}
-
-        Все сообщения клиента: "{combined_text}"
-
-        Определи, указана ли в сообщениях дата проведения мероприятия.
-
-        Если указан только день и месяц — подставь текущий год: {current_year}.
-        Если указан год — используй его.
-        Формат: ГГГГ-ММ-ДД. Если даты нет — "нет даты".
-        """
-        date_reply = ask_openai(date_prompt).strip()
-        match_date = date_reply if date_reply.lower() != "нет даты" else None
-        logger.info("Дата проведения мероприятия от ИИ %s", match_date)
-
-        time_prompt = f"""
-        Все сообщения клиента: "{combined_text}"
-        Определи, указано ли в сообщениях время проведения мероприятия.
-        Если да — формат ЧЧ:ММ. Иначе — "нет времени".
-        """
-        time_reply = ask_openai(time_prompt).strip()
-        match_time = time_reply if time_reply.lower() != "нет времени" else None
-        logger.info("Время проведения мероприятия от ИИ %s", match_time)
+    match_date = slots["date"]
+    match_time = slots["time"]
+    logger.info("Дата/время мероприятия от ИИ %s %s", match_date, match_time)
     # сохраним нормализованные поля для downstream
     if match_date:
         update_state(user_id, {"event_date_iso": _clean_date(match_date)})
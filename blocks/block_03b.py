@@ -7,11 +7,13 @@ from utils.schedule import load_schedule_from_s3, check_date_availability
 from state.state import get_state, update_state
 from utils.reminder_engine import plan
 from logger import logger
+from utils.prompt_registry import load_prompt, render_prompt
+from utils.slot_extraction import extract_slots, ask_date_time, clean_date, clean_time
+from utils.fanout import FanOut
 
 # Пути к промптам
 GLOBAL_PROMPT_PATH = "prompts/global_prompt.txt"
 STAGE_PROMPT_PATH = "prompts/block03b_prompt.txt"
-STRUCTURE_PROMPT_PATH = "prompts/block03b_data_prompt.txt"
 REMINDER_1_PROMPT_PATH = "prompts/block03_reminder_1_prompt.txt"
 REMINDER_2_PROMPT_PATH = "prompts/block03_reminder_2_prompt.txt"
 AVAILABILITY_PROMPT_PATH = "prompts/block03_availability_prompt.txt"
@@ -36,22 +38,6 @@ KEY_NAMES = {
     "compere_availability": "наличие ведущего"
 }
 
-def load_prompt(path):
-    with open(path, "r", encoding="utf-8") as f:
-        return f.read()
-    
-def render_prompt(path: str, **kwargs) -> str:
-    """
-    Рендерим текст промпта с плейсхолдерами {name} через str.format().
-    Если в шаблоне нужны фигурные скобки как символы — экранировать {{ }}.
-    """
-    tmpl = load_prompt(path)
-    try:
-        return tmpl.format(**kwargs)
-    except Exception as e:
-        logger.warning(f"[block03a] format error in {path}: {e}")
-        return tmpl
-
 def missing_info_keys(state):
     required = [
         'event_format',
@@ -69,31 +55,6 @@ def missing_info_keys(state):
     missing = [key for key in required if not state.get(key)]
     return missing
 
-def parse_structured_pairs(text):
-    result = {}
-    patterns = {
-        "event_format": r"Формат мероприятия\s*[-—:]\s*(.+)",
-        "celebrant_name": r"Имя ключевого участника.*?[-—:]\s*(.+)",
-        "celebrant_gender": r"Пол ключевого участника.*?[-—:]\s*(.+)",
-        "celebrant_age": r"Возраст ключевого участника.*?[-—:]\s*(.+)",
-        "event_date": r"Дата мероприятия\s*[-—:]\s*(.+)",
-        "event_time": r"Время мероприятия\s*[-—:]\s*(.+)",
-        "event_location_type": r"Тип места проведения\s*[-—:]\s*(.+)",
-        "event_location": r"Название места проведения\s*[-—:]\s*(.+)",
-        "guests_count": r"Количество гостей\s*[-—:]\s*(.+)",
-        "guests_gender": r"Пол гостей\s*[-—:]\s*(.+)",
-        "guests_age": r"Возраст гостей\s*[-—:]\s*(.+)",
-        "compere_availability": r"(?:наличие ведущего|ведущий)\s*[-—:]\s*(.+)"
-    }
-    IGNORED_VALUES = {"не указано", "не указан", "неизвестно", "прочерк", "-", "n/a"}
-    for key, pattern in patterns.items():
-        m = re.search(pattern, text, re.IGNORECASE)
-        if m:
-            val = m.group(1).strip()
-            if val and val.lower() not in IGNORED_VALUES:
-                result[key] = val
-    return result
-
 def _normalize_compere(val: str) -> str:
     s = val.lower().strip()
     # отрицательные в первую очередь
@@ -109,35 +70,39 @@ def handle_block3b(message_text, user_id, send_reply_func, client_request_date=N
     if client_request_date is None:
         client_request_date = time.time()
 
-    if wants_handover_ai(message_text):
-        update_state(user_id, {
-            "handover_reason": "asked_handover",
-            "scenario_stage_at_handover": "block3"
-        })
-        from router import route_message
-        return route_message(message_text, user_id, force_stage="block5")
-
     state = get_state(user_id) or {}
+    prev_info = state.get("event_description", "")
+    combined_text = f"{prev_info}\n{message_text}".strip()
+    need_datetime = not DATE_DECISION_FLAGS.get(user_id) and not state.get("availability_reply_sent")
+
+    # Проверка хендовера и структурирование (один JSON-запрос: поля + дата ISO + время ЧЧ:ММ;
+    # дату/время выясняем, пока не отправлен availability_reply) независимы — идут параллельно.
+    # Если клиент просит Арсения, выход из with отменяет структурирование.
+    with FanOut() as fan:
+        handover = fan.submit(wants_handover_ai, message_text)
+        slots_job = fan.submit(extract_slots, message_text, combined_text, KEY_NAMES, ask=ask_openai,
+                               with_datetime=need_datetime)
+        if handover.result():
+            fan.cancel()            # до хендовера, а не после него: структурирование больше не нужно
+            update_state(user_id, {
+                "handover_reason": "asked_handover",
+                "scenario_stage_at_handover": "block3"
+            })
+            from router import route_message
+            return route_message(message_text, user_id, force_stage="block5")
+        slots = slots_job.result()
+
     # Любой входящий текст от клиента «гасит» дальнейшие автокасания до явного решения
     update_state(user_id, {"last_sender": "user"})
     updated_description = (state.get("event_description", "") + "\n" + message_text).strip()
     update_state(user_id, {"event_description": updated_description})
 
-    prev_info = state.get("event_description", "")
-
     # Загружаем промпты
     global_prompt = load_prompt(GLOBAL_PROMPT_PATH)
     stage_prompt = load_prompt(STAGE_PROMPT_PATH)
-    struct_prompt = load_prompt(STRUCTURE_PROMPT_PATH)
-
-    # 1. Получаем структурированные данные
-    struct_input = (
-        struct_prompt
-        + f"\n\nСообщение клиента: \"{message_text}\""
-        + f"\n\nПредыдущее описание: {prev_info}"
-    )
-    structured_reply = ask_openai(struct_input).strip()
-    parsed_data = parse_structured_pairs(structured_reply)
+
+    # 1. Слоты из JSON-ответа
+    parsed_data = slots["fields"]
     # если из структурного ответа пришло поле — нормализуем
     if "compere_availability" in parsed_data:
         parsed_data["compere_availability"] = _normalize_compere(parsed_data["compere_availability"])
@@ -157,42 +122,9 @@ def handle_block3b(message_text, user_id, send_reply_func, client_request_date=N
 
     now = datetime.now()
     client_request_date_str = now.strftime("%d %B %Y")  # напр. "06 августа 2025"
-    current_year = now.year
-    match_date = None
-    match_time = None
-    if user_id not in DATE_DECISION_FLAGS or not DATE_DECISION_FLAGS[user_id]:
-        combined_text = f"{prev_info}\n{message_text}".strip()
-
-        # Пытаемся извлечь дату/время всегда, пока не отправлен availability_reply
-        if not state.get("availability_reply_sent"):
-            date_prompt = f"""
-            Сегодня: {client_request_date_str}
-
-            Все сообщения клиента: "{combined_text}"
-
-            Определи, указана ли в сообщениях дата проведения мероприятия.
-
-            Если указан только день и месяц — подставь текущий год: {current_year}.
-            Если указан год — используй его.
-            Формат: ГГГГ-ММ-ДД. Если даты нет — "нет даты".
-            """
-            date_reply = ask_openai(date_prompt).strip()
-            match_date = date_reply if date_reply.lower() != "нет даты" else None
-            logger.info("Дата проведения мероприятия от ИИ %s", match_date)
-            time_prompt = f"""
-            Все сообщения клиента: "{combined_text}"
-            Определи, указано ли в сообщениях время проведения мероприятия.
-            Если да — формат ЧЧ:ММ. Иначе — "нет времени".
-            """
-            time_reply = ask_openai(time_prompt).strip()
-            match_time = time_reply if time_reply.lower() != "нет времени" else None
-            logger.info("Время проведения мероприятия от ИИ %s", match_time)
-    def clean_time(raw_time: str) -> str:
-        match = re.search(r"\b([01]?\d|2[0-3]):[0-5]\d\b", raw_time)
-        return match.group(0) if match else ""
-    def clean_date(raw_date: str) -> str:
-        match = re.search(r"\b\d{4}-\d{2}-\d{2}\b", raw_date)
-        return match.group(0) if match else ""
+    match_date = slots["date"]
+    match_time = slots["time"]
+    logger.info("Дата/время мероприятия от ИИ %s %s", match_date, match_time)
 
 # --- Новый блок: отправка availability_reply сразу, как только есть дата и время ---
     if not state.get("availability_reply_sent"):
@@ -313,35 +245,8 @@ def handle_block3b(message_text, user_id, send_reply_func, client_request_date=N
         has_date = state.get("event_date")
         has_time = state.get("event_time")
         if has_date and has_time and not state.get("availability_reply_sent"):
-            # Уточняем дату и время через OpenAI
-            date_prompt = f"""
-            Сегодня: {client_request_date_str}
-
-            Все сообщения клиента: "{combined_text}"
-
-            Определи, указана ли в сообщениях дата проведения мероприятия.
-
-            Если в сообщении указан только день и месяц — подставь текущий год: {current_year}.
-            Если в сообщении указан полный год — используй его.
-            Формат: ГГГГ-ММ-ДД. Если даты нет — напиши "нет даты".
-            """
-            date_reply = ask_openai(date_prompt).strip()
-            match_date = date_reply if date_reply.lower() != "нет даты" else None
-            logger.info("Дата проведения мероприятия от ИИ %s", match_date)
-
-            time_prompt = f"""
-            Все сообщения клиента: "{combined_text}"
-            Определи, указано ли в сообщениях время проведения мероприятия. 
-            Если да, напиши его в формате ЧЧ:ММ. Иначе — "нет времени".
-            """
-            time_reply = ask_openai(time_prompt).strip()
-            match_time = time_reply if time_reply.lower() != "нет времени" else None
-            logger.info("Время проведения мероприятия от ИИ %s", match_time)
-
-            def clean_time(raw_time: str) -> str:
-                match = re.search(r"\b([01]?\d|2[0-3]):[0-5]\d\b", raw_time)
-                return match.group(0) if match else ""
-
+            # Уточняем дату и время через OpenAI (те же промпты — ответ обычно уже в кэше)
+            match_date, match_time = ask_date_time(combined_text, ask_openai)
             match_time = clean_time(match_time)
 
             # Определяем тип места
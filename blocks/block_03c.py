@@ -7,12 +7,14 @@ from utils.schedule import load_schedule_from_s3, check_date_availability
 from state.state import get_state, update_state
 from utils.reminder_engine import plan
 from logger import logger
+from utils.prompt_registry import load_prompt, render_prompt
+from utils.slot_extraction import extract_slots, ask_date_time, clean_date, clean_time
 from utils.structured import build_structured_snapshot
+from utils.fanout import FanOut
 
 # Пути к промптам
 GLOBAL_PROMPT_PATH = "prompts/global_prompt.txt"
 STAGE_PROMPT_PATH = "prompts/block03c_prompt.txt"
-STRUCTURE_PROMPT_PATH = "prompts/block03c_data_prompt.txt"
 REMINDER_1_PROMPT_PATH = "prompts/block03_reminder_1_prompt.txt"
 REMINDER_2_PROMPT_PATH = "prompts/block03_reminder_2_prompt.txt"
 AVAILABILITY_PROMPT_PATH = "prompts/block03_availability_prompt.txt"
@@ -78,22 +80,6 @@ def upsert_state(user_id, parsed_data: dict):
         update_state(user_id, out)
     return get_state(user_id)
 
-def load_prompt(path):
-    with open(path, "r", encoding="utf-8") as f:
-        return f.read()
-    
-def render_prompt(path: str, **kwargs) -> str:
-    """
-    Рендерим текст промпта с плейсхолдерами {name} через str.format().
-    Если в шаблоне нужны фигурные скобки как символы — экранировать {{ }}.
-    """
-    tmpl = load_prompt(path)
-    try:
-        return tmpl.format(**kwargs)
-    except Exception as e:
-        logger.warning(f"[block03a] format error in {path}: {e}")
-        return tmpl
-
 def is_true(v):
     return str(v).strip().lower() in {"true","yes","да","y","1"}
 
@@ -112,52 +98,40 @@ def handle_block3c(message_text, user_id, send_reply_func, client_request_date=N
     if client_request_date is None:
         client_request_date = time.time()
 
-    if wants_handover_ai(message_text):
-        update_state(user_id, {
-            "handover_reason": "asked_handover",
-            "scenario_stage_at_handover": "block3"
-        })
-        return route_message(message_text, user_id, force_stage="block5")
-
     state = get_state(user_id) or {}
+    prev_info = state.get("event_description", "")
+    combined_text = f"{prev_info}\n{message_text}".strip()
+
+    # Проверка хендовера и структурирование (один JSON-запрос: поля + дата ISO + время ЧЧ:ММ;
+    # дату/время выясняем всегда, пока не отправлен availability_reply) независимы — идут параллельно.
+    # Если клиент просит Арсения, выход из with отменяет структурирование.
+    with FanOut() as fan:
+        handover = fan.submit(wants_handover_ai, message_text)
+        slots_job = fan.submit(extract_slots, message_text, combined_text, KEY_NAMES, ask=ask_openai,
+                               with_datetime=not state.get("availability_reply_sent"))
+        if handover.result():
+            fan.cancel()            # до хендовера, а не после него: структурирование больше не нужно
+            update_state(user_id, {
+                "handover_reason": "asked_handover",
+                "scenario_stage_at_handover": "block3"
+            })
+            return route_message(message_text, user_id, force_stage="block5")
+        slots = slots_job.result()
+
     # Любой входящий текст от клиента «гасит» дальнейшие автокасания до явного решения
     update_state(user_id, {"last_sender": "user"})
     updated_description = (state.get("event_description", "") + "\n" + message_text).strip()
     update_state(user_id, {"event_description": updated_description})
 
-    prev_info = state.get("event_description", "")
-
     # Загружаем промпты
     global_prompt = load_prompt(GLOBAL_PROMPT_PATH)
     stage_prompt = load_prompt(STAGE_PROMPT_PATH)
-    struct_prompt = load_prompt(STRUCTURE_PROMPT_PATH)
-
-    # 1. Получаем структурированные данные
-    struct_input = (
-        struct_prompt
-        + f"\n\nСообщение клиента: \"{message_text}\""
-    )
-    import json
 
-    structured_reply = ask_openai(struct_input).strip()
-    logger.info("Ответ от OpenAI ДО парсинга:\n%s", structured_reply)
-
-    try:
-        parsed_data = json.loads(structured_reply)
-    except json.JSONDecodeError:
-        logger.warning("Ошибка при разборе JSON-ответа от OpenAI")
-        parsed_data = {}
-
-    state = upsert_state(user_id, parsed_data)  # <-- только это
-    logger.info("Структурированные данные после апсёрта %s", {k: state.get(k) for k in SAFE_KEYS})
+    # 1. Слоты из JSON-ответа
+    parsed_data = slots["fields"]
 
-    # раньше ты тут чистил и сразу update_state(...)
     state = upsert_state(user_id, parsed_data)
-    parsed_data = {
-        key: str(value).strip()
-        for key, value in parsed_data.items()
-        if value is not None and str(value).strip().lower() not in IGNORED_VALUES
-    }
+    logger.info("Структурированные данные после апсёрта %s", {k: state.get(k) for k in SAFE_KEYS})
     logger.info("Структурированные данные после очистки %s", parsed_data)
     snap = build_structured_snapshot(state)
     update_state(user_id, {"structured_cache": snap})
@@ -169,42 +143,9 @@ def handle_block3c(message_text, user_id, send_reply_func, client_request_date=N
     from datetime import datetime
     now = datetime.now()
     client_request_date_str = now.strftime("%d %B %Y")  # напр. "06 августа 2025"
-    current_year = now.year
-    match_date = None
-    match_time = None
-    combined_text = f"{prev_info}\n{message_text}".strip()
-
-    # Пытаемся извлечь дату/время всегда, пока не отправлен availability_reply
-    if not state.get("availability_reply_sent"):
-        date_prompt = f"""
-        Сегодня: {client_request_date_str}
-
-        Все сообщения клиента: "{combined_text}"
-
-        Определи, указана ли в сообщениях дата проведения мероприятия.
-
-        Если указан только день и месяц — подставь текущий год: {current_year}.
-        Если указан год — используй его.
-        Формат: ГГГГ-ММ-ДД. Если даты нет — "нет даты".
-        """
-        date_reply = ask_openai(date_prompt).strip()
-        match_date = date_reply if date_reply.lower() != "нет даты" else None
-        logger.info("Дата проведения мероприятия от ИИ %s", match_date)
-
-        time_prompt = f"""
-        Все сообщения клиента: "{combined_text}"
-        Определи, указано ли в сообщениях время проведения мероприятия.
-        Если да — формат ЧЧ:ММ. Иначе — "нет времени".
-        """
-        time_reply = ask_openai(time_prompt).strip()
-        match_time = time_reply if time_reply.lower() != "нет времени" else None
-        logger.info("Время проведения мероприятия от ИИ %s", match_time)
-    def clean_time(raw_time: str) -> str:
-        match = re.search(r"\b([01]?\d|2[0-3]):[0-5]\d\b", raw_time)
-        return match.group(0) if match else ""
-    def clean_date(raw_date: str) -> str:
-        match = re.search(r"\b\d{4}-\d{2}-\d{2}\b", raw_date)
-        return match.group(0) if match else ""
+    match_date = slots["date"]
+    match_time = slots["time"]
+    logger.info("Дата/время мероприятия от ИИ %s %s", match_date, match_time)
     if match_date:
         update_state(user_id, {"event_date_iso": clean_date(match_date)})  # 'YYYY-MM-DD'
     if match_time:
@@ -329,35 +270,8 @@ def handle_block3c(message_text, user_id, send_reply_func, client_request_date=N
         has_date = state.get("event_date")
         has_time = state.get("event_time")
         if has_date and has_time and not state.get("availability_reply_sent"):
-            # Уточняем дату и время через OpenAI
-            date_prompt = f"""
-            Сегодня: {client_request_date_str}
-
-            Все сообщения клиента: "{combined_text}"
-
-            Определи, указана ли в сообщениях дата проведения мероприятия.
-
-            Если в сообщении указан только день и месяц — подставь текущий год: {current_year}.
-            Если в сообщении указан полный год — используй его.
-            Формат: ГГГГ-ММ-ДД. Если даты нет — напиши "нет даты".
-            """
-            date_reply = ask_openai(date_prompt).strip()
-            match_date = date_reply if date_reply.lower() != "нет даты" else None
-            logger.info("Дата проведения мероприятия от ИИ %s", match_date)
-
-            time_prompt = f"""
-            Все сообщения клиента: "{combined_text}"
-            Определи, указано ли в сообщениях время проведения мероприятия. 
-            Если да, напиши его в формате ЧЧ:ММ. Иначе — "нет времени".
-            """
-            time_reply = ask_openai(time_prompt).strip()
-            match_time = time_reply if time_reply.lower() != "нет времени" else None
-            logger.info("Время проведения мероприятия от ИИ %s", match_time)
-
-            def clean_time(raw_time: str) -> str:
-                match = re.search(r"\b([01]?\d|2[0-3]):[0-5]\d\b", raw_time)
-                return match.group(0) if match else ""
-
+            # Уточняем дату и время через OpenAI (те же промпты — ответ обычно уже в кэше)
+            match_date, match_time = ask_date_time(combined_text, ask_openai)
             match_time = clean_time(match_time)
 
             # Определяем тип места
@@ -2,16 +2,13 @@ import time
 from utils.ask_openai import ask_openai
 from utils.wants_handover_ai import wants_handover_ai
 from state.state import get_state, update_state
+from utils.prompt_registry import load_prompt
 from utils.schedule import load_schedule_from_s3  # не нужен, но оставлен для единообразия импорта
 
 # Пути к промптам
 GLOBAL_PROMPT_PATH = "prompts/global_prompt.txt"
 STAGE_PROMPT_PATH  = "prompts/block03d_prompt.txt"
 
-def load_prompt(path: str) -> str:
-    with open(path, "r", encoding="utf-8") as f:
-        return f.read()
-
 def handle_block3d(message_text: str, user_id: str, send_reply_func, client_request_date: str):
     """
     Нестандартное шоу — сразу передаём общение Арсению после единственного ответа.
@@ -1,24 +1,38 @@
 from utils.env_loader import ensure_env_loaded
 ensure_env_loaded()
 import time
-import requests, os
+import os
 from utils.ask_openai import ask_openai
 from state.state import get_state, update_state
-from utils.wants_handover_ai import wants_handover_ai
 from utils.whatsapp_senders import (
     send_owner_resume,      # единственная отправка резюме
     send_image,             # для фото
  )
 from logger import logger
+from utils.prompt_registry import load_prompt
+from utils.telegram_alert import send_telegram_alert
+from utils import response_pool, llm_limiter, graph_http
 
 GLOBAL_PROMPT = "prompts/global_prompt.txt"
 STAGE_PROMPT  = "prompts/block05_prompt.txt"
 OWNER_WA_ID   = os.getenv("OWNER_WA_ID")  # в тестах может быть пусто
 
+HANDOVER_NOTICE_SITUATION = (
+    "\n\nСИТУАЦИЯ: бот передаёт диалог Арсению. Сформируй короткое дружелюбное сообщение: "
+    "поблагодари, скажи что Арсений свяжется при необходимости, заверши позитивно."
+)
+
 # ---------------------------------------------------------------------------
 def _load(p: str) -> str:
-    with open(p, "r", encoding="utf-8") as f:
-        return f.read()
+    return load_prompt(p)
+
+
+def _handover_notice_prompt() -> str:
+    return _load(GLOBAL_PROMPT) + "\n\n" + _load(STAGE_PROMPT) + HANDOVER_NOTICE_SITUATION
+
+
+# сообщение «передаю Арсению» одинаково для всех — берём из пула готовых вариантов
+response_pool.register("block5_handover_notice", _handover_notice_prompt)
 
 # ---------------------------------------------------------------------------
 def handle_block5(
@@ -32,10 +46,6 @@ def handle_block5(
     Универсальный hand-over: формируем расширенное резюме и передаём
     Арсению. Вызывается force_stage='block5' из любого блока.
     """
-    if wants_handover_ai(message_text):
-        # уже в процессе передачи — игнорируем повторную просьбу
-        pass
-
     st = get_state(user_id) or {}
     # Если не зафиксировали этап для CRM – фиксируем текущий
     if not st.get("scenario_stage_at_handover"):
@@ -48,15 +58,21 @@ def handle_block5(
         summary = _build_summary(st, comment)
         # Постоянная подпись для Арсения (всегда одинаковая)
         # формируем две переменные для шаблона
+        delivered = False
         try:
-            # Одним вызовом: сам разрежет и пошлёт несколько template-частей
-            wa_resps = send_owner_resume(summary)   # list[requests.Response]
+            # Одним вызовом: сам разрежет и пошлёт несколько template-частей.
+            # Синхронно, мимо очереди: флаг ставим только по ответу 2xx от Graph API
+            wa_resps = send_owner_resume(summary)
             statuses = [getattr(r, "status_code", "?") for r in wa_resps]
             logger.info("[block5] resume WA-status=%s user=%s", statuses, user_id)
-            if any(getattr(r, "status_code", 0) // 100 == 2 for r in wa_resps):
-                update_state(user_id, {"arseniy_notified": True})
+            delivered = bool(wa_resps) and all(getattr(r, "status_code", 0) // 100 == 2 for r in wa_resps)
         except Exception as e:
             logger.error("[block5] failed to send owner summary: %s", e)
+        if delivered:
+            update_state(user_id, {"arseniy_notified": True})
+        else:
+            # WhatsApp не принял резюме — чтобы клиент не потерялся, дублируем в Telegram
+            send_telegram_alert(f"⚠️ Резюме для Арсения не ушло в WhatsApp (user={user_id}):\n{summary}")
 
         # --- 1a. Фото именинника -------------------------------------
         if st.get("celebrant_photo_id"):
@@ -69,12 +85,10 @@ def handle_block5(
     # --- 2. Сообщение клиенту (если ещё не уведомили) ---------------
     if not st.get("client_notified_about_handover"):
         try:
-            prompt = (
-                _load(GLOBAL_PROMPT) + "\n\n" + _load(STAGE_PROMPT) +
-                "\n\nСИТУАЦИЯ: бот передаёт диалог Арсению. Сформируй короткое дружелюбное сообщение: "
-                "поблагодари, скажи что Арсений свяжется при необходимости, заверши позитивно."
-            )
-            txt = ask_openai(prompt).strip()
+            txt = response_pool.pick("block5_handover_notice")
+            if not txt:
+                with llm_limiter.priority(llm_limiter.HANDOVER):
+                    txt = ask_openai(_handover_notice_prompt()).strip()
         except Exception:
             txt = ("Спасибо! Передал информацию Арсению – он посмотрит детали и свяжется с вами при необходимости. "
                    "Хорошего дня!")
@@ -221,13 +235,12 @@ def _forward_and_persist_photo(media_id: str, user_id: str, send_owner_media):
     # --- 2. запрашиваем временный URL у Meta ----------------------
     token = os.getenv("WHATSAPP_TOKEN") or st.get("wa_token")  # fallback
     try:
-        meta = requests.get(
-            f"https://graph.facebook.com/v17.0/{media_id}",
+        meta = graph_http.get(
+            graph_http.graph_url(media_id),
             headers={"Authorization": f"Bearer {token}"},
-            timeout=10,
         ).json()
         file_url = meta["url"]
-        img_resp = requests.get(file_url, headers={"Authorization": f"Bearer {token}"}, timeout=20)
+        img_resp = graph_http.get(file_url, headers={"Authorization": f"Bearer {token}"}, timeout=30)
         img_resp.raise_for_status()
     except Exception as e:
         logger.error(f"[block5] cannot fetch media {media_id}: {e}")
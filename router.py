@@ -3,7 +3,8 @@ ensure_env_loaded()
 import os
 import inspect
 import time
-from state.state import get_state, update_state
+from state.state import get_state, update_state, transaction
+from utils import deadline as turn_deadline
 from logger import logger
 from utils.whatsapp_senders import send_text, send_document, send_video, send_image
 from utils.lang_detect import detect_lang, is_russian, is_affirmative, is_negative
@@ -52,16 +53,22 @@ def _response(user_id: str) -> dict:
         next_step = "hello"
     return {"ok": True, "stage": stage, "next_step": next_step}
 
-def route_message(text: str, normalized_number: str, client_name: str | None = None, message_uid: str | None = None, message_ts: int | None = None, force_stage: str | None = None):
-    """Единый интерфейс: пробрасываем параметры в _route_message_impl."""
-    return _route_message_impl(
-        message_text=text,
-        user_id=normalized_number,
-        client_name=client_name,
-        force_stage=force_stage,
-        message_uid=message_uid,
-        message_ts=message_ts,
-    )
+def route_message(text: str, normalized_number: str, client_name: str | None = None, message_uid: str | None = None, message_ts: int | None = None, force_stage: str | None = None, deadline: "turn_deadline.Deadline | None" = None):
+    """
+    Единый интерфейс: пробрасываем параметры в _route_message_impl.
+    Весь ход — одна транзакция state: записи роутера и блока применяются разом
+    (вложенные route_message с force_stage присоединяются к ней же).
+    deadline — бюджет хода: блоки и ask_openai видят его через utils.deadline.current().
+    """
+    with transaction(normalized_number), turn_deadline.scope(deadline):
+        return _route_message_impl(
+            message_text=text,
+            user_id=normalized_number,
+            client_name=client_name,
+            force_stage=force_stage,
+            message_uid=message_uid,
+            message_ts=message_ts,
+        )
 # ---------------------------------------------------------------------------
 def _route_message_impl(
     message_text: str,
@@ -97,11 +104,9 @@ def _route_message_impl(
                 except Exception:
                     pass
 
-            # 🧹 чистим отложенные джобы
-            from utils.reminder_engine import sched
-            for job in sched.get_jobs():
-                if job.id.startswith(f"{user_id}:"):
-                    sched.remove_job(job.id)
+            # 🧹 чистим отложенные джобы (по индексу задач пользователя)
+            from utils.reminder_engine import cancel_user_jobs
+            cancel_user_jobs(user_id)
 
             send_text(wa_to, "State cleared.")
         else:
@@ -110,8 +115,8 @@ def _route_message_impl(
         return _response(user_id)
 
     elif message_text.strip() == "#jobs" and user_id in ADMIN_NUMBERS:
-        from utils.reminder_engine import sched
-        jobs = "\n".join(j.id for j in sched.get_jobs())
+        from utils.reminder_engine import all_job_ids
+        jobs = "\n".join(all_job_ids())
         send_text(wa_to, jobs or "нет job-ов")
         return _response(user_id)
 
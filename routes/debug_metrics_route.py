@@ -0,0 +1,92 @@
+# routes/debug_metrics_route.py
+from flask import Blueprint, jsonify, request
+from utils import inbound_queue, user_lanes, llm_cache
+
+debug_metrics_bp = Blueprint("debug_metrics", __name__)
+
+@debug_metrics_bp.route("/debug/queue")
+def debug_queue():
+    """Глубина входящей очереди и задержка enqueue→start."""
+    return jsonify(inbound_queue.stats()), 200
+
+@debug_metrics_bp.route("/debug/outbound")
+def debug_outbound():
+    """Исходящая очередь: глубина, повторы, задержка доставки и последние мёртвые письма."""
+    from utils import outbound_queue
+    return jsonify({**outbound_queue.stats(), "dead_letters": outbound_queue.dead_letters(20)}), 200
+
+@debug_metrics_bp.route("/debug/delivery")
+def debug_delivery():
+    """Статусы доставки: по статусам, повторные отправки, задержка отправка → доставка/прочтение."""
+    from utils import delivery_status
+    return jsonify(delivery_status.stats()), 200
+
+@debug_metrics_bp.route("/debug/lanes")
+def debug_lanes():
+    """Бэклог по дорожкам пользователей."""
+    return jsonify(user_lanes.stats()), 200
+
+@debug_metrics_bp.route("/debug/bursts")
+def debug_bursts():
+    """Склейка коротких сообщений: сообщений на один ход роутера."""
+    from utils.incoming_message import burst_stats
+    return jsonify(burst_stats()), 200
+
+@debug_metrics_bp.route("/debug/state")
+def debug_state():
+    """Кэш состояния, очередь на запись и транзакции."""
+    from state import state
+    return jsonify(state.stats()), 200
+
+@debug_metrics_bp.route("/debug/users")
+def debug_users():
+    """Выборка по индексам: ?stage=block2&older_than=3600 или ?field=handover_reason&value=..."""
+    from state import state
+    stage = request.args.get("stage")
+    older_than = request.args.get("older_than", type=float)
+    if stage:
+        users = state.users_in_stage(stage, older_than=older_than)
+    elif request.args.get("field"):
+        value = request.args.get("value", "")
+        value = {"true": True, "false": False}.get(value.lower(), value)
+        users = sorted(state.users_where(request.args["field"], value))
+    elif older_than is not None:
+        users = state.users_idle(older_than)
+    else:
+        return jsonify({"error": "нужен stage, field или older_than"}), 400
+    return jsonify({"count": len(users), "users": users[:500]}), 200
+
+@debug_metrics_bp.route("/debug/llm")
+def debug_llm():
+    """Кэш ответов LLM (попадания по местам вызова), склейка одинаковых запросов в полёте,
+    параллельные вызовы хода, пулы готовых статичных ответов, ограничитель RPM/TPM с очередью,
+    дубли медленных запросов и бюджет хода."""
+    from utils.ask_openai import flight_stats, hedge_stats
+    from utils import fanout, response_pool, llm_limiter, deadline
+    return jsonify({**llm_cache.stats(), "single_flight": flight_stats(), "fanout": fanout.stats(),
+                    "response_pools": response_pool.stats(), "limiter": llm_limiter.stats(),
+                    "hedge": hedge_stats(), "deadline": deadline.stats()}), 200
+
+@debug_metrics_bp.route("/debug/prompts")
+def debug_prompts():
+    """Промпты в памяти: размер, рендеры, перечитывания с диска."""
+    from utils.prompt_registry import registry
+    return jsonify(registry.stats()), 200
+
+@debug_metrics_bp.route("/debug/handover")
+def debug_handover():
+    """Локальный классификатор хендовера: сколько решено без LLM."""
+    from utils import handover_classifier
+    return jsonify(handover_classifier.stats()), 200
+
+@debug_metrics_bp.route("/debug/graph")
+def debug_graph():
+    """Транспорт Graph API: задержки и ошибки по эндпоинтам."""
+    from utils import graph_http
+    return jsonify(graph_http.stats()), 200
+
+@debug_metrics_bp.route("/debug/token")
+def debug_token():
+    """WA-токен: источник, срок жизни, фоновые обновления (сам токен не показываем)."""
+    from utils import token_manager
+    return jsonify(token_manager.stats()), 200
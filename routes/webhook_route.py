@@ -1,7 +1,8 @@
-import hmac, hashlib
+import hmac, hashlib, time
 from flask import Blueprint, request, abort, Response, current_app
 from logger import logger
-from utils.incoming_message import handle_message, handle_status  # используем реальные обработчики
+from utils.incoming_message import handle_message, handle_status, retry_turn, recover_bursts, normalize_for_meta  # используем реальные обработчики
+from utils import inbound_queue
 
 webhook_bp = Blueprint("webhook", __name__)
 
@@ -25,6 +26,66 @@ def _check_signature(raw: bytes) -> bool:
     return ok
 
 
+def _collect_events(data: dict) -> list[tuple[str, dict]]:
+    """Разворачиваем payload Meta в плоский список событий (kind, payload)."""
+    events = []
+    received_at = time.time()           # от этого момента отсчитывается бюджет хода (utils/deadline.py)
+    for entry in data.get('entry', []):
+        for change in entry.get('changes', []):
+            value = change.get('value', {}) or {}
+            meta = value.get('metadata') or {}
+            phone_id = meta.get('phone_number_id', '')
+            display = meta.get('display_phone_number', '')
+            contacts = value.get('contacts') or []
+
+            for message in value.get('messages', []):
+                events.append(("message", {
+                    "message": message,
+                    "phone_id": phone_id,
+                    "display": display,
+                    "contacts": contacts,
+                    "received_at": received_at,
+                }))
+
+            for status in value.get('statuses', []):
+                events.append(("status", {"status": status}))
+    return events
+
+
+def dispatch_event(kind: str, payload: dict) -> None:
+    """Обработка одного события — и из очереди, и в синхронном режиме."""
+    if kind == "message":
+        handle_message(payload["message"], payload["phone_id"], payload["display"], payload["contacts"],
+                       received_at=payload.get("received_at"))
+    elif kind == "status":
+        handle_status(payload["status"])
+    elif kind == "turn_retry":
+        retry_turn(payload)
+    else:
+        logger.warning(f"⚠️ webhook: неизвестный тип события {kind!r}")
+
+
+def event_user_key(kind: str, payload: dict) -> str:
+    """Ключ дорожки: события одного клиента обрабатываются строго по порядку."""
+    if kind == "message":
+        return normalize_for_meta(payload["message"].get("from") or "")
+    if kind == "status":
+        return normalize_for_meta(payload["status"].get("recipient_id") or "")
+    if kind == "turn_retry":
+        return payload["user"]
+    return ""
+
+
+def start_inbound_workers() -> None:
+    """Запуск разбора входящей очереди (берём dispatch_event через модуль — его можно подменить)."""
+    try:
+        recover_bursts()
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось восстановить незавершённые склейки: {e}")
+    inbound_queue.start_workers(lambda kind, payload: dispatch_event(kind, payload),
+                                key_fn=event_user_key)
+
+
 @webhook_bp.route("/webhook", methods=["GET", "POST"])
 def webhook():
     if request.method == 'GET':
@@ -50,18 +111,13 @@ def webhook():
         logger.info("📩 webhook raw json: %s", data)
 
         if data.get('object') == 'whatsapp_business_account':
-            for entry in data.get('entry', []):
-                for change in entry.get('changes', []):
-                    value = change.get('value', {}) or {}
-                    meta = value.get('metadata') or {}
-                    phone_id = meta.get('phone_number_id', '')
-                    display = meta.get('display_phone_number', '')
-                    contacts = value.get('contacts') or []
-
-                    for message in value.get('messages', []):
-                        handle_message(message, phone_id, display, contacts)
-
-                    for status in value.get('statuses', []):
-                        handle_status(status)
+            events = _collect_events(data)
+            if inbound_queue.is_running():
+                # Быстрый ack: события надёжно сохранены, разбирают воркеры
+                inbound_queue.enqueue_many(events)
+            else:
+                # Очередь не запущена (тесты / локальный запуск) — по-старому, синхронно
+                for kind, payload in events:
+                    dispatch_event(kind, payload)
 
-        return Response("ok", mimetype="text/plain")
\ No newline at end of file
+        return Response("ok", mimetype="text/plain")
@@ -0,0 +1,42 @@
+"""
+Пропускная способность исходящей отправки без сети: очередь → graph_http → локальный Graph API.
+Запуск: python -m scripts.bench_outbound_send [сообщений] [получателей] [задержка, мс] [доля 429]
+Поднимает scripts.fake_graph_api в этом же процессе, очередь и статусы — во временной папке.
+"""
+import sys, time, tempfile
+from scripts.fake_graph_api import FakeConfig, start_in_thread
+from utils import graph_http, outbound_queue, delivery_status, token_manager
+
+
+def main(n: int = 2000, recipients: int = 50, latency_ms: float = 80, rate_limit: float = 0.02):
+    server = start_in_thread(FakeConfig(latency_ms=latency_ms, jitter_ms=latency_ms / 2,
+                                        rate_limit=rate_limit, retry_after=0))
+    graph_http.GRAPH_BASE_URL = server.base_url
+    tmp = tempfile.mkdtemp(prefix="bench_outbound_")
+    token_manager.configure(f"{tmp}/wa_token.json")
+    token_manager.set_token("fake-token")
+    outbound_queue.configure(f"{tmp}/outbound.db")
+    delivery_status.configure(f"{tmp}/delivery.db")
+
+    outbound_queue.start_workers()
+    t0 = time.monotonic()
+    for i in range(n):
+        outbound_queue.send({"messaging_product": "whatsapp", "to": f"7700{i % recipients:07d}",
+                             "type": "text", "text": {"body": f"сообщение {i}"}})
+    while outbound_queue.stats()["total_sent"] < n and time.monotonic() - t0 < 600:
+        time.sleep(0.05)
+    elapsed = time.monotonic() - t0
+    outbound_queue.stop_workers()
+
+    q = outbound_queue.stats()
+    print(f"отправлено {q['total_sent']}/{n} за {elapsed:.1f} с → {q['total_sent'] / elapsed:.0f} msg/s "
+          f"(лимит OUTBOUND_MPS={outbound_queue.MPS:g}, воркеров {outbound_queue.WORKERS})")
+    print(f"повторов {q['total_retried']}, мёртвых {q['dead']}, сервер: {dict(server.state.counters)}")
+    for name, ep in graph_http.stats()["endpoints"].items():
+        print(f"  {name}: p50 {ep['p50_ms']} мс, p95 {ep['p95_ms']} мс, ошибок {ep['errors']}/{ep['requests']}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    main(*(int(a) for a in args[:2]), *(float(a) for a in args[2:4]))
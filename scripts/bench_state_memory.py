@@ -0,0 +1,50 @@
+"""
+Память: dict против DialogueState на типичном состоянии диалога.
+Запуск: python -m scripts.bench_state_memory [кол-во пользователей ...]
+"""
+import sys, time, tracemalloc
+from state.dialogue_state import DialogueState
+
+
+def _sample(i: int) -> dict:
+    """Типичный диалог в середине воронки (block3a): ~40 ключей."""
+    now = time.time()
+    return {
+        "stage": "block3a", "show_type": "детское", "last_sender": "user",
+        "last_message_ts": now - i, "normalized_number": f"7870{i:07d}", "raw_number": f"7870{i:07d}",
+        "client_name": "Мария", "last_incoming_id": f"wamid.HBgL{i:012d}", "last_incoming_ts": int(now),
+        "last_incoming_text": "на 15 июня, 12 детей", "last_incoming_stage": "block3a",
+        "last_msg_uid": f"wamid.HBgL{i:012d}", "last_msg_hash": f"{i:040x}", "last_msg_ts": now,
+        "event_description": "День рождения дочери, 7 лет, 12 детей, дома",
+        "structured_cache": "Имя именинника: Алиса\nВозраст: 7", "event_date_iso": "2025-06-15",
+        "event_time_24": "12:00", "celebrant_name": "Алиса", "uninformative_replies": 0,
+        "block2_intro_sent": True, "r1_scheduled_b2": False, "r2_scheduled_b2": False,
+        "r1_scheduled_b3a": True, "r2_scheduled_b3a": False, "fin_scheduled_b3a_done": False,
+        "availability_reply_sent": True, "summary_and_availability_sent": False,
+        "lang_confirmed": True, "lang_check_pending": False, "no_celebrant": False,
+        "arseniy_notified": False, "notion_exported": False, "notion_export_error": False,
+        "clarification_attempts": 1, "detected_lang": "ru", "date_decision_flag": "ok",
+        "guests_count": 12, "place_type": "дом", "celebrant_age": 7,
+    }
+
+
+def _measure(n: int, factory) -> int:
+    raw = [_sample(i) for i in range(n)]          # исходные данные — вне замера
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    # как в проде: stage/show_type приходят из разных ответов, т.е. разными объектами-строками
+    kept = [factory({k: (v.encode().decode() if isinstance(v, str) and k in ("stage", "show_type", "last_sender") else v)
+                     for k, v in d.items()}) for d in raw]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return after - before
+
+
+if __name__ == "__main__":
+    sizes = [int(x) for x in sys.argv[1:]] or [10_000, 100_000]
+    print(f"{'users':>8} | {'dict, MB':>9} | {'DialogueState, MB':>18} | экономия")
+    for n in sizes:
+        d = _measure(n, dict)
+        c = _measure(n, DialogueState)
+        print(f"{n:>8} | {d / 2**20:>9.1f} | {c / 2**20:>18.1f} | {100 * (1 - c / d):.0f}%")
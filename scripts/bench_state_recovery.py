@@ -0,0 +1,25 @@
+"""
+Замер старта журнального бэкенда состояния.
+Запуск: python -m scripts.bench_state_recovery [кол-во диалогов]
+"""
+import sys, time, tempfile
+from state.journal import JournalStateStore
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    with tempfile.TemporaryDirectory() as d:
+        js = JournalStateStore(d, start_compactor=False)
+        sample = {"stage": "block3a", "show_type": "детское", "last_sender": "user",
+                  "last_message_ts": time.time(), "event_description": "день рождения, 10 детей"}
+        js.write_batch({f"7800{i:07d}": dict(sample, n=i) for i in range(n)}, set())
+        js.compact()
+        js.write_batch({f"7800{i:07d}": dict(sample, n=-i) for i in range(0, n, 10)}, set())
+        js.close()
+
+        t0 = time.perf_counter()
+        js = JournalStateStore(d, start_compactor=False)
+        opened = time.perf_counter() - t0
+        js.load("78000000007")
+        print(f"диалогов: {n}, хвост журнала: {len(js._tail)}, "
+              f"старт: {opened * 1000:.1f} мс, первый get: {(time.perf_counter() - t0 - opened) * 1000:.2f} мс")
+        js.close()
@@ -0,0 +1,218 @@
+"""
+Локальная подмена WhatsApp Cloud API (Graph API) для нагрузочных замеров без сети.
+Запуск: python -m scripts.fake_graph_api [--port 8090] [--latency-ms 80] [--jitter-ms 40]
+                                         [--error-rate 0.01] [--rate-limit 0.05] [--mps 80]
+Бот направляем на неё: GRAPH_BASE_URL=http://127.0.0.1:8090 (utils/graph_http.py).
+
+Что умеет:
+  POST /{ver}/{phone_id}/messages  → wamid (как настоящий API);
+  POST /{ver}/{phone_id}/media     → id загруженного файла;
+  GET  /{ver}/{media_id}           → {"url": .../download/{media_id}} (как lookaside-ссылка);
+  GET  /download/{media_id}        → байты файла (загруженного или заглушка OGG);
+  GET  /{ver}/me                   → проверка токена (--bad-token → 401, code 190);
+  GET  /{ver}/debug_token          → is_valid и expires_at (--token-ttl, 0 — бессрочный);
+  GET  /{ver}/oauth/access_token   → обмен fb_exchange_token на новый токен;
+  GET  /_stats                     → счётчики запросов, 429 и ошибок.
+Задержка — latency ± jitter на каждый запрос; error-rate — доля 500, rate-limit — доля
+429 (code 130429, Retry-After); --mps — сверх стольких сообщений в секунду тоже 429.
+"""
+import argparse, itertools, json, random, threading, time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+FAKE_OGG = b"OggS" + b"\x00" * 256
+
+
+@dataclass
+class FakeConfig:
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    error_rate: float = 0.0
+    rate_limit: float = 0.0
+    mps: float = 0.0                  # 0 — без лимита пропускной способности
+    retry_after: int = 1
+    bad_token: str | None = None
+    token_ttl: float = 0.0            # срок жизни токенов в debug_token, 0 — бессрочные
+
+
+class _State:
+    def __init__(self, config: FakeConfig):
+        self.config = config
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.media: dict[str, tuple[bytes, str]] = {}
+        self.window = [0.0, 0]        # начало секунды, сообщений в ней
+        self.counters = {"messages": 0, "media_upload": 0, "media_get": 0, "download": 0,
+                         "me": 0, "debug_token": 0, "exchanged": 0, "rate_limited": 0, "errors": 0}
+        self.sent: list[dict] = []
+
+    def over_mps(self) -> bool:
+        if not self.config.mps:
+            return False
+        now = time.monotonic()
+        with self.lock:
+            if now - self.window[0] >= 1.0:
+                self.window = [now, 0]
+            self.window[1] += 1
+            return self.window[1] > self.config.mps
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # заголовки и тело уходят разными write(): без TCP_NODELAY keep-alive клиент
+    # ждёт delayed ACK (~40 мс) на каждом ответе, и замер мерит Nagle, а не бота
+    disable_nagle_algorithm = True
+    state: _State = None
+    base_url = ""
+
+    # ─── ответы ──────────────────────────────────────────────────
+    def _send(self, code: int, body=None, raw: bytes | None = None, ctype="application/json", headers=None):
+        data = raw if raw is not None else json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _error(self, code: int, err_code: int, message: str, headers=None):
+        self._send(code, {"error": {"message": message, "type": "OAuthException", "code": err_code,
+                                    "fbtrace_id": "FAKE"}}, headers=headers)
+
+    def _body(self) -> bytes:
+        n = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(n) if n else b""
+
+    def _inject(self, count_mps: bool = False) -> bool:
+        """Задержка и инъекция ошибок. True — ответ уже отправлен."""
+        cfg, st = self.state.config, self.state
+        delay = cfg.latency_ms + random.uniform(-cfg.jitter_ms, cfg.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+        if (count_mps and st.over_mps()) or random.random() < cfg.rate_limit:
+            with st.lock:
+                st.counters["rate_limited"] += 1
+            self._error(429, 130429, "Rate limit hit", headers={"Retry-After": str(cfg.retry_after)})
+            return True
+        if random.random() < cfg.error_rate:
+            with st.lock:
+                st.counters["errors"] += 1
+            self._error(500, 131000, "Something went wrong")
+            return True
+        return False
+
+    def _count(self, key: str):
+        with self.state.lock:
+            self.state.counters[key] += 1
+
+    # ─── маршруты ────────────────────────────────────────────────
+    def do_POST(self):
+        parts = [p for p in urlsplit(self.path).path.split("/") if p]
+        body = self._body()
+        if self._inject(count_mps=parts[-1:] == ["messages"]):
+            return
+        if len(parts) == 3 and parts[2] == "messages":
+            payload = json.loads(body or b"{}")
+            wamid = f"wamid.FAKE{next(self.state.ids):010d}"
+            with self.state.lock:
+                self.state.sent.append(payload)
+            self._count("messages")
+            to = payload.get("to", "")
+            return self._send(200, {"messaging_product": "whatsapp",
+                                    "contacts": [{"input": to, "wa_id": to}],
+                                    "messages": [{"id": wamid}]})
+        if len(parts) == 3 and parts[2] == "media":
+            media_id = str(9_000_000 + next(self.state.ids))
+            with self.state.lock:
+                self.state.media[media_id] = (body, self.headers.get("Content-Type", ""))
+            self._count("media_upload")
+            return self._send(200, {"id": media_id})
+        self._error(404, 100, f"Unknown path {self.path}")
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parts = [p for p in url.path.split("/") if p]
+        if parts == ["_stats"]:
+            with self.state.lock:
+                return self._send(200, dict(self.state.counters))
+        if self._inject():
+            return
+        if len(parts) == 2 and parts[0] == "download":
+            self._count("download")
+            raw, _ = self.state.media.get(parts[1], (FAKE_OGG, ""))
+            return self._send(200, raw=raw, ctype="application/octet-stream")
+        query = parse_qs(url.query)
+        if len(parts) == 2 and parts[1] == "debug_token":
+            self._count("debug_token")
+            token = (query.get("input_token") or [""])[0]
+            ttl = 60 * 24 * 3600 if token.startswith("exchanged-") else self.state.config.token_ttl
+            return self._send(200, {"data": {"is_valid": bool(token) and token != self.state.config.bad_token,
+                                             "expires_at": int(time.time() + ttl) if ttl else 0}})
+        if parts[1:] == ["oauth", "access_token"]:
+            self._count("exchanged")
+            return self._send(200, {"access_token": f"exchanged-{next(self.state.ids)}",
+                                    "token_type": "bearer", "expires_in": 60 * 24 * 3600})
+        if len(parts) == 2 and parts[1] == "me":
+            self._count("me")
+            token = (query.get("access_token") or [""])[0] or \
+                self.headers.get("Authorization", "").removeprefix("Bearer ")
+            if not token or token == self.state.config.bad_token:
+                return self._error(401, 190, "Error validating access token")
+            return self._send(200, {"id": "100000000000001", "name": "Fake WABA"})
+        if len(parts) == 2:
+            self._count("media_get")
+            media_id = parts[1]
+            return self._send(200, {"messaging_product": "whatsapp", "id": media_id,
+                                    "mime_type": "audio/ogg",
+                                    "url": f"{self.base_url}/download/{media_id}"})
+        self._error(404, 100, f"Unknown path {self.path}")
+
+    def log_message(self, *args):
+        pass
+
+
+def make_server(host: str = "127.0.0.1", port: int = 0, config: FakeConfig | None = None) -> ThreadingHTTPServer:
+    """Сервер (ещё не запущен): server.serve_forever(), адрес — server.base_url, счётчики — server.state."""
+    state = _State(config or FakeConfig())
+    handler = type("FakeGraphHandler", (_Handler,), {"state": state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    handler.base_url = f"http://{host}:{server.server_port}"
+    server.base_url = handler.base_url
+    server.state = state
+    return server
+
+
+def start_in_thread(config: FakeConfig | None = None, port: int = 0) -> ThreadingHTTPServer:
+    """Для тестов и бенчмарков: поднять сервер в фоне."""
+    server = make_server(port=port, config=config)
+    threading.Thread(target=server.serve_forever, name="fake-graph", daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Локальная подмена WhatsApp Cloud API")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8090)
+    ap.add_argument("--latency-ms", type=float, default=80)
+    ap.add_argument("--jitter-ms", type=float, default=40)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--rate-limit", type=float, default=0.0)
+    ap.add_argument("--mps", type=float, default=0.0)
+    ap.add_argument("--bad-token", default=None)
+    ap.add_argument("--token-ttl", type=float, default=0.0)
+    a = ap.parse_args(argv)
+    server = make_server(a.host, a.port, FakeConfig(a.latency_ms, a.jitter_ms, a.error_rate,
+                                                    a.rate_limit, a.mps, bad_token=a.bad_token,
+                                                    token_ttl=a.token_ttl))
+    print(f"fake Graph API: {server.base_url}  (GRAPH_BASE_URL={server.base_url})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
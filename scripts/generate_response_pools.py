@@ -0,0 +1,26 @@
+"""
+Офлайн-генерация пулов статичных ответов (приветствие block2, напоминания block2,
+сообщение block5 «передаю Арсению») — например, перед деплоем.
+Запуск: python -m scripts.generate_response_pools [вариантов_на_промпт]
+
+Промпты регистрируют сами блоки при импорте; пишем в RESPONSE_POOL_PATH,
+тот же файл читает бот (и досоздаёт недостающее в фоне).
+"""
+import sys
+import blocks.block_02  # noqa: F401  регистрация промптов block2
+import blocks.block_05  # noqa: F401  регистрация промпта block5
+from utils import response_pool
+
+
+def main(size: str | None = None):
+    n = int(size) if size else response_pool.RESPONSE_POOL_SIZE
+    added = response_pool.fill_all(n)
+    stats = response_pool.stats()
+    print(f"пулы: {response_pool.RESPONSE_POOL_PATH} (по {n} вариантов)")
+    for name in stats["registered"]:
+        print(f"  {name:>24}: +{added.get(name, 0)}, всего {stats['sizes'].get(name, 0)}")
+    print(f"  отбраковано: {stats['rejected']}")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:2])
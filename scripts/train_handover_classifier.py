@@ -0,0 +1,64 @@
+"""
+Обучение локального классификатора хендовера и офлайн-отчёт (точность, покрытие, задержка).
+Запуск: python -m scripts.train_handover_classifier [датасет.tsv] [модель.json]
+
+  1) 5-fold кросс-валидация → вероятности «вне выборки»;
+  2) по ним калибруем полосу [low, high], вне которой модель отвечает сама;
+  3) обучаем на всём датасете, пишем модель с отчётом в meta.
+"""
+import sys, time
+from utils.handover_classifier import (
+    HandoverClassifier, load_dataset, cross_val_proba, calibrate_band, HANDOVER_MODEL_PATH,
+)
+
+
+def _report(probs, labels, low, high) -> dict:
+    n = len(labels)
+    acc = sum((p >= 0.5) == bool(y) for p, y in zip(probs, labels)) / n
+    local = [(p >= high, y) for p, y in zip(probs, labels) if p >= high or p <= low]
+    local_acc = sum(v == bool(y) for v, y in local) / len(local) if local else 0
+    return {
+        "samples": n,
+        "positives": sum(labels),
+        "cv_accuracy@0.5": round(acc, 4),
+        "local_coverage": round(len(local) / n, 4),     # доля сообщений без LLM
+        "local_accuracy": round(local_acc, 4),
+        "llm_share": round(1 - len(local) / n, 4),
+    }
+
+
+def _latency(model, texts, rounds: int = 20) -> dict:
+    samples = []
+    for _ in range(rounds):
+        for t in texts:
+            t0 = time.perf_counter()
+            model.proba(t)
+            samples.append((time.perf_counter() - t0) * 1e6)
+    samples.sort()
+    return {
+        "predict_us_p50": round(samples[len(samples) // 2], 1),
+        "predict_us_p99": round(samples[int(len(samples) * 0.99)], 1),
+    }
+
+
+def main(dataset: str = "data/handover_dataset.tsv", out: str = HANDOVER_MODEL_PATH):
+    texts, labels = load_dataset(dataset)
+    t0 = time.perf_counter()
+    probs = cross_val_proba(texts, labels)
+    low, high = calibrate_band(probs, labels)
+    report = _report(probs, labels, low, high)
+
+    model = HandoverClassifier.fit(texts, labels)
+    model.low, model.high = low, high
+    report.update(_latency(model, texts))
+    report["train_sec"] = round(time.perf_counter() - t0, 2)
+    model.meta = {"dataset": dataset, "report": report}
+    model.save(out)
+
+    print(f"модель: {out} ({len(model.weights)} признаков), полоса LLM: {low} … {high}")
+    for k, v in report.items():
+        print(f"  {k:>18}: {v}")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:3])
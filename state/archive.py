@@ -0,0 +1,122 @@
+# state/archive.py
+"""
+Холодный архив завершённых и давно молчащих диалогов.
+
+Раз в STATE_ARCHIVE_INTERVAL_SEC архиватор (state.archive_dialogues) выгружает
+подходящие диалоги пачкой в gzip JSONL — локально (tmp/state_archive) или в бакет
+Yandex S3 — и оставляет в state маленький «надгробный камень» {"_archived": ключ}.
+Если клиент напишет снова, get_state поднимет полную запись из архива.
+"""
+from utils.env_loader import ensure_env_loaded
+ensure_env_loaded()
+import os, io, gzip, json, time, uuid, threading, logging
+
+log = logging.getLogger(__name__)
+
+STATE_ARCHIVE              = os.getenv("STATE_ARCHIVE", "local")     # local | s3 | off
+STATE_ARCHIVE_DIR          = os.getenv("STATE_ARCHIVE_DIR", "tmp/state_archive")
+STATE_ARCHIVE_PREFIX       = os.getenv("STATE_ARCHIVE_PREFIX", "state_archive")
+STATE_ARCHIVE_INTERVAL_SEC = float(os.getenv("STATE_ARCHIVE_INTERVAL_SEC", "3600"))
+# завершённые (notion_exported) — через сутки тишины, прочие — через 30 дней тишины
+STATE_ARCHIVE_FINISHED_SEC = float(os.getenv("STATE_ARCHIVE_FINISHED_SEC", str(24 * 3600)))
+STATE_ARCHIVE_IDLE_SEC     = float(os.getenv("STATE_ARCHIVE_IDLE_SEC", str(30 * 24 * 3600)))
+
+
+def _pack(records: list[tuple[str, dict]]) -> bytes:
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode="wb") as gz:
+        for uid, st in records:
+            line = json.dumps({"u": uid, "s": st, "at": time.time()}, ensure_ascii=False, default=str)
+            gz.write(line.encode("utf-8") + b"\n")
+    return buf.getvalue()
+
+
+def _find(raw: bytes, user_id: str) -> dict | None:
+    found = None
+    for line in gzip.decompress(raw).splitlines():
+        rec = json.loads(line)
+        if rec["u"] == user_id:
+            found = rec["s"]            # последняя запись в файле — самая свежая
+    return found
+
+
+class LocalArchive:
+    def __init__(self, directory: str = STATE_ARCHIVE_DIR):
+        self.dir = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, records) -> str:
+        key = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.jsonl.gz"
+        tmp = os.path.join(self.dir, key + ".tmp")
+        with open(tmp, "wb") as f:
+            f.write(_pack(records))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, os.path.join(self.dir, key))
+        return key
+
+    def load(self, key: str, user_id: str) -> dict | None:
+        with open(os.path.join(self.dir, key), "rb") as f:
+            return _find(f.read(), user_id)
+
+
+class S3Archive:
+    """Тот же бакет Yandex S3, что и для логов/голосовых."""
+
+    def __init__(self):
+        import boto3
+        from botocore.config import Config
+        self.bucket = os.getenv("YANDEX_BUCKET", "magicacademylogsars")
+        self.s3 = boto3.client(
+            "s3",
+            region_name=os.getenv("YANDEX_REGION", "ru-central1"),
+            endpoint_url=os.getenv("YANDEX_ENDPOINT", "https://storage.yandexcloud.net"),
+            aws_access_key_id=os.getenv("YANDEX_ACCESS_KEY_ID"),
+            aws_secret_access_key=os.getenv("YANDEX_SECRET_ACCESS_KEY"),
+            config=Config(connect_timeout=5, read_timeout=10),
+        )
+
+    def write(self, records) -> str:
+        key = f"{STATE_ARCHIVE_PREFIX}/{time.strftime('%Y-%m-%d')}/{uuid.uuid4().hex}.jsonl.gz"
+        self.s3.put_object(Bucket=self.bucket, Key=key, Body=_pack(records),
+                           ContentType="application/gzip")
+        return key
+
+    def load(self, key: str, user_id: str) -> dict | None:
+        obj = self.s3.get_object(Bucket=self.bucket, Key=key)
+        return _find(obj["Body"].read(), user_id)
+
+
+_archive = None
+
+
+def get_archive():
+    """Хранилище архива по STATE_ARCHIVE (None — архив выключен)."""
+    global _archive
+    if _archive is None and STATE_ARCHIVE != "off":
+        _archive = S3Archive() if STATE_ARCHIVE == "s3" else LocalArchive()
+    return _archive
+
+
+def set_archive(archive) -> None:
+    """Подменить хранилище (тесты, скрипты)."""
+    global _archive
+    _archive = archive
+
+
+def start_archiver_loop():
+    if get_archive() is None:
+        log.info("🟡 STATE_ARCHIVE=off — архиватор состояния не запускаем")
+        return
+
+    def _loop():
+        from state import state
+        while True:
+            time.sleep(STATE_ARCHIVE_INTERVAL_SEC)
+            try:
+                state.archive_dialogues()
+            except Exception as e:
+                log.exception(f"💥 state archiver: {e}")
+
+    threading.Thread(target=_loop, name="state-archiver", daemon=True).start()
+    log.info(f"🧊 state archiver запущен ({STATE_ARCHIVE}, раз в {int(STATE_ARCHIVE_INTERVAL_SEC)} с)")
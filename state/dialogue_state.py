@@ -0,0 +1,158 @@
+# state/dialogue_state.py
+"""
+Компактная запись состояния диалога.
+
+Вместо свободного dict на 40+ строковых ключей:
+  • частые поля — в __slots__ (без хэш-таблицы и копий ключей на каждый диалог);
+  • stage/show_type/last_sender и т.п. — интернированные строки (одна копия на процесс);
+  • булевы флаги (r1_scheduled_b2, availability_reply_sent, …) — два int-битовых поля;
+  • всё остальное — в маленький _extra dict, который создаётся только при необходимости.
+
+Снаружи это MutableMapping: get/[]/update/in/items работают как у dict,
+поэтому блоки менять не нужно. dict(st) — обычный словарь (для JSON/хранилищ).
+"""
+import sys
+from collections.abc import MutableMapping
+
+# частые скалярные поля
+SLOT_FIELDS = (
+    "stage", "show_type", "last_sender", "last_message_ts",
+    "normalized_number", "raw_number", "client_name",
+    "last_incoming_id", "last_incoming_ts", "last_incoming_text", "last_incoming_stage",
+    "last_msg_uid", "last_msg_hash", "last_msg_ts", "last_bot_question",
+    "event_description", "structured_cache", "event_date", "event_time",
+    "event_date_iso", "event_time_24", "celebrant_name", "celebrant_photo_url",
+    "handover_reason", "scenario_stage_at_handover", "uninformative_replies",
+    "clarification_attempts", "detected_lang", "next_step",
+)
+
+# строковые значения из маленького словаря — интернируем
+INTERNED_FIELDS = frozenset((
+    "stage", "show_type", "last_sender", "last_incoming_stage",
+    "handover_reason", "scenario_stage_at_handover", "detected_lang", "next_step",
+))
+
+# булевы флаги сценария → биты
+FLAG_FIELDS = (
+    "block2_intro_sent", "availability_reply_sent", "summary_and_availability_sent", "summary_sent",
+    "r1_scheduled_b2", "r2_scheduled_b2", "fin_scheduled_b2_done",
+    "r1_scheduled_b3a", "r2_scheduled_b3a", "fin_scheduled_b3a_done",
+    "r1_scheduled_b3b", "r2_scheduled_b3b", "fin_scheduled_b3b_done",
+    "r1_scheduled_b3c", "r2_scheduled_b3c", "fin_scheduled_b3c_done",
+    "lang_check_pending", "lang_confirmed", "no_celebrant", "materials_sent",
+    "arseniy_notified", "client_notified_about_handover",
+    "notion_exported", "notion_export_error",
+)
+
+_SLOT_SET = frozenset(SLOT_FIELDS)
+_FLAG_BITS = {name: 1 << i for i, name in enumerate(FLAG_FIELDS)}
+
+
+class DialogueState(MutableMapping):
+    __slots__ = SLOT_FIELDS + ("_fp", "_fv", "_extra")   # _fp — какие флаги заданы, _fv — их значения
+
+    def __init__(self, data=None, **kwargs):
+        self._fp = 0
+        self._fv = 0
+        self._extra = None
+        if data:
+            self.update(data)
+        if kwargs:
+            self.update(kwargs)
+
+    # ─── Mapping ─────────────────────────────────────────────────
+    def __getitem__(self, key):
+        if key in _SLOT_SET:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        bit = _FLAG_BITS.get(key)
+        if bit is not None and self._fp & bit:
+            return bool(self._fv & bit)
+        if self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in _SLOT_SET:
+            if key in INTERNED_FIELDS and type(value) is str:
+                value = sys.intern(value)
+            setattr(self, key, value)
+            return
+        bit = _FLAG_BITS.get(key)
+        if bit is not None:
+            if type(value) is bool:
+                self._fp |= bit
+                self._fv = (self._fv | bit) if value else (self._fv & ~bit)
+                if self._extra:
+                    self._extra.pop(key, None)
+                return
+            self._fp &= ~bit            # флаг с не-bool значением — храним как есть
+        if self._extra is None:
+            self._extra = {}
+        self._extra[key] = value
+
+    def __delitem__(self, key):
+        if key in _SLOT_SET:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+            return
+        bit = _FLAG_BITS.get(key)
+        if bit is not None and self._fp & bit:
+            self._fp &= ~bit
+            self._fv &= ~bit
+            return
+        if self._extra is not None and key in self._extra:
+            del self._extra[key]
+            return
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        if key in _SLOT_SET:
+            return hasattr(self, key)
+        bit = _FLAG_BITS.get(key)
+        if bit is not None and self._fp & bit:
+            return True
+        return self._extra is not None and key in self._extra
+
+    def __iter__(self):
+        for name in SLOT_FIELDS:
+            if hasattr(self, name):
+                yield name
+        if self._fp:
+            for name, bit in _FLAG_BITS.items():
+                if self._fp & bit:
+                    yield name
+        if self._extra:
+            yield from list(self._extra)
+
+    def __len__(self):
+        return (sum(1 for name in SLOT_FIELDS if hasattr(self, name))
+                + bin(self._fp).count("1")
+                + (len(self._extra) if self._extra else 0))
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    # ─── удобства dict ───────────────────────────────────────────
+    def copy(self) -> "DialogueState":
+        return DialogueState(self)
+
+    def to_dict(self) -> dict:
+        return dict(self.items())
+
+    def __repr__(self):
+        return f"DialogueState({self.to_dict()!r})"
+
+
+def compact(state) -> "DialogueState | None":
+    """dict → DialogueState (None и уже компактные записи — как есть)."""
+    if state is None or isinstance(state, DialogueState):
+        return state
+    return DialogueState(state)
@@ -0,0 +1,182 @@
+# state/indexes.py
+"""
+Вторичные индексы по состоянию диалогов.
+
+Обновляются инкрементально на каждую применённую запись (state.py), поэтому
+выборки «кто в block2 молчит дольше 4 часов» или «кому не ушёл экспорт в Notion»
+стоят O(результата), а не O(всех пользователей).
+"""
+import time
+import threading
+from bisect import bisect_left, insort
+
+# поля с точным совпадением значения
+EXACT_FIELDS = ("stage", "arseniy_notified", "notion_export_error", "handover_reason", "notion_exported")
+# последняя активность клиента: last_incoming_ts ставит incoming_message на каждом входящем,
+# в каком бы блоке ни был диалог; last_message_ts пишут не все блоки — только запасной вариант
+TS_FIELDS = ("last_incoming_ts", "last_message_ts")
+
+_SCALARS = (str, int, float, bool)
+
+
+def _key(value):
+    return value if isinstance(value, _SCALARS) else None
+
+
+def _ts(value) -> float | None:
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def activity_ts(st) -> float | None:
+    """Когда клиент последний раз писал (по TS_FIELDS), None — неизвестно."""
+    for field in TS_FIELDS:
+        ts = _ts(st.get(field))
+        if ts is not None:
+            return ts
+    return None
+
+
+def _values(st) -> tuple:
+    return tuple(_key(st.get(f)) for f in EXACT_FIELDS) + (activity_ts(st),)
+
+
+class StateIndex:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+
+    def _reset(self):
+        self._seen: dict[str, tuple] = {}                       # user_id → проиндексированные значения
+        self._exact: dict[str, dict[object, set[str]]] = {f: {} for f in EXACT_FIELDS}
+        self._by_ts: list[tuple[float, str]] = []               # все пользователи по activity_ts
+        self._stage_ts: dict[str, list[tuple[float, str]]] = {} # stage → (ts, user_id) по возрастанию
+
+    # ─── поддержка ───────────────────────────────────────────────
+    def update(self, user_id: str, st: dict | None) -> None:
+        if st is None:
+            return self.remove(user_id)
+        new = _values(st)
+        with self._lock:
+            old = self._seen.get(user_id)
+            if old == new:
+                return
+            if old is not None:
+                self._unlink(user_id, old)
+            self._link(user_id, new)
+            self._seen[user_id] = new
+
+    def add_missing(self, items) -> int:
+        """
+        Пачка (user_id, state) при пересборке: только тех, кого ещё нет в индексе —
+        их запись уже пришла из живого чтения/записи и она свежее скана.
+        Ряды по времени активности дополняются и сортируются один раз на пачку, а не insort на каждого.
+        """
+        added, by_ts, stage_ts = 0, [], {}
+        with self._lock:
+            for user_id, st in items:
+                if user_id in self._seen or st is None:
+                    continue
+                vals = _values(st)
+                *exact, ts = vals
+                for field, value in zip(EXACT_FIELDS, exact):
+                    if value is not None:
+                        self._exact[field].setdefault(value, set()).add(user_id)
+                if ts is not None:
+                    by_ts.append((ts, user_id))
+                    if exact[0] is not None:
+                        stage_ts.setdefault(exact[0], []).append((ts, user_id))
+                self._seen[user_id] = vals
+                added += 1
+            if by_ts:
+                self._by_ts.extend(by_ts)
+                self._by_ts.sort()                  # timsort: слияние двух упорядоченных серий
+            for stage, series in stage_ts.items():
+                target = self._stage_ts.setdefault(stage, [])
+                target.extend(series)
+                target.sort()
+        return added
+
+    def remove(self, user_id: str) -> None:
+        with self._lock:
+            old = self._seen.pop(user_id, None)
+            if old is not None:
+                self._unlink(user_id, old)
+
+    def _link(self, user_id, vals):
+        *exact, ts = vals
+        for field, value in zip(EXACT_FIELDS, exact):
+            if value is not None:
+                self._exact[field].setdefault(value, set()).add(user_id)
+        if ts is not None:
+            insort(self._by_ts, (ts, user_id))
+            stage = exact[0]
+            if stage is not None:
+                insort(self._stage_ts.setdefault(stage, []), (ts, user_id))
+
+    def _unlink(self, user_id, vals):
+        *exact, ts = vals
+        for field, value in zip(EXACT_FIELDS, exact):
+            if value is not None:
+                bucket = self._exact[field].get(value)
+                if bucket is not None:
+                    bucket.discard(user_id)
+                    if not bucket:
+                        del self._exact[field][value]
+        if ts is not None:
+            _remove_sorted(self._by_ts, (ts, user_id))
+            stage = exact[0]
+            if stage is not None and stage in self._stage_ts:
+                _remove_sorted(self._stage_ts[stage], (ts, user_id))
+
+    # ─── выборки ─────────────────────────────────────────────────
+    def where(self, field: str, value) -> set[str]:
+        if field not in self._exact:
+            raise KeyError(f"поле {field!r} не индексируется, доступны: {EXACT_FIELDS}")
+        with self._lock:
+            return set(self._exact[field].get(value, ()))
+
+    def values(self, field: str) -> dict[object, int]:
+        with self._lock:
+            return {v: len(ids) for v, ids in self._exact[field].items()}
+
+    def in_stage(self, stage: str, older_than: float | None = None, now: float | None = None) -> list[str]:
+        """
+        Пользователи в stage. older_than (сек) — только те, кто писал (activity_ts)
+        раньше now - older_than (от самых давних к свежим).
+        """
+        with self._lock:
+            if older_than is None:
+                return list(self._exact["stage"].get(stage, ()))
+            series = self._stage_ts.get(stage, [])
+            cut = bisect_left(series, ((now or time.time()) - older_than,))
+            return [uid for _, uid in series[:cut]]
+
+    def idle(self, older_than: float, now: float | None = None) -> list[str]:
+        """Все пользователи, молчащие дольше older_than секунд (по activity_ts)."""
+        with self._lock:
+            cut = bisect_left(self._by_ts, ((now or time.time()) - older_than,))
+            return [uid for _, uid in self._by_ts[:cut]]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "indexed": len(self._seen),
+                "by_stage": {s: len(ids) for s, ids in self._exact["stage"].items()},
+                "handover_reasons": {r: len(ids) for r, ids in self._exact["handover_reason"].items()},
+                "arseniy_notified": len(self._exact["arseniy_notified"].get(True, ())),
+                "notion_export_error": len(self._exact["notion_export_error"].get(True, ())),
+            }
+
+
+def _remove_sorted(series: list, item) -> None:
+    i = bisect_left(series, item)
+    if i < len(series) and series[i] == item:
+        del series[i]
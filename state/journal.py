@@ -0,0 +1,226 @@
+# state/journal.py
+"""
+Журнальный бэкенд состояния: append-only лог + периодические снапшоты.
+
+Файлы в каталоге STATE_JOURNAL_DIR:
+  journal.log   — записи [u32 длина][u32 crc32][json {"u": user_id, "s": state|null}]
+  snapshot.bin  — записи [u32 длина][json state] + индекс {user_id: [offset, len]}
+                  и футер [u64 offset индекса][MAGIC]
+
+Старт: mmap снапшота + чтение одного индекса (без декодирования состояний)
+и проигрывание короткого хвоста журнала. Само состояние декодируется лениво,
+при первом get_state этого пользователя.
+"""
+import os, json, mmap, struct, zlib, time, threading, logging
+
+from state.store import StateStore
+
+log = logging.getLogger(__name__)
+
+MAGIC = b"STSNAP01"
+_REC = struct.Struct("<II")        # длина, crc32 (журнал)
+_LEN = struct.Struct("<I")         # длина (снапшот)
+_FOOTER = struct.Struct("<Q8s")    # offset индекса, MAGIC
+
+COMPACT_BYTES = int(os.getenv("STATE_JOURNAL_COMPACT_BYTES", str(8 * 1024 * 1024)))
+COMPACT_SEC   = float(os.getenv("STATE_JOURNAL_COMPACT_SEC", "600"))
+
+
+def _dumps(obj) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+
+class JournalStateStore(StateStore):
+
+    def __init__(self, directory: str, start_compactor: bool = True):
+        self.dir = directory
+        os.makedirs(directory, exist_ok=True)
+        self.snapshot_path = os.path.join(directory, "snapshot.bin")
+        self.journal_path = os.path.join(directory, "journal.log")
+        self._lock = threading.RLock()
+        self._mm: mmap.mmap | None = None
+        self._snap_file = None
+        self._index: dict[str, list[int]] = {}     # из снапшота: user_id → [offset, len]
+        self._tail: dict[str, dict | None] = {}    # из журнала после снапшота (None — удалён)
+        self.counters = {"appended": 0, "fsyncs": 0, "compactions": 0, "lazy_loads": 0}
+
+        t0 = time.perf_counter()
+        self._open_snapshot()
+        replayed = self._replay_journal()
+        self._journal = open(self.journal_path, "ab")
+        self.recovery_ms = round((time.perf_counter() - t0) * 1000, 1)
+        log.info(f"📜 state journal: снапшот {len(self._index)} диалогов, хвост журнала "
+                 f"{replayed} записей, восстановление {self.recovery_ms} мс")
+
+        self._stop = threading.Event()
+        if start_compactor:
+            threading.Thread(target=self._compact_loop, name="state-compactor", daemon=True).start()
+
+    # ─── старт ───────────────────────────────────────────────────
+    def _open_snapshot(self):
+        self._close_snapshot()
+        self._index = {}
+        if not os.path.exists(self.snapshot_path) or os.path.getsize(self.snapshot_path) < _FOOTER.size:
+            return
+        self._snap_file = open(self.snapshot_path, "rb")
+        self._mm = mmap.mmap(self._snap_file.fileno(), 0, access=mmap.ACCESS_READ)
+        index_off, magic = _FOOTER.unpack_from(self._mm, len(self._mm) - _FOOTER.size)
+        if magic != MAGIC:
+            raise RuntimeError(f"повреждён снапшот состояния: {self.snapshot_path}")
+        self._index = json.loads(self._mm[index_off:len(self._mm) - _FOOTER.size])
+
+    def _close_snapshot(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._snap_file is not None:
+            self._snap_file.close()
+            self._snap_file = None
+
+    def _replay_journal(self) -> int:
+        """Проигрываем журнал; битый хвост (упали посреди записи) обрезаем."""
+        self._tail = {}
+        if not os.path.exists(self.journal_path):
+            return 0
+        with open(self.journal_path, "rb") as f:
+            data = f.read()
+        pos, n = 0, 0
+        while pos + _REC.size <= len(data):
+            length, crc = _REC.unpack_from(data, pos)
+            payload = data[pos + _REC.size: pos + _REC.size + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            rec = json.loads(payload)
+            self._tail[rec["u"]] = rec["s"]
+            pos += _REC.size + length
+            n += 1
+        if pos < len(data):
+            log.warning(f"⚠️ state journal: обрезаем битый хвост {len(data) - pos} байт")
+            with open(self.journal_path, "r+b") as f:
+                f.truncate(pos)
+        return n
+
+    # ─── StateStore ──────────────────────────────────────────────
+    def load(self, user_id):
+        with self._lock:
+            if user_id in self._tail:
+                st = self._tail[user_id]
+                return dict(st) if st is not None else None
+            loc = self._index.get(user_id)
+            if loc is None or self._mm is None:
+                return None
+            off, length = loc
+            self.counters["lazy_loads"] += 1
+            return json.loads(self._mm[off:off + length])
+
+    def write_batch(self, upserts, deletes):
+        """Вся пачка — подряд в журнал и один fsync на пачку."""
+        records = [(uid, None) for uid in deletes] + list(upserts.items())
+        if not records:
+            return
+        buf = bytearray()
+        for uid, st in records:
+            payload = _dumps({"u": uid, "s": st})
+            buf += _REC.pack(len(payload), zlib.crc32(payload)) + payload
+        with self._lock:
+            self._journal.write(buf)
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self.counters["fsyncs"] += 1
+            self.counters["appended"] += len(records)
+            for uid, st in records:
+                self._tail[uid] = st
+            too_big = self._journal.tell() >= COMPACT_BYTES
+        if too_big:
+            self.compact()
+
+    def iter_all(self, batch: int = 500):
+        """
+        Все диалоги пачками. Замок — только на копирование байтов одной пачки
+        из снапшота, json.loads идёт без него: запись и компакция не ждут скана.
+        """
+        with self._lock:
+            ids = list(set(self._index) | set(self._tail))
+        for i in range(0, len(ids), batch):
+            raw = []
+            with self._lock:
+                for uid in ids[i:i + batch]:
+                    if uid in self._tail:
+                        if self._tail[uid] is not None:
+                            raw.append((uid, self._tail[uid]))
+                    elif (loc := self._index.get(uid)) is not None and self._mm is not None:
+                        off, length = loc
+                        raw.append((uid, self._mm[off:off + length]))
+            for uid, data in raw:
+                yield uid, dict(data) if isinstance(data, dict) else json.loads(data)
+
+    def load_all(self) -> dict[str, dict]:
+        return dict(self.iter_all())
+
+    # ─── компакция ───────────────────────────────────────────────
+    def compact(self) -> int:
+        """
+        Новый снапшот = старый снапшот (байты копируются без декодирования) + хвост журнала.
+        После атомарной подмены файла журнал обнуляется. Возвращает число диалогов.
+        """
+        with self._lock:
+            if not self._tail and self._index:
+                return len(self._index)
+            tmp_path = self.snapshot_path + ".tmp"
+            index: dict[str, list[int]] = {}
+            with open(tmp_path, "wb") as out:
+                pos = 0
+
+                def put(uid, payload: bytes):
+                    nonlocal pos
+                    out.write(_LEN.pack(len(payload)))
+                    out.write(payload)
+                    index[uid] = [pos + _LEN.size, len(payload)]
+                    pos += _LEN.size + len(payload)
+
+                for uid, (off, length) in self._index.items():
+                    if uid not in self._tail:
+                        put(uid, self._mm[off:off + length])
+                for uid, st in self._tail.items():
+                    if st is not None:
+                        put(uid, _dumps(st))
+                index_off = pos
+                out.write(_dumps(index))
+                out.write(_FOOTER.pack(index_off, MAGIC))
+                out.flush()
+                os.fsync(out.fileno())
+
+            self._close_snapshot()
+            os.replace(tmp_path, self.snapshot_path)
+            self._journal.close()
+            self._journal = open(self.journal_path, "wb")    # журнал с нуля
+            os.fsync(self._journal.fileno())
+            self._tail = {}
+            self._open_snapshot()
+            self.counters["compactions"] += 1
+            log.info(f"🗜 state journal: снапшот {len(index)} диалогов")
+            return len(index)
+
+    def _compact_loop(self):
+        while not self._stop.wait(COMPACT_SEC):
+            try:
+                if self._tail:
+                    self.compact()
+            except Exception as e:
+                log.exception(f"💥 state journal compaction failed: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "snapshot_entries": len(self._index),
+                "journal_tail": len(self._tail),
+                "journal_bytes": self._journal.tell(),
+                "recovery_ms": self.recovery_ms,
+                **self.counters,
+            }
+
+    def close(self):
+        self._stop.set()
+        with self._lock:
+            self._journal.close()
+            self._close_snapshot()
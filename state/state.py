@@ -1,21 +1,372 @@
-import logging, threading
+from utils.env_loader import ensure_env_loaded
+ensure_env_loaded()
+import os, copy, time, zlib, atexit, logging, threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from state.store import StateStore, build_store
+from state.indexes import StateIndex, activity_ts
+from state.dialogue_state import compact
+from utils.fanout import not_inherited
+import state.archive as _arch
+
+log = logging.getLogger(__name__)
+
+# ─── настройки хранилища ─────────────────────────────────────────
+# memory — как раньше, только в памяти процесса; sqlite/postgres/journal — write-behind на диск
+STATE_BACKEND    = os.getenv("STATE_BACKEND", "memory")
+STATE_DB_URL     = os.getenv("STATE_DB_URL") or None
+STATE_CACHE_SIZE = int(os.getenv("STATE_CACHE_SIZE", "5000"))   # только для постоянных бэкендов
+STATE_FLUSH_SEC  = float(os.getenv("STATE_FLUSH_SEC", "1.0"))
+STATE_LOCK_STRIPES = 64
+INDEX_REBUILD_BATCH = int(os.getenv("STATE_INDEX_REBUILD_BATCH", "500"))
+# хранить диалоги компактными записями DialogueState (slots + битовые флаги) вместо dict
+STATE_COMPACT    = os.getenv("STATE_COMPACT", "1") == "1"
+
+
+class _LRUStates(OrderedDict):
+    """
+    Горячий кэш диалогов. Вытесняем только «чистые» (уже сброшенные на диск) записи,
+    поэтому при memory-бэкенде (всё грязное или ёмкость None) ничего не теряется.
+    Запись, чья блокировка сейчас занята другим потоком, тоже не трогаем: она может
+    быть уже в кэше, но ещё не помечена грязной.
+    """
+    capacity: int | None = None
+
+    def clear(self):
+        super().clear()
+        _index.clear()
+
+    def touch(self, user_id):
+        if user_id in self:
+            self.move_to_end(user_id)
+
+    def evict(self, dirty: set):
+        if self.capacity is None or len(self) <= self.capacity:
+            return
+        with _evict_lock:
+            for uid in list(self.keys()):
+                if len(self) <= self.capacity:
+                    break
+                if uid in dirty:
+                    continue
+                lock = _lock_for(uid)
+                if not lock.acquire(blocking=False):
+                    continue
+                try:
+                    if uid not in dirty:
+                        self.pop(uid, None)
+                finally:
+                    lock.release()
+
+
 # Словарь, где ключ — номер телефона, значение — состояние
-user_states = {}
+user_states = _LRUStates()
+# Вторичные индексы (stage, время последнего входящего, флаги handover/экспорта) — по всем
+# известным диалогам, включая вытесненные из кэша
+_index = StateIndex()
+_evict_lock = threading.Lock()
+
+# ─── блокировки и версии ─────────────────────────────────────────
+# Полосатая таблица RLock: один пользователь — всегда одна и та же блокировка,
+# разные пользователи почти никогда не ждут друг друга (в отличие от глобального lock).
+_locks = [threading.RLock() for _ in range(STATE_LOCK_STRIPES)]
+_versions: dict[str, int] = {}     # растёт на каждую применённую запись пользователя
+
+
+def _lock_for(user_id) -> threading.RLock:
+    return _locks[zlib.crc32(str(user_id).encode("utf-8")) % STATE_LOCK_STRIPES]
+
+
+def get_state_version(user_id) -> int:
+    """Версия применённого состояния (0 — ещё не писали). Нужна для update_state_if."""
+    return _versions.get(user_id, 0)
+
+
+def _bump(user_id) -> None:
+    _versions[user_id] = _versions.get(user_id, 0) + 1
+
+_store: StateStore = None
+_dirty: set[str] = set()         # изменены в памяти, ещё не на диске
+_deleted: set[str] = set()       # удалены в памяти, ещё не на диске
+_flush_lock = threading.Lock()
+_flusher: threading.Thread | None = None
+_flush_wakeup = threading.Event()
+
+
+def configure(backend: str | None = None, url: str | None = None,
+              cache_size: int | None = None) -> None:
+    """(Пере)выбрать бэкенд. Несохранённое сбрасывается в старый бэкенд."""
+    global _store
+    if _store is not None:
+        flush()
+        _store.close()
+    _store = build_store(backend or STATE_BACKEND, url or STATE_DB_URL)
+    user_states.clear()
+    _dirty.clear()
+    _deleted.clear()
+    user_states.capacity = (cache_size or STATE_CACHE_SIZE) if _store.persistent else None
+    if _store.persistent:
+        threading.Thread(target=rebuild_indexes, name="state-index-rebuild", daemon=True).start()
+
+
+def _mark_dirty(user_id):
+    if not _store.persistent:
+        return
+    _deleted.discard(user_id)
+    _dirty.add(user_id)
+    user_states.evict(_dirty)
+    _ensure_flusher()
+
+
+def _ensure_flusher():
+    global _flusher
+    if _flusher is None or not _flusher.is_alive():
+        _flusher = threading.Thread(target=_flush_loop, name="state-flusher", daemon=True)
+        _flusher.start()
+
+
+def _flush_loop():
+    while True:
+        _flush_wakeup.wait(STATE_FLUSH_SEC)
+        _flush_wakeup.clear()
+        try:
+            flush()
+        except Exception as e:
+            log.exception(f"💥 state flush failed, повторим позже: {e}")
+
+
+def flush() -> int:
+    """
+    Сбросить на диск всё накопленное одной пачкой. Несколько изменений одного
+    диалога между сбросами склеиваются в одну запись. Возвращает число записей.
+    """
+    if _store is None or not _store.persistent:
+        return 0
+    with _flush_lock:
+        # снимок под _evict_lock: между выходом из _dirty и копированием запись
+        # не должна успеть вытесниться из кэша
+        with _evict_lock:
+            dirty, deleted = set(_dirty), set(_deleted)
+            _dirty.difference_update(dirty)
+            _deleted.difference_update(deleted)
+            upserts = {uid: dict(user_states[uid]) for uid in dirty if uid in user_states}
+        if not upserts and not deleted:
+            return 0
+        try:
+            _store.write_batch(upserts, deleted)
+        except Exception:
+            # вернём в очередь, если за это время их не переписали/удалили заново
+            _dirty.update(uid for uid in dirty if uid not in _deleted)
+            _deleted.update(uid for uid in deleted if uid not in _dirty)
+            raise
+    user_states.evict(_dirty)
+    return len(upserts) + len(deleted)
+
+
+# ─── транзакция на ход диалога ───────────────────────────────────
+_MISSING = object()
+# задачи FanOut транзакцию хода не наследуют: _Tx не потокобезопасен
+_tx_ctx: ContextVar[dict | None] = not_inherited(ContextVar("state_tx", default=None))
+_tx_counters = {"commits": 0, "rollbacks": 0, "writes_buffered": 0, "keys_committed": 0,
+                "conflicts": 0, "cas_failed": 0, "partial_commits": 0}
+
+
+class _Tx:
+    """
+    Буфер изменений одного пользователя: рабочая копия + факт удаления.
+    Копии глубокие: правки вложенных значений (structured_cache, списки) на месте
+    видны в диффе и откатываются вместе с ходом, не задевая применённое состояние.
+    external_effects — сколько раз внутри хода что-то ушло наружу (сообщение клиенту,
+    бронь слота, задача напоминания): такой ход при ошибке не откатывается.
+    """
+    __slots__ = ("user_id", "base", "view", "deleted", "version", "yield_to_newer", "external_effects")
+
+    def __init__(self, user_id, base, version, yield_to_newer=False):
+        self.user_id = user_id
+        self.version = version
+        self.yield_to_newer = yield_to_newer
+        self.base = copy.deepcopy(dict(base)) if base else None   # что было на момент начала
+        self.view = copy.deepcopy(dict(base)) if base else None   # что видит код внутри хода
+        self.deleted = False
+        self.external_effects = 0
+
+
+def _active_tx(user_id) -> "_Tx | None":
+    txs = _tx_ctx.get()
+    return txs.get(user_id) if txs else None
+
+
+@contextmanager
+def transaction(user_id, yield_to_newer: bool = False):
+    """
+    Все get/update/save_if_absent/delete_state по user_id внутри блока идут в буфер
+    (читаем свои же записи) и применяются одним set_state в конце хода.
+    Вложенные transaction() того же пользователя присоединяются к внешней.
+    При исключении изменения хода отбрасываются — если только внутри хода не было
+    внешних действий (note_external_effect): тогда применяем то, до чего дошли,
+    чтобы состояние не расходилось с уже отправленным. as tx — буфер хода.
+
+    yield_to_newer=True — для фоновых задач (напоминания): если ключ за время
+    транзакции успели поменять снаружи (живой ответ клиента), оставляем свежее значение.
+    """
+    txs = _tx_ctx.get() or {}
+    if user_id in txs:
+        yield txs[user_id]
+        return
+    with _lock_for(user_id):
+        tx = _Tx(user_id, _committed_get(user_id), get_state_version(user_id), yield_to_newer)
+    token = _tx_ctx.set({**txs, user_id: tx})
+    try:
+        yield tx
+    except BaseException:
+        if tx.external_effects:
+            _tx_counters["partial_commits"] += 1
+            _commit(tx)
+        else:
+            _tx_counters["rollbacks"] += 1
+        raise
+    else:
+        _commit(tx)
+    finally:
+        _tx_ctx.reset(token)
+
+
+def note_external_effect() -> None:
+    """Внутри хода случилось необратимое (ушло сообщение, забронирован слот, поставлена задача)."""
+    for tx in (_tx_ctx.get() or {}).values():
+        tx.external_effects += 1
+    for counter in _effects_ctx.get():
+        counter[0] += 1
+
+
+# счётчики внешних действий вне транзакции хода (наследуются задачами FanOut):
+# входящая очередь по ним решает, можно ли повторить упавшее событие
+_effects_ctx: ContextVar[tuple] = ContextVar("external_effects", default=())
+
+
+@contextmanager
+def track_external_effects():
+    """Считать note_external_effect() внутри блока: yield [n], n растёт на каждое действие."""
+    counter = [0]
+    token = _effects_ctx.set(_effects_ctx.get() + (counter,))
+    try:
+        yield counter
+    finally:
+        _effects_ctx.reset(token)
+
+
+def _commit(tx: "_Tx") -> None:
+    """Применяем дифф хода поверх актуального состояния (чужие ключи не затираем)."""
+    with _lock_for(tx.user_id):
+        _tx_counters["commits"] += 1
+        base, view = tx.base or {}, tx.view
+        if tx.deleted:
+            _drop(tx.user_id)
+            base = {}
+        if view is None:
+            return
+        changed = {k: v for k, v in view.items() if base.get(k, _MISSING) != v}
+        removed = [k for k in base if k not in view]
+        if not changed and not removed:
+            return
+        current = dict(_committed_get(tx.user_id) or {})
+        if get_state_version(tx.user_id) != tx.version:
+            # кто-то записал поверх нас за время хода
+            clash = [k for k in list(changed) + removed if current.get(k, _MISSING) != base.get(k, _MISSING)]
+            if clash:
+                _tx_counters["conflicts"] += 1
+                log.info(f"[state] concurrent write user={tx.user_id} keys={clash} "
+                         f"→ {'оставляем свежие' if tx.yield_to_newer else 'побеждает ход'}")
+                if tx.yield_to_newer:
+                    for k in clash:
+                        changed.pop(k, None)
+                    removed = [k for k in removed if k not in clash]
+        current.update(changed)
+        for k in removed:
+            current.pop(k, None)
+        _committed_set(tx.user_id, current)
+        _tx_counters["keys_committed"] += len(changed) + len(removed)
 
 
 def get_state(user_id):
-    return user_states.get(user_id)
+    tx = _active_tx(user_id)
+    if tx is not None:
+        return tx.view
+    return _committed_get(user_id)
+
+def _committed_get(user_id):
+    st = user_states.get(user_id)
+    if st is not None:
+        user_states.touch(user_id)
+    # промах кэша — единственное место, где читаем с диска
+    elif _store.persistent and user_id not in _deleted:
+        st = _store.load(user_id)
+        if st is not None:
+            if STATE_COMPACT:
+                st = compact(st)
+            user_states[user_id] = st
+            _index.update(user_id, st)
+            user_states.evict(_dirty)
+    if st is not None and TOMBSTONE in st:
+        st = _rehydrate(user_id)
+    return st
 
 def set_state(user_id, state):
-    user_states[user_id] = state
+    tx = _active_tx(user_id)
+    if tx is not None:
+        tx.view = state
+        _tx_counters["writes_buffered"] += 1
+        return
+    _committed_set(user_id, state)
+
+def _committed_set(user_id, state):
+    if STATE_COMPACT:
+        state = compact(state)
+    with _lock_for(user_id):
+        # сначала в _dirty, потом в кэш: иначе вытеснение успеет выкинуть
+        # ещё не сброшенную запись как «чистую»
+        if _store.persistent:
+            _dirty.add(user_id)
+        user_states[user_id] = state
+        user_states.touch(user_id)
+        _index.update(user_id, state)
+        _bump(user_id)
+        _mark_dirty(user_id)
 
 def reset_state(user_id):
-    user_states.pop(user_id, None)
+    tx = _active_tx(user_id)
+    if tx is not None:
+        tx.view, tx.deleted = None, True
+        return
+    _drop(user_id)
 
 def update_state(user_id, updates: dict):
-    current = get_state(user_id) or {}
-    current.update(updates)
-    set_state(user_id, current)
+    # read-modify-write под блокировкой пользователя: параллельные записи не теряются
+    with _lock_for(user_id):
+        current = get_state(user_id) or {}
+        current.update(updates)
+        set_state(user_id, current)
+
+def update_state_if(user_id, expected_version: int, changes: dict) -> bool:
+    """
+    Compare-and-swap: применить changes, только если версия состояния всё ещё
+    expected_version (см. get_state_version). Возвращает True, если записали.
+    Пишет сразу в применённое состояние, минуя буфер транзакции (но и его обновляет).
+    """
+    with _lock_for(user_id):
+        if get_state_version(user_id) != expected_version:
+            _tx_counters["cas_failed"] += 1
+            return False
+        current = dict(_committed_get(user_id) or {})
+        current.update(changes)
+        _committed_set(user_id, current)
+        tx = _active_tx(user_id)
+        if tx is not None:
+            tx.version = get_state_version(user_id)
+            tx.base = {**(tx.base or {}), **changes}
+            tx.view = {**(tx.view or {}), **changes}
+        return True
     # ---------------------------------------------------------------------------
 # Helper: кладём только если ещё пусто
 def save_if_absent(user_id, **kwargs):
@@ -23,20 +374,161 @@ def save_if_absent(user_id, **kwargs):
     Сохраняет пары ключ-значение, но **только** если такого ключа ещё нет
     или он пустой/None/''.
     """
-    st = get_state(user_id) or {}
-    fresh = {k: v for k, v in kwargs.items() if not st.get(k)}
-    if fresh:
-        update_state(user_id, fresh)
+    with _lock_for(user_id):
+        st = get_state(user_id) or {}
+        fresh = {k: v for k, v in kwargs.items() if not st.get(k)}
+        if fresh:
+            update_state(user_id, fresh)
+
+def _drop(user_id):
+    with _lock_for(user_id):
+        user_states.pop(user_id, None)
+        _index.remove(user_id)
+        _bump(user_id)
+        if _store.persistent:
+            _dirty.discard(user_id)
+            _deleted.add(user_id)
+            _ensure_flusher()
 
-#  Новый метод: полный сброс состояния пользователя
+#  Новый метод: полный сброс состояния пользователя
 def delete_state(user_id: str) -> None:
     """
     Полностью убрать всю информацию о пользователе
     (state + любые сторонние снапшоты, если они есть).
     """
-    user_states.pop(user_id, None)
+    # из кэша сразу, из постоянного хранилища — ближайшим сбросом
+    reset_state(user_id)
+
+    logging.getLogger(__name__).info("🗑  state for %s deleted via #reset", user_id)
+
+
+# ─── архив завершённых / давно молчащих диалогов ──────────────────
+TOMBSTONE = "_archived"          # {"_archived": ключ файла в архиве} вместо полной записи
+_archive_counters = {"archived": 0, "rehydrated": 0, "skipped_changed": 0, "rehydrate_failed": 0}
+
+
+def _rehydrate(user_id):
+    """
+    Клиент вернулся — поднимаем полную запись из холодного архива.
+    Архив выключен, недоступен или записи в нём нет — ход не роняем: логируем и отдаём
+    надгробие как есть (диалог без истории). Записанное поверх него сохранится
+    и ляжет поверх архивной записи, когда её удастся поднять.
+    """
+    with _lock_for(user_id):
+        tomb = user_states.get(user_id)
+        if tomb is None or TOMBSTONE not in tomb:
+            return tomb                                   # уже подняли в другом потоке
+        key, archive, full = tomb[TOMBSTONE], _arch.get_archive(), None
+        try:
+            full = archive.load(key, user_id) if archive is not None else None
+        except Exception as e:
+            log.warning(f"⚠️ архив {key} не читается: {e}")
+        if full is None:
+            _archive_counters["rehydrate_failed"] += 1
+            why = "STATE_ARCHIVE=off" if archive is None else "записи нет или архив недоступен"
+            log.error(f"💥 state {user_id} в архиве {key}, но поднять не удалось ({why}) — продолжаем без истории")
+            return tomb
+        full.update({k: tomb[k] for k in tomb if k != TOMBSTONE})
+        _committed_set(user_id, full)
+        _archive_counters["rehydrated"] += 1
+        log.info(f"🧊→🔥 state {user_id} поднят из архива {tomb[TOMBSTONE]}")
+        return user_states[user_id]
+
+
+def archive_dialogues() -> int:
+    """
+    Выгрузить в холодный архив завершённые (notion_exported и тишина дольше
+    STATE_ARCHIVE_FINISHED_SEC) и просто давно молчащие (STATE_ARCHIVE_IDLE_SEC) диалоги.
+    Кандидаты берутся из индексов, пачка пишется одним файлом. Возвращает число выгруженных.
+    """
+    storage = _arch.get_archive()
+    if storage is None:
+        return 0
+    finished = users_where("notion_exported", True) & set(users_idle(_arch.STATE_ARCHIVE_FINISHED_SEC))
+    candidates = finished | set(users_idle(_arch.STATE_ARCHIVE_IDLE_SEC))
+    records, versions = [], {}
+    now = time.time()
+    for uid in candidates:
+        with _lock_for(uid):
+            st = _committed_get(uid)
+            if not st or TOMBSTONE in st:
+                continue
+            # индекс мог отстать от живой записи — сверяем по ней самой
+            ts = activity_ts(st)
+            quiet = _arch.STATE_ARCHIVE_FINISHED_SEC if st.get("notion_exported") is True \
+                else _arch.STATE_ARCHIVE_IDLE_SEC
+            if ts is None or now - ts < quiet:
+                _archive_counters["skipped_changed"] += 1
+                continue
+            records.append((uid, dict(st)))
+            versions[uid] = get_state_version(uid)
+    if not records:
+        return 0
+    key = storage.write(records)
+    archived = 0
+    for uid, _ in records:
+        with _lock_for(uid):
+            if get_state_version(uid) != versions[uid]:
+                _archive_counters["skipped_changed"] += 1     # клиент успел написать — не трогаем
+                continue
+            _committed_set(uid, {TOMBSTONE: key})
+            archived += 1
+    _archive_counters["archived"] += archived
+    log.info(f"🧊 state archive: выгружено диалогов {archived} → {key}")
+    return archived
+
+
+# ─── выборки по индексам ─────────────────────────────────────────
+def users_in_stage(stage: str, older_than: float | None = None) -> list[str]:
+    """
+    Пользователи на этапе stage. older_than (сек) — только молчащие дольше
+    (по времени последнего входящего, indexes.activity_ts), от самых давних. O(результата), без обхода всех диалогов.
+    """
+    return _index.in_stage(stage, older_than)
+
+def users_idle(older_than: float) -> list[str]:
+    """Все пользователи, кто не писал дольше older_than секунд (indexes.activity_ts)."""
+    return _index.idle(older_than)
+
+def users_where(field: str, value) -> set[str]:
+    """Точное совпадение по stage / arseniy_notified / notion_export_error / handover_reason."""
+    return _index.where(field, value)
+
+def rebuild_indexes(batch: int = INDEX_REBUILD_BATCH) -> int:
+    """
+    Пересобрать индексы по постоянному хранилищу (на старте — в фоне).
+    Хранилище отдаёт диалоги пачками (iter_all) и не держит свой замок между ними,
+    так что запись и get_state во время пересборки не ждут декодирования всего журнала.
+    """
+    seen, chunk = 0, []
+    try:
+        for uid, st in _store.iter_all(batch):
+            seen += 1
+            if uid not in user_states and uid not in _deleted:
+                chunk.append((uid, st))
+            if len(chunk) >= batch:
+                _index.add_missing(chunk)
+                chunk = []
+    except Exception as e:
+        log.warning(f"⚠️ state index rebuild failed: {e}")
+    _index.add_missing(chunk)
+    return seen
+
+
+def stats() -> dict:
+    """Размер кэша, очередь на запись и счётчики транзакций."""
+    return {
+        "backend": type(_store).__name__,
+        "cached": len(user_states),
+        "capacity": user_states.capacity,
+        "dirty": len(_dirty),
+        "pending_deletes": len(_deleted),
+        "tx": dict(_tx_counters),
+        "store": _store.stats() if hasattr(_store, "stats") else {},
+        "index": _index.stats(),
+        "archive": dict(_archive_counters),
+    }
 
-    # если сохраняете снапшоты где‑то ещё (S3, Postgres) —
-    # добавьте сюда соответствующие операции.
 
-    logging.getLogger(__name__).info("🗑  state for %s deleted via #reset", user_id)
\ No newline at end of file
+configure()
+atexit.register(lambda: flush())
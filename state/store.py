@@ -0,0 +1,144 @@
+# state/store.py
+"""
+Постоянные хранилища состояния диалогов (бэкенды для state/state.py).
+
+state.py держит горячий кэш в памяти и раз в STATE_FLUSH_SEC сбрасывает сюда
+пачку изменённых диалогов. Чтение с диска — только при промахе кэша.
+"""
+import os, json, time, logging
+from abc import ABC, abstractmethod
+
+log = logging.getLogger(__name__)
+
+
+class StateStore(ABC):
+    """Интерфейс бэкенда: загрузить один диалог и записать пачку изменений."""
+    persistent = True
+
+    @abstractmethod
+    def load(self, user_id: str) -> dict | None:
+        """Один диалог или None, если его нет."""
+
+    @abstractmethod
+    def write_batch(self, upserts: dict[str, dict], deletes: set[str]) -> None:
+        """Записать пачку изменений атомарно, насколько это умеет бэкенд."""
+
+    def iter_all(self, batch: int = 500):
+        """Все диалоги (user_id, state) пачками по batch — для пересборки индексов."""
+        return iter(())
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryStateStore(StateStore):
+    """Без диска: источник правды — сам кэш (поведение по умолчанию, как раньше)."""
+    persistent = False
+
+    def load(self, user_id):
+        return None
+
+    def write_batch(self, upserts, deletes):
+        pass
+
+
+class SqlStateStore(StateStore):
+    """
+    SQLite (локально/тесты) или Postgres (прод) через тот же SQLAlchemy-стек,
+    что и у reminder_engine. Одна строка на диалог, состояние — JSON.
+    """
+
+    def __init__(self, url: str, table: str = "dialogue_states"):
+        from sqlalchemy import create_engine, MetaData, Table, Column, String, Text, Float
+        if url.startswith("sqlite"):
+            connect_args = {"check_same_thread": False}
+            db_path = url.split("///", 1)[-1]
+            if db_path and db_path != ":memory:" and os.path.dirname(db_path):
+                os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        else:
+            connect_args = {"connect_timeout": 5}
+        self.engine = create_engine(url, future=True, pool_pre_ping=True, connect_args=connect_args)
+        self.dialect = self.engine.dialect.name
+        meta = MetaData()
+        self.table = Table(
+            table, meta,
+            Column("user_id", String(64), primary_key=True),
+            Column("data", Text, nullable=False),
+            Column("updated_at", Float, nullable=False),
+        )
+        meta.create_all(self.engine)
+        log.info(f"💾 state store: {self.dialect} ({url.split('@')[-1].split('?')[0]})")
+
+    def _insert(self):
+        if self.dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        return insert(self.table)
+
+    def load(self, user_id):
+        from sqlalchemy import select
+        with self.engine.connect() as conn:
+            row = conn.execute(
+                select(self.table.c.data).where(self.table.c.user_id == user_id)
+            ).first()
+        return json.loads(row[0]) if row else None
+
+    def iter_all(self, batch: int = 500):
+        """Постранично по первичному ключу: ни одна транзакция не тянет всю таблицу разом."""
+        from sqlalchemy import select
+        c, last = self.table.c, None
+        while True:
+            query = select(c.user_id, c.data).order_by(c.user_id).limit(batch)
+            if last is not None:
+                query = query.where(c.user_id > last)
+            with self.engine.connect() as conn:
+                rows = conn.execute(query).all()
+            for uid, data in rows:
+                yield uid, json.loads(data)
+            if len(rows) < batch:
+                return
+            last = rows[-1][0]
+
+    def load_all(self) -> dict[str, dict]:
+        return dict(self.iter_all())
+
+    def write_batch(self, upserts, deletes):
+        now = time.time()
+        with self.engine.begin() as conn:
+            if deletes:
+                conn.execute(self.table.delete().where(self.table.c.user_id.in_(list(deletes))))
+            if upserts:
+                stmt = self._insert()
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[self.table.c.user_id],
+                    set_={"data": stmt.excluded.data, "updated_at": stmt.excluded.updated_at},
+                )
+                conn.execute(stmt, [
+                    {"user_id": uid, "data": json.dumps(st, ensure_ascii=False, default=str), "updated_at": now}
+                    for uid, st in upserts.items()
+                ])
+
+    def close(self):
+        self.engine.dispose()
+
+
+def build_store(backend: str, url: str | None = None) -> StateStore:
+    """
+    memory | sqlite | postgres | journal. Для postgres по умолчанию берём SUPABASE_DB_URL,
+    для journal url — это каталог журнала (по умолчанию tmp/state_journal).
+    """
+    backend = (backend or "memory").lower()
+    if backend == "memory":
+        return MemoryStateStore()
+    if backend == "journal":
+        from state.journal import JournalStateStore
+        return JournalStateStore(url or os.getenv("STATE_JOURNAL_DIR", "tmp/state_journal"))
+    if backend == "sqlite":
+        return SqlStateStore(url or "sqlite:///tmp/state.db")
+    if backend in ("postgres", "postgresql"):
+        pg_url = url or os.getenv("SUPABASE_DB_URL")
+        if not pg_url:
+            raise RuntimeError("STATE_BACKEND=postgres, но нет ни STATE_DB_URL, ни SUPABASE_DB_URL")
+        return SqlStateStore(pg_url)
+    raise ValueError(f"unknown STATE_BACKEND: {backend}")
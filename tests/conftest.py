@@ -72,6 +72,27 @@ def fake_outbox(monkeypatch):
 
     return sent
 
+@pytest.fixture
+def fake_graph(monkeypatch):
+    """
+    Локальный Graph API (scripts/fake_graph_api.py): fake_graph(**FakeConfig) поднимает
+    сервер и направляет на него graph_http. Возвращает сервер (счётчики — server.state).
+    """
+    from scripts.fake_graph_api import FakeConfig, start_in_thread
+    from utils import graph_http
+    servers = []
+
+    def start(**config):
+        server = start_in_thread(FakeConfig(**config))
+        servers.append(server)
+        monkeypatch.setattr(graph_http, "GRAPH_BASE_URL", server.base_url)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
 @pytest.fixture(autouse=True)
 def ensure_prompts_exist_and_real():
     """
@@ -145,7 +145,7 @@ def test_forward_photo_and_persist_url(monkeypatch, state_store):
         owner_media["last_id"] = media_id
     monkeypatch.setattr(b5, "send_image", lambda to, media: fake_send_image(to, media), raising=True)
 
-    # 3) requests.get для Meta: первый раз — JSON с url, второй — бинарь
+    # 3) graph_http.get для Meta: первый раз — JSON с url, второй — бинарь
     class _RespJson:
         def __init__(self, data=None, content=None):
             self._data = data
@@ -155,13 +155,13 @@ def test_forward_photo_and_persist_url(monkeypatch, state_store):
         def raise_for_status(self): pass
 
     calls = {"n": 0}
-    def fake_get(url, headers=None, timeout=10):
+    def fake_get(url, headers=None, timeout=None, **kw):
         calls["n"] += 1
         if calls["n"] == 1:
             return _RespJson(data={"url": "https://tmp/meta/image"})
         else:
             return _RespJson(content=b"\x89PNG...")
-    monkeypatch.setattr(b5.requests, "get", fake_get, raising=True)
+    monkeypatch.setattr(b5.graph_http, "get", fake_get, raising=True)
 
     # 4) upload_image возвращает постоянный URL
     monkeypatch.setitem(sys.modules, "utils.s3_upload", types.SimpleNamespace(upload_image=lambda content: "https://s3/permanent/photo.png"))
@@ -216,3 +216,31 @@ def test_reason_comment_mapping_in_summary(monkeypatch, state_store):
 
     assert "Нестандартный формат шоу – нужна консультация." in captured["summary"]
     assert any(c["force_stage"] == "block6" for c in router_calls)
+
+
+def test_rejected_owner_resume_keeps_flag_and_alerts(monkeypatch, state_store):
+    """
+    Graph API не принял резюме (например, шаблон отклонён):
+      • arseniy_notified не ставится;
+      • резюме уходит в Telegram, клиент всё равно получает уведомление.
+    """
+    from importlib import import_module
+    b5 = import_module("blocks.block_05")
+
+    class _Resp: status_code = 400
+    monkeypatch.setattr(b5, "send_owner_resume", lambda s: [_Resp()], raising=True)
+    alerts = []
+    monkeypatch.setattr(b5, "send_telegram_alert", alerts.append, raising=True)
+    install_fake_router(monkeypatch, [])
+
+    uid = "userE"
+    install_state_api(monkeypatch, b5, state_store)
+    state_store[uid] = {"stage": "block3a", "normalized_number": "+7705***5073"}
+    client_msgs = []
+
+    b5.handle_block5("позовите Арсения", uid, client_msgs.append, lambda _: None)
+
+    st = state_store[uid]
+    assert not st.get("arseniy_notified")
+    assert len(alerts) == 1 and "userE" in alerts[0]
+    assert client_msgs and st.get("client_notified_about_handover") is True
@@ -112,14 +112,14 @@ def test_materials_end2end(monkeypatch, tmp_path):
 
     sent = {"text": [], "document": [], "video": []}
 
-    # send_text использует requests.post напрямую — подменим его локально
+    # send_text без запущенной очереди отправляет сразу через graph_http.post — подменим его
     class _Resp:
         status_code = 200
         reason = "OK"
         text = "ok"
         def raise_for_status(self): pass
 
-    def fake_requests_post(url, headers=None, json=None, timeout=20, **kw):
+    def fake_graph_post(url, headers=None, json=None, timeout=None, **kw):
         if json and json.get("type") == "text":
             sent["text"].append(json["text"]["body"])
         return _Resp()
@@ -131,7 +131,7 @@ def test_materials_end2end(monkeypatch, tmp_path):
         if payload.get("type") == "video":
             sent["video"].append(payload["video"]["id"])
 
-    monkeypatch.setattr(wa.requests, "post", fake_requests_post)
+    monkeypatch.setattr(wa.outbound_queue.graph_http, "post", fake_graph_post)
     monkeypatch.setattr(wa, "_post", fake__post)
 
     # ---------- ИИ-текст ----------
@@ -0,0 +1,86 @@
+import sys, time, types
+import pytest
+
+import utils.incoming_message as inc
+from utils import user_lanes, inbound_queue
+
+
+@pytest.fixture(autouse=True)
+def burst_db(tmp_path):
+    inbound_queue.configure(str(tmp_path / "inbound.db"))
+    yield inbound_queue
+    inbound_queue.configure()
+
+
+@pytest.fixture
+def fake_state(monkeypatch):
+    store = {}
+    mod = types.SimpleNamespace(
+        get_state=lambda uid: store.get(uid, {}),
+        update_state=lambda uid, upd: store.setdefault(uid, {}).update(upd),
+        save_if_absent=lambda uid, **kw: [store.setdefault(uid, {}).setdefault(k, v) for k, v in kw.items()],
+    )
+    monkeypatch.setitem(sys.modules, "state.state", mod)
+    return store
+
+
+@pytest.fixture
+def routed(monkeypatch):
+    calls = []
+    monkeypatch.setattr(inc, "route_message", lambda text, uid, client_name=None: calls.append((uid, text)))
+    return calls
+
+
+def _wait(cond, timeout=3.0):
+    end = time.time() + timeout
+    while time.time() < end and not cond():
+        time.sleep(0.02)
+    return cond()
+
+
+def test_rapid_messages_are_routed_as_one_turn(monkeypatch, fake_state, routed):
+    monkeypatch.setattr(inc, "BURST_WINDOW_SEC", 0.2)
+    uid = "78000000101"
+    for i, text in enumerate(["Здравствуйте", "хотим шоу", "на 15 июня"]):
+        inc.process_text_message(text, uid, "PNID", "Max", meta_message_id=f"wamid.{i}")
+
+    assert _wait(lambda: routed) and user_lanes.wait_idle(3)
+    assert routed == [(uid, "Здравствуйте\nхотим шоу\nна 15 июня")]
+    assert fake_state[uid]["last_incoming_id"] == "wamid.2"
+
+
+def test_messages_after_window_start_new_turn(monkeypatch, fake_state, routed):
+    monkeypatch.setattr(inc, "BURST_WINDOW_SEC", 0.1)
+    uid = "78000000102"
+    inc.process_text_message("первое", uid, "PNID", "Max", meta_message_id="wamid.a")
+    assert _wait(lambda: len(routed) == 1)
+    inc.process_text_message("второе", uid, "PNID", "Max", meta_message_id="wamid.b")
+    assert _wait(lambda: len(routed) == 2)
+    assert [t for _, t in routed] == ["первое", "второе"]
+
+
+def test_window_zero_routes_immediately(monkeypatch, fake_state, routed):
+    monkeypatch.setattr(inc, "BURST_WINDOW_SEC", 0)
+    inc.process_text_message("привет", "78000000103", "PNID", "Max", meta_message_id="wamid.z")
+    assert routed == [("78000000103", "привет")]
+
+
+def test_pending_burst_is_on_disk_until_flushed(monkeypatch, fake_state, routed, burst_db):
+    monkeypatch.setattr(inc, "BURST_WINDOW_SEC", 0.3)
+    uid = "78000000104"
+    inc.process_text_message("хотим шоу", uid, "PNID", "Max", meta_message_id="wamid.p")
+    assert [(u, b["parts"]) for u, _, b in burst_db.pending_bursts()] == [(uid, ["хотим шоу"])]
+
+    assert _wait(lambda: routed) and user_lanes.wait_idle(3)
+    assert burst_db.pending_bursts() == []
+
+
+def test_bursts_left_by_a_crash_are_routed_on_start(fake_state, routed, burst_db):
+    uid = "78000000105"
+    burst_db.save_burst(uid, 100.0, {"parts": ["Здравствуйте", "на 15 июня"], "phone_id": "PNID",
+                                     "name": "Max", "received_at": 100.0})
+
+    assert inc.recover_bursts() == 1
+    assert _wait(lambda: routed) and user_lanes.wait_idle(3)
+    assert routed == [(uid, "Здравствуйте\nна 15 июня")]
+    assert burst_db.pending_bursts() == []
@@ -83,6 +83,7 @@ def test_dataset_routing_with_stubbed_classifier(monkeypatch, fake_state_store):
 
     import blocks.block_02 as b2
     send = _send_accumulator()
+    monkeypatch.setattr(b2, "wants_handover_ai", lambda t: False, raising=True)
 
     # мокаем внутреннюю классификацию блока, чтобы не дергать LLM
     mapping = {text: expected for (text, expected) in DATASET}
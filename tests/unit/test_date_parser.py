@@ -0,0 +1,52 @@
+from datetime import datetime
+
+import pytest
+
+import utils.date_parser as dp
+from utils.date_parser import parse_date_time, confident
+
+# среда, 11 июня 2025, Атырау
+NOW = datetime(2025, 6, 11, 10, 0, tzinfo=dp.TZ)
+
+
+@pytest.mark.parametrize("text, date, time", [
+    ("15 июня", "2025-06-15", None),
+    ("хотим 1 мая", "2026-05-01", None),                 # прошедшее число — следующий год
+    ("в субботу", "2025-06-14", None),
+    ("в следующую пятницу в 7 часов вечера", "2025-06-20", "19:00"),
+    ("послезавтра в 18:30", "2025-06-13", "18:30"),
+    ("к 5 вечера", None, "17:00"),
+    ("в 16", None, "16:00"),
+    ("15.06 в 18.30", "2025-06-15", "18:30"),
+    ("дата 3 сентября, 15:00", "2025-09-03", "15:00"),
+    ("через неделю в полдень", "2025-06-18", "12:00"),
+    ("tomorrow at 7 pm", "2025-06-12", "19:00"),
+    ("June 15th, 2026", "2026-06-15", None),
+    ("1 мая, нет, лучше 2 мая", "2026-05-02", None),
+    ("праздник на 12.11 с 3 до 5 дня", "2025-11-12", "15:00"),     # начало интервала, не «до»
+    ("с 18:00 до 20:00", None, "18:00"),
+    ("мая 10 в 18:00", "2026-05-10", "18:00"),
+])
+def test_parses_ru_and_en(text, date, time):
+    parsed = parse_date_time(text, now=NOW)
+    assert (parsed["date"], parsed["time"]) == (date, time)
+    assert confident(parsed) == (date, time)
+
+
+@pytest.mark.parametrize("text", [
+    "Ане 7 лет, будет 20 гостей",
+    "шоу на 2 часа",
+    "праздник длится 2 дня",
+    "сыну 3.5 года",
+    "бюджет 1.5 тыс",
+    "в мае 10 детей будет",
+])
+def test_counts_and_durations_are_not_dates(text):
+    parsed = parse_date_time(text, now=NOW)
+    assert parsed["date"] is None and parsed["time"] is None
+
+
+def test_ambiguous_values_are_left_to_llm():
+    parsed = parse_date_time("сегодня узнали о вас, давайте в 5", now=NOW)
+    assert parsed["date"] == "2025-06-11" and parsed["time"] == "17:00"
+    assert confident(parsed) == (None, None)
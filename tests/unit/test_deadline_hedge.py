@@ -0,0 +1,121 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import utils.ask_openai as ao
+from utils import deadline, llm_cache, llm_limiter
+from utils.fanout import FanOut
+
+
+class SlowClient:
+    """Первый запрос «зависает» на slow_first секунд, остальные отвечают сразу."""
+
+    def __init__(self, slow_first=0.0):
+        self.slow_first = slow_first
+        self.calls = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, **kw):
+        self.calls.append(kw)
+        n = len(self.calls)
+        if n == 1 and self.slow_first:
+            time.sleep(self.slow_first)
+        msg = SimpleNamespace(content=f"ответ #{n}")
+        return SimpleNamespace(choices=[SimpleNamespace(message=msg)],
+                               usage=SimpleNamespace(total_tokens=10))
+
+
+@pytest.fixture
+def fresh(monkeypatch):
+    llm_cache.clear()
+    monkeypatch.setattr(ao, "_latencies", type(ao._latencies)(maxlen=200))
+    monkeypatch.setattr(ao, "_hedge_counters", {k: 0 for k in ao._hedge_counters})
+    yield
+    llm_cache.clear()
+
+
+def test_timeout_is_clamped_to_remaining_budget(fresh, monkeypatch):
+    client = SlowClient()
+    monkeypatch.setattr(ao, "get_client", lambda: client)
+    with llm_cache.policy(0, site="t"):
+        ao.ask_openai("вне хода")
+        with deadline.scope(deadline.Deadline(budget=10, started_at=time.time() - 4)):
+            ao.ask_openai("середина хода")
+        with deadline.scope(deadline.Deadline(budget=10, started_at=time.time() - 30)):
+            ao.ask_openai("бюджет исчерпан")
+
+    timeouts = [c["timeout"] for c in client.calls]
+    assert timeouts[0] == ao.LLM_TIMEOUT_SEC
+    assert 5 < timeouts[1] <= 6
+    assert timeouts[2] == ao.LLM_MIN_TIMEOUT_SEC
+    assert ao.hedge_stats()["clamped"] == 2
+
+
+def test_timeout_after_budget_is_spent_never_reaches_the_client(fresh, monkeypatch):
+    import httpx
+    import utils.incoming_message as im
+    from openai import APITimeoutError
+
+    def hang(**kw):
+        raise APITimeoutError(request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+    monkeypatch.setattr(ao, "get_client", lambda: SimpleNamespace(chat=SimpleNamespace(
+        completions=SimpleNamespace(create=hang))))
+    sent = []
+    monkeypatch.setattr(im.outgoing, "send_text_message", lambda pnid, to, body: sent.append(body))
+    monkeypatch.setattr(im, "route_message", lambda text, uid, client_name=None: sent.append(ao.ask_openai(text)))
+
+    with llm_cache.policy(0, site="t"):
+        with pytest.raises(llm_limiter.LLMUnavailable):
+            ao.ask_openai("вне хода")
+        im._route_turn("на 15 июня", "7702", "PNID", "Мария", parts=1, received_at=time.time() - 60)
+    assert sent == ["Техническая ошибка. Попробуйте позже."]
+
+
+def test_deadline_reaches_fanout_tasks():
+    d = deadline.Deadline(budget=7)
+    with deadline.scope(d), FanOut() as fan:
+        seen = fan.submit(deadline.current)
+        assert seen.result(2) is d
+    assert deadline.current() is None
+    with deadline.scope(None):                     # None не сбрасывает текущий
+        assert deadline.current() is None
+
+
+def test_slow_primary_is_hedged_and_backup_wins(fresh, monkeypatch):
+    monkeypatch.setattr(ao, "LLM_HEDGE_MIN_DELAY_SEC", 0.05)
+    ao._latencies.extend([0.01] * ao.LLM_HEDGE_MIN_SAMPLES)
+    client = SlowClient(slow_first=1.0)
+    monkeypatch.setattr(ao, "get_client", lambda: client)
+
+    t0 = time.monotonic()
+    with llm_cache.policy(0, site="t"):
+        ans = ao.ask_openai("медленный промпт")
+    assert ans == "ответ #2"
+    assert time.monotonic() - t0 < 0.8
+    assert len(client.calls) == 2
+    assert client.calls[1]["timeout"] < client.calls[0]["timeout"]
+    st = ao.hedge_stats()
+    assert st["hedged"] == 1 and st["hedge_won"] == 1
+
+
+def test_background_calls_are_not_hedged(fresh, monkeypatch):
+    monkeypatch.setattr(ao, "LLM_HEDGE_MIN_DELAY_SEC", 0.05)
+    ao._latencies.extend([0.01] * ao.LLM_HEDGE_MIN_SAMPLES)
+    client = SlowClient(slow_first=0.2)
+    monkeypatch.setattr(ao, "get_client", lambda: client)
+
+    with llm_cache.policy(0, site="t"), llm_limiter.priority(llm_limiter.REMINDER):
+        assert ao.ask_openai("напоминание") == "ответ #1"
+    assert len(client.calls) == 1
+    assert ao.hedge_stats()["hedged"] == 0
+
+
+def test_turn_durations_are_recorded(monkeypatch):
+    monkeypatch.setattr(deadline, "_durations", type(deadline._durations)(maxlen=1000))
+    monkeypatch.setattr(deadline, "_counters", {"turns": 0, "over_budget": 0})
+    deadline.record_turn(deadline.Deadline(budget=25, started_at=time.time() - 3))
+    deadline.record_turn(deadline.Deadline(budget=25, started_at=time.time() - 40))
+    st = deadline.stats()
+    assert st["turns"] == 2 and st["over_budget"] == 1
+    assert st["turn_sec_max"] >= 40
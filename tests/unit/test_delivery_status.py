@@ -0,0 +1,130 @@
+import time
+import types
+
+import pytest
+
+from utils import delivery_status as ds
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    ds.configure(str(tmp_path / "delivery.db"))
+    monkeypatch.setattr(ds, "_counters", {k: 0 for k in ds._counters})
+    yield ds
+    ds.configure()
+
+
+@pytest.fixture
+def resent(monkeypatch):
+    from utils import outbound_queue
+    calls = []
+    monkeypatch.setattr(outbound_queue, "send", lambda payload, **kw: calls.append((payload, kw)))
+    return calls
+
+
+def _text(to, body):
+    return {"messaging_product": "whatsapp", "to": to, "type": "text", "text": {"body": body}}
+
+
+def _status(wamid, name, ts=None, code=None):
+    st = {"id": wamid, "status": name, "timestamp": str(ts or time.time()), "recipient_id": "x"}
+    if code:
+        st["errors"] = [{"code": code, "title": "err"}]
+    return st
+
+
+def test_statuses_join_by_wamid_and_give_latency(store):
+    t0 = time.time()
+    store.record_sent("wamid.1", _text("A", "привет"), "text")
+    store.on_status(_status("wamid.1", "sent", t0 + 1))
+    store.on_status(_status("wamid.1", "read", t0 + 9))
+    store.on_status(_status("wamid.1", "delivered", t0 + 4))      # опоздал — назад не откатываемся
+    store.on_status(_status("wamid.other", "delivered"))
+
+    st = store.stats()
+    assert st["by_status"] == {"read": 1}
+    assert st["unknown_wamid"] == 1
+    assert st["send_to_delivered_sec"]["n"] == 1 and st["send_to_read_sec"]["p50"] >= 8
+
+
+def test_transient_failure_is_resent_until_limit(store, resent, monkeypatch):
+    monkeypatch.setattr(store, "MAX_RESENDS", 1)
+    msg = _text("A", "КП")
+    store.record_sent("wamid.1", msg, "document", "PNID")
+    store.on_status(_status("wamid.1", "failed", code=131000))
+    assert resent == [(msg, {"tag": "document", "phone_id": "PNID", "delay": store.RESEND_DELAY_SEC})]
+
+    store.record_sent("wamid.2", msg, "document", "PNID")          # повтор снова упал
+    store.on_status(_status("wamid.2", "failed", code=131000))
+    assert len(resent) == 1
+
+
+def test_permanent_failure_is_not_resent(store, resent):
+    store.record_sent("wamid.1", _text("A", "x"), "text")
+    store.on_status(_status("wamid.1", "failed", code=131047))       # вне 24-часового окна
+    assert resent == []
+
+
+def test_undelivered_tracks_last_message(store):
+    assert not store.undelivered("A")
+    store.record_sent("wamid.1", _text("A", "1"), "text")
+    assert not store.undelivered("A")                               # статусов нет — не знаем
+    store.on_status(_status("wamid.1", "sent"))
+    assert store.undelivered("A")
+    store.on_status(_status("wamid.1", "delivered"))
+    assert not store.undelivered("A")
+
+
+@pytest.fixture
+def reminders(monkeypatch):
+    import utils.reminder_engine as re_
+    planned, ran = [], []
+    monkeypatch.setattr(re_, "get_state", lambda uid: {"normalized_number": "A"})
+    monkeypatch.setattr(re_, "plan", lambda uid, path, delay: planned.append((uid, path, delay)))
+    monkeypatch.setattr(re_, "_unindex_job", lambda job_id: None)
+    job = lambda uid, send=None: ran.append(uid)
+    monkeypatch.setitem(__import__("sys").modules, "fake_reminders", types.SimpleNamespace(
+        send_first_reminder_if_silent=job, finalize_if_still_silent=job, retry_export=job))
+    return types.SimpleNamespace(engine=re_, planned=planned, ran=ran)
+
+
+def test_reminder_is_deferred_while_undelivered(store, reminders):
+    re_ = reminders.engine
+    store.record_sent("wamid.1", _text("A", "напоминание 1"), "text")
+    store.on_status(_status("wamid.1", "sent"))
+    re_.execute_job("u1", "fake_reminders.send_first_reminder_if_silent")
+    assert reminders.ran == []
+    assert reminders.planned == [("u1", "fake_reminders.send_first_reminder_if_silent", re_.UNDELIVERED_RETRY_SEC)]
+    assert store.stats()["reminders_deferred"] == 1
+
+
+def test_finalize_and_export_jobs_are_not_deferred(store, reminders):
+    store.record_sent("wamid.1", _text("A", "напоминание 2"), "text")
+    store.on_status(_status("wamid.1", "sent"))
+    reminders.engine.execute_job("u1", "fake_reminders.finalize_if_still_silent")
+    reminders.engine.execute_job("u1", "fake_reminders.retry_export")
+    assert reminders.ran == ["u1", "u1"] and reminders.planned == []
+
+
+def test_permanent_failure_does_not_hold_reminders(store, reminders):
+    store.record_sent("wamid.1", _text("A", "напоминание 1"), "text")
+    store.on_status(_status("wamid.1", "failed", code=131047))     # окно 24 ч закрылось
+    assert not store.undelivered("A")
+    reminders.engine.execute_job("u1", "fake_reminders.send_first_reminder_if_silent")
+    assert reminders.ran == ["u1"]
+
+
+def test_deferral_is_capped_by_age(store, reminders, monkeypatch):
+    store.record_sent("wamid.1", _text("A", "напоминание 1"), "text")
+    store.on_status(_status("wamid.1", "sent"))
+    monkeypatch.setattr(reminders.engine, "UNDELIVERED_MAX_DEFER_SEC", -1)   # «висит» дольше предела
+    reminders.engine.execute_job("u1", "fake_reminders.send_first_reminder_if_silent")
+    assert reminders.ran == ["u1"] and reminders.planned == []
+
+
+def test_old_rows_are_evicted(store, monkeypatch):
+    store.record_sent("wamid.old", _text("A", "1"), "text")
+    monkeypatch.setattr(store, "_last_evict", 0.0)
+    monkeypatch.setattr(store, "TTL_SEC", -1)
+    store.record_sent("wamid.new", _text("B", "2"), "text")
+    assert sum(store.stats()["by_status"].values()) == 0
@@ -0,0 +1,40 @@
+import json
+
+import state.state as state
+from state.dialogue_state import DialogueState
+
+
+def test_behaves_like_dict():
+    st = DialogueState({"stage": "block2", "r1_scheduled_b2": True, "custom_key": [1, 2]})
+    assert st == {"stage": "block2", "r1_scheduled_b2": True, "custom_key": [1, 2]}
+    assert st.get("show_type") is None and "show_type" not in st
+    assert st["r1_scheduled_b2"] is True and st.get("r2_scheduled_b2", "нет") == "нет"
+
+    st.update({"r1_scheduled_b2": False, "show_type": "детское"})
+    assert st["r1_scheduled_b2"] is False and len(st) == 4
+    del st["custom_key"]
+    st.pop("stage")
+    assert dict(st) == {"show_type": "детское", "r1_scheduled_b2": False}
+    assert json.loads(json.dumps(dict(st), ensure_ascii=False)) == dict(st)
+
+
+def test_flags_keep_non_bool_values_and_stage_is_interned():
+    st = DialogueState({"arseniy_notified": "yes"})            # не bool — хранится как есть
+    assert st["arseniy_notified"] == "yes"
+    st["arseniy_notified"] = True
+    assert st == {"arseniy_notified": True}
+
+    a = DialogueState({"stage": "".join(["block", "3a"])})
+    b = DialogueState({"stage": "".join(["block", "3a"])})
+    assert a["stage"] is b["stage"]
+
+
+def test_state_module_stores_compact_records():
+    state.user_states.clear()
+    state.update_state("cmp", {"stage": "block2", "block2_intro_sent": True})
+    st = state.get_state("cmp")
+    assert isinstance(st, DialogueState)
+    with state.transaction("cmp"):
+        state.update_state("cmp", {"stage": "block3a"})
+    assert state.get_state("cmp") == {"stage": "block3a", "block2_intro_sent": True}
+    assert state.users_in_stage("block3a") == ["cmp"]
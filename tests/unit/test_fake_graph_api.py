@@ -0,0 +1,53 @@
+import time
+
+import pytest
+
+from utils import graph_http, outbound_queue as oq, delivery_status, token_manager
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    mps = oq.MPS
+    oq.configure(str(tmp_path / "outbound.db"), mps=1000)
+    delivery_status.configure(str(tmp_path / "delivery.db"))
+    monkeypatch.setattr(oq, "BACKOFF_BASE_SEC", 0.02)
+    monkeypatch.setattr(oq, "_counters", {k: 0 for k in oq._counters})
+    monkeypatch.setattr(oq, "get_token", lambda: "fake-token")
+    yield oq
+    oq.stop_workers()
+    oq.configure(mps=mps)
+    delivery_status.configure()
+
+
+def _text(to, body):
+    return {"messaging_product": "whatsapp", "to": to, "type": "text", "text": {"body": body}}
+
+
+def test_send_path_survives_429_and_keeps_order(fake_graph, queue):
+    server = fake_graph(latency_ms=5, jitter_ms=5, rate_limit=0.2, retry_after=0)
+    queue.start_workers()
+    for i in range(10):
+        for to in ("A", "B", "C"):
+            queue.send(_text(to, str(i)))
+
+    end = time.time() + 10
+    while queue.stats()["total_sent"] < 30 and time.time() < end:
+        time.sleep(0.02)
+    assert queue.stats()["total_sent"] == 30
+    assert server.state.counters["rate_limited"] > 0
+    for to in ("A", "B", "C"):
+        bodies = [p["text"]["body"] for p in server.state.sent if p["to"] == to]
+        assert bodies == [str(i) for i in range(10)]
+    assert sum(delivery_status.stats()["by_status"].values()) == 30    # wamid из ответа сохранён
+
+
+def test_media_roundtrip_and_token_check(fake_graph):
+    fake_graph(bad_token="expired")
+    up = graph_http.post(graph_http.graph_url("PNID/media"), data=b"pdf-bytes",
+                         headers={"Content-Type": "application/pdf"})
+    media_id = up.json()["id"]
+    meta = graph_http.get(graph_http.graph_url(media_id)).json()
+    assert graph_http.get(meta["url"]).content == b"pdf-bytes"
+
+    assert token_manager.check_token_validity_raw("fresh")
+    assert not token_manager.check_token_validity_raw("expired")
@@ -0,0 +1,78 @@
+import threading
+import time
+
+import pytest
+
+import state.state as state
+import utils.ask_openai as ao
+from utils import fanout, llm_cache
+from utils.fanout import FanOut
+
+
+def test_independent_calls_take_the_slowest_not_the_sum():
+    t0 = time.perf_counter()
+    with FanOut() as fan:
+        a = fan.submit(lambda: time.sleep(0.2) or "a")
+        b = fan.submit(lambda: time.sleep(0.2) or "b")
+        assert (a.result(), b.result()) == ("a", "b")
+    assert time.perf_counter() - t0 < 0.35
+
+
+def test_exit_cancels_pending_work(monkeypatch):
+    monkeypatch.setattr(fanout, "_executor", fanout.ThreadPoolExecutor(max_workers=1))
+    gate, ran = threading.Event(), []
+    with FanOut() as fan:
+        first = fan.submit(gate.wait, 1)
+        second = fan.submit(ran.append, "late")
+    gate.set()
+    assert first.result() is True
+    assert second.cancelled() and ran == []
+
+
+def test_context_is_copied_and_nested_submit_runs_inline():
+    def inner():
+        with FanOut() as fan:
+            return fan.submit(lambda: (threading.current_thread().name, llm_cache.current_policy())).result()
+
+    with llm_cache.policy(60, site="t"):
+        with FanOut() as fan:
+            outer = fan.submit(lambda: threading.current_thread().name)
+            nested = fan.submit(inner)
+            thread_name, policy = nested.result()
+    assert outer.result().startswith("fanout")
+    assert thread_name.startswith("fanout")
+    assert policy == (60, "t")
+
+
+def test_errors_surface_on_result():
+    with FanOut() as fan:
+        fut = fan.submit(lambda: 1 / 0)
+        with pytest.raises(ZeroDivisionError):
+            fut.result()
+
+
+def test_tasks_do_not_inherit_the_state_transaction():
+    with state.transaction("7703") as tx:
+        with FanOut() as fan:
+            seen = fan.submit(state._active_tx, "7703").result()
+        assert state._active_tx("7703") is tx
+    assert seen is None
+
+
+def test_cancel_stops_a_running_task_before_its_next_llm_call(monkeypatch):
+    calls, started, release = [], threading.Event(), threading.Event()
+    monkeypatch.setattr(ao, "_call", lambda *a, **kw: calls.append(a[1]) or "ok")
+
+    def structuring():
+        started.set()
+        release.wait(1)
+        return ao.ask_openai("структурирование")
+
+    with llm_cache.policy(0, site="t"), FanOut() as fan:
+        job = fan.submit(structuring)
+        started.wait(1)
+        fan.cancel()                                  # ход ушёл в хендовер
+        release.set()
+        with pytest.raises(fanout.Cancelled):
+            job.result(1)
+    assert calls == [] and fanout.stats()["stopped"] >= 1
@@ -0,0 +1,85 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from utils import graph_http
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"            # keep-alive
+    log = []
+    fail_first = 0
+
+    def _reply(self, code, body):
+        raw = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def _handle(self):
+        n = int(self.headers.get("Content-Length") or 0)
+        if n:
+            self.rfile.read(n)
+        type(self).log.append((self.command, self.path, self.client_address[1]))
+        if type(self).fail_first:
+            type(self).fail_first -= 1
+            return self._reply(503, {"error": "busy"})
+        self._reply(200, {"ok": True})
+
+    do_GET = do_POST = _handle
+
+    def log_message(self, *a):
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch):
+    _Handler.log, _Handler.fail_first = [], 0
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    monkeypatch.setattr(graph_http, "_session", None)
+    monkeypatch.setattr(graph_http, "_endpoints", {})
+    yield f"http://127.0.0.1:{srv.server_port}"
+    srv.shutdown()
+    srv.server_close()
+
+
+def test_connections_are_reused(server):
+    for _ in range(5):
+        assert graph_http.post(f"{server}/v19.0/123/messages", json={"x": 1}).status_code == 200
+    ports = {port for _, _, port in _Handler.log}
+    assert len(_Handler.log) == 5 and len(ports) == 1
+
+
+def test_get_is_retried_but_post_is_not(server, monkeypatch):
+    _Handler.fail_first = 1
+    assert graph_http.get(f"{server}/v19.0/555").status_code == 200
+    assert [m for m, _, _ in _Handler.log] == ["GET", "GET"]
+
+    _Handler.log.clear()
+    _Handler.fail_first = 1
+    assert graph_http.post(f"{server}/v19.0/123/messages", json={}).status_code == 503
+    assert [m for m, _, _ in _Handler.log] == ["POST"]
+
+
+def test_endpoint_labels_hide_ids():
+    ep = graph_http._endpoint
+    assert ep("POST", graph_http.graph_url("1234567/messages")) == "POST /{id}/messages"
+    assert ep("GET", graph_http.graph_url("me")) == "GET /me"
+    assert ep("GET", graph_http.graph_url("MEDIA_ID_1")) == "GET /{id}"
+    assert ep("GET", "https://lookaside.fbsbx.com/whatsapp_business/attachments/?mid=1") == \
+        "GET lookaside.fbsbx.com"
+
+
+def test_stats_per_endpoint(server):
+    graph_http.get(f"{server}/v19.0/me")
+    _Handler.fail_first = 3
+    graph_http.post(f"{server}/v19.0/1/messages", json={})
+    eps = graph_http.stats()["endpoints"]
+    host = server.split("//")[1]
+    assert eps[f"GET {host}"]["requests"] == 1 and eps[f"GET {host}"]["errors"] == 0
+    assert eps[f"POST {host}"]["errors"] == 1
@@ -0,0 +1,48 @@
+import pytest
+
+from utils import handover_classifier as hc
+import utils.wants_handover_ai as wh
+
+
+@pytest.fixture
+def llm_calls(monkeypatch):
+    calls = []
+    monkeypatch.setattr(wh, "ask_openai", lambda prompt: calls.append(prompt) or "нет", raising=True)
+    return calls
+
+
+def test_shipped_model_decides_obvious_messages_without_llm(llm_calls):
+    model = hc.get_classifier()
+    assert model is not None and 0 < model.low < model.high < 1
+    assert wh.wants_handover_ai("Сколько стоит выступление?") is True
+    assert wh.wants_handover_ai("У нас будет 12 детей, праздник дома") is False
+    assert wh.wants_handover_ai("15 июня в 16:00") is False
+    assert llm_calls == []
+
+
+def test_ambiguous_band_goes_to_llm(monkeypatch, llm_calls):
+    model = hc.get_classifier()
+    monkeypatch.setattr(model, "low", 0.0)
+    monkeypatch.setattr(model, "high", 1.0)          # всё в полосе сомнений
+    assert wh.wants_handover_ai("Сколько стоит выступление?") is False   # решил фейковый LLM
+    assert len(llm_calls) == 1
+
+
+def test_fit_save_load_roundtrip(tmp_path):
+    texts = ["сколько стоит", "какая цена", "дайте телефон", "позвоните мне",
+             "праздник дома", "будет 10 детей", "в субботу в 12", "день рождения дочки"]
+    labels = [1, 1, 1, 1, 0, 0, 0, 0]
+    model = hc.HandoverClassifier.fit(texts, labels, epochs=30)
+    assert model.proba("а сколько стоит?") > 0.5 > model.proba("праздник в субботу")
+
+    path = tmp_path / "m.json"
+    model.save(str(path))
+    again = hc.HandoverClassifier.load(str(path))
+    assert again.proba("какая цена") == pytest.approx(model.proba("какая цена"), abs=1e-3)
+
+
+def test_calibrate_band_keeps_precision():
+    probs  = [0.01, 0.05, 0.1, 0.3, 0.45, 0.55, 0.7, 0.9, 0.95, 0.99]
+    labels = [0,    0,    0,   1,   0,    1,    0,   1,   1,    1]
+    low, high = hc.calibrate_band(probs, labels, target=1.0)
+    assert (low, high) == (0.1, 0.9)
@@ -0,0 +1,126 @@
+import json, hmac, hashlib, time
+import pytest
+
+import state.state as state
+from utils import inbound_queue as iq
+
+
+@pytest.fixture
+def queue(tmp_path):
+    iq.configure(str(tmp_path / "inbound.db"))
+    yield iq
+    iq.stop_workers()
+    iq.configure()
+
+
+def _wait(cond, timeout=3.0):
+    end = time.time() + timeout
+    while time.time() < end:
+        if cond():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_enqueue_then_workers_drain_in_order(queue):
+    seen = []
+    queue.enqueue_many([("message", {"n": 1}), ("message", {"n": 2}), ("status", {"n": 3})])
+    assert queue.stats()["depth"] == 3
+
+    queue.start_workers(lambda kind, payload: seen.append((kind, payload["n"])))
+    assert _wait(lambda: len(seen) == 3)
+    assert seen == [("message", 1), ("message", 2), ("status", 3)]
+
+    st = queue.stats()
+    assert st["depth"] == 0 and st["in_progress"] == 0
+    assert st["wait_ms"]["max"] >= 0
+
+
+def test_processing_rows_recovered_after_restart(queue):
+    queue.enqueue("message", {"n": 1})
+    rows = queue._claim_batch(1)               # «упали» посреди обработки
+    assert rows and queue.stats()["in_progress"] == 1
+
+    seen = []
+    queue.start_workers(lambda kind, payload: seen.append(payload["n"]))
+    assert _wait(lambda: seen == [1])
+
+
+def test_failing_event_goes_dead_after_max_attempts(queue, monkeypatch):
+    monkeypatch.setattr(queue, "MAX_ATTEMPTS", 2)
+    monkeypatch.setattr(queue, "RETRY_DELAY_SEC", 0)
+    queue.enqueue("message", {"n": 1})
+    calls = []
+
+    def boom(kind, payload):
+        calls.append(payload["n"])
+        raise RuntimeError("boom")
+
+    queue.start_workers(boom)
+    assert _wait(lambda: queue.stats()["dead"] == 1)
+    assert queue.stats()["depth"] == 0 and calls == [1, 1]
+
+
+def test_retry_runs_before_the_same_users_later_events(queue, monkeypatch):
+    monkeypatch.setattr(queue, "RETRY_DELAY_SEC", 0)
+    queue.enqueue_many([("message", {"n": 1}), ("message", {"n": 2})])
+    retried = queue.stats()["total_retried"]
+    seen = []
+
+    def flaky(kind, payload):
+        seen.append(payload["n"])
+        if seen == [1]:
+            raise RuntimeError("временный сбой")
+
+    queue.start_workers(flaky, key_fn=lambda k, p: "7701")
+    assert _wait(lambda: len(seen) == 3)
+    assert seen == [1, 1, 2]
+    assert queue.stats()["total_retried"] == retried + 1 and queue.stats()["dead"] == 0
+
+
+def test_event_that_already_reached_the_client_is_not_retried(queue, monkeypatch):
+    import utils.telegram_alert as telegram_alert
+    monkeypatch.setattr(queue, "RETRY_DELAY_SEC", 0)
+    alerts = []
+    monkeypatch.setattr(telegram_alert, "send_telegram_alert", alerts.append)
+    queue.enqueue("message", {"n": 1})
+    calls = []
+
+    def sent_then_failed(kind, payload):
+        calls.append(payload["n"])
+        state.note_external_effect()            # ответ клиенту уже ушёл
+        raise RuntimeError("boom")
+
+    queue.start_workers(sent_then_failed)
+    assert _wait(lambda: queue.stats()["dead"] == 1)
+    assert calls == [1]
+    assert len(alerts) == 1 and "не повторяем" in alerts[0]
+
+
+def test_webhook_acks_and_defers_to_queue(client, queue, monkeypatch):
+    import routes.webhook_route as wh
+    calls = []
+    monkeypatch.setattr(wh, "handle_message", lambda *a, **k: calls.append(a))
+    wh.start_inbound_workers()
+
+    body = {"object": "whatsapp_business_account", "entry": [{"changes": [{"value": {
+        "metadata": {"phone_number_id": "123456", "display_phone_number": "7000"},
+        "contacts": [],
+        "messages": [{"from": "71234567890", "id": "wamid.Q", "type": "text", "text": {"body": "привет"}}],
+    }}]}]}
+    raw = json.dumps(body, ensure_ascii=False).encode("utf-8")
+    sig = "sha256=" + hmac.new(b"shhh", raw, hashlib.sha256).hexdigest()
+
+    resp = client.post("/webhook", data=raw, headers={
+        "Content-Type": "application/json", "X-Hub-Signature-256": sig})
+    assert resp.status_code == 200
+    assert _wait(lambda: len(calls) == 1)
+    assert calls[0][0]["id"] == "wamid.Q" and calls[0][1] == "123456"
+
+
+def test_delayed_event_waits_for_its_time(queue):
+    queue.enqueue("turn_retry", {"n": 1}, delay=60)
+    queue.enqueue("message", {"n": 2})
+    assert [json.loads(r[2])["n"] for r in queue._claim_batch(10)] == [2]
+    queue._db().execute("UPDATE inbound_events SET not_before=0")
+    assert [json.loads(r[2])["n"] for r in queue._claim_batch(10)] == [1]
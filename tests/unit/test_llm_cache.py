@@ -0,0 +1,93 @@
+from types import SimpleNamespace
+
+import pytest
+
+import utils.ask_openai as ao
+from utils import llm_cache, llm_limiter
+
+
+class FakeClient:
+    def __init__(self, answer="Привет!"):
+        self.calls = 0
+        self.answer = answer
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, **kw):
+        self.calls += 1
+        if isinstance(self.answer, Exception):
+            raise self.answer
+        msg = SimpleNamespace(content=f"{self.answer} #{self.calls}")
+        return SimpleNamespace(choices=[SimpleNamespace(message=msg)],
+                               usage=SimpleNamespace(total_tokens=10))
+
+
+@pytest.fixture
+def client(monkeypatch):
+    llm_cache.clear()
+    fake = FakeClient()
+    monkeypatch.setattr(ao, "get_client", lambda: fake)
+    yield fake
+    llm_cache.clear()
+
+
+def test_identical_requests_hit_cache(client):
+    with llm_cache.policy(60, site="t"):
+        a = ao.ask_openai("одинаковый промпт")
+        b = ao.ask_openai("одинаковый промпт")
+        c = ao.ask_openai("одинаковый промпт", max_tokens=50)    # другой ключ
+    assert a == b == "Привет! #1"
+    assert c == "Привет! #2"
+    assert client.calls == 2
+    assert llm_cache.stats()["sites"]["t"] == {"hit_mem": 1, "hit_disk": 0, "miss": 2, "store": 2}
+
+
+def test_ttl_zero_and_expiry(client, monkeypatch):
+    with llm_cache.policy(0, site="off"):
+        ao.ask_openai("p")
+        ao.ask_openai("p")
+    assert client.calls == 2
+
+    now = [1000.0]
+    monkeypatch.setattr(llm_cache.time, "time", lambda: now[0])
+    with llm_cache.policy(10, site="short"):
+        ao.ask_openai("q")
+        now[0] += 11
+        ao.ask_openai("q")
+    assert client.calls == 4
+
+
+def test_calls_without_policy_are_not_cached(client):
+    assert ao.ask_openai("ответ клиенту") == "Привет! #1"
+    assert ao.ask_openai("ответ клиенту") == "Привет! #2"
+    assert llm_cache.stats()["size"] == 0
+
+
+def test_slot_extraction_is_cached(client):
+    from utils.slot_extraction import extract_slots
+    client.answer = '{"fields": {}, "event_date_iso": null, "event_time_24": null}'
+    for _ in range(2):
+        extract_slots("привет", "привет", {"celebrant_name": "имя"}, ao.ask_openai, with_datetime=False)
+    assert client.calls == 1
+    assert llm_cache.stats()["sites"]["slot_extraction"]["hit_mem"] == 1
+
+
+def test_errors_are_not_cached(client):
+    client.answer = RuntimeError("boom")
+    with llm_cache.policy(60):
+        with pytest.raises(llm_limiter.LLMUnavailable):
+            ao.ask_openai("x")
+        client.answer = "ok"
+        assert ao.ask_openai("x") == "ok #2"
+
+
+def test_disk_tier_survives_memory_loss(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(llm_cache, "LLM_CACHE_DB", str(tmp_path / "llm.db"))
+    monkeypatch.setattr(llm_cache, "_db", None)
+    with llm_cache.policy(60, site="disk"):
+        first = ao.ask_openai("холодный старт")
+        llm_cache._mem.clear()
+        assert ao.ask_openai("холодный старт") == first
+    assert client.calls == 1
+    assert llm_cache.stats()["sites"]["disk"]["hit_disk"] == 1
+    llm_cache._db.close()
+    monkeypatch.setattr(llm_cache, "_db", None)
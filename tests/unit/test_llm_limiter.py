@@ -0,0 +1,180 @@
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+import state.state as state
+import utils.ask_openai as ao
+from utils import llm_cache, llm_limiter
+from utils.llm_limiter import LLMLimiter, LIVE, REMINDER, BACKGROUND
+
+
+def test_live_turn_overtakes_queued_reminders():
+    lim = LLMLimiter(rpm=10_000, tpm=10_000_000, max_concurrency=1)
+    order = []
+    lim.acquire(10, LIVE)                                   # единственный слот занят
+
+    def worker(cls, name):
+        with lim.slot(10, cls):
+            order.append(name)
+
+    threads = [threading.Thread(target=worker, args=(REMINDER, "reminder")),
+               threading.Thread(target=worker, args=(BACKGROUND, "background"))]
+    for t in threads:
+        t.start()
+    time.sleep(0.05)
+    live = threading.Thread(target=worker, args=(LIVE, "live"))
+    live.start()
+    time.sleep(0.05)
+    assert lim.stats()["queued"] == {"live": 1, "handover": 0, "reminder": 1, "background": 1}
+
+    lim.release(10)
+    for t in threads + [live]:
+        t.join(2)
+    assert order == ["live", "reminder", "background"]
+    assert lim.stats()["wait"]["reminder"]["n"] == 1
+
+
+def test_token_bucket_delays_when_tpm_is_spent():
+    lim = LLMLimiter(rpm=10_000, tpm=600, max_concurrency=4)  # 10 токенов в секунду
+    assert lim.acquire(600) < 0.05
+    lim.release(600)
+    waited = lim.acquire(3)
+    assert 0.2 < waited < 1.0
+
+
+def test_wait_is_capped_by_turn_deadline_after_429_pause():
+    from utils import deadline as turn_deadline
+    lim = LLMLimiter(rpm=10_000, tpm=10_000_000, max_concurrency=4)
+    lim._paused_until = time.monotonic() + 30                # как после penalize() на 429
+    t0 = time.monotonic()
+    with turn_deadline.scope(turn_deadline.Deadline(budget=0.2)), pytest.raises(llm_limiter.LLMRateLimited):
+        lim.acquire(10)
+    assert time.monotonic() - t0 < 1.0
+    st = lim.stats()
+    assert st["timed_out"] == 1 and st["queued"]["live"] == 0 and st["active"] == 0
+
+
+def test_timed_out_waiter_leaves_the_queue_to_others():
+    lim = LLMLimiter(rpm=10_000, tpm=10_000_000, max_concurrency=1)
+    lim.acquire(10)
+    with pytest.raises(llm_limiter.LLMRateLimited):
+        lim.acquire(10, timeout=0.05)
+    lim.release(10)
+    assert lim.acquire(10, timeout=0.05) < 0.05
+
+
+def _rate_limit_error(headers):
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    return openai.RateLimitError("rate limited", response=httpx.Response(429, headers=headers, request=request),
+                                 body=None)
+
+
+@pytest.fixture
+def fake_openai(monkeypatch):
+    monkeypatch.setattr(llm_limiter, "limiter", LLMLimiter())
+    monkeypatch.setattr(llm_limiter, "LLM_BACKOFF_BASE_SEC", 0.01)
+    monkeypatch.setattr(llm_limiter, "LLM_RATE_RETRIES", 2)
+    calls = []
+
+    def install(*outcomes):
+        def create(**kw):
+            calls.append(time.monotonic())
+            out = outcomes[min(len(calls), len(outcomes)) - 1]
+            if isinstance(out, Exception):
+                raise out
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=out))],
+                                   usage=SimpleNamespace(total_tokens=5))
+        monkeypatch.setattr(ao, "get_client", lambda: SimpleNamespace(
+            chat=SimpleNamespace(completions=SimpleNamespace(create=create))))
+        return calls
+    return install
+
+
+def test_rate_limit_is_retried_after_retry_after(fake_openai):
+    calls = fake_openai(_rate_limit_error({"retry-after-ms": "150"}), "готово")
+    with llm_cache.policy(0):
+        assert ao.ask_openai("привет") == "готово"
+    assert len(calls) == 2 and calls[1] - calls[0] >= 0.14
+    assert llm_limiter.limiter.stats()["rate_limited"] == 1
+
+
+def test_exhausted_retries_raise_instead_of_texting_the_client(fake_openai):
+    calls = fake_openai(_rate_limit_error({}))
+    with llm_cache.policy(0), pytest.raises(llm_limiter.LLMRateLimited):
+        ao.ask_openai("привет")
+    assert len(calls) == 3
+    assert llm_limiter.limiter.stats()["gave_up"] == 1
+
+
+def test_queue_timeout_reaches_caller_as_rate_limit(fake_openai):
+    from utils import deadline as turn_deadline
+    calls = fake_openai("готово")
+    llm_limiter.limiter._paused_until = time.monotonic() + 30
+    with llm_cache.policy(0), turn_deadline.scope(turn_deadline.Deadline(budget=0.1)), \
+            pytest.raises(llm_limiter.LLMRateLimited):
+        ao.ask_openai("привет")
+    assert calls == []
+
+
+@pytest.fixture
+def limited_turn(tmp_path, monkeypatch):
+    """Ход, в котором ask_openai упирается в лимит; effect=True — до этого клиенту ушёл ответ."""
+    import utils.incoming_message as im
+    from utils import inbound_queue
+    inbound_queue.configure(str(tmp_path / "inbound.db"))
+    sent = []
+    monkeypatch.setattr(im.outgoing, "send_text_message", lambda *a: sent.append(a))
+
+    def run(effect, route=None):
+        def limited(text, uid, client_name=None):
+            state.update_state(uid, {"availability_reply_sent": True})
+            if effect:
+                state.note_external_effect()
+            raise llm_limiter.LLMRateLimited("429")
+        monkeypatch.setattr(im, "route_message", route or limited)
+        state.user_states.pop("7701", None)
+        im._route_turn("на 15 июня", "7701", "PNID", "Мария", parts=1)
+        return state.get_state("7701") or {}
+
+    yield SimpleNamespace(run=run, queue=inbound_queue, sent=sent)
+    inbound_queue.configure()
+
+
+def test_limited_turn_without_effects_is_replayed_through_queue(limited_turn):
+    st = limited_turn.run(effect=False)
+    assert "availability_reply_sent" not in st                    # откатили
+    rows = limited_turn.queue._db().execute(
+        "SELECT kind, payload, not_before - enqueued_at FROM inbound_events").fetchall()
+    assert [(r[0], r[2] > 0) for r in rows] == [("turn_retry", True)]
+    assert '"user": "7701"' in rows[0][1] and limited_turn.sent == []
+
+
+def test_limited_turn_after_reply_is_kept_and_not_replayed(limited_turn):
+    st = limited_turn.run(effect=True)
+    assert st["availability_reply_sent"] is True                  # повтор не отправит ответ второй раз
+    assert limited_turn.queue.stats()["depth"] == 0
+
+
+def test_rate_limited_block2_classification_is_retried_not_counted(limited_turn, monkeypatch):
+    import blocks.block_02 as b2
+    import utils.wants_handover_ai as wh
+
+    def limited(*a, **kw):
+        raise llm_limiter.LLMRateLimited("429")
+    monkeypatch.setattr(b2, "ask_openai", limited)
+    monkeypatch.setattr(wh, "ask_openai", limited)
+    monkeypatch.setitem(sys.modules, "state.state", state)
+
+    def route(text, uid, client_name=None):
+        state.update_state(uid, {"stage": "block2", "uninformative_replies": 1})
+        b2.handle_block2_user_reply("ну даже не знаю", uid, lambda *a: None)
+
+    st = limited_turn.run(effect=False, route=route)
+    assert "show_type" not in st and "uninformative_replies" not in st
+    kinds = [r[0] for r in limited_turn.queue._db().execute("SELECT kind FROM inbound_events")]
+    assert kinds == ["turn_retry"]
@@ -0,0 +1,130 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from utils import outbound_queue as oq, delivery_status
+
+
+def _resp(status=200, body=None, headers=None):
+    body = body if body is not None else {"messages": [{"id": "wamid.X"}]}
+    return SimpleNamespace(status_code=status, json=lambda: body, headers=headers or {}, text=str(body))
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    mps = oq.MPS
+    oq.configure(str(tmp_path / "outbound.db"), mps=1000)
+    delivery_status.configure(str(tmp_path / "delivery.db"))
+    monkeypatch.setattr(oq, "BACKOFF_BASE_SEC", 0.05)
+    monkeypatch.setattr(oq, "_counters", {k: 0 for k in oq._counters})
+    yield oq
+    oq.stop_workers()
+    oq.configure(mps=mps)
+    delivery_status.configure()
+
+
+@pytest.fixture
+def graph(monkeypatch):
+    """Фейковый Graph API: scripted[(to, body)] — список ответов по очереди, дальше 200."""
+    sent, scripted = [], {}
+
+    def deliver(phone_id, payload):
+        key = (payload["to"], payload.get("text", {}).get("body"))
+        sent.append(key)
+        answers = scripted.get(key)
+        return answers.pop(0) if answers else _resp()
+
+    monkeypatch.setattr(oq, "_deliver", deliver)
+    return SimpleNamespace(sent=sent, scripted=scripted)
+
+
+def _text(to, body):
+    return {"messaging_product": "whatsapp", "to": to, "type": "text", "text": {"body": body}}
+
+
+def _wait(cond, timeout=3.0):
+    end = time.time() + timeout
+    while time.time() < end:
+        if cond():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_retry_keeps_recipient_order_and_others_go_ahead(queue, graph):
+    graph.scripted[("A", "a1")] = [_resp(503), _resp(503)]
+    queue.start_workers()
+    for to, body in [("A", "a1"), ("A", "a2"), ("B", "b1")]:
+        assert queue.send(_text(to, body)).status_code == 202
+
+    assert _wait(lambda: queue.stats()["total_sent"] == 3)
+    a_sends = [b for to, b in graph.sent if to == "A"]
+    assert a_sends == ["a1", "a1", "a1", "a2"]           # a2 ждал, пока a1 не ушёл
+    assert graph.sent.index(("B", "b1")) < graph.sent.index(("A", "a2"))
+    assert queue.stats()["total_retried"] == 2
+
+
+def test_throughput_error_is_retried(queue, graph):
+    graph.scripted[("A", "x")] = [_resp(400, {"error": {"code": 130429, "message": "throughput"}})]
+    queue.start_workers()
+    queue.send(_text("A", "x"))
+    assert _wait(lambda: queue.stats()["total_sent"] == 1)
+    assert graph.sent == [("A", "x"), ("A", "x")]
+
+
+def test_bad_request_goes_to_dead_letters_and_can_be_requeued(queue, graph):
+    graph.scripted[("A", "bad")] = [_resp(400, {"error": {"code": 100, "message": "Invalid parameter"}})]
+    queue.start_workers()
+    queue.send(_text("A", "bad"))
+    queue.send(_text("A", "next"))
+    assert _wait(lambda: queue.stats()["total_sent"] == 1)
+
+    dead = queue.dead_letters()
+    assert [d["payload"]["text"]["body"] for d in dead] == ["bad"]
+    assert "Invalid parameter" in dead[0]["error"]
+    assert graph.sent == [("A", "bad"), ("A", "next")]
+
+    assert queue.requeue_dead() == 1
+    assert _wait(lambda: queue.stats()["total_sent"] == 2)
+    assert queue.stats()["dead"] == 0
+
+
+def test_retries_exhausted_go_dead(queue, graph, monkeypatch):
+    monkeypatch.setattr(queue, "MAX_ATTEMPTS", 2)
+    graph.scripted[("A", "x")] = [_resp(500), _resp(500)]
+    queue.start_workers()
+    queue.send(_text("A", "x"))
+    assert _wait(lambda: queue.stats()["dead"] == 1)
+    assert len(graph.sent) == 2
+
+
+def test_without_workers_sends_inline(queue, graph):
+    resp = queue.send(_text("A", "sync"))
+    assert resp.status_code == 200
+    assert graph.sent == [("A", "sync")]
+    assert queue.stats()["depth"] == 0
+
+
+def test_bucket_paces_sends():
+    bucket = oq._Bucket(20)
+    t0 = time.monotonic()
+    for _ in range(25):                     # 20 в запасе, ещё 5 — по 1/20 с
+        bucket.take()
+    assert time.monotonic() - t0 >= 0.2
+
+
+def test_send_now_waits_for_graph_and_retries_throttling(queue, graph, monkeypatch):
+    monkeypatch.setattr(oq, "NOW_MAX_WAIT_SEC", 0.01)
+    graph.scripted[("OWNER", "resume")] = [_resp(429)]
+    queue.start_workers()                                   # даже при запущенной очереди — мимо неё
+    resp = queue.send_now(_text("OWNER", "resume"))
+    assert resp.status_code == 200
+    assert graph.sent == [("OWNER", "resume"), ("OWNER", "resume")]
+    assert queue.stats()["total_enqueued"] == 0
+
+
+def test_send_now_returns_the_rejection(queue, graph):
+    graph.scripted[("OWNER", "bad")] = [_resp(400, {"error": {"code": 132000, "message": "template"}})]
+    assert queue.send_now(_text("OWNER", "bad")).status_code == 400
+    assert graph.sent == [("OWNER", "bad")]
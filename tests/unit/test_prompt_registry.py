@@ -0,0 +1,64 @@
+import os
+
+from utils.prompt_registry import PromptRegistry, registry
+
+
+def _write(path, text, mtime):
+    path.write_text(text, encoding="utf-8")
+    os.utime(path, (mtime, mtime))
+
+
+def test_all_repo_prompts_load_and_render_like_str_format():
+    assert "global_prompt" in registry.stats()
+    kw = dict(message_text="день рождения", date_iso="2025-09-03", time_24="15:00",
+              client_request_date="2025-08-01", availability="свободно", previous_description="",
+              fields_spec="- \"guests_count\": количество гостей", today="01 August 2025", current_year=2025,
+              combined_text="день рождения")
+    for name, info in registry.stats().items():
+        path = f"prompts/{name}.txt"
+        raw = open(path, encoding="utf-8").read()
+        assert registry.get(path) == raw
+        if info["fields"]:
+            assert registry.render(path, **kw) == raw.format(**kw)
+
+
+def test_render_counts_sizes_and_bad_input(tmp_path):
+    _write(tmp_path / "greet.txt", "Привет, {name}! {{литерал}}", 1000)
+    _write(tmp_path / "json.txt", 'Ответь JSON: {"a": 1}', 1000)
+    reg = PromptRegistry(str(tmp_path), check_sec=0)
+    assert reg.load_all() == 2
+
+    assert reg.render("greet", name="Аня") == "Привет, Аня! {литерал}"
+    assert reg.render(str(tmp_path / "greet.txt")) == "Привет, {name}! {{литерал}}"   # нет поля — сырой текст
+    assert reg.get("json") == 'Ответь JSON: {"a": 1}'                             # не шаблон — не ошибка
+
+    st = reg.stats()
+    assert st["greet"]["renders"] == 2 and st["greet"]["render_errors"] == 1
+    assert st["greet"]["fields"] == ["name"]
+    assert st["json"]["template_ok"] is False and st["json"]["gets"] == 1
+
+
+def test_hot_reload_on_mtime_change(tmp_path):
+    path = tmp_path / "p.txt"
+    _write(path, "версия 1", 1000)
+    reg = PromptRegistry(str(tmp_path), check_sec=0)
+    reg.load_all()
+    assert reg.get("p") == "версия 1"
+
+    _write(path, "версия {n}", 2000)
+    assert reg.render("p", n=2) == "версия 2"
+    assert reg.stats()["p"]["reloads"] == 1
+
+    path.unlink()
+    assert reg.get("p") == "версия {n}"            # файл пропал — держим последнюю версию
+
+
+def test_block2_reads_prompts_at_call_time(monkeypatch):
+    import blocks.block_02 as b2
+    texts = {b2.GLOBAL_PROMPT_PATH: "G1", b2.STAGE_PROMPT_PATH: "S1"}
+    monkeypatch.setattr(b2, "load_prompt", texts.get)
+    assert b2._stage_prompt() == "G1\n\nS1"
+
+    texts[b2.STAGE_PROMPT_PATH] = "S2"                 # промпт поправили на проде
+    assert b2._stage_prompt() == "G1\n\nS2"
+    assert not hasattr(b2, "stage_prompt")
@@ -123,6 +123,7 @@ def test_block2_clarification_schedules_r1_for_uninformative(monkeypatch, state_
     install_fake_router(monkeypatch, calls)
     install_state_api(monkeypatch, b2, state_store)
     patch_llm(monkeypatch, b2, text="clarify")
+    monkeypatch.setattr(b2, "wants_handover_ai", lambda t: False, raising=True)
 
     uid = "u_uninf"
     state_store[uid] = {}
@@ -148,6 +149,7 @@ def test_block2_clarification_schedules_r1_for_unknown(monkeypatch, state_store)
     def llm_return_unknown(prompt: str):
         return "неизвестно"
     monkeypatch.setattr(b2, "ask_openai", llm_return_unknown, raising=True)
+    monkeypatch.setattr(b2, "wants_handover_ai", lambda t: False, raising=True)
 
     uid = "u_unknown"
     state_store[uid] = {}
@@ -170,6 +172,7 @@ def test_block2_handover_stops_reminders_after_third_try(monkeypatch, state_stor
     install_state_api(monkeypatch, b2, state_store)
     # Всегда 'неизвестно' → на 3-й раз хендовер
     monkeypatch.setattr(b2, "ask_openai", lambda p: "неизвестно", raising=True)
+    monkeypatch.setattr(b2, "wants_handover_ai", lambda t: False, raising=True)
 
     uid = "u3"
     state_store[uid] = {}
@@ -309,6 +312,7 @@ def test_block2_any_user_reply_cancels_timers(monkeypatch, state_store):
     plan_spy = PlanSpy(monkeypatch)
     b2 = import_module("blocks.block_02")
     plan_spy.patch_into_module(monkeypatch, b2)
+    patch_llm(monkeypatch, b2, text="Напоминаю о себе — расскажите о празднике?")
 
     calls = []
     install_fake_router(monkeypatch, calls)
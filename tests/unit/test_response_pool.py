@@ -0,0 +1,71 @@
+import itertools
+from types import SimpleNamespace
+
+import pytest
+
+import utils.ask_openai as ao
+from utils import llm_cache, response_pool
+
+
+@pytest.fixture
+def pool(monkeypatch, tmp_path):
+    monkeypatch.setattr(response_pool, "RESPONSE_POOL_PATH", str(tmp_path / "pools.json"))
+    monkeypatch.setattr(response_pool, "_pools", None)
+    monkeypatch.setattr(response_pool, "_builders", {})
+    monkeypatch.setattr(response_pool, "_counters", dict.fromkeys(response_pool._counters, 0))
+    return response_pool
+
+
+def test_fill_keeps_only_vetted_variants_and_pick_serves_them(pool, monkeypatch):
+    replies = itertools.cycle([
+        "Здравствуйте! Напомню о себе — расскажите о празднике?",
+        "Хорошо!",                                                # слишком короткий
+        "Здравствуйте,  напомню о себе — расскажите о празднике?",  # повтор
+        "Привет, [Имя]! Как дела с праздником?",                  # недозаполненный шаблон
+        "Добрый день! Подскажите, удалось ли подумать о шоу?",
+    ])
+    monkeypatch.setattr(pool, "ask_openai", lambda prompt: next(replies))
+    pool.register("reminder", lambda: "промпт напоминания")
+
+    assert pool.pick("reminder") is None                        # пул пуст — блок спросит модель
+    assert pool.fill("reminder", size=2) == 2
+    assert pool.pick("reminder") in {
+        "Здравствуйте! Напомню о себе — расскажите о празднике?",
+        "Добрый день! Подскажите, удалось ли подумать о шоу?",
+    }
+    st = pool.stats()
+    assert st["sizes"] == {"reminder": 2} and st["rejected"] == 3 and st["hits"] == 1
+
+
+def test_edited_prompt_gets_a_new_pool_and_stale_one_is_dropped(pool, monkeypatch):
+    counter = itertools.count()
+    monkeypatch.setattr(pool, "ask_openai", lambda prompt: f"Вариант ответа номер {next(counter)} для клиента")
+    text = {"v": "версия 1"}
+    pool.register("intro", lambda: text["v"])
+    pool.fill_all(size=2)
+    text["v"] = "версия 2"
+    assert pool.pick("intro") is None
+    pool.fill_all(size=2)
+    assert list(pool._load()) == [pool.prompt_key("версия 2")]
+
+    monkeypatch.setattr(pool, "_pools", None)                    # перечитываем с диска
+    assert pool.pick("intro").startswith("Вариант ответа")
+
+
+def test_sampling_changes_temperature_and_cache_key(monkeypatch):
+    seen = []
+
+    def create(**kw):
+        seen.append(kw["temperature"])
+        msg = SimpleNamespace(content=f"ответ {len(seen)}")
+        return SimpleNamespace(choices=[SimpleNamespace(message=msg)], usage=SimpleNamespace(total_tokens=1))
+
+    monkeypatch.setattr(ao, "get_client", lambda: SimpleNamespace(
+        chat=SimpleNamespace(completions=SimpleNamespace(create=create))))
+    llm_cache.clear()
+    with llm_cache.policy(60, site="t"):
+        ao.ask_openai("одинаковый промпт")
+        with ao.sampling(0.9):
+            ao.ask_openai("одинаковый промпт")
+    assert seen == [0.0, 0.9]
+    llm_cache.clear()
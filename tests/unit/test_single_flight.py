@@ -0,0 +1,68 @@
+import threading
+import time
+
+import pytest
+
+from utils.single_flight import SingleFlight
+
+
+def _run_concurrently(n, target):
+    results, threads = [None] * n, []
+    for i in range(n):
+        def run(i=i):
+            try:
+                results[i] = target()
+            except Exception as e:
+                results[i] = e
+        threads.append(threading.Thread(target=run))
+    for t in threads:
+        t.start()
+    return results, threads
+
+
+def _wait_for(cond, timeout=2.0):
+    deadline = time.time() + timeout
+    while not cond():
+        assert time.time() < deadline, "не дождались"
+        time.sleep(0.005)
+
+
+def test_concurrent_identical_calls_share_one_result():
+    sf, release, calls = SingleFlight(), threading.Event(), []
+
+    def slow():
+        calls.append(1)
+        release.wait(2)
+        return "ответ"
+
+    results, threads = _run_concurrently(5, lambda: sf.do("k", slow))
+    _wait_for(lambda: sf.stats()["coalesced"] == 4)
+    assert sf.stats()["in_flight"] == 1
+    release.set()
+    for t in threads:
+        t.join(2)
+
+    assert results == ["ответ"] * 5
+    assert len(calls) == 1
+    assert sf.stats() == {"in_flight": 0, "calls": 1, "coalesced": 4, "errors": 0, "max_waiters": 4}
+    assert sf.do("k", lambda: "новый") == "новый"        # после завершения — снова настоящий вызов
+
+
+def test_leader_error_is_shared_and_not_sticky():
+    sf, release = SingleFlight(), threading.Event()
+
+    def boom():
+        release.wait(2)
+        raise RuntimeError("сбой")
+
+    results, threads = _run_concurrently(3, lambda: sf.do("k", boom))
+    _wait_for(lambda: sf.stats()["coalesced"] == 2)
+    release.set()
+    for t in threads:
+        t.join(2)
+
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert sf.stats()["errors"] == 1
+    with pytest.raises(ValueError):
+        sf.do("k", lambda: (_ for _ in ()).throw(ValueError()))
+    assert sf.do("other", lambda: 42) == 42
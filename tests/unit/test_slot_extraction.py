@@ -0,0 +1,111 @@
+import json
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+import utils.ask_openai as ao
+import utils.date_parser as dp
+import utils.slot_extraction as se
+from utils import llm_cache
+from utils.slot_extraction import extract_slots, parse_structured_pairs
+
+FIELDS = {
+    "celebrant_name": "имя именинника",
+    "guests_count": "количество гостей",
+    "compere_availability": "наличие ведущего",
+}
+
+
+@pytest.fixture(autouse=True)
+def fixed_now(monkeypatch):
+    now = lambda: datetime(2025, 5, 20, 12, 0, tzinfo=dp.TZ)
+    monkeypatch.setattr(dp, "now_local", now)
+    monkeypatch.setattr(se, "now_local", now)
+
+
+def test_single_json_call_gives_fields_date_and_time():
+    prompts = []
+
+    def ask(prompt):
+        prompts.append(prompt)
+        return json.dumps({
+            "fields": {"celebrant_name": "Аня", "guests_count": 12, "compere_availability": "не указано",
+                       "лишний_ключ": "x"},
+            "event_date_iso": "2025-06-15",
+            "event_time_24": "в 16:00",
+        }, ensure_ascii=False)
+
+    slots = extract_slots("15 июня в 16, Ане 7 лет", "15 июня в 16, Ане 7 лет", FIELDS, ask=ask)
+    assert len(prompts) == 1
+    assert '"guests_count": количество гостей' in prompts[0]
+    assert slots["source"] == "json"
+    assert slots["fields"] == {"celebrant_name": "Аня", "guests_count": "12"}
+    assert (slots["date"], slots["time"]) == ("2025-06-15", "16:00")
+
+
+def test_without_datetime_dates_are_ignored():
+    ask = lambda p: '{"fields": {}, "event_date_iso": "2025-06-15", "event_time_24": "16:00"}'
+    slots = extract_slots("x", "x", FIELDS, ask=ask, with_datetime=False)
+    assert slots["date"] is None and slots["time"] is None
+
+
+def test_non_json_reply_falls_back_to_pairs_and_legacy_prompts():
+    prompts = []
+
+    def ask(prompt):
+        prompts.append(prompt)
+        if "нет даты" in prompt:
+            return "2025-09-03"
+        if "нет времени" in prompt:
+            return "нет времени"
+        return "Имя ключевого участника мероприятия (юбиляр) - Олег\nКоличество гостей - не указано"
+
+    slots = extract_slots("юбилей Олега, вечером", "юбилей Олега, вечером", FIELDS, ask=ask)
+    assert len(prompts) == 3
+    assert slots["source"] == "legacy"
+    assert slots["fields"] == {"celebrant_name": "Олег"}
+    assert (slots["date"], slots["time"]) == ("2025-09-03", None)
+
+
+def test_legacy_prompts_only_for_what_local_parser_missed():
+    prompts = []
+
+    def ask(prompt):
+        prompts.append(prompt)
+        return "нет времени" if "нет времени" in prompt else "Имя именинника - Олег"
+
+    slots = extract_slots("юбилей Олега 3 сентября", "юбилей Олега 3 сентября", FIELDS, ask=ask)
+    assert len(prompts) == 2 and "нет даты" not in prompts[1]
+    assert (slots["date"], slots["time"]) == ("2025-09-03", None)
+
+
+def test_model_value_wins_over_disagreeing_local_parse():
+    ask = lambda p: '{"fields": {}, "event_date_iso": "2025-06-21", "event_time_24": null}'
+    slots = extract_slots("в субботу к 5 вечера", "в субботу к 5 вечера", FIELDS, ask=ask)
+    assert (slots["date"], slots["time"]) == ("2025-06-21", "17:00")   # время — локально, модель его не нашла
+
+
+def test_parse_structured_pairs_understands_3a_and_3b_formats():
+    assert parse_structured_pairs("Имя именинника: Витя\nВозраст именинника — 6.") == {
+        "celebrant_name": "Витя", "celebrant_age": "6"}
+    assert parse_structured_pairs("Формат мероприятия - свадьба\nНаличие ведущего - будет\nПол гостей - прочерк") == {
+        "event_format": "свадьба", "compere_availability": "будет"}
+
+
+def test_json_mode_is_sent_to_openai(monkeypatch):
+    seen = []
+
+    def create(**kw):
+        seen.append(kw)
+        msg = SimpleNamespace(content="{}")
+        return SimpleNamespace(choices=[SimpleNamespace(message=msg)], usage=SimpleNamespace(total_tokens=1))
+
+    monkeypatch.setattr(ao, "get_client", lambda: SimpleNamespace(
+        chat=SimpleNamespace(completions=SimpleNamespace(create=create))))
+    with llm_cache.policy(0):
+        with ao.json_mode():
+            ao.ask_openai("верни JSON")
+        ao.ask_openai("просто текст")
+    assert seen[0]["response_format"] == {"type": "json_object"} and seen[0]["max_tokens"] == 400
+    assert "response_format" not in seen[1] and seen[1]["max_tokens"] == 150
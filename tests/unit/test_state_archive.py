@@ -0,0 +1,95 @@
+import time
+import pytest
+
+import state.state as state
+from state import archive as arch
+
+
+@pytest.fixture
+def local_archive(tmp_path):
+    state.user_states.clear()
+    arch.set_archive(arch.LocalArchive(str(tmp_path)))
+    yield tmp_path
+    arch.set_archive(None)
+    state.user_states.clear()
+
+
+def test_finished_and_idle_dialogues_are_archived_and_rehydrated(local_archive):
+    now = time.time()
+    state.update_state("done", {"stage": "block6", "notion_exported": True,
+                                "last_message_ts": now - 2 * 24 * 3600,
+                                "event_description": "длинное описание " * 50})
+    state.update_state("idle", {"stage": "block2", "last_message_ts": now - 40 * 24 * 3600})
+    state.update_state("live", {"stage": "block3a", "last_message_ts": now - 60})
+
+    assert state.archive_dialogues() == 2
+    files = list(local_archive.glob("*.jsonl.gz"))
+    assert len(files) == 1
+    assert dict(state.user_states["done"]) == {state.TOMBSTONE: files[0].name}
+    assert state.users_in_stage("block6") == []                   # из индексов ушли
+    assert state.archive_dialogues() == 0                         # повторно не трогаем
+
+    # клиент написал снова — полная запись на месте
+    st = state.get_state("done")
+    assert st["stage"] == "block6" and st["event_description"].startswith("длинное")
+    assert state.users_in_stage("block6") == ["done"]
+    state.update_state("idle", {"stage": "block2", "last_sender": "user"})
+    assert state.get_state("idle")["last_message_ts"] < now
+    assert state.stats()["archive"]["rehydrated"] >= 2
+
+
+def test_write_during_archiving_keeps_live_record(local_archive, monkeypatch):
+    now = time.time()
+    state.update_state("race", {"stage": "block2", "last_message_ts": now - 40 * 24 * 3600})
+    storage = arch.get_archive()
+    real_write = storage.write
+
+    def write_and_client_replies(records):
+        key = real_write(records)
+        state.update_state("race", {"last_sender": "user", "last_message_ts": time.time()})
+        return key
+
+    monkeypatch.setattr(storage, "write", write_and_client_replies)
+    assert state.archive_dialogues() == 0
+    assert state.get_state("race")["last_sender"] == "user"
+
+
+def test_unavailable_archive_does_not_break_the_turn(local_archive):
+    now = time.time()
+    state.update_state("cold", {"stage": "block2", "client_name": "Мария",
+                                "last_message_ts": now - 40 * 24 * 3600})
+    assert state.archive_dialogues() == 1
+    storage = arch.get_archive()
+
+    arch.set_archive(None)                                        # архив выключили
+    st = state.get_state("cold")
+    assert state.TOMBSTONE in st and st.get("stage") is None      # диалог без истории, без исключения
+    state.update_state("cold", {"last_sender": "user"})
+    assert state.stats()["archive"]["rehydrate_failed"] >= 1
+
+    arch.set_archive(storage)                                     # вернули — история и новое вместе
+    st = state.get_state("cold")
+    assert st["client_name"] == "Мария" and st["last_sender"] == "user"
+    assert state.TOMBSTONE not in st
+
+
+def test_missing_archive_record_is_logged_not_raised(local_archive):
+    state.set_state("lost", {state.TOMBSTONE: "no-such-file.jsonl.gz"})
+    assert dict(state.get_state("lost")) == {state.TOMBSTONE: "no-such-file.jsonl.gz"}
+
+
+def test_archiver_uses_client_activity_and_rechecks_the_live_record(local_archive):
+    now = time.time()
+    month = 40 * 24 * 3600
+    # только приветствие в block1: last_message_ts нет вовсе — всё равно стареет
+    state.update_state("b1", {"stage": "block1", "last_incoming_ts": now - month})
+    # block4 не пишет last_message_ts, но клиент пишет прямо сейчас
+    state.update_state("b4", {"stage": "block4", "last_message_ts": now - month, "last_incoming_ts": now - 30})
+    # индекс отстал от живой записи (клиент ответил, запись ещё не дошла до индекса)
+    state.update_state("lag", {"stage": "block5", "last_incoming_ts": now - month})
+    state.user_states["lag"]["last_incoming_ts"] = now
+
+    assert state.archive_dialogues() == 1
+    assert state.TOMBSTONE in state.user_states["b1"]
+    assert state.TOMBSTONE not in state.user_states["b4"]
+    assert state.TOMBSTONE not in state.user_states["lag"]
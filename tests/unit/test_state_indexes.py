@@ -0,0 +1,87 @@
+import time
+import pytest
+
+import state.state as state
+import utils.reminder_engine as re
+
+
+@pytest.fixture(autouse=True)
+def clean_state():
+    state.user_states.clear()
+    yield
+    state.user_states.clear()
+
+
+def test_stage_index_follows_updates_and_deletes():
+    state.update_state("a", {"stage": "block2"})
+    state.update_state("b", {"stage": "block2"})
+    state.update_state("c", {"stage": "block3a"})
+    assert set(state.users_in_stage("block2")) == {"a", "b"}
+
+    state.update_state("a", {"stage": "block3a"})
+    state.delete_state("c")
+    assert state.users_in_stage("block2") == ["b"]
+    assert state.users_in_stage("block3a") == ["a"]
+
+
+def test_older_than_returns_only_stale_users_oldest_first():
+    now = time.time()
+    state.update_state("old", {"stage": "block2", "last_message_ts": now - 5 * 3600})
+    state.update_state("older", {"stage": "block2", "last_message_ts": now - 9 * 3600})
+    state.update_state("fresh", {"stage": "block2", "last_message_ts": now - 60})
+    state.update_state("other", {"stage": "block3b", "last_message_ts": now - 9 * 3600})
+
+    assert state.users_in_stage("block2", older_than=4 * 3600) == ["older", "old"]
+    assert state.users_idle(4 * 3600) == ["older", "other", "old"]
+
+    state.update_state("old", {"last_message_ts": now})        # клиент ответил
+    assert state.users_in_stage("block2", older_than=4 * 3600) == ["older"]
+
+
+def test_client_writing_in_block3b_is_not_idle(monkeypatch):
+    import sys
+    import utils.incoming_message as inc
+    monkeypatch.setitem(sys.modules, "state.state", state)   # другие тесты подменяют модуль фейком
+    monkeypatch.setattr(inc, "BURST_WINDOW_SEC", 0)
+    monkeypatch.setattr(inc, "route_message", lambda *a, **kw: None)
+    now = time.time()
+    # block3b не пишет last_message_ts: он остался от приветствия в block2 месяц назад
+    state.update_state("b3", {"stage": "block3b", "last_message_ts": now - 30 * 24 * 3600,
+                              "last_incoming_ts": now - 30 * 24 * 3600})
+    assert state.users_idle(4 * 3600) == ["b3"]
+
+    inc.process_text_message("нас будет 20 человек", "b3", "PNID", "Иван", meta_message_id="wamid.b3")
+    assert state.users_idle(4 * 3600) == []
+    assert state.users_in_stage("block3b", older_than=4 * 3600) == []
+
+
+def test_flag_and_reason_indexes_and_transaction_commit():
+    with state.transaction("h"):
+        state.update_state("h", {"handover_reason": "asked_handover"})
+        assert state.users_where("handover_reason", "asked_handover") == set()   # до коммита не видно
+    state.update_state("n", {"notion_export_error": True, "arseniy_notified": True})
+    assert state.users_where("handover_reason", "asked_handover") == {"h"}
+    assert state.users_where("notion_export_error", True) == {"n"}
+    assert state.users_where("arseniy_notified", True) == {"n"}
+    with pytest.raises(KeyError):
+        state.users_where("client_name", "Max")
+
+
+def test_reminder_job_index_used_for_cancel(monkeypatch):
+    removed = []
+    monkeypatch.setattr(re.sched, "add_job", lambda *a, **k: None)
+    monkeypatch.setattr(re.sched, "remove_job", lambda job_id: removed.append(job_id))
+    monkeypatch.setattr(re.sched, "get_jobs", lambda: pytest.fail("полный обход задач"))
+
+    re.plan("u1", "blocks.block_02:send_first_reminder_if_silent", 3600)
+    re.plan("u1", "blocks.block_02:finalize_if_still_silent", 7200)
+    re.plan("u2", "blocks.block_02:finalize_if_still_silent", 7200)
+    assert re.user_jobs("u1") == ["u1:blocks.block_02.finalize_if_still_silent",
+                                  "u1:blocks.block_02.send_first_reminder_if_silent"]
+
+    removed.clear()
+    assert re.cancel_user_jobs("u1") == 2
+    assert len(removed) == 2 and re.user_jobs("u1") == []
+    assert re.user_jobs("u2") == ["u2:blocks.block_02.finalize_if_still_silent"]
+    re.remove_job("u2:blocks.block_02:finalize_if_still_silent")
+    assert not {"u1", "u2"} & {j.split(":")[0] for j in re.all_job_ids()}
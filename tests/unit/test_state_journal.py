@@ -0,0 +1,97 @@
+import os, time, threading
+
+import state.state as state
+from state.journal import JournalStateStore
+
+
+def _store(tmp_path):
+    return JournalStateStore(str(tmp_path), start_compactor=False)
+
+
+def test_restart_replays_journal_tail(tmp_path):
+    js = _store(tmp_path)
+    js.write_batch({"u1": {"stage": "block2"}, "u2": {"stage": "block3a"}}, set())
+    js.write_batch({"u1": {"stage": "block3b"}}, {"u2"})
+    assert js.counters["fsyncs"] == 2
+    js.close()
+
+    js = _store(tmp_path)
+    assert js.load("u1") == {"stage": "block3b"}
+    assert js.load("u2") is None
+
+
+def test_compaction_snapshot_is_lazy_and_journal_truncated(tmp_path):
+    js = _store(tmp_path)
+    js.write_batch({f"u{i}": {"stage": "block2", "n": i} for i in range(1000)}, set())
+    assert js.compact() == 1000
+    assert os.path.getsize(js.journal_path) == 0
+    js.write_batch({"u5": {"stage": "block5"}}, {"u6"})
+    js.close()
+
+    js = _store(tmp_path)
+    assert js.stats()["snapshot_entries"] == 1000
+    assert js.counters["lazy_loads"] == 0                 # ничего не декодировали на старте
+    assert js.load("u7") == {"stage": "block2", "n": 7}
+    assert js.load("u5") == {"stage": "block5"}           # хвост журнала поверх снапшота
+    assert js.load("u6") is None
+    assert js.compact() == 999
+
+
+def test_torn_tail_is_dropped_on_replay(tmp_path):
+    js = _store(tmp_path)
+    js.write_batch({"ok": {"stage": "block2"}}, set())
+    js.close()
+    with open(os.path.join(tmp_path, "journal.log"), "ab") as f:
+        f.write(b"\x40\x00\x00\x00garbage")                # упали посреди записи
+
+    js = _store(tmp_path)
+    assert js.load("ok") == {"stage": "block2"}
+    js.write_batch({"after": {"stage": "block3a"}}, set())
+    js.close()
+    assert _store(tmp_path).load("after") == {"stage": "block3a"}
+
+
+def test_state_module_on_journal_backend(tmp_path):
+    state.configure("journal", str(tmp_path))
+    try:
+        state.update_state("j1", {"stage": "block4"})
+        state.flush()
+        state.configure("journal", str(tmp_path))
+        assert state.get_state("j1") == {"stage": "block4"}
+    finally:
+        state.configure("memory")
+
+
+def test_iter_all_releases_the_lock_between_batches(tmp_path):
+    js = _store(tmp_path)
+    js.write_batch({f"s{i}": {"stage": "block2", "n": i} for i in range(10)}, set())
+    js.compact()
+    js.write_batch({"s3": {"stage": "block5"}}, {"s4"})
+
+    scan = js.iter_all(batch=4)
+    first = [next(scan) for _ in range(4)]
+    writer = threading.Thread(target=js.write_batch, args=({"late": {"stage": "block2"}}, set()))
+    writer.start()
+    writer.join(1)
+    assert not writer.is_alive()                          # скан посреди пачек не держит замок
+
+    everything = dict(first + list(scan))
+    assert len(everything) == 9 and "s4" not in everything
+    assert everything["s3"] == {"stage": "block5"} and everything["s7"] == {"stage": "block2", "n": 7}
+    js.close()
+
+
+def test_index_rebuild_on_restart_keeps_live_entries(tmp_path):
+    state.configure("journal", str(tmp_path))
+    try:
+        now = time.time()
+        for i in range(5):
+            state.update_state(f"r{i}", {"stage": "block2", "last_message_ts": now - (i + 1) * 3600})
+        state.flush()
+        state.configure("journal", str(tmp_path))
+        state.update_state("r0", {"stage": "block3a"})         # живая запись до пересборки
+        assert state.rebuild_indexes(batch=2) == 5
+        assert state.users_in_stage("block2", older_than=1800) == ["r4", "r3", "r2", "r1"]
+        assert state.users_in_stage("block3a") == ["r0"]
+    finally:
+        state.configure("memory")
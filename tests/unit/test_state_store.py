@@ -0,0 +1,190 @@
+import pytest
+
+import state.state as state
+
+
+@pytest.fixture
+def sqlite_state(tmp_path):
+    url = f"sqlite:///{tmp_path / 'state.db'}"
+    state.configure("sqlite", url, cache_size=2)
+    yield url
+    state.configure("memory")
+
+
+def test_memory_backend_is_default_and_unbounded():
+    assert not state._store.persistent
+    assert state.user_states.capacity is None
+
+
+def test_backend_must_implement_load_and_write_batch():
+    from state.store import StateStore
+
+    class NoWrites(StateStore):
+        def load(self, user_id):
+            return None
+
+    with pytest.raises(TypeError):
+        NoWrites()
+
+
+def test_write_behind_coalesces_and_survives_restart(sqlite_state):
+    state.update_state("u1", {"stage": "block1"})
+    state.update_state("u1", {"stage": "block2", "last_sender": "user"})
+    state.save_if_absent("u1", client_name="Max")
+    assert state.flush() == 1                       # три изменения → одна запись
+
+    # «рестарт»: новый процесс видит тот же файл
+    state.configure("sqlite", sqlite_state, cache_size=2)
+    assert state.user_states == {}
+    st = state.get_state("u1")
+    assert st == {"stage": "block2", "last_sender": "user", "client_name": "Max"}
+
+
+def test_lru_evicts_only_flushed_entries(sqlite_state):
+    for uid in ("a", "b", "c"):
+        state.update_state(uid, {"stage": "block2"})
+    assert set(state.user_states) == {"a", "b", "c"}   # грязные не вытесняем
+
+    state.flush()
+    assert len(state.user_states) == 2
+    assert state.get_state("a") == {"stage": "block2"}  # догружено с диска
+
+
+def test_eviction_during_a_write_keeps_the_unflushed_state(sqlite_state, monkeypatch):
+    import threading
+
+    for uid in ("a", "b", "c"):
+        state.update_state(uid, {"stage": "block1"})
+    state.flush()
+    state.update_state("b", {"stage": "block2"})
+    state.update_state("c", {"stage": "block2"})   # грязные: вытеснять можно только новую
+
+    # вытеснение из другого потока ровно в момент, когда новая запись уже в кэше
+    real_update = state._index.update
+
+    def update_and_evict(user_id, st):
+        real_update(user_id, st)
+        t = threading.Thread(target=state.user_states.evict, args=(state._dirty,))
+        t.start()
+        t.join()
+
+    monkeypatch.setattr(state._index, "update", update_and_evict)
+    state.update_state("d", {"stage": "block2"})
+    monkeypatch.setattr(state._index, "update", real_update)
+
+    assert state.flush() == 3
+    state.configure("sqlite", sqlite_state, cache_size=2)
+    assert state.get_state("d") == {"stage": "block2"}
+
+
+def test_delete_is_persisted(sqlite_state):
+    state.update_state("gone", {"stage": "block3a"})
+    state.flush()
+    state.delete_state("gone")
+    assert state.get_state("gone") is None             # до сброса — не лезем на диск
+    state.flush()
+    state.configure("sqlite", sqlite_state)
+    assert state.get_state("gone") is None
+
+
+def test_transaction_buffers_and_commits_once():
+    state.user_states.clear()
+    state.update_state("tx1", {"stage": "block2"})
+    with state.transaction("tx1"):
+        state.update_state("tx1", {"last_sender": "user"})
+        state.save_if_absent("tx1", client_name="Max")
+        assert state.get_state("tx1")["last_sender"] == "user"     # read-your-writes
+        assert "last_sender" not in state.user_states["tx1"]       # снаружи ещё не видно
+        with state.transaction("tx1"):                             # вложенная — та же
+            state.update_state("tx1", {"stage": "block3a"})
+    assert state.get_state("tx1") == {"stage": "block3a", "last_sender": "user", "client_name": "Max"}
+
+
+def test_transaction_keeps_concurrent_foreign_keys_and_rolls_back_on_error():
+    state.user_states.clear()
+    state.update_state("tx2", {"stage": "block2"})
+    with state.transaction("tx2"):
+        state.update_state("tx2", {"stage": "block3b"})
+        state.user_states["tx2"]["r1_scheduled_b2"] = True         # «напоминание» параллельно
+    assert state.get_state("tx2") == {"stage": "block3b", "r1_scheduled_b2": True}
+
+    with pytest.raises(RuntimeError):
+        with state.transaction("tx2"):
+            state.update_state("tx2", {"stage": "block5"})
+            raise RuntimeError("handler crashed")
+    assert state.get_state("tx2")["stage"] == "block3b"
+
+
+def test_delete_inside_transaction():
+    state.user_states.clear()
+    state.update_state("tx3", {"stage": "block6"})
+    with state.transaction("tx3"):
+        state.delete_state("tx3")
+        assert state.get_state("tx3") is None
+        state.update_state("tx3", {"stage": "block1"})
+    assert state.get_state("tx3") == {"stage": "block1"}
+
+
+def test_parallel_updates_are_not_lost():
+    import threading
+    state.user_states.clear()
+
+    def writer(i):
+        for n in range(200):
+            state.update_state("race", {f"k{i}": n})
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert state.get_state("race") == {f"k{i}": 199 for i in range(8)}
+
+
+def test_update_state_if_compare_and_swap():
+    state.user_states.clear()
+    state.update_state("cas", {"stage": "block2"})
+    ver = state.get_state_version("cas")
+
+    assert state.update_state_if("cas", ver, {"r1_scheduled_b2": True})
+    assert not state.update_state_if("cas", ver, {"r1_scheduled_b2": False})   # версия ушла
+    assert state.get_state("cas")["r1_scheduled_b2"] is True
+
+
+def test_background_transaction_yields_to_fresher_live_write():
+    state.user_states.clear()
+    state.update_state("bg", {"stage": "block2"})
+    with state.transaction("bg", yield_to_newer=True):
+        state.update_state("bg", {"stage": "block2", "last_message_ts": 1})
+        state.update_state("bg", {"stage": "block2", "r1": True})
+        # пока «напоминание» работало, клиент ответил и ушёл дальше
+        state.user_states["bg"] = {"stage": "block3a"}
+        state._bump("bg")
+    assert state.get_state("bg") == {"stage": "block3a", "last_message_ts": 1, "r1": True}
+
+
+def test_nested_values_are_tracked_and_rolled_back():
+    state.user_states.clear()
+    state.update_state("nested", {"structured_cache": {"age": 7}})
+    with state.transaction("nested"):
+        state.get_state("nested")["structured_cache"]["age"] = 8     # правка на месте
+        assert state.user_states["nested"]["structured_cache"] == {"age": 7}
+    assert state.get_state("nested")["structured_cache"] == {"age": 8}
+
+    with pytest.raises(RuntimeError):
+        with state.transaction("nested"):
+            state.get_state("nested")["structured_cache"]["age"] = 9
+            raise RuntimeError("handler crashed")
+    assert state.get_state("nested")["structured_cache"] == {"age": 8}
+
+
+def test_turn_with_external_effect_keeps_what_it_reached():
+    state.user_states.clear()
+    state.update_state("fx", {"stage": "block3a"})
+    with pytest.raises(RuntimeError):
+        with state.transaction("fx") as tx:
+            state.update_state("fx", {"availability_reply_sent": True})
+            state.note_external_effect()                             # ответ клиенту уже ушёл
+            raise RuntimeError("limit later in the turn")
+    assert tx.external_effects == 1
+    assert state.get_state("fx")["availability_reply_sent"] is True
@@ -0,0 +1,95 @@
+import threading
+import time
+
+import pytest
+
+from utils import graph_http, token_manager as tm
+
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    monkeypatch.setattr(tm, "TOKEN_CACHE_PATH", str(tmp_path / "wa_token.json"))
+    monkeypatch.setattr(tm, "_WHATSAPP_TOKEN", None)
+    monkeypatch.setattr(tm, "_meta", {"source": None, "expires_at": None, "checked_at": None})
+    monkeypatch.setattr(tm, "_counters", {k: 0 for k in tm._counters})
+    monkeypatch.setattr(tm, "_started", False)
+    monkeypatch.setattr(tm, "META_APP_ID", None)
+    monkeypatch.setattr(tm, "META_APP_SECRET", None)
+    monkeypatch.delenv("WHATSAPP_TOKEN", raising=False)
+    saved = []
+    monkeypatch.setattr(tm, "save_token_to_supabase", lambda token: saved.append(token) or True)
+    monkeypatch.setattr(tm, "saved", saved, raising=False)
+    return tm
+
+
+def _no_network(*a, **kw):
+    raise AssertionError("сетевой запрос на горячем пути")
+
+
+def test_get_token_serves_cache_without_network(manager, monkeypatch):
+    manager.set_token("cached-token")
+    monkeypatch.setattr(manager, "_WHATSAPP_TOKEN", None)
+    monkeypatch.setattr(manager, "_started", True)              # фоновый менеджер ещё грузит
+    monkeypatch.setattr(manager, "load_token", _no_network)
+    monkeypatch.setattr(graph_http, "request", _no_network)
+
+    assert manager.get_token() == "cached-token"
+    assert manager.stats()["source"] == "cache"
+
+
+def test_get_token_without_cache_does_not_block_when_manager_runs(manager, monkeypatch):
+    monkeypatch.setattr(manager, "_started", True)
+    monkeypatch.setattr(manager, "load_token", _no_network)
+    assert manager.get_token() == ""
+
+
+def test_only_one_caller_refreshes(manager, monkeypatch):
+    release, calls = threading.Event(), []
+
+    def slow_load():
+        calls.append(1)
+        release.wait(2)
+        return "supabase-token"
+
+    monkeypatch.setattr(manager, "load_token", slow_load)
+    monkeypatch.setattr(manager, "check_token_validity_raw", lambda token: True)
+    first = threading.Thread(target=manager.refresh)
+    first.start()
+    while not calls:
+        time.sleep(0.01)
+    assert manager.refresh() is False                           # уже обновляется — не дублируем
+    release.set()
+    first.join()
+
+    assert calls == [1]
+    assert manager.get_token() == "supabase-token"
+    assert manager.stats()["refresh_coalesced"] == 1
+
+
+def test_expiring_token_is_exchanged_ahead_of_time(manager, fake_graph, monkeypatch):
+    server = fake_graph(token_ttl=3600)                        # истекает через час
+    monkeypatch.setattr(manager, "META_APP_ID", "app")
+    monkeypatch.setattr(manager, "META_APP_SECRET", "secret")
+    monkeypatch.setattr(manager, "load_token", lambda: "old-token")
+
+    assert manager.refresh()
+    token = manager.get_token()
+    assert token.startswith("exchanged-") and manager.saved == [token]
+    assert server.state.counters["exchanged"] == 1
+    assert manager.stats()["expires_in_sec"] > manager.REFRESH_BEFORE_SEC
+    assert manager._next_refresh_in(True) == manager.REFRESH_SEC
+
+
+def test_failed_refresh_keeps_last_known_token(manager, fake_graph, monkeypatch):
+    fake_graph(bad_token="revoked")
+    manager.set_token("working")
+    manager._meta["source"] = "cache"
+    monkeypatch.setattr(manager, "load_token", lambda: "revoked")
+
+    assert manager.refresh()                                   # Supabase отдал отозванный — остаёмся
+    assert manager.get_token() == "working"
+
+    monkeypatch.setattr(graph_http, "request", lambda *a, **kw: (_ for _ in ()).throw(ConnectionError()))
+    assert not manager.refresh()                               # сеть недоступна
+    assert manager.get_token() == "working"
+    assert manager.stats()["refresh_failed"] == 1
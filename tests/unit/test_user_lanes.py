@@ -0,0 +1,49 @@
+import threading, time
+
+from utils import user_lanes
+
+
+def test_same_user_runs_in_order_and_other_users_in_parallel():
+    order, gate = [], threading.Event()
+
+    def slow(tag):
+        gate.wait(2)
+        order.append(tag)
+
+    def fast(tag):
+        order.append(tag)
+
+    a = "78000000001"
+    b = next(u for u in (f"7800000{i:04d}" for i in range(100))
+             if user_lanes.lane_for(u) != user_lanes.lane_for(a))
+
+    user_lanes.submit(a, slow, "a1")
+    user_lanes.submit(a, fast, "a2")
+    user_lanes.submit(b, fast, "b1")
+
+    # b не ждёт медленную задачу a; a2 не обгоняет a1
+    end = time.time() + 2
+    while "b1" not in order and time.time() < end:
+        time.sleep(0.01)
+    assert order == ["b1"]
+
+    gate.set()
+    assert user_lanes.wait_idle(3)
+    assert order == ["b1", "a1", "a2"]
+
+
+def test_run_in_lane_is_inline_on_own_lane_and_stats_visible():
+    uid = "78000000042"
+    seen = []
+
+    def outer():
+        user_lanes.run_in_lane(uid, lambda: seen.append(threading.current_thread().name))
+        seen.append("after")
+
+    user_lanes.submit(uid, outer)
+    assert user_lanes.wait_idle(3)
+    assert seen == [f"lane-{user_lanes.lane_for(uid)}", "after"]
+
+    st = user_lanes.stats()
+    assert st["started"] and st["backlog_total"] == 0
+    assert len(st["per_lane"]) == user_lanes.LANES
@@ -31,8 +31,8 @@ def _mk_audio_webhook(*, wamid="wamid.GS1", audio_id="MEDIA_AUDIO_ID", ts="17250
 # --- моки Graph (получение media URL и скачивание файла) ---
 class GraphMock:
     def __init__(self, monkeypatch, *, bytes_payload: bytes):
-        import requests
-        def _get(url, headers=None, timeout=10):
+        from utils import graph_http
+        def _get(url, headers=None, timeout=None, **kw):
             if url.endswith("/MEDIA_AUDIO_ID"):
                 return SimpleNamespace(
                     status_code=200,
@@ -48,7 +48,7 @@ class GraphMock:
                     raise_for_status=lambda: None,
                 )
             raise AssertionError(f"unexpected GET {url}")
-        monkeypatch.setattr(requests, "get", _get, raising=True)
+        monkeypatch.setattr(graph_http, "get", _get, raising=True)
 
 # --- мок pydub: длительность ---
 def patch_duration(monkeypatch, seconds: float):
@@ -1,8 +1,11 @@
 import json, re
 from utils.ask_openai import ask_openai
+from utils import llm_cache, llm_limiter
 from logger import logger
 from utils.constants import REQUIRED_FIELDS
 
+EXTRACTION_CACHE_TTL_SEC = 24 * 3600
+
 def ai_extract_fields(message: str, state_snapshot: dict) -> dict:
     prompt = (
         "Ты — JSON‑парсер. Извлеки известные поля, если они встречаются "
@@ -25,11 +28,14 @@ def ai_extract_fields(message: str, state_snapshot: dict) -> dict:
         "- special_wishes (string)"
     )
     try:
-        raw = ask_openai(prompt)
+        with llm_cache.policy(EXTRACTION_CACHE_TTL_SEC, site="ai_extract"):
+            raw = ask_openai(prompt)
         data = json.loads(raw)
         refused = data.pop("refused_fields", [])
         result = {k: data[k] for k in data if k in REQUIRED_FIELDS}
         return result, refused
+    except llm_limiter.LLMUnavailable:
+        raise
     except Exception as e:
         logger.error(f"[ai_extract] fail: {e}")
         return {}, []
\ No newline at end of file
@@ -3,10 +3,44 @@ ensure_env_loaded()
 import os
 import time
 import logging
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+from contextvars import ContextVar
 from openai import OpenAI, APIError, RateLimitError, AuthenticationError, APITimeoutError, APIConnectionError
+from utils import llm_cache, llm_limiter, fanout, deadline as turn_deadline
+from utils.single_flight import SingleFlight
 
 logger = logging.getLogger(__name__)
 
+MODEL = "gpt-3.5-turbo-0125"
+
+# таймаут одного запроса: не больше остатка бюджета хода (utils/deadline.py), но не меньше минимума
+LLM_TIMEOUT_SEC     = float(os.getenv("LLM_TIMEOUT_SEC", "20"))
+LLM_MIN_TIMEOUT_SEC = float(os.getenv("LLM_MIN_TIMEOUT_SEC", "3"))
+# хеджирование живых запросов: ответа нет дольше p90 наблюдаемой задержки — шлём дубль, берём первый ответ
+LLM_HEDGE               = os.getenv("LLM_HEDGE", "1") == "1"
+LLM_HEDGE_MIN_SAMPLES   = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGE_MIN_DELAY_SEC = float(os.getenv("LLM_HEDGE_MIN_DELAY_SEC", "0.5"))
+
+# JSON-режим ответа: включается на месте вызова через with json_mode(), сигнатура ask_openai та же
+_json_mode: ContextVar[int | None] = ContextVar("openai_json_mode", default=None)
+# температура выборки: по умолчанию 0; варианты для пулов ответов генерируются с with sampling(0.9)
+_temperature: ContextVar[float] = ContextVar("openai_temperature", default=0.0)
+
+# при ошибке ask_openai бросает llm_limiter.LLMUnavailable (лимит 429 — его наследник LLMRateLimited):
+# текст ошибки вместо ответа модели мог уйти клиенту, а исключение блок ловит или ход падает в заглушку
+
+# одинаковые запросы, пришедшие одновременно (волна напоминаний, приветствие block2) — один вызов
+_inflight = SingleFlight()
+
+_latencies: deque[float] = deque(maxlen=200)     # успешные запросы к OpenAI, сек
+_hedge_executor: ThreadPoolExecutor | None = None
+_hedge_lock = threading.Lock()
+_hedge_counters = {"requests": 0, "hedged": 0, "hedge_won": 0, "clamped": 0}
+
 # 1) Сначала пробрасываем старую переменную в новую
 os.environ["OPENAI_API_KEY"] = os.getenv("OPENAI_APIKEY", "")
 
@@ -18,40 +52,184 @@ def get_client():
         api_key = os.getenv("OPENAI_API_KEY")
         if not api_key:
             raise RuntimeError("Missing OPENAI_APIKEY/OPENAI_API_KEY")
-        _client = OpenAI(api_key=api_key)
+        # повторы делаем сами (429 — через llm_limiter), иначе SDK умножает таймаут хода
+        _client = OpenAI(api_key=api_key, max_retries=0)
     return _client
 
-def ask_openai(prompt: str, system_prompt: str = "Ты ассистент иллюзиониста Арсения. Отвечай осмысленно, дружелюбно и кратко.", max_tokens: int = 150) -> str:
+@contextmanager
+def json_mode(max_tokens: int = 400):
+    """Ответ модели — строго JSON-объект (response_format=json_object); max_tokens не меньше заданного."""
+    token = _json_mode.set(max_tokens)
+    try:
+        yield
+    finally:
+        _json_mode.reset(token)
+
+
+@contextmanager
+def sampling(temperature: float):
+    """Температура для всех ask_openai внутри блока (ключ кэша учитывает её)."""
+    token = _temperature.set(temperature)
     try:
-        client = get_client()
-        start = time.time()
-        resp = client.chat.completions.create(
-            model="gpt-3.5-turbo-0125",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0,
-            max_tokens=max_tokens,
-            timeout=20
-        )
-        ans = resp.choices[0].message.content.strip()
-        logger.info(f"[ask_openai] ✅ Ответ: {ans}")
-        logger.info(f"[ask_openai] 🕒 {time.time() - start:.2f} сек")
-        logger.info(f"[ask_openai] 📈 Токены: {resp.usage.total_tokens}")
-        return ans
-    except AuthenticationError as e:
-        logger.error(f"[ask_openai] ❌ Авторизация: {e}")
-        return "Ошибка авторизации"
-    except RateLimitError:
-        logger.warning("[ask_openai] ⚠️ Лимит запросов")
-        return "Превышен лимит запросов"
-    except (APITimeoutError, APIConnectionError):
-        logger.warning("[ask_openai] ⏰ Таймаут / нет связи")
-        return "Таймаут"
-    except APIError as e:
-        logger.error(f"[ask_openai] ⛔ Ошибка API: {e}")
-        return "API ошибка"
-    except Exception as e:
-        logger.exception(f"[ask_openai] 💥 Неизвестная ошибка: {e}")
-        return "Неизвестная ошибка"
+        yield
+    finally:
+        _temperature.reset(token)
+
+
+def ask_openai(prompt: str, system_prompt: str = "Ты ассистент иллюзиониста Арсения. Отвечай осмысленно, дружелюбно и кратко.", max_tokens: int = 150) -> str:
+    json_tokens = _json_mode.get()
+    if json_tokens:
+        max_tokens = max(max_tokens, json_tokens)
+    temperature = _temperature.get()
+    model_key = f"{MODEL}:json" if json_tokens else MODEL
+    if temperature:
+        model_key += f"@t{temperature}"
+    key = llm_cache.make_key(model_key, system_prompt, prompt, max_tokens)
+    cached = llm_cache.get(key)
+    if cached is not None:
+        logger.info(f"[ask_openai] ♻️ Из кэша: {cached}")
+        return cached
+    fanout.raise_if_cancelled()          # задачу FanOut отменили — запрос уже никому не нужен
+    return _inflight.do(key, _call, key, prompt, system_prompt, max_tokens, bool(json_tokens), temperature)
+
+
+def flight_stats() -> dict:
+    return _inflight.stats()
+
+
+def hedge_stats() -> dict:
+    with _hedge_lock:
+        s = sorted(_latencies)
+        counters = dict(_hedge_counters)
+
+    def q(p):
+        return round(s[min(int(len(s) * p), len(s) - 1)] * 1000) if s else 0
+
+    return {"enabled": LLM_HEDGE, "samples": len(s), "p50_ms": q(0.5), "p90_ms": q(0.9),
+            "delay_ms": round((_hedge_delay(force=True) or 0) * 1000), **counters}
+
+
+def _request_timeout() -> float:
+    """Таймаут запроса: остаток бюджета хода, в пределах [LLM_MIN_TIMEOUT_SEC, LLM_TIMEOUT_SEC]."""
+    left = turn_deadline.remaining(LLM_TIMEOUT_SEC)
+    if left < LLM_TIMEOUT_SEC:
+        with _hedge_lock:
+            _hedge_counters["clamped"] += 1
+    return max(LLM_MIN_TIMEOUT_SEC, min(LLM_TIMEOUT_SEC, left))
+
+
+def _hedge_delay(force: bool = False) -> float | None:
+    """Через сколько слать дубль: p90 задержки. None — не хеджируем (фон, мало замеров)."""
+    if not force and (not LLM_HEDGE or llm_limiter.current_priority() != llm_limiter.LIVE):
+        return None
+    with _hedge_lock:
+        if len(_latencies) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        s = sorted(_latencies)
+    return max(LLM_HEDGE_MIN_DELAY_SEC, s[int(len(s) * 0.9)])
+
+
+def _hedge_pool() -> ThreadPoolExecutor:
+    global _hedge_executor
+    if _hedge_executor is None:
+        with _hedge_lock:
+            if _hedge_executor is None:
+                _hedge_executor = ThreadPoolExecutor(max_workers=2 * llm_limiter.LLM_MAX_CONCURRENCY,
+                                                     thread_name_prefix="llm-hedge")
+    return _hedge_executor
+
+
+def _create(estimated: int, **kwargs):
+    """Один запрос к OpenAI под слотом llm_limiter; задержку успешного ответа запоминаем."""
+    with llm_limiter.limiter.slot(estimated) as slot:
+        start = time.monotonic()
+        resp = get_client().chat.completions.create(**kwargs)
+        slot.used = getattr(resp.usage, "total_tokens", None)
+    with _hedge_lock:
+        _latencies.append(time.monotonic() - start)
+    return resp
+
+
+def _request(estimated: int, timeout: float, **kwargs):
+    """Запрос с хеджированием: основной не ответил за p90 — дубль, побеждает первый успешный."""
+    with _hedge_lock:
+        _hedge_counters["requests"] += 1
+    delay = _hedge_delay()
+    if delay is None or delay >= timeout:
+        return _create(estimated, timeout=timeout, **kwargs)
+    pool = _hedge_pool()
+    primary = pool.submit(contextvars.copy_context().run, _create, estimated, timeout=timeout, **kwargs)
+    if wait([primary], timeout=delay).done:
+        return primary.result()
+    logger.info(f"[ask_openai] 🪁 нет ответа за {delay:.2f} с — дублируем запрос")
+    backup = pool.submit(contextvars.copy_context().run, _create, estimated,
+                         timeout=max(LLM_MIN_TIMEOUT_SEC, timeout - delay), **kwargs)
+    with _hedge_lock:
+        _hedge_counters["hedged"] += 1
+    pending, error = {primary, backup}, None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for fut in done:
+            if fut.exception() is None:
+                if fut is backup:
+                    with _hedge_lock:
+                        _hedge_counters["hedge_won"] += 1
+                return fut.result()          # проигравший доработает вхолостую
+            error = error or fut.exception()
+    raise error
+
+
+def _call(key: str, prompt: str, system_prompt: str, max_tokens: int, as_json: bool = False,
+          temperature: float = 0.0) -> str:
+    limiter = llm_limiter.limiter
+    estimated = llm_limiter.estimate_tokens(system_prompt, prompt, max_tokens)
+    for attempt in range(llm_limiter.LLM_RATE_RETRIES + 1):
+        try:
+            start = time.time()
+            extra = {"response_format": {"type": "json_object"}} if as_json else {}
+            resp = _request(
+                estimated,
+                _request_timeout(),
+                model=MODEL,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=temperature,
+                max_tokens=max_tokens,
+                **extra
+            )
+            ans = resp.choices[0].message.content.strip()
+            logger.info(f"[ask_openai] ✅ Ответ: {ans}")
+            logger.info(f"[ask_openai] 🕒 {time.time() - start:.2f} сек")
+            logger.info(f"[ask_openai] 📈 Токены: {resp.usage.total_tokens}")
+            llm_cache.put(key, ans)
+            return ans
+        except RateLimitError as e:
+            if getattr(e, "code", None) == "insufficient_quota":
+                logger.error("[ask_openai] ❌ Квота OpenAI исчерпана")
+                break
+            if attempt == llm_limiter.LLM_RATE_RETRIES:
+                break
+            delay = limiter.penalize(llm_limiter.retry_after_sec(e), attempt)
+            logger.warning(f"[ask_openai] ⚠️ Лимит запросов, повтор через {delay:.1f} с "
+                           f"({attempt + 1}/{llm_limiter.LLM_RATE_RETRIES})")
+        except AuthenticationError as e:
+            logger.error(f"[ask_openai] ❌ Авторизация: {e}")
+            raise llm_limiter.LLMUnavailable("OpenAI: ошибка авторизации") from e
+        except (APITimeoutError, APIConnectionError) as e:
+            spent = turn_deadline.remaining(1.0) <= 0
+            logger.warning(f"[ask_openai] ⏰ Таймаут / нет связи{' (бюджет хода исчерпан)' if spent else ''}")
+            raise llm_limiter.LLMUnavailable("OpenAI: таймаут / нет связи") from e
+        except APIError as e:
+            logger.error(f"[ask_openai] ⛔ Ошибка API: {e}")
+            raise llm_limiter.LLMUnavailable("OpenAI: ошибка API") from e
+        except llm_limiter.LLMUnavailable:
+            # не дождались слота в очереди ограничителя — отдаём как есть
+            raise
+        except Exception as e:
+            logger.exception(f"[ask_openai] 💥 Неизвестная ошибка: {e}")
+            raise llm_limiter.LLMUnavailable(f"OpenAI: {e!r}") from e
+    # текст ошибки клиенту не уходит: ход/напоминание упадёт и будет повторено позже
+    limiter.gave_up()
+    raise llm_limiter.LLMRateLimited("OpenAI rate limit: повторы исчерпаны")
@@ -0,0 +1,309 @@
+# utils/date_parser.py
+"""
+Локальный разбор даты и времени мероприятия из текста клиента (RU/EN), без LLM.
+
+  «15 июня», «15.06», «2025-06-15», «June 15», «в субботу», «в следующую пятницу»,
+  «завтра», «послезавтра в 18:30», «к 5 вечера», «в 16», «at 6pm», «в полдень».
+
+Относительные даты считаем от «сегодня» по Asia/Atyrau. День и месяц без года —
+ближайшая такая дата в будущем (прошедшее число → следующий год).
+
+Каждое значение идёт с уверенностью 0…1. Если в тексте несколько упоминаний,
+берём последнее уверенное — клиент обычно поправляет себя ближе к концу;
+из интервала «с 3 до 5» — начало. Ниже LOCAL_DATETIME_MIN_CONF (или ничего
+не нашли) — решает LLM; в extract_slots ответ модели, если он есть, главнее.
+"""
+from utils.env_loader import ensure_env_loaded
+ensure_env_loaded()
+import os, re
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+
+LOCAL_DATETIME_PARSER   = os.getenv("LOCAL_DATETIME_PARSER", "1") == "1"
+LOCAL_DATETIME_MIN_CONF = float(os.getenv("LOCAL_DATETIME_MIN_CONF", "0.7"))
+TZ = ZoneInfo("Asia/Atyrau")
+
+_MONTHS = [
+    (r"январ[ьяе]|jan(?:uary)?", 1),
+    (r"феврал[ьяе]|feb(?:ruary)?", 2),
+    (r"март[ае]?|mar(?:ch)?", 3),
+    (r"апрел[ьяе]|apr(?:il)?", 4),
+    (r"ма[йяе]|may", 5),
+    (r"июн[ьяе]|june?", 6),
+    (r"июл[ьяе]|july?", 7),
+    (r"август[ае]?|aug(?:ust)?", 8),
+    (r"сентябр[ьяе]|sep(?:t(?:ember)?)?", 9),
+    (r"октябр[ьяе]|oct(?:ober)?", 10),
+    (r"ноябр[ьяе]|nov(?:ember)?", 11),
+    (r"декабр[ьяе]|dec(?:ember)?", 12),
+]
+_MONTH_RE = "|".join(p for p, _ in _MONTHS)
+
+_WEEKDAYS = [
+    (r"понедельник|monday", 0),
+    (r"вторник|tuesday", 1),
+    (r"сред[аеу]|wednesday", 2),
+    (r"четверг|thursday", 3),
+    (r"пятниц[аеу]|friday", 4),
+    (r"суббот[аеу]|saturday", 5),
+    (r"воскресень[ея]|sunday", 6),
+]
+_WEEKDAY_RE = "|".join(p for p, _ in _WEEKDAYS)
+
+_RELATIVE = {"сегодня": 0, "today": 0, "завтра": 1, "tomorrow": 1,
+             "послезавтра": 2, "day after tomorrow": 2}
+
+# «в 5» может быть возрастом, количеством и т.п. — такие хвосты отсекаем
+_NOT_TIME_TAIL = r"(?!\s*(?:лет|год|г\b|класс|чел|гост|дет|ребен|минут|мин\b|%|years?|people|guests|kids))"
+# «1.5 тыс», «2.5к», «10/20 тенге» — суммы, а не даты
+_AMOUNT_TAIL = r"(?!\s*(?:тыс|т\.?р|тг|тенге|₸|руб|р\b|млн|к\b|k\b|\$|usd|kzt))"
+# после «June 15» может идти только служебное слово («at 6pm», «в 18:00», «года»), не «10 детей»
+_NO_NOUN_TAIL = r"(?!\s+(?!(?:в|во|к|с|на|около|at|by|on|around|года?|г)\b)[а-яa-z])"
+_PERIOD = r"(утра|дня|вечера|ночи|am|pm|a\.m\.|p\.m\.)"
+
+_DATE_PATTERNS = [
+    # 2025-06-15
+    ("iso",     re.compile(r"\b(\d{4})-(\d{1,2})-(\d{1,2})\b")),
+    # 15 июня [2025], 15-го июня, 15th of June
+    ("day_mon", re.compile(rf"\b(\d{{1,2}})(?:-?(?:го|е|ого|st|nd|rd|th))?\s+(?:of\s+)?({_MONTH_RE})\b\.?(?:\s+(\d{{4}}))?")),
+    # June 15[th][, 2025] — число сразу за месяцем, дальше не существительное («в мае 10 детей»)
+    ("mon_day", re.compile(rf"\b({_MONTH_RE})\s+(\d{{1,2}})(?:st|nd|rd|th)?\b(?:,?\s+(\d{{4}}))?{_NO_NOUN_TAIL}")),
+    # 15.06[.2025], 15/06/25 — но не «в 18.30» (это время), не «1.5» (дробь) и не «1.5 тыс» (сумма)
+    ("numeric", re.compile(r"(?<![\d.:/,])(?<!\bв )(?<!\bк )(?<!\bat )(?<!\bс )(?<!\bдо )"
+                           r"(\d{1,2})(?:\.(\d{2})|/(\d{1,2}))(?:[./](\d{4}|\d{2}))?\b(?![.,:/]\d)"
+                           rf"(?!\s*(?:год|лет|г\b|ч\b|час|%|years?)){_AMOUNT_TAIL}")),
+    # сегодня / завтра / послезавтра / today / tomorrow / day after tomorrow
+    ("relative", re.compile(r"\b(послезавтра|завтра|сегодня|day after tomorrow|tomorrow|today)\b")),
+    # через 3 дня / через неделю / in 2 weeks
+    ("in_days", re.compile(r"\b(?:через|in)\s+(\d{1,2}|одну|один|две|два|три|a|one|two|three)?\s*"
+                           r"(дн[яей]|день|недел[июь]|days?|weeks?)\b")),
+    # в субботу / в эту пятницу / в следующую среду / next friday / on saturday
+    ("weekday", re.compile(rf"\b(?:(?:в|во|on)\s+)?(?:(эт\w*|следующ\w*|ближайш\w*|next|this)\s+)?({_WEEKDAY_RE})\b")),
+]
+
+_TIME_PATTERNS = [
+    # с 3 до 5 дня / from 6 to 8 pm — событие начинается в начале интервала
+    ("range",   re.compile(rf"\b(?:с|со|from)\s+([01]?\d|2[0-3])(?:[:.]([0-5]\d))?\s*(?:час(?:а|ов)?\s*)?"
+                           rf"(?:до|-|–|to|till|until)\s*([01]?\d|2[0-3])(?:[:.]([0-5]\d))?\s*(?:час(?:а|ов)?\s*)?"
+                           rf"(?:{_PERIOD}(?![а-яa-z]))?")),
+    # 18:30 / 18.30 после предлога / 6:30 pm
+    ("hhmm",    re.compile(rf"\b([01]?\d|2[0-3]):([0-5]\d)\b(?:\s*{_PERIOD})?")),
+    ("hh_dot",  re.compile(rf"\b(?:в|к|с|до|около|at|by|around)\s+([01]?\d|2[0-3])\.([0-5]\d)\b(?!\.\d)(?:\s*{_PERIOD})?")),
+    # 5 вечера / к 5 вечера / 6pm / в 7 часов утра
+    ("period",  re.compile(rf"(?:\b(в|к|с|до|около|at|by|around)\s+)?\b(\d{{1,2}})\s*(час(?:а|ов)?\s*)?{_PERIOD}(?![а-яa-z])")),
+    # в 18 часов / к 7 ч («2 часа» без предлога — это длительность)
+    ("hours",   re.compile(r"\b(?:в|к|с|около)\s+(\d{1,2})\s*(?:час(?:а|ов)?|ч)\b\.?")),
+    # в 16 / к 5 / at 6 — без уточнения части дня
+    ("bare",    re.compile(rf"\b(?:в|к|около|at|by|around)\s+(\d{{1,2}})\b(?![:.]\d){_NOT_TIME_TAIL}")),
+    # полдень / полночь
+    ("named",   re.compile(r"\b(полдень|полудн[юя]|noon|полночь|midnight)\b")),
+]
+
+
+def now_local() -> datetime:
+    """Текущий момент во времени Asia/Atyrau (тесты подменяют)."""
+    return datetime.now(TZ)
+
+
+def _normalize(text: str) -> str:
+    return (text or "").casefold().replace("ё", "е")
+
+
+def _month(token: str) -> int | None:
+    for pattern, num in _MONTHS:
+        if re.fullmatch(pattern, token):
+            return num
+    return None
+
+
+def _weekday(token: str) -> int | None:
+    for pattern, num in _WEEKDAYS:
+        if re.fullmatch(pattern, token):
+            return num
+    return None
+
+
+def _year(raw: str | None) -> int | None:
+    if not raw:
+        return None
+    y = int(raw)
+    return 2000 + y if y < 100 else y
+
+
+def _upcoming(today: date, month: int, day: int) -> date | None:
+    """День и месяц без года → ближайшая будущая (или сегодняшняя) дата."""
+    try:
+        d = date(today.year, month, day)
+        if d < today:
+            d = date(today.year + 1, month, day)
+        return d
+    except ValueError:
+        return None
+
+
+def _safe_date(year: int, month: int, day: int) -> date | None:
+    try:
+        return date(year, month, day)
+    except ValueError:
+        return None
+
+
+_COUNT_WORDS = {"одну": 1, "один": 1, "a": 1, "one": 1, "две": 2, "два": 2, "two": 2,
+                "три": 3, "three": 3}
+
+
+def _date_from(kind: str, m: re.Match, today: date) -> tuple[date | None, float]:
+    if kind == "iso":
+        return _safe_date(int(m.group(1)), int(m.group(2)), int(m.group(3))), 0.98
+    if kind == "day_mon":
+        month, year = _month(m.group(2)), _year(m.group(3))
+        day = int(m.group(1))
+        if year:
+            return _safe_date(year, month, day), 0.95
+        return _upcoming(today, month, day), 0.9
+    if kind == "mon_day":
+        month, year = _month(m.group(1)), _year(m.group(3))
+        day = int(m.group(2))
+        if year:
+            return _safe_date(year, month, day), 0.95
+        return _upcoming(today, month, day), 0.85
+    if kind == "numeric":
+        day, month, year = int(m.group(1)), int(m.group(2) or m.group(3)), _year(m.group(4))
+        if not 1 <= month <= 12:
+            return None, 0.0
+        if year:
+            return _safe_date(year, month, day), 0.9
+        return _upcoming(today, month, day), 0.8
+    if kind == "relative":
+        # «сегодня» часто просто вводное слово («сегодня узнали о вас») — пусть решает LLM
+        offset = _RELATIVE[m.group(1)]
+        return today + timedelta(days=offset), (0.6 if offset == 0 else 0.85)
+    if kind == "in_days":
+        raw = m.group(1) or "1"
+        n = int(raw) if raw.isdigit() else _COUNT_WORDS.get(raw, 1)
+        unit_days = 7 if m.group(2).startswith(("недел", "week")) else 1
+        return today + timedelta(days=n * unit_days), 0.8
+    if kind == "weekday":
+        wd = _weekday(m.group(2))
+        ahead = (wd - today.weekday()) % 7 or 7
+        if m.group(1) and m.group(1).startswith(("следующ", "next")):
+            # «в следующую субботу» — суббота следующей календарной недели
+            next_monday = today + timedelta(days=7 - today.weekday())
+            return next_monday + timedelta(days=wd), 0.75
+        return today + timedelta(days=ahead), 0.8
+    return None, 0.0
+
+
+def _hour_24(hour: int, period: str | None) -> int | None:
+    period = (period or "").replace(".", "")
+    if period in ("утра", "am"):
+        hour = 0 if hour == 12 else hour
+    elif period in ("дня", "pm", "вечера"):
+        hour = hour if hour == 12 else hour + 12
+    elif period == "ночи":
+        hour = 0 if hour == 12 else (hour + 12 if hour >= 9 else hour)
+    return hour if 0 <= hour <= 23 else None
+
+
+def _time_from(kind: str, m: re.Match) -> tuple[str | None, float]:
+    if kind == "named":
+        return ("12:00" if m.group(1).startswith(("пол", "noon")) and "ноч" not in m.group(1)
+                else "00:00"), 0.9
+    if kind == "range":
+        return _range_start(m)
+    if kind == "period":
+        prep, hour, hour_word, period = m.group(1), int(m.group(2)), m.group(3), m.group(4)
+        if hour > 12 or (period == "дня" and not (prep or hour_word)):
+            return None, 0.0                        # «2 дня» без предлога — это длительность
+        minute = 0
+    else:
+        hour = int(m.group(1))
+        minute = int(m.group(2)) if kind in ("hhmm", "hh_dot") else 0
+        period = m.group(3) if kind in ("hhmm", "hh_dot") else None
+    h = _hour_24(hour, period) if period and hour <= 12 else hour
+    if h is None or h > 23:
+        return None, 0.0
+    conf = {"hhmm": 0.95, "hh_dot": 0.85, "period": 0.9, "hours": 0.8}.get(kind)
+    if kind == "bare":
+        # «в 16» — однозначно; «в 5» — скорее 17:00, но пусть решает LLM
+        if h >= 12 or h == 0:
+            conf = 0.8
+        else:
+            h, conf = (h + 12 if h <= 7 else h), 0.5
+    return f"{h:02d}:{minute:02d}", conf
+
+
+def _range_start(m: re.Match) -> tuple[str | None, float]:
+    """«с 3 до 5 дня» → 15:00: часть дня из конца интервала относится и к началу."""
+    start, start_min = int(m.group(1)), int(m.group(2) or 0)
+    end, period = int(m.group(3)), m.group(5)
+    if period and start <= 12 and end <= 12:
+        # «с 11 до 2 дня» — начало ещё утром
+        h = start if start > end and period in ("дня", "pm", "p.m.") else _hour_24(start, period)
+        conf = 0.9
+    elif start >= 12 or start == 0 or m.group(2):
+        h, conf = start, 0.85
+    else:
+        h, conf = (start + 12 if start <= 7 else start), 0.5     # «с 3 до 5» — как «в 3»
+    if h is None:
+        return None, 0.0
+    return f"{h:02d}:{start_min:02d}", conf
+
+
+def _last(found: list[tuple]) -> tuple[str | None, float]:
+    """
+    Последнее уверенное упоминание; если уверенных нет — последнее вообще.
+    «до 17:00» — конец мероприятия: берём его, только если начала в тексте нет.
+    """
+    if not found:
+        return None, 0.0
+    _, value, conf, *_ = max(found, key=lambda f: (f[2] >= LOCAL_DATETIME_MIN_CONF,
+                                                   not (f[3] if len(f) > 3 else False), f[0]))
+    return value, conf
+
+
+def _is_end_time(s: str, m: re.Match) -> bool:
+    """Время после «до / till / until» (в самом совпадении или прямо перед ним)."""
+    return bool(re.match(r"(?:до|till|until)\s", m.group(0))
+                or re.search(r"\b(?:до|till|until)\s*$", s[:m.start()]))
+
+
+def parse_date_time(text: str, now: datetime | None = None) -> dict:
+    """
+    → {"date": "ГГГГ-ММ-ДД" | None, "time": "ЧЧ:ММ" | None, "date_conf": 0…1, "time_conf": 0…1}
+    """
+    s = _normalize(text)
+    today = (now or now_local()).date()
+
+    dates, taken = [], []
+    for kind, rx in _DATE_PATTERNS:
+        for m in rx.finditer(s):
+            if any(m.start() < b and m.end() > a for a, b in taken):
+                continue                                    # «15 июня» уже разобрано — не читаем его ещё раз
+            d, conf = _date_from(kind, m, today)
+            if d:
+                dates.append((m.start(), d.isoformat(), conf))
+                taken.append(m.span())
+
+    times = []
+    for kind, rx in _TIME_PATTERNS:
+        for m in rx.finditer(s):
+            if any(m.start() < b and m.end() > a for a, b in taken):
+                continue
+            t, conf = _time_from(kind, m)
+            if t:
+                times.append((m.start(), t, conf, _is_end_time(s, m)))
+                taken.append(m.span())
+
+    date_val, date_conf = _last(dates)
+    time_val, time_conf = _last(times)
+    return {"date": date_val, "time": time_val, "date_conf": date_conf, "time_conf": time_conf}
+
+
+def confident(parsed: dict) -> tuple[str | None, str | None]:
+    """Только то, в чём парсер уверен (≥ LOCAL_DATETIME_MIN_CONF); выключен — (None, None)."""
+    if not LOCAL_DATETIME_PARSER:
+        return None, None
+    d = parsed["date"] if parsed["date_conf"] >= LOCAL_DATETIME_MIN_CONF else None
+    t = parsed["time"] if parsed["time_conf"] >= LOCAL_DATETIME_MIN_CONF else None
+    return d, t
@@ -0,0 +1,94 @@
+# utils/deadline.py
+"""
+Бюджет времени на один ход диалога.
+
+Дедлайн создаётся, когда ход готов к обработке (сообщение принято вебхуком или
+закрылось окно склейки), и передаётся в route_message(deadline=...). Дальше он
+лежит в contextvar: блоки, FanOut-задачи и ask_openai видят его без смены сигнатур.
+
+  • ask_openai берёт таймаут не больше оставшегося бюджета
+    (но не меньше LLM_MIN_TIMEOUT_SEC — ответ клиенту всё же нужен);
+  • record_turn() — длительность хода и перерасход бюджета для /debug/llm.
+"""
+from utils.env_loader import ensure_env_loaded
+ensure_env_loaded()
+import os, time, threading
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+TURN_DEADLINE_SEC = float(os.getenv("TURN_DEADLINE_SEC", "25"))
+
+
+class Deadline:
+    __slots__ = ("budget", "started_at")
+
+    def __init__(self, budget: float = TURN_DEADLINE_SEC, started_at: float | None = None):
+        self.budget = budget
+        self.started_at = time.time() if started_at is None else started_at
+
+    def elapsed(self) -> float:
+        return time.time() - self.started_at
+
+    def remaining(self) -> float:
+        return self.budget - self.elapsed()
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def __repr__(self):
+        return f"Deadline(budget={self.budget}, remaining={self.remaining():.2f})"
+
+
+_current: ContextVar[Deadline | None] = ContextVar("turn_deadline", default=None)
+
+
+@contextmanager
+def scope(deadline: Deadline | None):
+    """Сделать дедлайн текущим для блока. None — оставить тот, что уже есть."""
+    if deadline is None:
+        yield _current.get()
+        return
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+
+
+def current() -> Deadline | None:
+    return _current.get()
+
+
+def remaining(default: float) -> float:
+    """Сколько осталось у текущего хода; вне хода (напоминания, фон) — default."""
+    d = _current.get()
+    return default if d is None else d.remaining()
+
+
+# ─── метрики ходов ───────────────────────────────────────────────
+_lock = threading.Lock()
+_durations: deque[float] = deque(maxlen=1000)
+_counters = {"turns": 0, "over_budget": 0}
+
+
+def record_turn(deadline: Deadline) -> None:
+    elapsed = deadline.elapsed()
+    with _lock:
+        _durations.append(elapsed)
+        _counters["turns"] += 1
+        if elapsed > deadline.budget:
+            _counters["over_budget"] += 1
+
+
+def stats() -> dict:
+    with _lock:
+        s = sorted(_durations)
+        counters = dict(_counters)
+
+    def q(p):
+        return round(s[min(int(len(s) * p), len(s) - 1)], 2) if s else 0
+
+    return {"budget_sec": TURN_DEADLINE_SEC, **counters,
+            "turn_sec_p50": q(0.5), "turn_sec_p90": q(0.9), "turn_sec_p99": q(0.99),
+            "turn_sec_max": round(s[-1], 2) if s else 0}
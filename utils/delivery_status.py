@@ -0,0 +1,218 @@
+# utils/delivery_status.py
+"""
+Статусы доставки исходящих сообщений (вебхук statuses: sent/delivered/read/failed).
+
+outbound_queue после успешного POST /messages записывает сюда wamid, получателя
+и тело сообщения; handle_status по тому же wamid дописывает статус. Хранилище —
+SQLite, строки старше DELIVERY_STATUS_TTL_SEC удаляются. По статусам:
+
+  • failed с временной ошибкой Meta (131000, 131016, 130429, 131056) — сообщение
+    заново ставится в исходящую очередь, не больше DELIVERY_MAX_RESENDS раз;
+  • undelivered(recipient) — последнее сообщение клиенту не доставлено
+    (sent без delivered или failed с временной ошибкой): reminder_engine
+    откладывает очередное напоминание;
+  • stats() — задержка отправка → доставка / прочтение по перцентилям (/debug/delivery).
+Статусы приходят не по порядку — назад (read → delivered) не откатываемся.
+"""
+from utils.env_loader import ensure_env_loaded
+ensure_env_loaded()
+import os, json, time, sqlite3, threading
+from logger import logger
+
+STORE_PATH         = os.getenv("DELIVERY_STATUS_PATH", "tmp/delivery_status.db")
+TTL_SEC            = float(os.getenv("DELIVERY_STATUS_TTL_SEC", str(7 * 24 * 3600)))
+MAX_RESENDS        = int(os.getenv("DELIVERY_MAX_RESENDS", "2"))
+RESEND_DELAY_SEC   = float(os.getenv("DELIVERY_RESEND_DELAY_SEC", "30"))
+EVICT_EVERY_SEC    = 600.0
+
+# ошибки доставки, после которых имеет смысл отправить ещё раз
+RESENDABLE_CODES = frozenset({131000, 131016, 130429, 131056})
+_RANK = {"sent": 1, "delivered": 2, "read": 3, "failed": 4}
+
+_conn: sqlite3.Connection | None = None
+_db_lock = threading.Lock()
+_last_evict = 0.0
+_counters = {"recorded": 0, "statuses": 0, "unknown_wamid": 0, "resent": 0, "reminders_deferred": 0}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS deliveries (
+    wamid        TEXT PRIMARY KEY,
+    recipient    TEXT NOT NULL,
+    phone_id     TEXT,
+    tag          TEXT,
+    payload      TEXT NOT NULL,
+    sent_at      REAL NOT NULL,
+    status       TEXT NOT NULL DEFAULT 'accepted',
+    delivered_at REAL,
+    read_at      REAL,
+    error        TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_deliveries_recipient ON deliveries(recipient, sent_at);
+CREATE INDEX IF NOT EXISTS ix_deliveries_sent ON deliveries(sent_at);
+"""
+
+
+def _db() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        folder = os.path.dirname(STORE_PATH)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        _conn = sqlite3.connect(STORE_PATH, check_same_thread=False, isolation_level=None)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("PRAGMA synchronous=NORMAL")
+        _conn.executescript(_SCHEMA)
+    return _conn
+
+
+def configure(path: str | None = None) -> None:
+    """Переключить файл хранилища (нужно тестам и скриптам)."""
+    global STORE_PATH, _conn
+    with _db_lock:
+        if _conn is not None:
+            _conn.close()
+            _conn = None
+        if path:
+            STORE_PATH = path
+
+
+def _evict(now: float) -> None:
+    """Раз в EVICT_EVERY_SEC удаляем строки старше TTL (вызывается под _db_lock)."""
+    global _last_evict
+    if now - _last_evict < EVICT_EVERY_SEC:
+        return
+    _last_evict = now
+    n = _db().execute("DELETE FROM deliveries WHERE sent_at < ?", (now - TTL_SEC,)).rowcount
+    if n:
+        logger.info(f"[delivery] 🧹 удалено старых статусов: {n}")
+
+
+# ─── запись ──────────────────────────────────────────────────────
+def wamid_of(resp) -> str | None:
+    """wamid из ответа POST /messages."""
+    try:
+        return (resp.json().get("messages") or [{}])[0].get("id")
+    except Exception:
+        return None
+
+
+def record_sent(wamid: str | None, payload: dict, tag: str = "", phone_id: str | None = None) -> None:
+    """Graph API принял сообщение — запоминаем его, чтобы связать со статусами."""
+    if not wamid:
+        return
+    now = time.time()
+    with _db_lock:
+        _db().execute(
+            "INSERT OR IGNORE INTO deliveries(wamid, recipient, phone_id, tag, payload, sent_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (wamid, payload.get("to") or "", phone_id, tag, json.dumps(payload, ensure_ascii=False), now),
+        )
+        _counters["recorded"] += 1
+        _evict(now)
+
+
+def on_status(status: dict) -> None:
+    """Событие statuses[] из вебхука Meta."""
+    wamid, name = status.get("id"), status.get("status")
+    if not wamid or name not in _RANK:
+        return
+    try:
+        ts = float(status.get("timestamp") or time.time())
+    except (TypeError, ValueError):
+        ts = time.time()
+    errors = status.get("errors") or []
+    error = errors[0] if errors else {}
+    with _db_lock:
+        row = _db().execute(
+            "SELECT recipient, phone_id, tag, payload, status FROM deliveries WHERE wamid=?", (wamid,)
+        ).fetchone()
+        _counters["statuses"] += 1
+        if row is None:
+            _counters["unknown_wamid"] += 1       # не наше или уже вытеснено по TTL
+            return
+        recipient, phone_id, tag, payload, current = row
+        if _RANK[name] <= _RANK.get(current, 0):
+            return
+        _db().execute(
+            "UPDATE deliveries SET status=?, "
+            "delivered_at=CASE WHEN ? IN ('delivered', 'read') THEN COALESCE(delivered_at, ?) ELSE delivered_at END, "
+            "read_at=CASE WHEN ?='read' THEN ? ELSE read_at END, error=? WHERE wamid=?",
+            (name, name, ts, name, ts, json.dumps(error, ensure_ascii=False) if error else None, wamid),
+        )
+        resends = 0
+        if name == "failed":
+            (resends,) = _db().execute(
+                "SELECT COUNT(*) FROM deliveries WHERE recipient=? AND payload=? AND status='failed'",
+                (recipient, payload),
+            ).fetchone()
+    if name == "failed":
+        _on_failed(wamid, recipient, phone_id, tag, json.loads(payload), error, resends)
+
+
+def _on_failed(wamid, recipient, phone_id, tag, payload, error, failures) -> None:
+    code = error.get("code")
+    if code not in RESENDABLE_CODES or failures > MAX_RESENDS:
+        logger.error(f"[delivery] ❌ {tag} → {recipient} не доставлено ({wamid}): {error or 'без деталей'}")
+        return
+    from utils import outbound_queue
+    outbound_queue.send(payload, tag=tag, phone_id=phone_id, delay=RESEND_DELAY_SEC)
+    _counters["resent"] += 1
+    logger.warning(f"[delivery] 🔁 {tag} → {recipient}: ошибка {code}, отправим ещё раз "
+                   f"через {RESEND_DELAY_SEC:.0f} с ({failures}/{MAX_RESENDS})")
+
+
+# ─── чтение ──────────────────────────────────────────────────────
+def undelivered(recipient: str, within_sec: float | None = None) -> bool:
+    """
+    Последнее сообщение клиенту (не старше within_sec) Meta отправила, но не доставила (sent),
+    или доставка упала с временной ошибкой. Без единого статуса (accepted) — не знаем,
+    считаем доставленным: иначе без подписки на statuses напоминания не ушли бы никогда.
+    Окончательные ошибки (131047 — закрылось 24-часовое окно и т.п.) ожиданием не лечатся.
+    """
+    window = TTL_SEC if within_sec is None else min(within_sec, TTL_SEC)
+    with _db_lock:
+        row = _db().execute(
+            "SELECT status, error FROM deliveries WHERE recipient=? AND sent_at >= ? ORDER BY sent_at DESC LIMIT 1",
+            (recipient, time.time() - window),
+        ).fetchone()
+    if not row:
+        return False
+    status, error = row
+    if status == "failed":
+        try:
+            return (json.loads(error or "{}") or {}).get("code") in RESENDABLE_CODES
+        except ValueError:
+            return False
+    return status == "sent"
+
+
+def note_reminder_deferred() -> None:
+    _counters["reminders_deferred"] += 1
+
+
+def stats() -> dict:
+    with _db_lock:
+        by_status = dict(_db().execute("SELECT status, COUNT(*) FROM deliveries GROUP BY status").fetchall())
+        delivered = [r[0] for r in _db().execute(
+            "SELECT delivered_at - sent_at FROM deliveries WHERE delivered_at IS NOT NULL "
+            "ORDER BY sent_at DESC LIMIT 1000").fetchall()]
+        read = [r[0] for r in _db().execute(
+            "SELECT read_at - sent_at FROM deliveries WHERE read_at IS NOT NULL "
+            "ORDER BY sent_at DESC LIMIT 1000").fetchall()]
+        counters = dict(_counters)
+
+    def pct(values):
+        s = sorted(max(0.0, v) for v in values)
+
+        def q(p):
+            return round(s[min(int(len(s) * p), len(s) - 1)], 2) if s else 0
+
+        return {"n": len(s), "p50": q(0.5), "p90": q(0.9), "p99": q(0.99)}
+
+    return {
+        "ttl_sec": TTL_SEC,
+        "by_status": by_status,
+        **counters,
+        "send_to_delivered_sec": pct(delivered),
+        "send_to_read_sec": pct(read),
+    }
@@ -0,0 +1,146 @@
+# utils/fanout.py
+"""
+Параллельный запуск независимых вызовов одного хода (обычно ask_openai).
+
+В блоках 2 и 3 проверка хендовера и структурирование/классификация не зависят
+друг от друга, а шли одна за другой — ход ждал сумму задержек. FanOut запускает
+их на общем ограниченном пуле (LLM_FANOUT_WORKERS), ход ждёт самый медленный:
+
+    with FanOut() as fan:
+        handover = fan.submit(wants_handover_ai, message_text)
+        slots = fan.submit(extract_slots, ...)
+        if handover.result():
+            return ...          # выход из with отменяет ещё не начатые задачи
+
+  • контекст (llm_cache.policy, json_mode, дедлайн хода) копируется в задачу, кроме
+    переменных, помеченных not_inherited() (транзакция state: задача не пишет в чужой _Tx);
+  • внутри задачи пула вложенный submit выполняется сразу, без пула —
+    пул не забивается ожидающими друг друга задачами;
+  • cancel() снимает ещё не начатые задачи и помечает идущие: следующий ask_openai
+    в такой задаче бросит Cancelled, а не уйдёт в OpenAI. Уже отправленный запрос
+    не прерываем: его ответ просто никто не ждёт, а в кэш LLM он всё равно попадёт.
+Под gevent.monkey потоки пула — гринлеты.
+"""
+from utils.env_loader import ensure_env_loaded
+ensure_env_loaded()
+import os, threading, contextvars
+from contextvars import ContextVar
+from concurrent.futures import Future, ThreadPoolExecutor
+
+LLM_FANOUT         = os.getenv("LLM_FANOUT", "1") == "1"
+LLM_FANOUT_WORKERS = int(os.getenv("LLM_FANOUT_WORKERS", "8"))
+
+_executor: ThreadPoolExecutor | None = None
+_executor_lock = threading.Lock()
+_local = threading.local()
+_lock = threading.Lock()
+_in_flight = 0
+_counters = {"submitted": 0, "inline": 0, "cancelled": 0, "abandoned": 0, "stopped": 0, "max_in_flight": 0}
+
+# флаг отмены задачи, в которой сейчас выполняется код (None — не задача FanOut)
+_cancel_flag: ContextVar[threading.Event | None] = ContextVar("fanout_cancel", default=None)
+# переменные контекста, которые в задачу не копируются: (переменная, значение в задаче)
+_not_inherited: list[tuple[ContextVar, object]] = []
+
+
+class Cancelled(RuntimeError):
+    """Задачу FanOut отменили (например, ход ушёл в хендовер) — её результат никому не нужен."""
+
+
+def not_inherited(var: ContextVar, value=None) -> ContextVar:
+    """Не переносить var в задачи FanOut: там она будет равна value."""
+    _not_inherited.append((var, value))
+    return var
+
+
+def raise_if_cancelled() -> None:
+    """Вызывать перед дорогим шагом (запросом к OpenAI) внутри задачи."""
+    flag = _cancel_flag.get()
+    if flag is not None and flag.is_set():
+        with _lock:
+            _counters["stopped"] += 1
+        raise Cancelled("задача FanOut отменена")
+
+
+def _task_context(flag: threading.Event) -> contextvars.Context:
+    ctx = contextvars.copy_context()
+
+    def detach():
+        for var, value in _not_inherited:
+            var.set(value)
+        _cancel_flag.set(flag)
+
+    ctx.run(detach)
+    return ctx
+
+
+def _pool() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=LLM_FANOUT_WORKERS, thread_name_prefix="fanout")
+    return _executor
+
+
+def _run(ctx: contextvars.Context, fn, args, kwargs):
+    global _in_flight
+    with _lock:
+        _in_flight += 1
+        _counters["max_in_flight"] = max(_counters["max_in_flight"], _in_flight)
+    _local.in_worker = True
+    try:
+        return ctx.run(fn, *args, **kwargs)
+    finally:
+        _local.in_worker = False
+        with _lock:
+            _in_flight -= 1
+
+
+def _inline(fn, args, kwargs) -> Future:
+    fut = Future()
+    try:
+        fut.set_result(fn(*args, **kwargs))
+    except BaseException as e:
+        fut.set_exception(e)
+    return fut
+
+
+class FanOut:
+
+    def __init__(self):
+        self._futures: list[Future] = []
+        self._flag = threading.Event()
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        if not LLM_FANOUT or getattr(_local, "in_worker", False):
+            with _lock:
+                _counters["inline"] += 1
+            return _inline(fn, args, kwargs)
+        fut = _pool().submit(_run, _task_context(self._flag), fn, args, kwargs)
+        self._futures.append(fut)
+        with _lock:
+            _counters["submitted"] += 1
+        return fut
+
+    def cancel(self) -> None:
+        """Отменить всё, что ещё не завершилось (начатое остановится перед следующим запросом к OpenAI)."""
+        self._flag.set()
+        for fut in self._futures:
+            if fut.done():
+                continue
+            key = "cancelled" if fut.cancel() else "abandoned"
+            with _lock:
+                _counters[key] += 1
+        self._futures.clear()
+
+    def __enter__(self) -> "FanOut":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.cancel()
+
+
+def stats() -> dict:
+    with _lock:
+        return {"enabled": LLM_FANOUT, "workers": LLM_FANOUT_WORKERS, "in_flight": _in_flight, **_counters}
@@ -0,0 +1,170 @@
+# utils/graph_http.py
+"""
+Общий HTTP-транспорт для всех запросов к Meta Graph API.
+
+Отправка сообщений, скачивание медиа, проверка токена и загрузка материалов
+раньше шли через голые requests.get/post: новое TLS-соединение на каждый вызов,
+где-то без таймаута, таймауты и повторы у всех разные. Теперь:
+
+  • одна Session с пулом keep-alive соединений (GRAPH_HTTP_POOL);
+  • GRAPH_HTTP2=1 — HTTP/2 через httpx (нужен пакет h2), запросы мультиплексируются
+    в одном соединении; без httpx/h2 остаёмся на HTTP/1.1 с пулом;
+  • единые таймауты: соединение GRAPH_CONNECT_TIMEOUT_SEC, ответ GRAPH_READ_TIMEOUT_SEC
+    (для скачивания/загрузки файлов вызывающий передаёт свой timeout);
+  • повторы: GET — при обрыве и 429/5xx (с учётом Retry-After); POST — только если
+    соединение не установилось, чтобы не отправить сообщение клиенту дважды;
+  • задержки и ошибки по эндпоинтам (/{id}/messages, /{id}/media, /me …) — stats()
+    (/debug/graph).
+"""
+from utils.env_loader import ensure_env_loaded
+ensure_env_loaded()
+import os, re, time, threading
+from collections import deque
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from logger import logger
+
+GRAPH_API_VERSION         = os.getenv("GRAPH_API_VERSION", "v19.0")
+# локальная подмена Graph API для нагрузочных тестов: GRAPH_BASE_URL=http://127.0.0.1:8090 (scripts/fake_graph_api.py)
+GRAPH_BASE_URL            = os.getenv("GRAPH_BASE_URL", "https://graph.facebook.com").rstrip("/")
+GRAPH_HTTP_POOL           = int(os.getenv("GRAPH_HTTP_POOL", "20"))
+GRAPH_HTTP2               = os.getenv("GRAPH_HTTP2", "0") == "1"
+GRAPH_CONNECT_TIMEOUT_SEC = float(os.getenv("GRAPH_CONNECT_TIMEOUT_SEC", "3.05"))
+GRAPH_READ_TIMEOUT_SEC    = float(os.getenv("GRAPH_READ_TIMEOUT_SEC", "20"))
+GRAPH_HTTP_RETRIES        = int(os.getenv("GRAPH_HTTP_RETRIES", "2"))
+
+# что ловить вызывающему вместо requests.RequestException (в режиме HTTP/2 — ещё и ошибки httpx)
+HTTPError: tuple = (requests.RequestException,)
+
+_session = None
+_session_lock = threading.Lock()
+_backend = "http/1.1"
+_lock = threading.Lock()
+_endpoints: dict[str, dict] = {}
+
+
+def graph_url(path: str) -> str:
+    """graph_url("123/messages") → https://graph.facebook.com/v19.0/123/messages"""
+    return f"{GRAPH_BASE_URL}/{GRAPH_API_VERSION}/{path.lstrip('/')}"
+
+
+def _retry() -> Retry:
+    return Retry(
+        total=GRAPH_HTTP_RETRIES,
+        connect=GRAPH_HTTP_RETRIES,
+        read=GRAPH_HTTP_RETRIES,
+        status=GRAPH_HTTP_RETRIES,
+        backoff_factor=0.3,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset({"GET", "HEAD"}),   # POST повторяем только при connect-ошибке
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+
+
+def _requests_session() -> requests.Session:
+    s = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=GRAPH_HTTP_POOL, max_retries=_retry())
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    return s
+
+
+class _Http2Session:
+    """httpx.Client с HTTP/2 под интерфейсом requests.Session (то, чем пользуются вызывающие)."""
+
+    def __init__(self, httpx):
+        self._httpx = httpx
+        self._client = httpx.Client(
+            http2=True,
+            limits=httpx.Limits(max_connections=GRAPH_HTTP_POOL, max_keepalive_connections=GRAPH_HTTP_POOL),
+            transport=httpx.HTTPTransport(http2=True, retries=GRAPH_HTTP_RETRIES),
+        )
+
+    def request(self, method, url, *, timeout=None, **kwargs):
+        connect, read = timeout if isinstance(timeout, tuple) else (GRAPH_CONNECT_TIMEOUT_SEC, timeout)
+        kwargs["timeout"] = self._httpx.Timeout(read, connect=connect)
+        resp = self._client.request(method, url, **kwargs)
+        resp.ok = resp.is_success                  # как у requests.Response
+        resp.reason = resp.reason_phrase
+        return resp
+
+
+def _get_session():
+    global _session, _backend, HTTPError
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                if GRAPH_HTTP2:
+                    try:
+                        import httpx, h2  # noqa: F401
+                        _session = _Http2Session(httpx)
+                        _backend = "http/2"
+                        HTTPError = (requests.RequestException, httpx.HTTPError)
+                    except ImportError:
+                        logger.warning("⚠️ GRAPH_HTTP2=1, но httpx[http2] не установлен — работаем по HTTP/1.1")
+                if _session is None:
+                    _session = _requests_session()
+    return _session
+
+
+def _endpoint(method: str, url: str) -> str:
+    """Метка для метрик: id в пути → {id}, чужие хосты (lookaside CDN медиа) — по имени хоста."""
+    parts = urlsplit(url)
+    if parts.netloc != urlsplit(GRAPH_BASE_URL).netloc:
+        return f"{method} {parts.netloc}"
+    segs = [s for s in parts.path.split("/") if s]
+    if segs and re.fullmatch(r"v\d+\.\d+", segs[0]):
+        segs = segs[1:]
+    return f"{method} /" + "/".join(s if re.fullmatch(r"[a-z_]+", s) else "{id}" for s in segs)
+
+
+def _record(endpoint: str, elapsed: float, error: bool) -> None:
+    with _lock:
+        ep = _endpoints.setdefault(endpoint, {"requests": 0, "errors": 0, "latency": deque(maxlen=200)})
+        ep["requests"] += 1
+        ep["errors"] += error
+        ep["latency"].append(elapsed)
+
+
+def request(method: str, url: str, *, timeout=None, **kwargs):
+    """Запрос через общий пул. timeout по умолчанию — (connect, read) из настроек."""
+    if timeout is None:
+        timeout = (GRAPH_CONNECT_TIMEOUT_SEC, GRAPH_READ_TIMEOUT_SEC)
+    elif not isinstance(timeout, tuple):
+        timeout = (GRAPH_CONNECT_TIMEOUT_SEC, timeout)
+    endpoint = _endpoint(method, url)
+    start = time.monotonic()
+    try:
+        resp = _get_session().request(method, url, timeout=timeout, **kwargs)
+    except Exception:
+        _record(endpoint, time.monotonic() - start, True)
+        raise
+    _record(endpoint, time.monotonic() - start, resp.status_code >= 400)
+    return resp
+
+
+def get(url: str, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+def stats() -> dict:
+    with _lock:
+        endpoints = {}
+        for name, ep in _endpoints.items():
+            s = sorted(ep["latency"])
+            endpoints[name] = {
+                "requests": ep["requests"],
+                "errors": ep["errors"],
+                "p50_ms": round(s[len(s) // 2] * 1000, 1) if s else 0,
+                "p95_ms": round(s[int(len(s) * 0.95)] * 1000, 1) if s else 0,
+                "max_ms": round(s[-1] * 1000, 1) if s else 0,
+            }
+    return {"backend": _backend, "base_url": GRAPH_BASE_URL, "pool": GRAPH_HTTP_POOL,
+            "api_version": GRAPH_API_VERSION, "endpoints": endpoints}
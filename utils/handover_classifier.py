@@ -0,0 +1,217 @@
+# utils/handover_classifier.py
+"""
+Локальный классификатор «клиент хочет к Арсению / про деньги» перед LLM-фолбэком
+wants_handover_ai.
+
+Символьные n-граммы (2–4) → TF-IDF → логистическая регрессия. Без numpy/sklearn:
+модель маленькая (сотни примеров), предсказание — доли миллисекунды.
+
+Обучение — scripts/train_handover_classifier.py на data/handover_dataset.tsv;
+результат (словарь, веса и откалиброванная полоса порогов) — в data/handover_model.json.
+decide(): p ≥ high → True, p ≤ low → False, между ними — None (спросить LLM).
+"""
+from utils.env_loader import ensure_env_loaded
+ensure_env_loaded()
+import os, re, math, json, random, threading
+from collections import Counter
+from logger import logger
+
+HANDOVER_CLASSIFIER = os.getenv("HANDOVER_CLASSIFIER", "1") == "1"
+HANDOVER_MODEL_PATH = os.getenv("HANDOVER_MODEL_PATH", "data/handover_model.json")
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+NGRAM_MIN, NGRAM_MAX = 2, 4
+
+
+def normalize(text: str) -> str:
+    s = (text or "").casefold().replace("ё", "е")
+    s = re.sub(r"\d+", "0", s)
+    s = re.sub(r"[^\w0]+", " ", s)
+    return s.strip()
+
+
+def char_ngrams(text: str) -> Counter:
+    """n-граммы внутри слов с пробелами по краям (как char_wb в sklearn)."""
+    grams = Counter()
+    for word in normalize(text).split():
+        w = f" {word} "
+        for n in range(NGRAM_MIN, NGRAM_MAX + 1):
+            for i in range(len(w) - n + 1):
+                grams[w[i:i + n]] += 1
+    return grams
+
+
+class HandoverClassifier:
+
+    def __init__(self, idf: dict[str, float], weights: dict[str, float], bias: float,
+                 low: float = 0.2, high: float = 0.8, meta: dict | None = None):
+        self.idf = idf
+        self.weights = weights
+        self.bias = bias
+        self.low = low
+        self.high = high
+        self.meta = meta or {}
+
+    # ─── признаки ────────────────────────────────────────────────
+    @staticmethod
+    def _vectorize(grams: Counter, idf: dict[str, float]) -> dict[str, float]:
+        vec = {g: (1 + math.log(c)) * idf[g] for g, c in grams.items() if g in idf}
+        norm = math.sqrt(sum(v * v for v in vec.values()))
+        return {g: v / norm for g, v in vec.items()} if norm else {}
+
+    def proba(self, text: str) -> float:
+        vec = self._vectorize(char_ngrams(text), self.idf)
+        z = self.bias + sum(self.weights.get(g, 0.0) * v for g, v in vec.items())
+        return _sigmoid(z)
+
+    def decide(self, text: str) -> bool | None:
+        p = self.proba(text)
+        if p >= self.high:
+            return True
+        if p <= self.low:
+            return False
+        return None
+
+    # ─── обучение ────────────────────────────────────────────────
+    @classmethod
+    def fit(cls, texts: list[str], labels: list[int], epochs: int = 60, lr: float = 0.5,
+            l2: float = 1e-4, min_df: int = 1, seed: int = 0) -> "HandoverClassifier":
+        grams = [char_ngrams(t) for t in texts]
+        df = Counter(g for gs in grams for g in gs)
+        n = len(texts)
+        idf = {g: math.log((1 + n) / (1 + d)) + 1 for g, d in df.items() if d >= min_df}
+        X = [cls._vectorize(gs, idf) for gs in grams]
+
+        # веса классов — чтобы перекос датасета не сдвигал порог
+        pos = sum(labels) or 1
+        cw = {1: n / (2 * pos), 0: n / (2 * max(n - pos, 1))}
+        w: dict[str, float] = {}
+        b = 0.0
+        order = list(range(n))
+        rnd = random.Random(seed)
+        for epoch in range(epochs):
+            rnd.shuffle(order)
+            step = lr / (1 + epoch * 0.1)
+            for i in order:
+                x, y = X[i], labels[i]
+                p = _sigmoid(b + sum(w.get(g, 0.0) * v for g, v in x.items()))
+                grad = (p - y) * cw[y]
+                for g, v in x.items():
+                    w[g] = w.get(g, 0.0) * (1 - step * l2) - step * grad * v
+                b -= step * grad
+        weights = {g: round(v, 5) for g, v in w.items() if abs(v) >= 1e-4}
+        idf = {g: round(v, 5) for g, v in idf.items() if g in weights}
+        return cls(idf, weights, round(b, 5))
+
+    # ─── файл модели ─────────────────────────────────────────────
+    def to_dict(self) -> dict:
+        return {"ngram": [NGRAM_MIN, NGRAM_MAX], "low": self.low, "high": self.high,
+                "bias": self.bias, "idf": self.idf, "weights": self.weights, "meta": self.meta}
+
+    def save(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+
+    @classmethod
+    def load(cls, path: str) -> "HandoverClassifier":
+        with open(path, encoding="utf-8") as f:
+            d = json.load(f)
+        return cls(d["idf"], d["weights"], d["bias"], d["low"], d["high"], d.get("meta"))
+
+
+def _sigmoid(z: float) -> float:
+    if z < -30:
+        return 0.0
+    if z > 30:
+        return 1.0
+    return 1 / (1 + math.exp(-z))
+
+
+# ─── датасет и калибровка (используются скриптом обучения и тестами) ─────
+def load_dataset(path: str = "data/handover_dataset.tsv") -> tuple[list[str], list[int]]:
+    texts, labels = [], []
+    with open(path, encoding="utf-8") as f:
+        next(f)                                     # заголовок label\ttext
+        for line in f:
+            if line.strip():
+                label, text = line.rstrip("\n").split("\t", 1)
+                texts.append(text)
+                labels.append(int(label))
+    return texts, labels
+
+
+def cross_val_proba(texts, labels, folds: int = 5, **fit_kw) -> list[float]:
+    """Вероятности «вне выборки»: каждый пример предсказан моделью, которая его не видела."""
+    probs = [0.0] * len(texts)
+    for k in range(folds):
+        train = [i for i in range(len(texts)) if i % folds != k]
+        model = HandoverClassifier.fit([texts[i] for i in train], [labels[i] for i in train], **fit_kw)
+        for i in range(k, len(texts), folds):
+            probs[i] = model.proba(texts[i])
+    return probs
+
+
+def calibrate_band(probs, labels, target: float = 0.97) -> tuple[float, float]:
+    """
+    Полоса неуверенности [low, high]: выше high доля настоящих «да» ≥ target,
+    ниже low доля настоящих «нет» ≥ target. Всё между — к LLM.
+    """
+    pairs = sorted(zip(probs, labels))
+    high = 1.0
+    for t, _ in pairs:                               # самый низкий порог, при котором «да» ещё точны
+        above = [y for p, y in pairs if p >= t]
+        if sum(above) / len(above) >= target:
+            high = t
+            break
+    low = 0.0
+    for t, _ in reversed(pairs):                     # самый высокий порог, при котором «нет» ещё точны
+        below = [y for p, y in pairs if p <= t]
+        if (len(below) - sum(below)) / len(below) >= target:
+            low = t
+            break
+    if low >= high:                                  # датасет слишком «лёгкий» — не схлопываем полосу
+        low, high = min(low, 0.5), max(high, 0.5)
+    return round(low, 4), round(high, 4)
+
+
+# ─── модель процесса ─────────────────────────────────────────────
+_model: HandoverClassifier | None = None
+_loaded = False
+_load_lock = threading.Lock()
+_counters = {"local_yes": 0, "local_no": 0, "ambiguous": 0}
+
+
+def get_classifier() -> HandoverClassifier | None:
+    global _model, _loaded
+    if not _loaded:
+        with _load_lock:
+            if not _loaded:
+                path = os.path.join(_ROOT, HANDOVER_MODEL_PATH)     # относительный путь — от корня проекта
+                if HANDOVER_CLASSIFIER and os.path.exists(path):
+                    try:
+                        _model = HandoverClassifier.load(path)
+                        logger.info(f"[handover_clf] 🧠 модель загружена: {len(_model.weights)} признаков, "
+                                    f"полоса LLM {_model.low}–{_model.high}")
+                    except Exception as e:
+                        logger.warning(f"[handover_clf] ⚠️ модель не загрузилась ({e}) — решает LLM")
+                _loaded = True
+    return _model
+
+
+def decide(text: str) -> bool | None:
+    """True/False — уверенный локальный ответ, None — классификатор сомневается или выключен."""
+    model = get_classifier()
+    if model is None:
+        return None
+    verdict = model.decide(text)
+    key = "ambiguous" if verdict is None else ("local_yes" if verdict else "local_no")
+    _counters[key] += 1
+    return verdict
+
+
+def stats() -> dict:
+    model = get_classifier()
+    return {
+        "enabled": model is not None,
+        "band": [model.low, model.high] if model else None,
+        **_counters,
+    }
@@ -0,0 +1,331 @@
+# utils/inbound_queue.py
+"""
+Надёжная очередь входящих событий вебхука (SQLite в режиме WAL).
+
+Вебхук только проверяет подпись, складывает события сюда и сразу отвечает 200.
+Насос разбирает очередь и раздаёт события по дорожкам пользователей
+(utils.user_lanes): один клиент — строго по порядку, разные — параллельно. Если процесс упал
+посреди обработки — событие вернётся в очередь при следующем старте.
+enqueue(..., delay=) — событие не раньше чем через delay секунд (повтор хода после
+лимита OpenAI переживает рестарт, в отличие от таймера в памяти).
+Склейка коротких сообщений (incoming_message) хранит ещё не отправленные в роутер
+части здесь же (pending_bursts): событие уже подтверждено, но текст клиента
+не теряется, если процесс упал в окне склейки.
+
+Упавшее событие повторяем сразу на той же дорожке (до MAX_ATTEMPTS раз): более поздние
+события клиента ждут и не обгоняют его. Повторяем, только если наружу ничего не ушло
+(state.note_external_effect не вызывался) — обработчик не идемпотентен и второй раз
+отправил бы клиенту то же сообщение. Иначе событие — в dead и алерт в Telegram.
+"""
+from utils.env_loader import ensure_env_loaded
+ensure_env_loaded()
+import os, json, time, sqlite3, threading
+from collections import deque
+from logger import logger
+from state.state import track_external_effects
+from utils import user_lanes
+
+QUEUE_PATH   = os.getenv("INBOUND_QUEUE_PATH", "tmp/inbound_queue.db")
+MAX_INFLIGHT = int(os.getenv("INBOUND_MAX_INFLIGHT", "500"))   # сколько событий раздано по дорожкам
+MAX_ATTEMPTS = int(os.getenv("INBOUND_MAX_ATTEMPTS", "3"))
+RETRY_DELAY_SEC = float(os.getenv("INBOUND_RETRY_DELAY_SEC", "1"))   # пауза перед повтором, растёт с попыткой
+POLL_SEC     = 1.0            # страховочный опрос, если уведомление потерялось
+
+_conn: sqlite3.Connection | None = None
+_db_lock = threading.Lock()
+_wakeup  = threading.Condition()
+_running = threading.Event()
+_pump: threading.Thread | None = None
+_inflight = 0
+
+# метрики
+_latencies = deque(maxlen=1000)   # enqueue → start, секунды
+_counters  = {"enqueued": 0, "processed": 0, "failed": 0, "retried": 0, "dead": 0}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS inbound_events (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind        TEXT    NOT NULL,
+    payload     TEXT    NOT NULL,
+    enqueued_at REAL    NOT NULL,
+    not_before  REAL    NOT NULL DEFAULT 0,
+    status      TEXT    NOT NULL DEFAULT 'pending',
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    last_error  TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_inbound_status ON inbound_events(status, id);
+CREATE TABLE IF NOT EXISTS pending_bursts (
+    user        TEXT NOT NULL,
+    first_ts    REAL NOT NULL,
+    data        TEXT NOT NULL,
+    PRIMARY KEY (user, first_ts)
+);
+"""
+
+
+def _db() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        folder = os.path.dirname(QUEUE_PATH)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        _conn = sqlite3.connect(QUEUE_PATH, check_same_thread=False, isolation_level=None)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("PRAGMA synchronous=NORMAL")
+        _conn.executescript(_SCHEMA)
+        cols = {r[1] for r in _conn.execute("PRAGMA table_info(inbound_events)")}
+        if "not_before" not in cols:             # файл очереди от прошлой версии
+            _conn.execute("ALTER TABLE inbound_events ADD COLUMN not_before REAL NOT NULL DEFAULT 0")
+    return _conn
+
+
+def configure(path: str | None = None) -> None:
+    """Переключить файл очереди (нужно тестам и скриптам). Только до start_workers()."""
+    global QUEUE_PATH, _conn
+    with _db_lock:
+        if _conn is not None:
+            _conn.close()
+            _conn = None
+        if path:
+            QUEUE_PATH = path
+
+
+# ─── запись ──────────────────────────────────────────────────────
+def enqueue_many(events: list[tuple[str, dict]], delay: float = 0.0) -> int:
+    """
+    Положить пачку событий одной транзакцией.
+    events — список (kind, payload), payload должен сериализоваться в JSON.
+    """
+    if not events:
+        return 0
+    now = time.time()
+    rows = [(kind, json.dumps(payload, ensure_ascii=False), now, now + delay) for kind, payload in events]
+    with _db_lock:
+        db = _db()
+        db.execute("BEGIN IMMEDIATE")
+        db.executemany(
+            "INSERT INTO inbound_events(kind, payload, enqueued_at, not_before) VALUES (?, ?, ?, ?)", rows
+        )
+        db.execute("COMMIT")
+        _counters["enqueued"] += len(rows)
+    with _wakeup:
+        _wakeup.notify(len(rows))
+    return len(rows)
+
+
+def enqueue(kind: str, payload: dict, delay: float = 0.0) -> int:
+    return enqueue_many([(kind, payload)], delay=delay)
+
+
+# ─── незавершённые склейки ───────────────────────────────────────
+def save_burst(user: str, first_ts: float, data: dict) -> None:
+    """Записать (перезаписать) копящуюся склейку пользователя."""
+    with _db_lock:
+        _db().execute(
+            "INSERT OR REPLACE INTO pending_bursts(user, first_ts, data) VALUES (?, ?, ?)",
+            (user, first_ts, json.dumps(data, ensure_ascii=False)),
+        )
+
+
+def drop_burst(user: str, first_ts: float) -> None:
+    """Склейка отработала — удаляем (только её: следующая могла уже начаться)."""
+    with _db_lock:
+        _db().execute("DELETE FROM pending_bursts WHERE user=? AND first_ts=?", (user, first_ts))
+
+
+def pending_bursts() -> list[tuple[str, float, dict]]:
+    """Склейки, не дошедшие до роутера (после рестарта), в порядке начала."""
+    with _db_lock:
+        rows = _db().execute("SELECT user, first_ts, data FROM pending_bursts ORDER BY first_ts").fetchall()
+    return [(user, first_ts, json.loads(data)) for user, first_ts, data in rows]
+
+
+# ─── разбор ──────────────────────────────────────────────────────
+def _claim_batch(limit: int) -> list:
+    """Забрать до limit самых старых pending-событий и пометить их processing."""
+    if limit <= 0:
+        return []
+    with _db_lock:
+        db = _db()
+        db.execute("BEGIN IMMEDIATE")
+        rows = db.execute(
+            "SELECT id, kind, payload, MAX(enqueued_at, not_before), attempts FROM inbound_events "
+            "WHERE status='pending' AND not_before <= ? ORDER BY id LIMIT ?", (time.time(), limit)
+        ).fetchall()
+        if rows:
+            db.executemany(
+                "UPDATE inbound_events SET status='processing', attempts=attempts+1 WHERE id=?",
+                [(r[0],) for r in rows],
+            )
+        db.execute("COMMIT")
+    return rows
+
+
+def _done(event_id: int) -> None:
+    with _db_lock:
+        _db().execute("DELETE FROM inbound_events WHERE id=?", (event_id,))
+        _counters["processed"] += 1
+
+
+def _retry(event_id: int, err: Exception) -> None:
+    """Событие остаётся processing (его держит дорожка), считаем ещё одну попытку."""
+    with _db_lock:
+        _db().execute(
+            "UPDATE inbound_events SET attempts=attempts+1, last_error=? WHERE id=?",
+            (repr(err)[:500], event_id),
+        )
+        _counters["failed"] += 1
+        _counters["retried"] += 1
+
+
+def _dead(event_id: int, kind: str, err: Exception, why: str) -> None:
+    with _db_lock:
+        _db().execute(
+            "UPDATE inbound_events SET status='dead', last_error=? WHERE id=?",
+            (repr(err)[:500], event_id),
+        )
+        _counters["failed"] += 1
+        _counters["dead"] += 1
+    logger.error(f"☠️ inbound_queue: событие {event_id} ({kind}) не обработано — {why}")
+    try:
+        from utils.telegram_alert import send_telegram_alert
+        send_telegram_alert(f"☠️ Входящее событие {event_id} ({kind}) не обработано — {why}: {err!r}"[:1000])
+    except Exception as e:
+        logger.warning(f"⚠️ inbound_queue: алерт не отправлен: {e}")
+
+
+def _run_event(handler, row) -> None:
+    """Выполняется уже на дорожке пользователя."""
+    global _inflight
+    event_id, kind, payload, enqueued_at, attempts = row
+    _latencies.append(max(0.0, time.time() - enqueued_at))
+    try:
+        while True:
+            attempts += 1
+            with track_external_effects() as effects:
+                try:
+                    handler(kind, json.loads(payload))
+                    err = None
+                except Exception as e:
+                    logger.exception(f"💥 inbound_queue: событие {event_id} ({kind}) упало "
+                                     f"(попытка {attempts}/{MAX_ATTEMPTS}): {e}")
+                    err = e
+            if err is None:
+                _done(event_id)
+                break
+            if effects[0]:
+                # клиенту уже что-то ушло — повтор продублировал бы это
+                _dead(event_id, kind, err, f"внешних действий {effects[0]}, не повторяем")
+                break
+            if attempts >= MAX_ATTEMPTS:
+                _dead(event_id, kind, err, f"попытки исчерпаны ({attempts})")
+                break
+            # повторяем здесь же: более поздние события клиента стоят за нами в дорожке
+            _retry(event_id, err)
+            time.sleep(RETRY_DELAY_SEC * attempts)
+    finally:
+        with _wakeup:
+            _inflight -= 1
+            _wakeup.notify_all()
+
+
+def _pump_loop(handler, key_fn):
+    """
+    Один «насос»: забирает события из SQLite и раскладывает по дорожкам
+    пользователей (utils.user_lanes). Порядок внутри пользователя — порядок в очереди.
+    """
+    global _inflight
+    while _running.is_set():
+        try:
+            rows = _claim_batch(MAX_INFLIGHT - _inflight)
+            for row in rows:
+                _, kind, payload, _, _ = row
+                try:
+                    user_key = key_fn(kind, json.loads(payload))
+                except Exception:
+                    user_key = ""
+                with _wakeup:
+                    _inflight += 1
+                user_lanes.submit(user_key, _run_event, handler, row)
+            if rows:
+                continue
+        except Exception as e:
+            logger.exception(f"💥 inbound_queue pump: {e}")
+        with _wakeup:
+            _wakeup.wait(POLL_SEC)
+
+
+def start_workers(handler, key_fn=None) -> None:
+    """
+    Запустить разбор очереди. handler(kind, payload) вызывается для каждого события
+    на дорожке пользователя key_fn(kind, payload). Без key_fn всё идёт одной дорожкой.
+    Идемпотентен: повторный вызов ничего не делает.
+    """
+    global _pump
+    if _running.is_set():
+        return
+    with _db_lock:
+        # всё, что осталось processing после падения, — обратно в очередь
+        recovered = _db().execute(
+            "UPDATE inbound_events SET status='pending' WHERE status='processing'"
+        ).rowcount
+    if recovered:
+        logger.warning(f"♻️ inbound_queue: возвращено в очередь после рестарта: {recovered}")
+    _running.set()
+    _pump = threading.Thread(target=_pump_loop, args=(handler, key_fn or (lambda k, p: "")),
+                             name="inbound-pump", daemon=True)
+    _pump.start()
+    logger.info(f"📥 inbound_queue: запущен разбор очереди ({QUEUE_PATH}), дорожек {user_lanes.LANES}")
+
+
+def stop_workers(timeout: float = 5.0) -> None:
+    """Остановить насос и дождаться уже розданных по дорожкам событий."""
+    global _pump
+    _running.clear()
+    with _wakeup:
+        _wakeup.notify_all()
+    if _pump is not None:
+        _pump.join(timeout)
+        _pump = None
+    user_lanes.wait_idle(timeout)
+
+
+def is_running() -> bool:
+    return _running.is_set()
+
+
+# ─── метрики ─────────────────────────────────────────────────────
+def _percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    idx = min(len(values) - 1, int(round(q * (len(values) - 1))))
+    return values[idx]
+
+
+def stats() -> dict:
+    """Глубина очереди и задержка enqueue→start (мс) по последним событиям."""
+    with _db_lock:
+        rows = _db().execute(
+            "SELECT status, COUNT(*) FROM inbound_events GROUP BY status"
+        ).fetchall()
+        (bursts,) = _db().execute("SELECT COUNT(*) FROM pending_bursts").fetchone()
+        counters = dict(_counters)
+    by_status = {status: n for status, n in rows}
+    lat = list(_latencies)
+    return {
+        "running": is_running(),
+        "lanes": user_lanes.LANES,
+        "depth": by_status.get("pending", 0),
+        "in_progress": by_status.get("processing", 0),
+        "inflight": _inflight,
+        "dead": by_status.get("dead", 0),
+        "pending_bursts": bursts,
+        **{f"total_{k}": v for k, v in counters.items()},
+        "wait_ms": {
+            "p50": round(_percentile(lat, 0.50) * 1000, 1),
+            "p90": round(_percentile(lat, 0.90) * 1000, 1),
+            "p99": round(_percentile(lat, 0.99) * 1000, 1),
+            "max": round(max(lat, default=0.0) * 1000, 1),
+        },
+    }
@@ -1,12 +1,13 @@
 from utils.env_loader import ensure_env_loaded
 ensure_env_loaded()
-import os, time, threading, requests
+import os, time, threading
 from openai import OpenAI
 from logger import logger
-from state.state import save_if_absent, get_state, update_state
+from state.state import save_if_absent, get_state, update_state, transaction
 from utils.token_manager import get_token
 from router import route_message
 import utils.outgoing_message as outgoing
+from utils import user_lanes, llm_limiter, graph_http, delivery_status, inbound_queue, deadline as turn_deadline
 from datetime import datetime
 from zoneinfo import ZoneInfo
 
@@ -22,7 +23,19 @@ S3_BUCKET = os.getenv("YANDEX_BUCKET", "magicacademylogsars")
 S3_ENDPOINT = os.getenv("YANDEX_ENDPOINT", "https://storage.yandexcloud.net")
 S3_REGION = os.getenv("YANDEX_REGION", "ru-central1")
 
-def handle_message(message, phone_number_id, bot_display_number, contacts):
+# Склейка «очереди» коротких сообщений: ждём паузу BURST_WINDOW_SEC после последнего,
+# но не дольше BURST_MAX_SEC от первого. 0 — отключено (каждое сообщение — отдельный ход).
+BURST_WINDOW_SEC = float(os.getenv("BURST_WINDOW_SEC", "3"))
+BURST_MAX_SEC = float(os.getenv("BURST_MAX_SEC", "10"))
+# OpenAI так и не пустил запрос (429 после всех повторов) — ход целиком повторяем один раз через
+# это время (через входящую очередь), если внутри хода клиенту ещё ничего не ушло
+RATE_LIMIT_TURN_RETRY_SEC = float(os.getenv("RATE_LIMIT_TURN_RETRY_SEC", "30"))
+
+_bursts: dict[str, dict] = {}
+_bursts_lock = threading.Lock()
+_burst_counters = {"turns": 0, "messages": 0}
+
+def handle_message(message, phone_number_id, bot_display_number, contacts, received_at=None):
     from_number = message.get("from")
     meta_msg_id = message.get("id")           # <-- добавили
     meta_ts     = int(message.get("timestamp", time.time()))
@@ -37,21 +50,18 @@ def handle_message(message, phone_number_id, bot_display_number, contacts):
     if message.get("type") == "text":
         text = message.get("text", {}).get("body", "").strip()
         process_text_message(text, normalized_number, phone_number_id, name,
-                             meta_message_id=meta_msg_id, meta_ts=meta_ts)
+                             meta_message_id=meta_msg_id, meta_ts=meta_ts, received_at=received_at)
 
     elif message.get("type") == "audio":
-        logger.info("🎤 Аудио передаётся на фон для обработки")
-        threading.Thread(
-            target=handle_audio_async,
-            args=(message, phone_number_id, normalized_number, name),
-            daemon=True
-        ).start()
+        # на дорожке клиента: голосовое не обгонит текст, отправленный следом
+        logger.info("🎤 Аудио передаётся в дорожку пользователя для обработки")
+        user_lanes.run_in_lane(normalized_number, handle_audio_async,
+                               message, phone_number_id, normalized_number, name)
     elif message.get("type") in ("image", "document"):
         # MVP: медиа не обрабатываем — ответим пользователю вежливо
         logger.info("🖼 Получено media-сообщение (%s) — в MVP не обрабатываем", message["type"])
-        threading.Thread(target=handle_media_async,
-                         args=(message, phone_number_id, normalized_number),
-                         daemon=True).start()
+        user_lanes.run_in_lane(normalized_number, handle_media_async,
+                               message, phone_number_id, normalized_number)
 
 def handle_audio_async(message, phone_number_id, normalized_number, name):
     from pydub import AudioSegment
@@ -59,13 +69,12 @@ def handle_audio_async(message, phone_number_id, normalized_number, name):
         audio_id = message["audio"]["id"]
         logger.info(f"🎿 Обработка голосового файла, media ID: {audio_id}")
 
-        url = f"https://graph.facebook.com/v19.0/{audio_id}"
         headers = {"Authorization": f"Bearer {get_token()}"}
-        resp = requests.get(url, headers=headers, timeout=10)
+        resp = graph_http.get(graph_http.graph_url(audio_id), headers=headers)
         resp.raise_for_status()
         media_url = resp.json().get("url")
 
-        media_resp = requests.get(media_url, headers=headers, timeout=30)
+        media_resp = graph_http.get(media_url, headers=headers, timeout=30)
         media_resp.raise_for_status()
         # локальный путь
         audio_path = "/tmp/audio.ogg"
@@ -166,7 +175,8 @@ def process_text_message(text: str,
                          phone_number_id: str,
                          name: str | None,
                          meta_message_id: str | None = None,
-                         meta_ts: int | None = None):
+                         meta_ts: int | None = None,
+                         received_at: float | None = None):
     from state.state import get_state, update_state, save_if_absent
     if not text:
         return
@@ -203,8 +213,106 @@ def process_text_message(text: str,
                    raw_number=normalized_number,
                    client_name=name or "")
 
+    # несколько коротких сообщений подряд → один ход роутера (один вызов LLM)
+    if BURST_WINDOW_SEC <= 0:
+        _route_turn(text, normalized_number, phone_number_id, name, parts=1, received_at=received_at)
+        return
+    _add_to_burst(text, normalized_number, phone_number_id, name, received_at)
+
+
+def _add_to_burst(text, normalized_number, phone_number_id, name, received_at=None):
+    """Копим сообщение в буфер пользователя и (пере)заводим окно тишины."""
+    now = time.time()
+    with _bursts_lock:
+        burst = _bursts.get(normalized_number)
+        if burst is None:
+            burst = _bursts[normalized_number] = {
+                "parts": [], "first_ts": now, "phone_id": phone_number_id, "name": name,
+            }
+            threading.Thread(target=_burst_timer, args=(normalized_number,),
+                             name="burst-timer", daemon=True).start()
+        burst["parts"].append(text)
+        burst["name"] = name or burst["name"]
+        # бюджет хода — от последнего сообщения склейки: окно тишины мы ждём намеренно
+        burst["received_at"] = received_at or now
+        burst["deadline"] = min(now + BURST_WINDOW_SEC, burst["first_ts"] + BURST_MAX_SEC)
+        # событие входящей очереди подтвердится сразу после возврата — текст держим на диске
+        inbound_queue.save_burst(normalized_number, burst["first_ts"], {
+            k: burst[k] for k in ("parts", "phone_id", "name", "received_at")})
+
+
+def _burst_timer(normalized_number):
+    """Ждём окончания окна и отдаём склейку в дорожку пользователя (порядок сохраняется)."""
+    while True:
+        with _bursts_lock:
+            burst = _bursts.get(normalized_number)
+            left = burst["deadline"] - time.time() if burst else 0
+        if left <= 0:
+            break
+        time.sleep(left)
+    user_lanes.submit(normalized_number, _flush_burst, normalized_number)
+
+
+def _flush_burst(normalized_number):
+    with _bursts_lock:
+        burst = _bursts.pop(normalized_number, None)
+    if not burst:
+        return
+    _route_burst(normalized_number, burst["first_ts"], burst)
+
+
+def _route_burst(normalized_number, first_ts, burst):
+    parts = burst["parts"]
+    if len(parts) > 1:
+        logger.info(f"🧩 склеено сообщений: {len(parts)} user={normalized_number}")
+    _route_turn("\n".join(parts), normalized_number, burst["phone_id"], burst["name"], parts=len(parts),
+                received_at=burst["received_at"])
+    inbound_queue.drop_burst(normalized_number, first_ts)
+
+
+def recover_bursts() -> int:
+    """
+    Склейки, которые копились в момент падения/редеплоя, — в дорожки пользователей.
+    Вызывать до запуска входящей очереди: так они обгонят более новые события клиента.
+    """
+    pending = inbound_queue.pending_bursts()
+    for normalized_number, first_ts, burst in pending:
+        user_lanes.submit(normalized_number, _route_burst, normalized_number, first_ts, burst)
+    if pending:
+        logger.warning(f"♻️ восстановлено незавершённых склеек после рестарта: {len(pending)}")
+    return len(pending)
+
+
+def _route_turn(text, normalized_number, phone_number_id, name, parts, attempt=0, received_at=None):
+    if attempt == 0:
+        _burst_counters["turns"] += 1
+        _burst_counters["messages"] += parts
+    # повтор после лимита — новый ход со своим бюджетом
+    deadline = turn_deadline.Deadline(started_at=received_at if attempt == 0 else None)
+    tx = None
     try:
-        route_message(text, normalized_number, client_name=name)
+        with turn_deadline.scope(deadline), transaction(normalized_number) as tx:
+            route_message(text, normalized_number, client_name=name)
+    except llm_limiter.LLMRateLimited:
+        if tx is not None and tx.external_effects:
+            # клиенту уже что-то ушло (ответ, бронь, напоминание) — повтор продублировал бы это;
+            # состояние, до которого дошёл ход, сохранено транзакцией
+            logger.error(f"💥 лимит OpenAI посреди хода {normalized_number}: "
+                         f"внешних действий {tx.external_effects}, ход не повторяем")
+        elif attempt == 0:
+            # ничего наружу не ушло, изменения откатились — повторяем ход целиком через очередь
+            logger.warning(f"⏳ лимит OpenAI: ход {normalized_number} повторим через {RATE_LIMIT_TURN_RETRY_SEC:.0f} с")
+            inbound_queue.enqueue("turn_retry", {
+                "user": normalized_number, "text": text, "phone_id": phone_number_id,
+                "name": name, "parts": parts,
+            }, delay=RATE_LIMIT_TURN_RETRY_SEC)
+        else:
+            logger.error(f"💥 лимит OpenAI: ход {normalized_number} не выполнен и после повтора")
+            outgoing.send_text_message(
+                phone_number_id,
+                normalized_number,
+                "Техническая ошибка. Попробуйте позже."
+            )
     except Exception as e:
         logger.exception(f"💥 Ошибка route_message для {normalized_number}: {e}")
         outgoing.send_text_message(
@@ -212,6 +320,29 @@ def process_text_message(text: str,
             normalized_number,
             "Техническая ошибка. Попробуйте позже."
         )
+    turn_deadline.record_turn(deadline)
+    if deadline.expired():
+        logger.warning(f"⏱ ход {normalized_number} вышел за бюджет: {deadline.elapsed():.1f} с из {deadline.budget:.0f}")
+
+
+def retry_turn(payload: dict) -> None:
+    """Событие turn_retry из входящей очереди: повтор хода, упёршегося в лимит OpenAI."""
+    _route_turn(payload["text"], payload["user"], payload["phone_id"], payload.get("name"),
+                payload.get("parts", 1), attempt=1)
+
+
+def burst_stats() -> dict:
+    """Сколько входящих сообщений ушло в сколько ходов роутера."""
+    with _bursts_lock:
+        pending = sum(len(b["parts"]) for b in _bursts.values())
+    turns, messages = _burst_counters["turns"], _burst_counters["messages"]
+    return {
+        "window_sec": BURST_WINDOW_SEC,
+        "turns": turns,
+        "messages": messages,
+        "coalesce_ratio": round(messages / turns, 2) if turns else 0,
+        "pending_messages": pending,
+    }
 
 def normalize_for_meta(number):
     if number.startswith('77'):
@@ -222,6 +353,7 @@ def normalize_for_meta(number):
 
 def handle_status(status):
     logger.info("📥 Статус: %s", status)
+    delivery_status.on_status(status)
 
 def _save_voice_to_s3(raw_bytes: bytes, transcript_text: str, wamid: str) -> None:
     """
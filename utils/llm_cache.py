@@ -0,0 +1,145 @@
+# utils/llm_cache.py
+"""
+Кэш ответов LLM для ask_openai.
+
+Модель вызывается с temperature=0, поэтому одинаковый запрос
+(model, system_prompt, prompt, max_tokens) даёт одинаковый ответ — его можно
+не оплачивать повторно. Два уровня: LRU в памяти и (опционально) SQLite на диске.
+TTL задаётся на месте вызова:
+
+    with llm_cache.policy(ttl=7 * 24 * 3600, site="handover"):
+        ask_openai(prompt)
+
+Без policy (LLM_CACHE_TTL_SEC=0 по умолчанию) ответы не кэшируются: ответ клиенту
+зависит от истории диалога, а не только от промпта. Кэш включают лишь детерминированные
+места — классификаторы, хендовер, извлечение слотов.
+
+Кэшируются только успешные ответы (ошибки ask_openai — нет).
+"""
+from utils.env_loader import ensure_env_loaded
+ensure_env_loaded()
+import os, time, sqlite3, hashlib, threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logger import logger
+
+LLM_CACHE_SIZE    = int(os.getenv("LLM_CACHE_SIZE", "2000"))
+LLM_CACHE_TTL_SEC = float(os.getenv("LLM_CACHE_TTL_SEC", "0"))      # если место вызова не задало; 0 — не кэшировать
+LLM_CACHE_DB      = os.getenv("LLM_CACHE_DB", "")                     # путь к SQLite; пусто — без диска
+
+_policy: ContextVar[tuple[float, str] | None] = ContextVar("llm_cache_policy", default=None)
+
+_lock = threading.Lock()
+_mem: "OrderedDict[str, tuple[float, str]]" = OrderedDict()   # key → (expires_at, answer)
+_db: sqlite3.Connection | None = None
+_counters: dict[str, dict[str, int]] = {}                   # site → {hit_mem, hit_disk, miss, store}
+
+
+@contextmanager
+def policy(ttl: float, site: str = "default"):
+    """TTL (сек) и метка для счётчиков для всех ask_openai внутри блока. ttl=0 — не кэшировать."""
+    token = _policy.set((ttl, site))
+    try:
+        yield
+    finally:
+        _policy.reset(token)
+
+
+def current_policy() -> tuple[float, str]:
+    return _policy.get() or (LLM_CACHE_TTL_SEC, "default")
+
+
+def make_key(model: str, system_prompt: str, prompt: str, max_tokens: int) -> str:
+    raw = "\x00".join((model, system_prompt or "", prompt or "", str(max_tokens)))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _count(site: str, what: str) -> None:
+    c = _counters.setdefault(site, {"hit_mem": 0, "hit_disk": 0, "miss": 0, "store": 0})
+    c[what] += 1
+
+
+def _disk() -> sqlite3.Connection | None:
+    global _db
+    if _db is None and LLM_CACHE_DB:
+        folder = os.path.dirname(LLM_CACHE_DB)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        _db = sqlite3.connect(LLM_CACHE_DB, check_same_thread=False, isolation_level=None)
+        _db.execute("PRAGMA journal_mode=WAL")
+        _db.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, answer TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+    return _db
+
+
+def get(key: str) -> str | None:
+    ttl, site = current_policy()
+    if ttl <= 0:
+        return None
+    now = time.time()
+    with _lock:
+        hit = _mem.get(key)
+        if hit is not None:
+            if hit[0] > now:
+                _mem.move_to_end(key)
+                _count(site, "hit_mem")
+                return hit[1]
+            del _mem[key]
+        db = _disk()
+        if db is not None:
+            row = db.execute("SELECT answer, expires_at FROM llm_cache WHERE key=?", (key,)).fetchone()
+            if row and row[1] > now:
+                _remember(key, row[1], row[0])
+                _count(site, "hit_disk")
+                return row[0]
+        _count(site, "miss")
+    return None
+
+
+def put(key: str, answer: str) -> None:
+    ttl, site = current_policy()
+    if ttl <= 0 or not answer:
+        return
+    expires_at = time.time() + ttl
+    with _lock:
+        _remember(key, expires_at, answer)
+        db = _disk()
+        if db is not None:
+            try:
+                db.execute("INSERT OR REPLACE INTO llm_cache(key, answer, expires_at) VALUES (?, ?, ?)",
+                           (key, answer, expires_at))
+            except sqlite3.Error as e:
+                logger.warning(f"[llm_cache] ⚠️ запись на диск не удалась: {e}")
+        _count(site, "store")
+
+
+def _remember(key, expires_at, answer):
+    _mem[key] = (expires_at, answer)
+    _mem.move_to_end(key)
+    while len(_mem) > LLM_CACHE_SIZE:
+        _mem.popitem(last=False)
+
+
+def clear() -> None:
+    with _lock:
+        _mem.clear()
+        _counters.clear()
+        if _db is not None:
+            _db.execute("DELETE FROM llm_cache")
+
+
+def stats() -> dict:
+    with _lock:
+        sites = {s: dict(c) for s, c in _counters.items()}
+        size = len(_mem)
+    hits = sum(c["hit_mem"] + c["hit_disk"] for c in sites.values())
+    total = hits + sum(c["miss"] for c in sites.values())
+    return {
+        "size": size,
+        "capacity": LLM_CACHE_SIZE,
+        "disk": bool(LLM_CACHE_DB),
+        "hit_ratio": round(hits / total, 3) if total else 0,
+        "sites": sites,
+    }
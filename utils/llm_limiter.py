@@ -0,0 +1,231 @@
+# utils/llm_limiter.py
+"""
+Общий ограничитель запросов к OpenAI: лимиты RPM/TPM, приоритеты и пауза по 429.
+
+Живые ответы, фолбэк wants_handover_ai, напоминания (reminder_engine.execute_job)
+и фоновая генерация раньше шли в ask_openai без согласования — волна напоминаний
+упиралась в RateLimitError. Теперь каждый вызов берёт «слот»:
+
+  • два токен-бакета: запросы в минуту (LLM_RPM) и токены в минуту (LLM_TPM);
+    токены оцениваем заранее по длине промпта + max_tokens, после ответа
+    поправляем по usage.total_tokens;
+  • не больше LLM_MAX_CONCURRENCY запросов одновременно;
+  • очередь с приоритетами: live > handover > reminder > background
+    (priority() — на месте вызова, через contextvar; по умолчанию live);
+  • 429: пауза для всех до retry-after (или экспоненциальный бэкофф с джиттером),
+    после LLM_RATE_RETRIES повторов — LLMRateLimited вместо текста ошибки клиенту.
+Метрики ожидания в очереди по классам — stats() (/debug/llm).
+"""
+from utils.env_loader import ensure_env_loaded
+ensure_env_loaded()
+import os, time, heapq, random, itertools, threading
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from utils import deadline as turn_deadline
+
+LLM_RPM             = float(os.getenv("LLM_RPM", "500"))
+LLM_TPM             = float(os.getenv("LLM_TPM", "160000"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_RATE_RETRIES    = int(os.getenv("LLM_RATE_RETRIES", "3"))
+LLM_BACKOFF_BASE_SEC = float(os.getenv("LLM_BACKOFF_BASE_SEC", "1"))
+LLM_BACKOFF_MAX_SEC  = float(os.getenv("LLM_BACKOFF_MAX_SEC", "30"))
+
+LIVE, HANDOVER, REMINDER, BACKGROUND = 0, 1, 2, 3
+CLASS_NAMES = {LIVE: "live", HANDOVER: "handover", REMINDER: "reminder", BACKGROUND: "background"}
+
+_priority: ContextVar[int] = ContextVar("llm_priority", default=LIVE)
+
+
+class LLMUnavailable(RuntimeError):
+    """OpenAI не дал ответа (таймаут, нет связи, ошибка API): текста для клиента нет."""
+
+
+class LLMRateLimited(LLMUnavailable):
+    """OpenAI так и не пустил запрос после всех повторов (429)."""
+
+
+@contextmanager
+def priority(cls: int):
+    """Класс приоритета для всех ask_openai внутри блока."""
+    token = _priority.set(cls)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> int:
+    return _priority.get()
+
+
+def estimate_tokens(system_prompt: str, prompt: str, max_tokens: int) -> int:
+    """Грубая оценка: ~3 символа на токен (русский текст) + максимум ответа."""
+    return (len(system_prompt or "") + len(prompt or "")) // 3 + max_tokens
+
+
+class _Bucket:
+
+    def __init__(self, per_min: float):
+        self.capacity = per_min
+        self.rate = per_min / 60.0
+        self.level = per_min
+        self.ts = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.ts) * self.rate)
+        self.ts = now
+
+    def wait_for(self, n: float, now: float) -> float:
+        """Сколько секунд ждать, пока в бакете наберётся n."""
+        self._refill(now)
+        n = min(n, self.capacity)
+        return 0.0 if self.level >= n else (n - self.level) / self.rate
+
+    def take(self, n: float):
+        self.level -= min(n, self.capacity)
+
+    def adjust(self, delta: float):
+        self.level = min(self.capacity, self.level - delta)
+
+
+class _Slot:
+    __slots__ = ("used",)
+
+    def __init__(self):
+        self.used = None            # фактические токены (usage.total_tokens), если известны
+
+
+class LLMLimiter:
+
+    def __init__(self, rpm: float = LLM_RPM, tpm: float = LLM_TPM, max_concurrency: int = LLM_MAX_CONCURRENCY):
+        self._cond = threading.Condition()
+        self._rpm = _Bucket(rpm)
+        self._tpm = _Bucket(tpm)
+        self.max_concurrency = max_concurrency
+        self._queue: list[tuple[int, int]] = []
+        self._seq = itertools.count()
+        self._active = 0
+        self._paused_until = 0.0
+        self._waits = {cls: deque(maxlen=500) for cls in CLASS_NAMES}
+        self.counters = {"acquired": 0, "rate_limited": 0, "gave_up": 0, "timed_out": 0}
+
+    def acquire(self, tokens: int, cls: int | None = None, timeout: float | None = None) -> float:
+        """
+        Дождаться своей очереди и лимитов. Возвращает время ожидания, сек.
+        Ждём не дольше timeout (по умолчанию — остаток бюджета текущего хода; вне хода
+        без ограничения), иначе уходим из очереди с LLMRateLimited.
+        """
+        cls = current_priority() if cls is None else cls
+        entry = (cls, next(self._seq))
+        t0 = time.monotonic()
+        if timeout is None:
+            timeout = turn_deadline.remaining(float("inf"))
+        give_up_at = t0 + timeout
+        with self._cond:
+            heapq.heappush(self._queue, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = 1.0
+                    if self._queue[0] == entry and self._active < self.max_concurrency:
+                        wait = max(self._paused_until - now,
+                                   self._rpm.wait_for(1, now),
+                                   self._tpm.wait_for(tokens, now))
+                        if wait <= 0:
+                            heapq.heappop(self._queue)
+                            self._rpm.take(1)
+                            self._tpm.take(tokens)
+                            self._active += 1
+                            self.counters["acquired"] += 1
+                            break
+                    if now >= give_up_at:
+                        self.counters["timed_out"] += 1
+                        raise LLMRateLimited(f"очередь к OpenAI: не дождались слота за {now - t0:.1f} с")
+                    self._cond.wait(timeout=min(wait, give_up_at - now))
+            except BaseException:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                raise
+            finally:
+                self._cond.notify_all()     # голова очереди могла смениться
+        waited = time.monotonic() - t0
+        self._waits[cls].append(waited)
+        return waited
+
+    def release(self, estimated: int, used: int | None = None):
+        with self._cond:
+            self._active -= 1
+            if used is not None:
+                self._tpm.adjust(used - estimated)
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, tokens: int, cls: int | None = None, timeout: float | None = None):
+        self.acquire(tokens, cls, timeout)
+        s = _Slot()
+        try:
+            yield s
+        finally:
+            self.release(tokens, s.used)
+
+    def penalize(self, retry_after: float | None, attempt: int) -> float:
+        """429 от OpenAI: пауза для всех. Возвращает длительность паузы, сек."""
+        backoff = min(LLM_BACKOFF_MAX_SEC, LLM_BACKOFF_BASE_SEC * 2 ** attempt) * random.uniform(0.8, 1.2)
+        delay = max(retry_after or 0.0, backoff)
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            self.counters["rate_limited"] += 1
+            self._cond.notify_all()
+        return delay
+
+    def gave_up(self):
+        with self._cond:
+            self.counters["gave_up"] += 1
+
+    def stats(self) -> dict:
+        with self._cond:
+            queued = {CLASS_NAMES[c]: 0 for c in CLASS_NAMES}
+            for cls, _ in self._queue:
+                queued[CLASS_NAMES[cls]] += 1
+            now = time.monotonic()
+            out = {
+                "active": self._active,
+                "max_concurrency": self.max_concurrency,
+                "queued": queued,
+                "paused_sec": round(max(0.0, self._paused_until - now), 2),
+                "rpm_available": round(self._rpm.level, 1),
+                "tpm_available": round(self._tpm.level),
+                **self.counters,
+            }
+        waits = {}
+        for cls, samples in self._waits.items():
+            s = sorted(samples)
+            waits[CLASS_NAMES[cls]] = {
+                "n": len(s),
+                "p50_ms": round(s[len(s) // 2] * 1000, 1) if s else 0,
+                "p95_ms": round(s[int(len(s) * 0.95)] * 1000, 1) if s else 0,
+                "max_ms": round(s[-1] * 1000, 1) if s else 0,
+            }
+        out["wait"] = waits
+        return out
+
+
+def retry_after_sec(err) -> float | None:
+    """retry-after-ms / retry-after из ответа OpenAI (если заголовок есть)."""
+    headers = getattr(getattr(err, "response", None), "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+limiter = LLMLimiter()
+
+
+def stats() -> dict:
+    return limiter.stats()
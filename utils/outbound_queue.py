@@ -0,0 +1,416 @@
+# utils/outbound_queue.py
+"""
+Надёжная очередь исходящих сообщений WhatsApp (SQLite в режиме WAL).
+
+Раньше send_text возвращал сырой ответ, который никто не смотрел, _post логировал
+и проглатывал ошибку, а обработчик хода ждал каждый HTTP-запрос к Graph API.
+Теперь send() кладёт сообщение в очередь и сразу возвращает Accepted (202):
+
+  • один получатель — строго по порядку (КП → видео → текст из block4 не обгонят
+    друг друга): следующее сообщение не уходит, пока предыдущее не отправлено
+    или не ушло в мёртвые, в том числе пока оно ждёт повтора;
+  • разные получатели — параллельно, OUTBOUND_WORKERS воркеров;
+  • темп — токен-бакет OUTBOUND_MPS сообщений в секунду (лимит тарифа WABA);
+  • 429/5xx, обрыв связи и ошибки пропускной способности Meta (130429, 131056 …) —
+    повтор с экспоненциальной задержкой (или по Retry-After); 401 — тоже, а токен
+    в фоне перечитывается (token_manager.request_refresh);
+  • остальные ошибки и исчерпанные повторы — в мёртвые письма (status='dead'):
+    dead_letters() / requeue_dead(), метрики — /debug/outbound;
+  • wamid принятого сообщения — в utils.delivery_status (статусы доставки).
+Если очередь не запущена (тесты, скрипты) — send() отправляет сразу, одной попыткой,
+как раньше: ошибка только логируется. send_now() — мимо очереди и с ожиданием ответа,
+когда вызывающему нужен настоящий результат отправки (резюме Арсению).
+"""
+from utils.env_loader import ensure_env_loaded
+ensure_env_loaded()
+import os, json, time, random, sqlite3, threading
+from collections import deque
+from logger import logger
+from utils import graph_http, delivery_status, token_manager
+from utils.token_manager import get_token
+from state.state import note_external_effect
+
+QUEUE_PATH       = os.getenv("OUTBOUND_QUEUE_PATH", "tmp/outbound_queue.db")
+WORKERS          = max(1, int(os.getenv("OUTBOUND_WORKERS", "8")))
+MPS              = float(os.getenv("OUTBOUND_MPS", "80"))
+MAX_ATTEMPTS     = int(os.getenv("OUTBOUND_MAX_ATTEMPTS", "6"))
+BACKOFF_BASE_SEC = float(os.getenv("OUTBOUND_BACKOFF_BASE_SEC", "2"))
+BACKOFF_MAX_SEC  = float(os.getenv("OUTBOUND_BACKOFF_MAX_SEC", "300"))
+DEFAULT_PHONE_ID = os.getenv("PHONE_NUMBER_ID")
+POLL_SEC         = 1.0
+NOW_ATTEMPTS     = 3      # send_now(): быстрые повторы прямо в вызывающем потоке
+NOW_MAX_WAIT_SEC = 5.0
+
+# коды ошибок Graph API, которые лечатся ожиданием (лимиты и пропускная способность)
+RETRYABLE_CODES = frozenset({4, 80007, 130429, 131016, 131056})
+
+_conn: sqlite3.Connection | None = None
+_db_lock = threading.Lock()
+_wakeup  = threading.Condition()
+_running = threading.Event()
+_workers: list[threading.Thread] = []
+
+_latencies = deque(maxlen=1000)   # enqueue → доставлено в Graph API, секунды
+_counters  = {"enqueued": 0, "sent": 0, "retried": 0, "dead": 0, "inline": 0}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbound_messages (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    recipient   TEXT    NOT NULL,
+    phone_id    TEXT,
+    tag         TEXT    NOT NULL,
+    payload     TEXT    NOT NULL,
+    enqueued_at REAL    NOT NULL,
+    next_at     REAL    NOT NULL,
+    status      TEXT    NOT NULL DEFAULT 'pending',
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    last_error  TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_outbound_status ON outbound_messages(status, next_at, id);
+CREATE INDEX IF NOT EXISTS ix_outbound_recipient ON outbound_messages(recipient, status, id);
+"""
+
+
+class Accepted:
+    """Ответ send(), когда сообщение поставлено в очередь (код как у HTTP 202 Accepted)."""
+    status_code = 202
+    ok = True
+
+    def __init__(self, message_id: int):
+        self.id = message_id
+
+    def __repr__(self):
+        return f"Accepted(id={self.id})"
+
+
+class _Bucket:
+    """Токен-бакет на исходящие сообщения (MPS в секунду, запас — секунда трафика)."""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.level = rate
+        self.ts = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self) -> float:
+        """Забрать токен; вернуть, сколько секунд пришлось ждать."""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.level = min(self.rate, self.level + (now - self.ts) * self.rate)
+                self.ts = now
+                if self.level >= 1:
+                    self.level -= 1
+                    return waited
+                pause = (1 - self.level) / self.rate
+            time.sleep(pause)
+            waited += pause
+
+
+_bucket = _Bucket(MPS)
+
+
+def _db() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        folder = os.path.dirname(QUEUE_PATH)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        _conn = sqlite3.connect(QUEUE_PATH, check_same_thread=False, isolation_level=None)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("PRAGMA synchronous=NORMAL")
+        _conn.executescript(_SCHEMA)
+    return _conn
+
+
+def configure(path: str | None = None, mps: float | None = None) -> None:
+    """Переключить файл очереди и темп (нужно тестам и скриптам). Только до start_workers()."""
+    global QUEUE_PATH, MPS, _conn, _bucket
+    with _db_lock:
+        if _conn is not None:
+            _conn.close()
+            _conn = None
+        if path:
+            QUEUE_PATH = path
+    if mps:
+        MPS = mps
+        _bucket = _Bucket(mps)
+
+
+# ─── отправка в Graph API ────────────────────────────────────────
+def _deliver(phone_id: str, payload: dict):
+    """Один POST /{phone_id}/messages через общий транспорт."""
+    _bucket.take()
+    headers = {"Authorization": f"Bearer {get_token()}", "Content-Type": "application/json"}
+    return graph_http.post(graph_http.graph_url(f"{phone_id}/messages"), headers=headers, json=payload)
+
+
+def _error_of(resp) -> tuple[bool, str, float | None]:
+    """(повторять ли, текст ошибки, Retry-After) для неуспешного ответа Graph API."""
+    try:
+        err = (resp.json() or {}).get("error") or {}
+    except Exception:
+        err = {}
+    code = err.get("code")
+    retry = resp.status_code == 429 or resp.status_code >= 500 or code in RETRYABLE_CODES
+    if code == 190 or resp.status_code == 401:
+        token_manager.request_refresh()          # токен истёк/сменился — перечитаем в фоне и повторим
+        retry = True
+    try:
+        retry_after = float(resp.headers.get("Retry-After"))
+    except (TypeError, ValueError, AttributeError):
+        retry_after = None
+    text = f"HTTP {resp.status_code} code={code} {err.get('message') or resp.text[:300]}"
+    return retry, text, retry_after
+
+
+def _backoff(attempts: int, retry_after: float | None) -> float:
+    delay = min(BACKOFF_MAX_SEC, BACKOFF_BASE_SEC * 2 ** (attempts - 1)) * random.uniform(0.8, 1.2)
+    return max(delay, retry_after or 0.0)
+
+
+# ─── запись ──────────────────────────────────────────────────────
+def send(payload: dict, tag: str = "text", phone_id: str | None = None, delay: float = 0.0):
+    """
+    Отправить сообщение (payload — тело POST /messages, получатель — payload["to"]).
+    Очередь запущена — Accepted сразу (delay — не раньше чем через столько секунд);
+    иначе — ответ Graph API (или None при сетевой ошибке).
+    """
+    phone_id = phone_id or DEFAULT_PHONE_ID
+    note_external_effect()               # ход, внутри которого ушло сообщение, уже не откатить
+    if not _running.is_set():
+        return _send_inline(payload, tag, phone_id)
+    now = time.time()
+    with _db_lock:
+        cur = _db().execute(
+            "INSERT INTO outbound_messages(recipient, phone_id, tag, payload, enqueued_at, next_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (payload["to"], phone_id, tag, json.dumps(payload, ensure_ascii=False), now, now + delay),
+        )
+        _counters["enqueued"] += 1
+    with _wakeup:
+        _wakeup.notify()
+    return Accepted(cur.lastrowid)
+
+
+def send_now(payload: dict, tag: str = "text", phone_id: str | None = None):
+    """
+    Отправить мимо очереди и дождаться ответа Graph API (Accepted тут не бывает).
+    На 429/5xx — до NOW_ATTEMPTS попыток с короткой паузой. Последний ответ или None.
+    """
+    phone_id = phone_id or DEFAULT_PHONE_ID
+    note_external_effect()
+    resp = None
+    for attempt in range(1, NOW_ATTEMPTS + 1):
+        resp = _send_inline(payload, tag, phone_id)
+        if resp is not None and resp.status_code < 300:
+            return resp
+        retry, _, retry_after = _error_of(resp) if resp is not None else (True, "", None)
+        if not retry or attempt == NOW_ATTEMPTS:
+            break
+        time.sleep(min(NOW_MAX_WAIT_SEC, _backoff(attempt, retry_after)))
+    return resp
+
+
+def _send_inline(payload: dict, tag: str, phone_id: str):
+    _counters["inline"] += 1
+    try:
+        resp = _deliver(phone_id, payload)
+    except graph_http.HTTPError as e:
+        logger.error("❌ WA %s to %s: %s", tag, payload.get("to"), e)
+        return None
+    if resp.status_code >= 300:
+        _, err, _ = _error_of(resp)
+        logger.error("❌ WA %s to %s: %s", tag, payload.get("to"), err)
+    else:
+        logger.info("➡️ WA %s ok → %s", tag, payload.get("to"))
+        delivery_status.record_sent(delivery_status.wamid_of(resp), payload, tag, phone_id)
+    return resp
+
+
+# ─── разбор ──────────────────────────────────────────────────────
+def _claim() -> tuple | None:
+    """
+    Самое старое готовое сообщение, перед которым у того же получателя
+    нет неотправленных (pending/sending) — так сохраняется порядок.
+    """
+    now = time.time()
+    with _db_lock:
+        db = _db()
+        db.execute("BEGIN IMMEDIATE")
+        row = db.execute(
+            "SELECT id, recipient, phone_id, tag, payload, enqueued_at, attempts FROM outbound_messages o "
+            "WHERE status='pending' AND next_at <= ? AND NOT EXISTS ("
+            "  SELECT 1 FROM outbound_messages p WHERE p.recipient=o.recipient "
+            "  AND p.status IN ('pending', 'sending') AND p.id < o.id) "
+            "ORDER BY id LIMIT 1", (now,)
+        ).fetchone()
+        if row:
+            db.execute("UPDATE outbound_messages SET status='sending', attempts=attempts+1 WHERE id=?", (row[0],))
+        db.execute("COMMIT")
+    return row
+
+
+def _next_due() -> float:
+    """Через сколько секунд созреет ближайший отложенный повтор."""
+    with _db_lock:
+        (next_at,) = _db().execute(
+            "SELECT MIN(next_at) FROM outbound_messages WHERE status='pending'"
+        ).fetchone()
+    return POLL_SEC if next_at is None else min(POLL_SEC, max(0.01, next_at - time.time()))
+
+
+def _finish(msg_id: int, status: str, *, error: str | None = None, next_at: float | None = None) -> None:
+    with _db_lock:
+        if status == "sent":
+            _db().execute("DELETE FROM outbound_messages WHERE id=?", (msg_id,))
+        else:
+            _db().execute(
+                "UPDATE outbound_messages SET status=?, last_error=?, next_at=COALESCE(?, next_at) WHERE id=?",
+                (status, (error or "")[:500], next_at, msg_id),
+            )
+    with _wakeup:
+        _wakeup.notify_all()         # следующее сообщение получателя могло освободиться
+
+
+def _process(row) -> None:
+    msg_id, recipient, phone_id, tag, payload, enqueued_at, attempts = row
+    attempts += 1
+    retry_after = None
+    payload = json.loads(payload)
+    try:
+        resp = _deliver(phone_id, payload)
+    except graph_http.HTTPError as e:
+        retry, err = True, repr(e)
+    else:
+        if resp.status_code < 300:
+            delivery_status.record_sent(delivery_status.wamid_of(resp), payload, tag, phone_id)
+            _finish(msg_id, "sent")
+            _counters["sent"] += 1
+            _latencies.append(max(0.0, time.time() - enqueued_at))
+            logger.info("➡️ WA %s ok → %s", tag, recipient)
+            return
+        retry, err, retry_after = _error_of(resp)
+    if retry and attempts < MAX_ATTEMPTS:
+        delay = _backoff(attempts, retry_after)
+        _finish(msg_id, "pending", error=err, next_at=time.time() + delay)
+        _counters["retried"] += 1
+        logger.warning("⏳ WA %s to %s: %s — повтор через %.1f с (%d/%d)",
+                       tag, recipient, err, delay, attempts, MAX_ATTEMPTS)
+    else:
+        _finish(msg_id, "dead", error=err)
+        _counters["dead"] += 1
+        logger.error("❌ WA %s to %s: %s — в мёртвые письма (попыток: %d)", tag, recipient, err, attempts)
+
+
+def _worker_loop() -> None:
+    while _running.is_set():
+        try:
+            row = _claim()
+            if row:
+                _process(row)
+                continue
+            wait = _next_due()
+        except Exception as e:
+            logger.exception(f"💥 outbound_queue worker: {e}")
+            wait = POLL_SEC
+        with _wakeup:
+            _wakeup.wait(wait)
+
+
+def start_workers() -> None:
+    """Запустить отправку очереди. Идемпотентен: повторный вызов ничего не делает."""
+    if _running.is_set():
+        return
+    with _db_lock:
+        # то, что отправлялось в момент падения, — обратно в очередь
+        recovered = _db().execute(
+            "UPDATE outbound_messages SET status='pending' WHERE status='sending'"
+        ).rowcount
+    if recovered:
+        logger.warning(f"♻️ outbound_queue: возвращено в очередь после рестарта: {recovered}")
+    _running.set()
+    for i in range(WORKERS):
+        t = threading.Thread(target=_worker_loop, name=f"outbound-{i}", daemon=True)
+        t.start()
+        _workers.append(t)
+    logger.info(f"📤 outbound_queue: запущена отправка ({QUEUE_PATH}), воркеров {WORKERS}, {MPS:g} сообщ./с")
+
+
+def stop_workers(timeout: float = 5.0) -> None:
+    _running.clear()
+    with _wakeup:
+        _wakeup.notify_all()
+    for t in _workers:
+        t.join(timeout)
+    _workers.clear()
+
+
+def is_running() -> bool:
+    return _running.is_set()
+
+
+def wait_idle(timeout: float = 5.0) -> bool:
+    """Дождаться, пока не останется готовых к отправке сообщений (для тестов)."""
+    end = time.time() + timeout
+    while time.time() < end:
+        with _db_lock:
+            (busy,) = _db().execute(
+                "SELECT COUNT(*) FROM outbound_messages WHERE status='sending' "
+                "OR (status='pending' AND next_at <= ?)", (time.time(),)
+            ).fetchone()
+        if not busy:
+            return True
+        time.sleep(0.01)
+    return False
+
+
+# ─── мёртвые письма ──────────────────────────────────────────────
+def dead_letters(limit: int = 50) -> list[dict]:
+    with _db_lock:
+        rows = _db().execute(
+            "SELECT id, recipient, tag, payload, enqueued_at, attempts, last_error FROM outbound_messages "
+            "WHERE status='dead' ORDER BY id DESC LIMIT ?", (limit,)
+        ).fetchall()
+    return [{"id": r[0], "recipient": r[1], "tag": r[2], "payload": json.loads(r[3]),
+             "enqueued_at": r[4], "attempts": r[5], "error": r[6]} for r in rows]
+
+
+def requeue_dead(ids: list[int] | None = None) -> int:
+    """Вернуть мёртвые письма в очередь (все или по id). Возвращает их число."""
+    sql = "UPDATE outbound_messages SET status='pending', attempts=0, next_at=? WHERE status='dead'"
+    args: list = [time.time()]
+    if ids:
+        sql += f" AND id IN ({','.join('?' * len(ids))})"
+        args += list(ids)
+    with _db_lock:
+        n = _db().execute(sql, args).rowcount
+    with _wakeup:
+        _wakeup.notify_all()
+    return n
+
+
+# ─── метрики ─────────────────────────────────────────────────────
+def stats() -> dict:
+    with _db_lock:
+        rows = _db().execute(
+            "SELECT status, COUNT(*) FROM outbound_messages GROUP BY status"
+        ).fetchall()
+        counters = dict(_counters)
+    by_status = {status: n for status, n in rows}
+    lat = sorted(_latencies)
+
+    def q(p):
+        return round(lat[min(int(len(lat) * p), len(lat) - 1)] * 1000, 1) if lat else 0
+
+    return {
+        "running": is_running(),
+        "workers": WORKERS,
+        "mps": MPS,
+        "depth": by_status.get("pending", 0),
+        "sending": by_status.get("sending", 0),
+        "dead": by_status.get("dead", 0),
+        **{f"total_{k}": v for k, v in counters.items()},
+        "delivery_ms": {"p50": q(0.5), "p90": q(0.9), "p99": q(0.99)},
+    }
@@ -0,0 +1,167 @@
+# utils/prompt_registry.py
+"""
+Реестр промптов: prompts/*.txt читаются один раз и держатся в памяти.
+
+  • на старте загружаем и проверяем все файлы (битые плейсхолдеры — в лог);
+  • шаблоны разбираются один раз: render() просто склеивает готовые куски;
+  • hot-reload: не чаще раза в PROMPT_RELOAD_CHECK_SEC сверяем mtime файла
+    и перечитываем его, если промпт поправили, — без рестарта;
+  • по каждому промпту считаем чтения, рендеры и размер результата.
+
+Ключ — путь ("prompts/global_prompt.txt") или имя файла без .txt ("global_prompt").
+"""
+from utils.env_loader import ensure_env_loaded
+ensure_env_loaded()
+import os, time, glob, threading
+from string import Formatter
+from logger import logger
+
+PROMPTS_DIR             = os.getenv("PROMPTS_DIR", "prompts")
+PROMPT_RELOAD_CHECK_SEC = float(os.getenv("PROMPT_RELOAD_CHECK_SEC", "2"))
+
+_formatter = Formatter()
+
+
+class _Prompt:
+    __slots__ = ("path", "text", "mtime", "checked_at", "parts", "fields", "error",
+                 "gets", "renders", "render_errors", "last_render_chars", "reloads")
+
+    def __init__(self, path: str):
+        self.path = path
+        self.gets = self.renders = self.render_errors = self.reloads = 0
+        self.last_render_chars = 0
+        self.read()
+
+    def read(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            self.text = f.read()
+        self.mtime = os.path.getmtime(self.path)
+        self.checked_at = time.monotonic()
+        self.compile()
+
+    def compile(self):
+        """
+        Разбираем str.format-шаблон один раз. parts — [(литерал, поле|None, conv, spec)].
+        Промпты без плейсхолдеров с «голыми» фигурными скобками (примеры JSON)
+        шаблонами не считаются — это не ошибка, пока их не рендерят.
+        """
+        self.parts, self.fields, self.error = None, (), None
+        try:
+            parts = list(_formatter.parse(self.text))
+        except ValueError as e:
+            self.error = str(e)
+            return
+        self.parts = [(lit, name, conv, spec) for lit, name, spec, conv in parts]
+        self.fields = tuple(sorted({name for _, name, _, _ in self.parts if name}))
+        if any(not name.isidentifier() for name in self.fields):
+            self.error = f"позиционные/составные поля: {self.fields}"
+
+    def render(self, kwargs: dict) -> str:
+        if self.error:
+            raise ValueError(self.error)
+        out = []
+        for lit, name, conv, spec in self.parts:
+            out.append(lit)
+            if name is None:
+                continue
+            value = kwargs[name]
+            if conv:
+                value = _formatter.convert_field(value, conv)
+            out.append(format(value, spec) if spec else str(value))
+        return "".join(out)
+
+
+class PromptRegistry:
+
+    def __init__(self, directory: str = PROMPTS_DIR, check_sec: float = PROMPT_RELOAD_CHECK_SEC):
+        self.dir = directory
+        self.check_sec = check_sec
+        self._lock = threading.Lock()
+        self._prompts: dict[str, _Prompt] = {}
+
+    def _name(self, key: str) -> str:
+        return os.path.splitext(os.path.basename(key))[0]
+
+    def load_all(self) -> int:
+        """Загрузить и проверить все prompts/*.txt. Возвращает число промптов."""
+        paths = sorted(glob.glob(os.path.join(self.dir, "*.txt")))
+        with self._lock:
+            for path in paths:
+                p = self._prompts[self._name(path)] = _Prompt(path)
+                if p.error and p.fields:
+                    logger.warning(f"[prompts] ⚠️ {path}: шаблон не разбирается ({p.error})")
+        logger.info(f"[prompts] 📚 загружено {len(paths)} промптов из {self.dir}")
+        return len(paths)
+
+    def _entry(self, key: str) -> _Prompt:
+        name = self._name(key)
+        with self._lock:
+            p = self._prompts.get(name)
+            if p is None:
+                path = key if key.endswith(".txt") and os.path.exists(key) else os.path.join(self.dir, name + ".txt")
+                p = self._prompts[name] = _Prompt(path)
+            elif time.monotonic() - p.checked_at >= self.check_sec:
+                self._maybe_reload(p)
+            p.gets += 1
+            return p
+
+    def _maybe_reload(self, p: _Prompt):
+        p.checked_at = time.monotonic()
+        try:
+            mtime = os.path.getmtime(p.path)
+        except OSError:
+            return                              # файл пропал — продолжаем с тем, что в памяти
+        if mtime != p.mtime:
+            p.read()
+            p.reloads += 1
+            logger.info(f"[prompts] 🔄 {p.path} перечитан (изменён на диске)")
+
+    def get(self, key: str) -> str:
+        return self._entry(key).text
+
+    def render(self, key: str, **kwargs) -> str:
+        """
+        Подстановка плейсхолдеров {name}. Внутренние фигурные скобки в промпте
+        должны быть экранированы как {{ }}. При ошибке — сырой текст, а не падение.
+        """
+        p = self._entry(key)
+        try:
+            text = p.render(kwargs)
+        except Exception as e:
+            p.render_errors += 1
+            logger.warning(f"[prompts] format error in {p.path}: {e!r}")
+            text = p.text
+        p.renders += 1
+        p.last_render_chars = len(text)
+        return text
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                name: {
+                    "chars": len(p.text),
+                    "fields": list(p.fields),
+                    "template_ok": p.error is None,
+                    "gets": p.gets,
+                    "renders": p.renders,
+                    "render_errors": p.render_errors,
+                    "last_render_chars": p.last_render_chars,
+                    "reloads": p.reloads,
+                }
+                for name, p in sorted(self._prompts.items())
+            }
+
+
+registry = PromptRegistry()
+if os.path.isdir(PROMPTS_DIR):
+    registry.load_all()
+else:
+    logger.warning(f"[prompts] ⚠️ каталог {PROMPTS_DIR} не найден — промпты будут читаться по требованию")
+
+
+def load_prompt(path: str) -> str:
+    return registry.get(path)
+
+
+def render_prompt(path: str, **kwargs) -> str:
+    return registry.render(path, **kwargs)
@@ -1,13 +1,14 @@
 from utils.env_loader import ensure_env_loaded
 ensure_env_loaded()
-import os, time, logging
+import os, time, logging, threading
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 from apscheduler.jobstores.memory import MemoryJobStore
 from datetime import datetime, timezone
-from state.state import get_state
+from state.state import get_state, transaction, note_external_effect
 from utils.whatsapp_senders import send_text          # тот же dict‑API
 from utils.env_flags import is_local_dev
+from utils import llm_limiter, delivery_status
 
 if not logging.getLogger().handlers:
     h = logging.StreamHandler()          # stdout → Render console
@@ -20,6 +21,12 @@ log.setLevel(logging.INFO)
 log.info("📦 reminder_engine import started")
 LOCAL_DEV = is_local_dev()
 TEST_MODE   = os.getenv("ACADEMYBOT_TEST", "0") == "1"
+# напоминание, упёршееся в лимит OpenAI, переносим на это время
+RATE_LIMIT_RETRY_SEC = int(os.getenv("REMINDER_RATE_LIMIT_RETRY_SEC", "600"))
+# прошлое сообщение клиенту ещё не доставлено — напоминание откладываем на столько
+UNDELIVERED_RETRY_SEC = int(os.getenv("REMINDER_UNDELIVERED_RETRY_SEC", "1800"))
+# …но не дольше этого: недоставленное сообщение старше — напоминание всё равно уходит
+UNDELIVERED_MAX_DEFER_SEC = int(os.getenv("REMINDER_UNDELIVERED_MAX_DEFER_SEC", str(6 * 3600)))
 
 # ---------- JobStore выбор ----------
 def _build_jobstores():
@@ -56,6 +63,58 @@ def _build_jobstores():
 jobstores = _build_jobstores()
 sched = BackgroundScheduler(jobstores=jobstores, timezone="UTC")
 
+# ---------- индекс задач по пользователю ----------
+# user_id → {job_id}; чтобы #reset/#jobs не обходили sched.get_jobs() целиком
+_jobs_by_user: dict[str, set[str]] = {}
+_jobs_lock = threading.Lock()
+
+def _index_job(job_id: str) -> None:
+    user_id = job_id.split(":", 1)[0]
+    with _jobs_lock:
+        _jobs_by_user.setdefault(user_id, set()).add(job_id)
+
+def _unindex_job(job_id: str) -> None:
+    user_id = job_id.split(":", 1)[0]
+    with _jobs_lock:
+        ids = _jobs_by_user.get(user_id)
+        if ids is not None:
+            ids.discard(job_id)
+            if not ids:
+                _jobs_by_user.pop(user_id, None)
+
+def _seed_job_index() -> None:
+    """Один раз при старте: задачи, пережившие рестарт в SQLAlchemyJobStore."""
+    for job in sched.get_jobs():
+        _index_job(job.id)
+
+def user_jobs(user_id: str) -> list[str]:
+    with _jobs_lock:
+        return sorted(_jobs_by_user.get(user_id, ()))
+
+def all_job_ids() -> list[str]:
+    with _jobs_lock:
+        return sorted(j for ids in _jobs_by_user.values() for j in ids)
+
+def _norm_job_id(job_id: str) -> str:
+    """'uid:pkg.mod:func' → 'uid:pkg.mod.func' (как в plan())."""
+    user_id, _, path = job_id.partition(":")
+    return f"{user_id}:{path.replace(':', '.', 1)}"
+
+def remove_job(job_id: str) -> None:
+    job_id = _norm_job_id(job_id)
+    try:
+        sched.remove_job(job_id)
+    except Exception:
+        pass
+    _unindex_job(job_id)
+
+def cancel_user_jobs(user_id: str) -> int:
+    """Снять все отложенные задачи пользователя (без обхода всех задач)."""
+    ids = user_jobs(user_id)
+    for job_id in ids:
+        remove_job(job_id)
+    return len(ids)
+
 # ВНИМАНИЕ: не стартуем шедулер при импорте.
 # В проде зови start() из входной точки приложения.
 def start():
@@ -71,6 +130,7 @@ def start():
         return
     try:
         sched.start()
+        _seed_job_index()
         start._started = True
         log.info("⏰ reminder_engine started with %s jobstore", next(iter(jobstores)))
     except Exception as e:
@@ -115,8 +175,22 @@ def plan(user_id: str, func_ref, delay_sec: int) -> None:
         misfire_grace_time=300,
         args=[user_id, norm_path],
     )
+    _index_job(job_id)
+    note_external_effect()
     log.info(f"[reminder_engine] scheduled {job_id} in {delay_sec//60} min")
 
+# ---------- отсрочка напоминаний при недоставке -----------------
+def _is_reminder(func_path: str) -> bool:
+    """Только send_*_reminder_if_silent пишут клиенту; финализация и экспорт не ждут доставки."""
+    name = func_path.rsplit(".", 1)[-1]
+    return name.startswith("send_") and name.endswith("_reminder_if_silent")
+
+
+def _last_undelivered(user_id: str) -> bool:
+    to = (get_state(user_id) or {}).get("normalized_number", user_id)
+    return delivery_status.undelivered(to, within_sec=UNDELIVERED_MAX_DEFER_SEC)
+
+
 # ---------- точка входа, которую увидит APScheduler -------------
 def execute_job(user_id: str, func_path: str):
     """
@@ -124,13 +198,28 @@ def execute_job(user_id: str, func_path: str):
     Сигнатура строго (user_id, func_path) – оба строки.
     """
     func_path = func_path.replace(":", ".", 1)     # поддержка «:»
+    _unindex_job(f"{user_id}:{func_path}")          # date-задача одноразовая
+    if _is_reminder(func_path) and _last_undelivered(user_id):
+        # телефон клиента офлайн или отправка упала — не копим непрочитанные напоминания
+        log.info(f"[reminder_engine] job {user_id}:{func_path} отложена: прошлое сообщение не доставлено")
+        delivery_status.note_reminder_deferred()
+        plan(user_id, func_path, UNDELIVERED_RETRY_SEC)
+        return
     mod_name, func_name = func_path.rsplit(".", 1)
     mod = __import__(mod_name, fromlist=[func_name])
     func = getattr(mod, func_name)
     try:
-        func(user_id, _send_func_factory(user_id))
-    except TypeError:
-        func(user_id)
+        # одна транзакция state на срабатывание напоминания; если клиент успел
+        # ответить параллельно — его свежие значения не затираем.
+        # Запросы к LLM из напоминаний уступают живым ответам клиентам.
+        with transaction(user_id, yield_to_newer=True), llm_limiter.priority(llm_limiter.REMINDER):
+            try:
+                func(user_id, _send_func_factory(user_id))
+            except TypeError:
+                func(user_id)
+    except llm_limiter.LLMRateLimited:
+        log.warning(f"[reminder_engine] job {user_id}:{func_path} отложена: лимит OpenAI")
+        plan(user_id, func_path, RATE_LIMIT_RETRY_SEC)
     except Exception as e:
         log.error(f"[reminder_engine] job {user_id}:{func_path} error: {e}")
 
@@ -0,0 +1,174 @@
+# utils/response_pool.py
+"""
+Пулы заранее сгенерированных ответов для статичных промптов.
+
+Приветствие block2, напоминания block2 и сообщение block5 «передаю Арсению» не
+зависят от клиента, но каждый раз генерировались в момент отправки. Теперь:
+
+  • блок регистрирует такой промпт: register(name, build) — build() собирает
+    текущий текст промпта (правки в prompts/*.txt подхватываются сами);
+  • фоновый генератор (start_response_pool_loop, раз в RESPONSE_POOL_REFRESH_SEC)
+    или офлайн-скрипт scripts/generate_response_pools.py набирает по
+    RESPONSE_POOL_SIZE проверенных вариантов на промпт, с температурой > 0;
+  • пул хранится в RESPONSE_POOL_PATH (JSON) по ключу sha256 текста промпта:
+    промпт поправили — ключ другой, пул набирается заново, старый удаляется;
+  • pick(name) — случайный вариант из пула мгновенно, без OpenAI; пул пуст —
+    None, и блок, как раньше, спрашивает модель.
+"""
+from utils.env_loader import ensure_env_loaded
+ensure_env_loaded()
+import os, re, json, time, random, hashlib, tempfile, threading
+from logger import logger
+from utils import llm_cache, llm_limiter
+from utils.ask_openai import ask_openai, sampling, MODEL
+
+RESPONSE_POOLS            = os.getenv("RESPONSE_POOLS", "1") == "1"
+RESPONSE_POOL_PATH        = os.getenv("RESPONSE_POOL_PATH", "tmp/response_pools.json")
+RESPONSE_POOL_SIZE        = int(os.getenv("RESPONSE_POOL_SIZE", "5"))
+RESPONSE_POOL_TEMPERATURE = float(os.getenv("RESPONSE_POOL_TEMPERATURE", "0.9"))
+RESPONSE_POOL_REFRESH_SEC = float(os.getenv("RESPONSE_POOL_REFRESH_SEC", str(6 * 3600)))
+MIN_CHARS, MAX_CHARS = 20, 1000
+
+_builders: dict = {}
+_pools: dict[str, dict] | None = None           # ключ промпта → {"name", "variants", "updated_at"}
+_lock = threading.Lock()
+_counters = {"hits": 0, "misses": 0, "generated": 0, "rejected": 0}
+
+
+def register(name: str, build) -> None:
+    """build() → полный текст статичного промпта (без данных клиента)."""
+    _builders[name] = build
+
+
+def prompt_key(prompt: str) -> str:
+    return hashlib.sha256(f"{MODEL}\x00{prompt}".encode("utf-8")).hexdigest()
+
+
+def _load() -> dict:
+    global _pools
+    if _pools is None:
+        try:
+            with open(RESPONSE_POOL_PATH, encoding="utf-8") as f:
+                _pools = json.load(f)
+        except FileNotFoundError:
+            _pools = {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"[response_pool] ⚠️ файл пулов не читается ({e}) — начинаем с пустых")
+            _pools = {}
+    return _pools
+
+
+def _save() -> None:
+    folder = os.path.dirname(RESPONSE_POOL_PATH) or "."
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=folder, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(_pools, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, RESPONSE_POOL_PATH)
+
+
+def vet(text: str, existing: list[str]) -> bool:
+    """Вариант годится: разумной длины, без недозаполненных шаблонов, не повтор."""
+    s = (text or "").strip()
+    if not s or not MIN_CHARS <= len(s) <= MAX_CHARS:
+        return False
+    if re.search(r"[{}]|\[[^\]]*\]|<[^>]*>", s):          # {name}, [Имя], <дата>
+        return False
+    norm = _norm(s)
+    return all(_norm(v) != norm for v in existing)
+
+
+def _norm(text: str) -> str:
+    return " ".join(re.sub(r"[^\w]+", " ", text.lower()).split())
+
+
+def pick(name: str) -> str | None:
+    """Случайный готовый вариант для зарегистрированного промпта или None (спросить модель)."""
+    build = _builders.get(name)
+    if not RESPONSE_POOLS or build is None:
+        return None
+    key = prompt_key(build())
+    with _lock:
+        pool = _load().get(key)
+        variants = pool["variants"] if pool else []
+        _counters["hits" if variants else "misses"] += 1
+        return random.choice(variants) if variants else None
+
+
+def fill(name: str, size: int = RESPONSE_POOL_SIZE) -> int:
+    """Добрать пул промпта до size вариантов. Возвращает число новых вариантов."""
+    prompt = _builders[name]()
+    key = prompt_key(prompt)
+    with _lock:
+        variants = list((_load().get(key) or {}).get("variants", []))
+    added = 0
+    for _ in range(max(size - len(variants), 0) * 3):          # с запасом на отбракованные
+        if len(variants) >= size:
+            break
+        try:
+            with llm_cache.policy(0, site="response_pool"), sampling(RESPONSE_POOL_TEMPERATURE), \
+                    llm_limiter.priority(llm_limiter.BACKGROUND):
+                text = ask_openai(prompt)
+        except llm_limiter.LLMUnavailable as e:
+            logger.warning(f"[response_pool] ⚠️ {name}: OpenAI не ответил ({e}) — доберём в следующий раз")
+            break
+        if not vet(text, variants):
+            _counters["rejected"] += 1
+            continue
+        variants.append(text.strip())
+        added += 1
+    if added:
+        with _lock:
+            _load()[key] = {"name": name, "variants": variants, "updated_at": time.time()}
+            _counters["generated"] += added
+            _save()
+        logger.info(f"[response_pool] 🧺 {name}: +{added}, в пуле {len(variants)}")
+    return added
+
+
+def fill_all(size: int = RESPONSE_POOL_SIZE) -> dict[str, int]:
+    """Добрать все зарегистрированные пулы и удалить пулы устаревших версий промптов."""
+    added = {}
+    for name in list(_builders):
+        try:
+            added[name] = fill(name, size)
+        except Exception as e:
+            logger.warning(f"[response_pool] ⚠️ {name}: генерация не удалась ({e})")
+    live = {prompt_key(build()) for build in _builders.values()}
+    with _lock:
+        pools = _load()
+        stale = [k for k in pools if k not in live]
+        for k in stale:
+            del pools[k]
+        if stale:
+            _save()
+    return added
+
+
+def stats() -> dict:
+    with _lock:
+        pools = _load()
+        sizes = {p["name"]: len(p["variants"]) for p in pools.values()}
+    return {
+        "enabled": RESPONSE_POOLS,
+        "registered": sorted(_builders),
+        "sizes": sizes,
+        **_counters,
+    }
+
+
+def start_response_pool_loop():
+    if not RESPONSE_POOLS:
+        logger.info("🟡 RESPONSE_POOLS=0 — пулы статичных ответов не генерируем")
+        return
+
+    def _loop():
+        while True:
+            try:
+                fill_all()
+            except Exception as e:
+                logger.exception(f"💥 response pool generator: {e}")
+            time.sleep(RESPONSE_POOL_REFRESH_SEC)
+
+    threading.Thread(target=_loop, name="response-pool", daemon=True).start()
+    logger.info(f"🧺 генератор пулов ответов запущен (по {RESPONSE_POOL_SIZE}, раз в {int(RESPONSE_POOL_REFRESH_SEC)} с)")
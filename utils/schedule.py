@@ -8,6 +8,7 @@ from datetime import datetime, timedelta
 from botocore.config import Config
 from botocore.exceptions import ClientError
 from logger import logger
+from state.state import note_external_effect
 
 # ==== Настройки доступа к Яндекс Object Storage ====
 AWS_ACCESS_KEY_ID = os.getenv("YANDEX_ACCESS_KEY_ID")
@@ -109,6 +110,7 @@ def reserve_slot(date_str: str, time_str: str) -> bool:
     sched.append({"date": date_str, "time": time_str})
     try:
         save_schedule_to_s3(sched)
+        note_external_effect()
         return True
     except Exception as e:
         print(f"[schedule] reserve_slot S3 error: {e}")
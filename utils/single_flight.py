@@ -0,0 +1,62 @@
+# utils/single_flight.py
+"""
+Single-flight: одинаковые запросы, пришедшие одновременно, выполняются один раз.
+
+Первый вызов с ключом становится «ведущим» и делает работу, остальные ждут его
+результат (или его исключение). Под gevent.monkey threading.Lock/Event —
+кооперативные, так что схема работает и между гринлетами, и между потоками.
+"""
+import threading
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: dict[str, _Call] = {}
+        self.counters = {"calls": 0, "coalesced": 0, "errors": 0, "max_waiters": 0}
+
+    def do(self, key: str, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.counters["calls"] += 1
+            else:
+                call.waiters += 1
+                self.counters["coalesced"] += 1
+                self.counters["max_waiters"] = max(self.counters["max_waiters"], call.waiters)
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            self.counters["errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            in_flight = len(self._calls)
+        return {"in_flight": in_flight, **self.counters}
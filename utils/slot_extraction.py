@@ -0,0 +1,197 @@
+# utils/slot_extraction.py
+"""
+Сбор слотов заявки для блоков 3a/3b/3c одним вызовом LLM.
+
+Раньше на каждый ход уходило до трёх последовательных запросов: структурирование
+(*_data_prompt), отдельный промпт на дату и отдельный на время. Теперь — один
+запрос в JSON-режиме по строгой схеме:
+
+    {"fields": {...}, "event_date_iso": "ГГГГ-ММ-ДД" | null, "event_time_24": "ЧЧ:ММ" | null}
+
+Дату и время берём из ответа модели: она видит контекст («бюджет 1.5 тыс»,
+«в мае 10 детей») и её значение главнее. Локальный парсер (utils/date_parser)
+только заполняет то, чего модель не нашла.
+
+Если модель всё же вернула не JSON, разбираем ответ как пары «Ключ — значение»
+(parse_structured_pairs) и спрашиваем у LLM только то, чего не нашёл парсер (ask_date_time).
+"""
+import re
+import json
+from logger import logger
+from utils import llm_cache
+from utils.ask_openai import json_mode
+from utils.date_parser import parse_date_time, confident, now_local
+from utils.fanout import FanOut
+from utils.prompt_registry import render_prompt
+
+SLOTS_PROMPT_PATH = "prompts/block03_slots_prompt.txt"
+# извлечение детерминировано (temperature=0, в промпте — текст клиента и сегодняшняя дата)
+EXTRACTION_CACHE_TTL_SEC = 24 * 3600
+IGNORED_VALUES = {"", "не указано", "не указан", "неизвестно", "прочерк", "-", "n/a", "null", "none"}
+
+# Фолбэк-парсер пар «Ключ — значение» (общий для 3a/3b/3c)
+_PAIR_PATTERNS = {
+    "event_format":         r"Формат\s+мероприятия\s*[-—:]\s*([^\n\r]+)",
+    "celebrant_name":       r"Имя\s+(?:ключевого\s+участника|именинника)[^\n\r]*?[-—:]\s*([^\n\r]+)",
+    "celebrant_gender":     r"Пол\s+(?:ключевого\s+участника|именинника)[^\n\r]*?[-—:]\s*([^\n\r]+)",
+    "celebrant_age":        r"Возраст\s+(?:ключевого\s+участника|именинника)[^\n\r]*?[-—:]\s*([^\n\r]+)",
+    "event_date":           r"Дата\s+мероприятия\s*[-—:]\s*([^\n\r]+)",
+    "event_time":           r"Время\s+мероприятия\s*[-—:]\s*([^\n\r]+)",
+    "event_location_type":  r"(?:Тип\s+места\s+проведения|Классификация\s+места)\s*[-—:]\s*([^\n\r]+)",
+    "event_location":       r"(?:Название\s+места\s+проведения|Название\s+места)\s*[-—:]\s*([^\n\r]+)",
+    "guests_count":         r"Количество\s+гостей\s*[-—:]\s*([^\n\r]+)",
+    "guests_gender":        r"Пол\s+гостей(?:\s+детского\s+возраста)?\s*[-—:]\s*([^\n\r]+)",
+    "guests_age":           r"Возраст\s+гостей(?:\s+детского\s+возраста)?\s*[-—:]\s*([^\n\r]+)",
+    "compere_availability": r"(?:наличие\s+ведущего|ведущий)\s*[-—:]\s*([^\n\r]+)",
+}
+
+
+def parse_structured_pairs(text: str) -> dict:
+    result = {}
+    for key, pattern in _PAIR_PATTERNS.items():
+        m = re.search(pattern, text or "", re.IGNORECASE | re.MULTILINE)
+        if m:
+            val = m.group(1).strip().strip(" .;,")
+            if val.lower() not in IGNORED_VALUES:
+                result[key] = val
+    return result
+
+
+def clean_time(raw_time: str) -> str:
+    m = re.search(r"\b([01]?\d|2[0-3]):[0-5]\d\b", raw_time or "")
+    return m.group(0) if m else ""
+
+
+def clean_date(raw_date: str) -> str:
+    m = re.search(r"\b\d{4}-\d{2}-\d{2}\b", raw_date or "")
+    return m.group(0) if m else ""
+
+
+def local_date_time(combined_text: str) -> tuple[str | None, str | None]:
+    """Дата/время локальным парсером — только уверенные значения."""
+    parsed = parse_date_time(combined_text)
+    local_date, local_time = confident(parsed)
+    logger.info("[slots] локально: дата %s (%.2f), время %s (%.2f)",
+                parsed["date"], parsed["date_conf"], parsed["time"], parsed["time_conf"])
+    return local_date, local_time
+
+
+def ask_date_time(combined_text: str, ask) -> tuple[str | None, str | None]:
+    """
+    Дата и время мероприятия. Сначала локальный парсер; старые промпты
+    «Определи, указана ли дата/время…» уходят в LLM только за тем, что он не нашёл;
+    если не нашлось ни то, ни другое — оба запроса идут параллельно.
+    """
+    match_date, match_time = local_date_time(combined_text)
+    with llm_cache.policy(EXTRACTION_CACHE_TTL_SEC, site="slot_extraction"), FanOut() as fan:
+        date_job = fan.submit(_ask_date, combined_text, ask) if match_date is None else None
+        time_job = fan.submit(_ask_time, combined_text, ask) if match_time is None else None
+        if date_job:
+            match_date = date_job.result()
+        if time_job:
+            match_time = time_job.result()
+    return match_date, match_time
+
+
+def _ask_date(combined_text: str, ask) -> str | None:
+    now = now_local()
+    date_prompt = f"""
+        Сегодня: {now.strftime("%d %B %Y")}
+
+        Все сообщения клиента: "{combined_text}"
+
+        Определи, указана ли в сообщениях дата проведения мероприятия.
+
+        Если указан только день и месяц — подставь текущий год: {now.year}.
+        Если указан год — используй его.
+        Формат: ГГГГ-ММ-ДД. Если даты нет — "нет даты".
+        """
+    date_reply = ask(date_prompt).strip()
+    match_date = date_reply if date_reply.lower() != "нет даты" else None
+    logger.info("Дата проведения мероприятия от ИИ %s", match_date)
+    return match_date
+
+
+def _ask_time(combined_text: str, ask) -> str | None:
+    time_prompt = f"""
+        Все сообщения клиента: "{combined_text}"
+        Определи, указано ли в сообщениях время проведения мероприятия.
+        Если да — формат ЧЧ:ММ. Иначе — "нет времени".
+        """
+    time_reply = ask(time_prompt).strip()
+    match_time = time_reply if time_reply.lower() != "нет времени" else None
+    logger.info("Время проведения мероприятия от ИИ %s", match_time)
+    return match_time
+
+
+def _fields_spec(fields: dict[str, str]) -> str:
+    return "\n".join(f'- "{k}": {desc}' for k, desc in fields.items())
+
+
+def _clean_fields(raw: dict, fields: dict[str, str]) -> dict:
+    out = {}
+    for k, v in (raw or {}).items():
+        if k not in fields or v is None or isinstance(v, (dict, list)):
+            continue
+        sv = str(v).strip()
+        if sv.lower() not in IGNORED_VALUES:
+            out[k] = sv
+    return out
+
+
+def extract_slots(message_text: str, combined_text: str, fields: dict[str, str], ask,
+                  with_datetime: bool = True) -> dict:
+    """
+    Один запрос в JSON-режиме → {"fields", "date", "time", "raw_date", "raw_time", "source"}.
+    date/time уже нормализованы (ГГГГ-ММ-ДД / ЧЧ:ММ) или None; raw_* — как ответила модель.
+    with_datetime=False — дату/время не выясняем (availability уже отправлен).
+    ask — ask_openai вызывающего модуля (тесты его подменяют).
+    """
+    now = now_local()
+    prompt = render_prompt(
+        SLOTS_PROMPT_PATH,
+        fields_spec=_fields_spec(fields),
+        today=now.strftime("%d %B %Y"),
+        current_year=now.year,
+        combined_text=combined_text,
+        message_text=message_text,
+    )
+    with json_mode(), llm_cache.policy(EXTRACTION_CACHE_TTL_SEC, site="slot_extraction"):
+        reply = (ask(prompt) or "").strip()
+    logger.info("Ответ от OpenAI (слоты) ДО парсинга:\n%s", reply)
+
+    try:
+        data = json.loads(reply)
+        if not isinstance(data, dict):
+            raise ValueError("не объект")
+    except ValueError:
+        # модель не выдержала схему — старый путь: пары из ответа + отдельные промпты даты/времени
+        logger.warning("[slots] ответ не JSON — фолбэк на пары и промпты даты/времени")
+        raw_date = raw_time = None
+        if with_datetime:
+            raw_date, raw_time = ask_date_time(combined_text, ask)
+        return {
+            "fields": _clean_fields(parse_structured_pairs(reply), fields),
+            "date": clean_date(raw_date) or None, "time": clean_time(raw_time) or None,
+            "raw_date": raw_date, "raw_time": raw_time, "source": "legacy",
+        }
+
+    # допускаем и «плоский» ответ без обёртки fields
+    raw_fields = data.get("fields") if isinstance(data.get("fields"), dict) else data
+    raw_date = raw_time = None
+    if with_datetime:
+        # модель видит контекст («бюджет 1.5 тыс», «в мае 10 детей») — её значение главнее;
+        # локальный разбор (по всей переписке) заполняет только то, что она не нашла
+        local_date, local_time = local_date_time(combined_text)
+        llm_date, llm_time = data.get("event_date_iso"), data.get("event_time_24")
+        raw_date = llm_date if clean_date(str(llm_date or "")) else local_date
+        raw_time = llm_time if clean_time(str(llm_time or "")) else local_time
+        if local_date and raw_date == llm_date and clean_date(str(llm_date)) != local_date:
+            logger.info("[slots] дата: модель %s, локально %s — берём модель", llm_date, local_date)
+    raw_date = str(raw_date) if raw_date else None
+    raw_time = str(raw_time) if raw_time else None
+    return {
+        "fields": _clean_fields(raw_fields, fields),
+        "date": clean_date(raw_date) or None, "time": clean_time(raw_time) or None,
+        "raw_date": raw_date, "raw_time": raw_time, "source": "json",
+    }
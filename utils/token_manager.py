@@ -1,67 +1,253 @@
 # utils/token_manager.py
+"""
+WA-токен без сетевых запросов на горячем пути.
+
+Раньше init_token() выполнялся при импорте app.py (Supabase с повторами по 3 с + /me)
+до того, как gunicorn начинал отвечать, а get_token() мог запустить его посреди
+обработки сообщения. Теперь:
+
+  • get_token() только читает память; до первой загрузки — последний известный
+    токен из локального кэш-файла (WA_TOKEN_CACHE_PATH);
+  • start_token_manager() (из app.py) поднимает фоновый поток: первая загрузка
+    Supabase → ENV сразу после старта, дальше проверка раз в WA_TOKEN_REFRESH_SEC;
+  • если Meta сообщает срок жизни токена (debug_token, нужны META_APP_ID/SECRET)
+    и до истечения меньше WA_TOKEN_REFRESH_BEFORE_SEC — заранее обмениваем его на
+    новый долгоживущий (fb_exchange_token) и сохраняем в Supabase;
+  • обновление — под замком: параллельные вызовы refresh() не дублируют запросы;
+  • request_refresh() — внеочередная проверка (например, Graph API ответил 401),
+    без ожидания результата.
+Скрипты без фонового менеджера, как и раньше, загружают токен синхронно при первом get_token().
+"""
 from utils.env_loader import ensure_env_loaded
 ensure_env_loaded()
-import os, time, threading, requests
+import os, json, time, tempfile, threading
 from logger import logger
 from utils.supabase_token import save_token_to_supabase, load_token
 from utils.env_flags import is_local_dev
+from utils import graph_http
 
 LOCAL_DEV = is_local_dev()
+TOKEN_CACHE_PATH   = os.getenv("WA_TOKEN_CACHE_PATH", "tmp/wa_token.json")
+REFRESH_SEC        = float(os.getenv("WA_TOKEN_REFRESH_SEC", str(6 * 3600)))
+REFRESH_BEFORE_SEC = float(os.getenv("WA_TOKEN_REFRESH_BEFORE_SEC", str(7 * 24 * 3600)))
+RETRY_SEC          = float(os.getenv("WA_TOKEN_RETRY_SEC", "300"))
+MIN_GAP_SEC        = 30.0     # request_refresh() чаще не дёргает Meta
+META_APP_ID        = os.getenv("META_APP_ID")
+META_APP_SECRET    = os.getenv("META_APP_SECRET")
+
 _WHATSAPP_TOKEN: str | None = None
+_meta = {"source": None, "expires_at": None, "checked_at": None}
+_refresh_lock = threading.Lock()
+_wake = threading.Event()
+_started = False
+_last_refresh = 0.0
+_counters = {"refreshes": 0, "refresh_failed": 0, "refresh_coalesced": 0, "exchanged": 0,
+             "cache_hits": 0, "refresh_requested": 0}
+
+
+def configure(cache_path: str | None = None) -> None:
+    """Переключить кэш-файл (нужно тестам и скриптам)."""
+    global TOKEN_CACHE_PATH
+    if cache_path:
+        TOKEN_CACHE_PATH = cache_path
+
+
+# ─── кэш-файл ────────────────────────────────────────────────────
+def _load_cached() -> bool:
+    global _WHATSAPP_TOKEN
+    try:
+        with open(TOKEN_CACHE_PATH, encoding="utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return False
+    except (OSError, ValueError) as e:
+        logger.warning(f"⚠️ Кэш WA токена не читается ({e})")
+        return False
+    if not data.get("token") or _WHATSAPP_TOKEN:
+        return False
+    _WHATSAPP_TOKEN = data["token"]
+    _meta.update(source="cache", expires_at=data.get("expires_at"), checked_at=data.get("checked_at"))
+    _counters["cache_hits"] += 1
+    logger.info(f"💾 WA токен из кэша: {_WHATSAPP_TOKEN[:8]}..., проверен {data.get('checked_at')}")
+    return True
+
 
+def _save_cached() -> None:
+    try:
+        folder = os.path.dirname(TOKEN_CACHE_PATH) or "."
+        os.makedirs(folder, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=folder, suffix=".tmp")    # права 0600
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"token": _WHATSAPP_TOKEN, **{k: _meta[k] for k in ("expires_at", "checked_at")}}, f)
+        os.replace(tmp, TOKEN_CACHE_PATH)
+    except OSError as e:
+        logger.warning(f"⚠️ Не удалось записать кэш WA токена: {e}")
 
 
+# ─── проверка и обмен ────────────────────────────────────────────
 def check_token_validity_raw(token: str) -> bool:
     """Проверка токена без побочных эффектов."""
     if not token:
         return False
-    url = f"https://graph.facebook.com/v19.0/me?access_token={token}"
     try:
-        r = requests.get(url, timeout=10)
+        r = graph_http.get(graph_http.graph_url("me"), params={"access_token": token}, timeout=10)
         return r.status_code == 200
     except Exception as e:
         logger.warning(f"⚠️ Ошибка проверки WA токена: {e}")
         return False
 
 
-def init_token() -> None:
-    """Инициализация при старте приложения."""
-    global _WHATSAPP_TOKEN
-    token = load_token()
-    if not token:
-        logger.critical("💥 Нет доступного WA токена ни в Supabase, ни в ENV")
-        _WHATSAPP_TOKEN = ""
-        return
+def _inspect(token: str) -> tuple[bool, float | None]:
+    """(валиден ли, когда истекает: unix-время, 0 — бессрочный, None — неизвестно)."""
+    if META_APP_ID and META_APP_SECRET:
+        try:
+            r = graph_http.get(graph_http.graph_url("debug_token"), timeout=10, params={
+                "input_token": token, "access_token": f"{META_APP_ID}|{META_APP_SECRET}"})
+            if r.status_code == 200:
+                data = r.json().get("data") or {}
+                return bool(data.get("is_valid")), float(data.get("expires_at") or 0)
+        except Exception as e:
+            logger.warning(f"⚠️ debug_token не ответил: {e}")
+    return check_token_validity_raw(token), None
 
-    if check_token_validity_raw(token):
-        _WHATSAPP_TOKEN = token
-        logger.info(f"🔍 WA токен валиден: {token[:8]}..., len={len(token)}")
-    else:
-        logger.warning("⚠️ Supabase токен недействителен")
-        env_token = os.getenv("WHATSAPP_TOKEN", "")
-        if env_token and check_token_validity_raw(env_token):
-            _WHATSAPP_TOKEN = env_token
-            logger.info("🔑 Переключились на WA токен из ENV (валидный)")
+
+def _exchange(token: str) -> tuple[str, float | None] | None:
+    """Обмен на новый долгоживущий токен (fb_exchange_token)."""
+    if not (META_APP_ID and META_APP_SECRET):
+        return None
+    try:
+        r = graph_http.get(graph_http.graph_url("oauth/access_token"), timeout=10, params={
+            "grant_type": "fb_exchange_token", "client_id": META_APP_ID,
+            "client_secret": META_APP_SECRET, "fb_exchange_token": token})
+        data = r.json() if r.status_code == 200 else {}
+    except Exception as e:
+        logger.warning(f"⚠️ Обмен WA токена не удался: {e}")
+        return None
+    if not data.get("access_token"):
+        logger.warning(f"⚠️ Обмен WA токена отклонён: HTTP {r.status_code}")
+        return None
+    expires_in = data.get("expires_in")
+    return data["access_token"], (time.time() + float(expires_in)) if expires_in else None
+
+
+# ─── обновление ──────────────────────────────────────────────────
+def refresh() -> bool:
+    """
+    Загрузить и проверить токен (Supabase → ENV → текущий), при скором истечении — обменять.
+    Если обновление уже идёт в другом потоке — сразу False, второго запроса не делаем.
+    """
+    if not _refresh_lock.acquire(blocking=False):
+        _counters["refresh_coalesced"] += 1
+        return False
+    try:
+        return _refresh_locked()
+    finally:
+        _refresh_lock.release()
+
+
+def _refresh_locked() -> bool:
+    global _WHATSAPP_TOKEN, _last_refresh
+    _last_refresh = time.time()
+    _counters["refreshes"] += 1
+    stored = load_token()
+    env_token = os.getenv("WHATSAPP_TOKEN", "")
+    candidates = [(stored, "supabase"), (env_token, "env"), (_WHATSAPP_TOKEN, _meta["source"])]
+    if _meta["source"] == "admin":             # введён в админке только что — он главнее
+        candidates.insert(0, candidates.pop())
+    seen = set()
+    for token, source in candidates:
+        if not token or token in seen:
+            continue
+        seen.add(token)
+        valid, expires_at = _inspect(token)
+        if not valid:
+            logger.warning(f"⚠️ WA токен ({source}) недействителен")
+            continue
+        if expires_at and expires_at - time.time() < REFRESH_BEFORE_SEC:
+            exchanged = _exchange(token)
+            if exchanged:
+                token, expires_at = exchanged
+                source = "exchanged"
+                _counters["exchanged"] += 1
+                logger.info(f"🔄 WA токен обменян заранее, новый действует до {time.ctime(expires_at or 0)}")
+        if token != stored and source in ("env", "exchanged"):
             try:
-                save_token_to_supabase(env_token)
-                logger.info("☁️ ENV-токен сохранён в Supabase")
+                save_token_to_supabase(token)
+                logger.info(f"☁️ WA токен ({source}) сохранён в Supabase")
             except Exception as e:
-                logger.warning(f"⚠️ Не удалось сохранить ENV-токен в Supabase: {e}")
-        else:
-            _WHATSAPP_TOKEN = ""
-            logger.critical("💥 Нет валидного WA токена ни в Supabase, ни в ENV")
+                logger.warning(f"⚠️ Не удалось сохранить WA токен в Supabase: {e}")
+        _WHATSAPP_TOKEN = token
+        _meta.update(source=source, expires_at=expires_at, checked_at=time.time())
+        _save_cached()
+        logger.info(f"🔍 WA токен валиден ({source}): {token[:8]}..., len={len(token)}")
+        return True
+    _counters["refresh_failed"] += 1
+    if _WHATSAPP_TOKEN:
+        logger.critical("💥 Не удалось подтвердить WA токен — продолжаем с последним известным")
+    else:
+        _WHATSAPP_TOKEN = ""
+        logger.critical("💥 Нет валидного WA токена ни в Supabase, ни в ENV")
+    return False
+
+
+def init_token() -> None:
+    """Синхронная загрузка (скрипты). В приложении — start_token_manager()."""
+    refresh()
+
+
+def _next_refresh_in(ok: bool) -> float:
+    if not ok:
+        return RETRY_SEC
+    expires_at = _meta["expires_at"]
+    if expires_at:
+        return max(MIN_GAP_SEC, min(REFRESH_SEC, expires_at - REFRESH_BEFORE_SEC - time.time()))
+    return REFRESH_SEC
+
+
+def _refresh_loop() -> None:
+    while True:
+        try:
+            ok = refresh()
+        except Exception as e:
+            logger.warning(f"⚠️ token_refresh_loop: {e}")
+            ok = False
+        _wake.wait(_next_refresh_in(ok))
+        _wake.clear()
+        time.sleep(max(0.0, _last_refresh + MIN_GAP_SEC - time.time()))
+
+
+def start_token_manager() -> None:
+    """Кэш — сразу (без сети), загрузка и проверка — в фоне. Идемпотентен."""
+    global _started
+    if _started:
+        return
+    _started = True
+    _load_cached()
+    threading.Thread(target=_refresh_loop, name="wa-token", daemon=True).start()
+
+
+def request_refresh() -> None:
+    """Внеочередная проверка токена в фоне (не ждём результата)."""
+    _counters["refresh_requested"] += 1
+    _wake.set()
+
 
 def get_token() -> str:
-    """Дай актуальный токен (ленивая инициализация)."""
-    global _WHATSAPP_TOKEN
+    """Актуальный токен из памяти — без сетевых запросов, если менеджер запущен."""
     if _WHATSAPP_TOKEN is None:
-        init_token()
+        _load_cached()
+    if _WHATSAPP_TOKEN is None and not _started:
+        with _refresh_lock:                    # скрипт: ждём того, кто уже загружает
+            if _WHATSAPP_TOKEN is None:
+                _refresh_locked()
     return _WHATSAPP_TOKEN or ""
 
 def set_token(new_token: str) -> None:
     """Обновить токен в памяти (после формы/админки)."""
     global _WHATSAPP_TOKEN
     _WHATSAPP_TOKEN = new_token
+    _meta.update(source="admin", expires_at=None, checked_at=time.time())
+    _save_cached()
 
 def save_token(new_token: str) -> bool:
     """Сохранить в Supabase и обновить в памяти (для прода)."""
@@ -78,8 +264,22 @@ def check_token_validity() -> bool:
     ok = check_token_validity_raw(token)
     if not ok:
         logger.warning("❌ WA токен из памяти оказался недействительным")
+        request_refresh()
     return ok
 
+def stats() -> dict:
+    now = time.time()
+    expires_at, checked_at = _meta["expires_at"], _meta["checked_at"]
+    return {
+        "has_token": bool(_WHATSAPP_TOKEN),
+        "source": _meta["source"],
+        "expires_in_sec": round(expires_at - now) if expires_at else None,
+        "never_expires": expires_at == 0,
+        "checked_ago_sec": round(now - checked_at) if checked_at else None,
+        "manager_running": _started,
+        **_counters,
+    }
+
 def start_token_check_loop(interval_minutes: int = 30):
     def loop():
         while True:
@@ -91,5 +291,3 @@ def start_token_check_loop(interval_minutes: int = 30):
                 logger.warning(f"⚠️ token_check_loop: {e}")
             time.sleep(interval_minutes * 60)
     threading.Thread(target=loop, daemon=True).start()
-
-
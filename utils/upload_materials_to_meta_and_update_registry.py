@@ -1,6 +1,6 @@
 from utils.env_loader import ensure_env_loaded
 ensure_env_loaded()
-import os, json, requests, time, threading
+import os, json, time, threading
 from datetime import datetime, timedelta
 from tempfile import TemporaryDirectory
 from botocore.exceptions import ClientError
@@ -12,11 +12,12 @@ from utils.materials import (
 )
 from logger import logger
 from utils.token_manager import get_token
+from utils import graph_http
 
 KP_PREFIX = "materials/KP/"
 REGISTRY_KEY = "materials/media_registry.json"
 PHONE_NUMBER_ID = os.getenv("PHONE_NUMBER_ID")
-META_URL        = f"https://graph.facebook.com/v19.0/{PHONE_NUMBER_ID}/media"
+META_URL        = graph_http.graph_url(f"{PHONE_NUMBER_ID}/media")
 
 def registry_load():
     try:
@@ -59,7 +60,7 @@ def meta_upload(local: str, mtype: str, wa_token: str):
         with open(local, "rb") as f:
             files = {"file": (fname, f, mime)}
             data  = {"messaging_product": "whatsapp", "type": mtype}
-            resp = requests.post(
+            resp = graph_http.post(
                 META_URL,
                 headers={"Authorization": f"Bearer {wa_token}"},
                 files=files,
@@ -78,7 +79,7 @@ def meta_upload(local: str, mtype: str, wa_token: str):
             )
             return None
         return resp.json().get("id")
-    except requests.RequestException as e:
+    except graph_http.HTTPError as e:
         # сетевые/таймауты
         logger.error("META /media request err for %s: %s", local, e, exc_info=True)
         return None
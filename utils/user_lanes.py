@@ -0,0 +1,122 @@
+# utils/user_lanes.py
+"""
+Упорядоченные «дорожки» обработки по пользователям.
+
+user_id хэшируется в одну из USER_LANES дорожек. Внутри дорожки задачи идут
+строго по очереди (значит, два сообщения одного клиента никогда не гонятся
+в router/update_state), разные дорожки работают параллельно.
+"""
+from utils.env_loader import ensure_env_loaded
+ensure_env_loaded()
+import os, time, zlib, queue, threading
+from logger import logger
+
+LANES = max(1, int(os.getenv("USER_LANES", "8")))
+
+_local = threading.local()          # на какой дорожке исполняется текущий поток
+_start_lock = threading.Lock()
+
+
+class _Lane:
+    def __init__(self, idx: int):
+        self.idx = idx
+        self.q: queue.Queue = queue.Queue()
+        self.thread: threading.Thread | None = None
+        self.processed = 0
+        self.failed = 0
+        self.busy_since: float | None = None
+        self.max_wait = 0.0
+
+    def start(self):
+        self.thread = threading.Thread(target=self._loop, name=f"lane-{self.idx}", daemon=True)
+        self.thread.start()
+
+    def _loop(self):
+        _local.lane = self.idx
+        while True:
+            enqueued_at, fn, args, kwargs = self.q.get()
+            self.max_wait = max(self.max_wait, time.time() - enqueued_at)
+            self.busy_since = time.time()
+            try:
+                fn(*args, **kwargs)
+            except Exception as e:
+                self.failed += 1
+                logger.exception(f"💥 lane-{self.idx}: задача {getattr(fn, '__name__', fn)} упала: {e}")
+            finally:
+                self.processed += 1
+                self.busy_since = None
+                self.q.task_done()
+
+
+_lanes: list[_Lane] = []
+
+
+def _ensure_started() -> list[_Lane]:
+    if not _lanes:
+        with _start_lock:
+            if not _lanes:
+                lanes = [_Lane(i) for i in range(LANES)]
+                for lane in lanes:
+                    lane.start()
+                _lanes.extend(lanes)
+                logger.info(f"🛣 user_lanes: запущено дорожек {LANES}")
+    return _lanes
+
+
+def lane_for(user_id) -> int:
+    """Стабильный (между рестартами) номер дорожки для пользователя."""
+    return zlib.crc32(str(user_id or "").encode("utf-8")) % LANES
+
+
+def in_own_lane(user_id) -> bool:
+    """True, если текущий поток — дорожка этого пользователя."""
+    return getattr(_local, "lane", None) == lane_for(user_id)
+
+
+def submit(user_id, fn, *args, **kwargs) -> None:
+    """Поставить задачу в дорожку пользователя (не ждёт выполнения)."""
+    lane = _ensure_started()[lane_for(user_id)]
+    lane.q.put((time.time(), fn, args, kwargs))
+
+
+def run_in_lane(user_id, fn, *args, **kwargs) -> None:
+    """
+    Если мы уже на дорожке пользователя — выполняем сразу (порядок и так соблюдён),
+    иначе ставим в его дорожку.
+    """
+    if in_own_lane(user_id):
+        fn(*args, **kwargs)
+    else:
+        submit(user_id, fn, *args, **kwargs)
+
+
+def wait_idle(timeout: float = 5.0) -> bool:
+    """Дождаться опустошения всех дорожек (для тестов и плавной остановки)."""
+    end = time.time() + timeout
+    for lane in list(_lanes):
+        while lane.q.unfinished_tasks:
+            if time.time() > end:
+                return False
+            time.sleep(0.01)
+    return True
+
+
+def stats() -> dict:
+    """Бэклог и счётчики по каждой дорожке."""
+    now = time.time()
+    lanes = []
+    for lane in _lanes:
+        lanes.append({
+            "lane": lane.idx,
+            "backlog": lane.q.qsize(),
+            "busy_sec": round(now - lane.busy_since, 2) if lane.busy_since else 0,
+            "processed": lane.processed,
+            "failed": lane.failed,
+            "max_wait_ms": round(lane.max_wait * 1000, 1),
+        })
+    return {
+        "lanes": LANES,
+        "started": bool(_lanes),
+        "backlog_total": sum(x["backlog"] for x in lanes),
+        "per_lane": lanes,
+    }
@@ -1,9 +1,14 @@
 import re
 from utils.ask_openai import ask_openai
+from utils import llm_cache, llm_limiter
+from utils.prompt_registry import load_prompt
+from utils import handover_classifier
+
+# ответ классификатора зависит только от текста сообщения — кэшируем надолго
+HANDOVER_CACHE_TTL_SEC = 7 * 24 * 3600
 
 def load_global_prompt():
-    with open("prompts/global_prompt.txt", encoding="utf-8") as f:
-        return f.read()
+    return load_prompt("prompts/global_prompt.txt")
 
 # Явный запрос «поговорить напрямую / контакты»
 HANDOVER_PATTERNS = [
@@ -67,7 +72,12 @@ def wants_handover_ai(user_message: str) -> bool:
         # logger.info("[handover] matched BOOKING_PATTERNS -> False")
         return False
 
-    # 4) Фолбэк на LLM (консервативный)
+    # 4) Локальный классификатор: уверен — отвечает сам, в полосе сомнений — спрашиваем LLM
+    verdict = handover_classifier.decide(user_message)
+    if verdict is not None:
+        return verdict
+
+    # 5) Фолбэк на LLM (консервативный)
     global_prompt = load_global_prompt()
     classification_prompt = global_prompt + f"""
 
@@ -83,7 +93,10 @@ def wants_handover_ai(user_message: str) -> bool:
 Ответь строго: да/нет.
 """
     try:
-        resp = ask_openai(classification_prompt).strip().lower()
+        with llm_cache.policy(HANDOVER_CACHE_TTL_SEC, site="handover"):
+            resp = ask_openai(classification_prompt).strip().lower()
+    except llm_limiter.LLMUnavailable:
+        raise         # модель не ответила — это не «нет»: ход уйдёт в повтор
     except Exception:
         return False  # безопасный дефолт
 
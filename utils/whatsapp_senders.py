@@ -1,14 +1,13 @@
 from utils.env_loader import ensure_env_loaded
 ensure_env_loaded()
-import os, requests, logging, json
-from utils.token_manager import get_token
+import os, logging
+from utils import outbound_queue
 
 logger = logging.getLogger(__name__)
 
 # --- адрес Арсения и шаблон, вынесены в env ----------------------
 OWNER_WA_ID   = os.getenv("OWNER_WA_ID")                # 7705…
 PHONE_ID = os.getenv("PHONE_NUMBER_ID")
-API_URL  = f"https://graph.facebook.com/v19.0/{PHONE_ID}/messages"
 MAX_LEN  = 4096                                         # лимит WA для text.body
 
 # ─────────────────────────────────────────────────────────────────
@@ -19,20 +18,9 @@ def _chunks(txt: str, size: int = MAX_LEN):
         txt = txt[size:]
 
 # ─── служебка ────────────────────────────────────────────────────
-def _headers() -> dict:
-    return {
-        "Authorization": f"Bearer {get_token()}",
-        "Content-Type":  "application/json",
-    }
-
-
-def _post(payload: dict, tag: str) -> None:
-    try:
-        resp = requests.post(API_URL, json=payload, headers=_headers(), timeout=30)
-        resp.raise_for_status()
-        logger.info("➡️ WA %s ok → %s", tag, payload["to"])
-    except requests.RequestException as e:
-        logger.error("❌ WA %s to %s: %s • payload=%s", tag, payload["to"], e, payload)
+def _post(payload: dict, tag: str):
+    """В исходящую очередь: порядок по получателю, повторы и мёртвые письма — там."""
+    return outbound_queue.send(payload, tag=tag, phone_id=PHONE_ID)
 
 
 # ─── публичные функции ──────────────────────────────────────────
@@ -43,11 +31,11 @@ def send_text(to: str, body: str):
         "type": "text",
         "text": {"body": body}
     }
-    return requests.post(API_URL, headers=_headers(), json=payload, timeout=20)
+    return _post(payload, "text")
 
 
 def send_image(to: str, media_id: str):
-    _post(
+    return _post(
         {
             "messaging_product": "whatsapp",
             "to": to,
@@ -59,7 +47,7 @@ def send_image(to: str, media_id: str):
 
 
 def send_document(to: str, media_id: str):
-    _post(
+    return _post(
         {
             "messaging_product": "whatsapp",
             "to": to,
@@ -71,7 +59,7 @@ def send_document(to: str, media_id: str):
 
 
 def send_video(to: str, media_id: str):
-    _post(
+    return _post(
         {
             "messaging_product": "whatsapp",
             "to": to,
@@ -88,7 +76,9 @@ def send_owner_resume(full_text: str):
       • несколько полей упаковываются в один HSM
         (символ • вместо «\\n» – внутри {{1}} переводы строк запрещены);
       • размер каждого HSM ≤ 1024 симв. – если не влезает, начинаем новый.
-    Возвращает list[requests.Response].
+    Отправка синхронная, мимо очереди (outbound_queue.send_now): вызывающему нужен
+    настоящий ответ, а не Accepted. Первая неудачная часть прерывает отправку.
+    Возвращает list ответов Graph API (None — сетевая ошибка).
     """
     if not OWNER_WA_ID:
         raise RuntimeError("OWNER_WA_ID не задан в переменных окружения")
@@ -130,15 +120,11 @@ def send_owner_resume(full_text: str):
                 ],
             },
         }
-        try:
-            resp = requests.post(API_URL, headers=_headers(), json=payload, timeout=20)
-            responses.append(resp)
-            if resp.status_code >= 400:
-                logger.error(
-                    "WA owner send error %s — %s\nresponse=%s\npayload=%s",
-                    resp.status_code, resp.reason, resp.text,
-                    json.dumps(payload, ensure_ascii=False),
-                )
-        except Exception as e:
-            logger.error("❌ WA owner_resume to %s: %s • chunk=%r", OWNER_WA_ID, e, chunk)
+        # части уходят одна за другой, каждая — после ответа на предыдущую
+        resp = outbound_queue.send_now(payload, tag=f"owner_resume {idx}/{len(chunks)}", phone_id=PHONE_ID)
+        responses.append(resp)
+        if resp is None or resp.status_code >= 300:
+            logger.error("❌ WA owner_resume to %s: часть %d/%d не отправлена • chunk=%r",
+                         OWNER_WA_ID, idx, len(chunks), chunk)
+            break
     return responses